@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+批量注释的多页打包
+连续的短页面（如只有一两百字的幻灯片）打包进一次请求，要求模型按页输出JSON，再拆回各页的注释。
+长页面、扫描页或打包后超出预算的页面仍逐页调用；输出无法解析或缺页时，缺少的页面回退为逐页调用
+"""
+
+import re
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from config import ANNOTATION_BATCH_MAX_PAGES, ANNOTATION_BATCH_SHORT_PAGE_TOKENS, ANNOTATION_BATCH_MAX_PROMPT_TOKENS
+from prompt_builder import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 各注释风格对每一页的要求（与逐页注释的提示词保持一致）
+_STYLE_REQUIREMENTS = {
+    "keywords": """为每一页生成关键词解释注释：
+1. 识别页面中的重要学术概念、专业术语，按主题或重要性分类
+2. 提供中文概念对应的英文术语，每个关键词用1-2句简明解释
+3. 使用"- **中文术语** (*English Term*): 简洁解释"的格式""",
+    "translation": """将每一页的文字内容准确翻译成流畅的中文：
+1. 保留原文的段落和层次结构，专业术语保持一致
+2. 重要术语标注英文原文""",
+    "detailed": """为每一页生成详细的学术注释：
+1. 核心概念总结和重要知识点解释
+2. 与其他概念的关联
+3. 学习要点和记忆提示，尽量提供具体例子"""
+}
+
+
+def plan_batches(pages: List[Dict[str, Any]],
+                 max_pages: int = ANNOTATION_BATCH_MAX_PAGES,
+                 short_page_tokens: int = ANNOTATION_BATCH_SHORT_PAGE_TOKENS,
+                 max_prompt_tokens: int = ANNOTATION_BATCH_MAX_PROMPT_TOKENS) -> List[List[Dict[str, Any]]]:
+    """
+    把页面分组
+
+    Args:
+        pages: 按页码排列的 [{"page", "text"}]，text为None表示扫描页或没有可用文字
+        max_pages: 每组最多页数
+        short_page_tokens: 不超过该token数的页面才参与打包
+        max_prompt_tokens: 每组页面内容的token上限
+
+    Returns:
+        分组列表，多页的组打包为一次请求，单页的组逐页调用
+    """
+    batches: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    current_tokens = 0
+    for page in pages:
+        tokens = estimate_tokens(page["text"]) if page["text"] else None
+        packable = tokens is not None and tokens <= short_page_tokens
+        if current and (not packable or len(current) >= max_pages
+                        or current_tokens + tokens > max_prompt_tokens
+                        or page["page"] != current[-1]["page"] + 1):
+            batches.append(current)
+            current, current_tokens = [], 0
+        if packable:
+            current.append(page)
+            current_tokens += tokens
+        else:
+            batches.append([page])
+    if current:
+        batches.append(current)
+    return batches
+
+
+def batch_prompt(filename: str, pages: List[Dict[str, Any]], style: str, custom_prompt: Optional[str] = None) -> str:
+    """构建多页注释的提示词，要求按页输出JSON"""
+    first, last = pages[0]["page"], pages[-1]["page"]
+    if style == "custom" and custom_prompt:
+        requirement = f"按照用户的自定义要求为每一页生成注释：\n{custom_prompt}"
+    else:
+        requirement = _STYLE_REQUIREMENTS.get(style, _STYLE_REQUIREMENTS["detailed"])
+    contents = "\n\n".join(f"--- 第{page['page']}页 ---\n{page['text']}" for page in pages)
+    return f"""以下是PDF文件 {filename} 第{first}页-第{last}页（共{len(pages)}页）的文字内容，请分别为每一页生成注释。
+
+{contents}
+
+注释要求：
+{requirement}
+
+输出要求：
+- 只输出一个JSON对象，不要输出JSON以外的任何内容
+- 格式为 {{"pages": [{{"page": 页码, "annotation": "该页的注释（Markdown格式）"}}]}}
+- 第{first}页到第{last}页每一页都必须有一个条目，每页的注释只基于该页内容
+
+请开始生成："""
+
+
+def parse_batch_output(text: str, page_numbers: List[int]) -> Dict[int, str]:
+    """
+    从模型输出中拆出各页注释
+
+    Returns:
+        {页码: 注释}，只包含解析成功且内容非空的页面；整体无法解析时返回空字典
+    """
+    if not text:
+        return {}
+    # 去掉代码块标记，取第一个"{"到最后一个"}"之间的内容
+    cleaned = re.sub(r"```(?:json)?", "", text).strip()
+    start, end = cleaned.find("{"), cleaned.rfind("}")
+    if start < 0 or end <= start:
+        return {}
+    try:
+        data = json.loads(cleaned[start:end + 1])
+    except json.JSONDecodeError as e:
+        logger.warning(f"⚠️ [BATCH-ANNOTATION] 批量注释输出不是有效的JSON: {str(e)}")
+        return {}
+
+    entries = data.get("pages") if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        return {}
+    wanted = set(page_numbers)
+    annotations: Dict[int, str] = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            page = int(entry.get("page"))
+        except (TypeError, ValueError):
+            continue
+        annotation = entry.get("annotation")
+        if page in wanted and isinstance(annotation, str) and annotation.strip():
+            annotations[page] = annotation.strip()
+    return annotations
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+视频拖动场景的传输量基准测试
+模拟一次频繁拖动进度条的视频播放会话，对比：
+  1. 不支持Range：每次拖动都从头下载完整文件
+  2. 支持Range：每次拖动只请求播放器需要的片段（206）
+  3. 刷新页面后重新加载：携带If-None-Match，返回304
+
+用法:
+    python bench_media_range.py [--size-mb 50] [--seeks 30] [--window-mb 2]
+"""
+
+import os
+import time
+import random
+import argparse
+
+from fastapi.testclient import TestClient
+
+from config import UPLOAD_DIR
+
+
+def run(size_mb: int, seeks: int, window_mb: int, seed: int):
+    import main
+
+    videos_dir = os.path.join(UPLOAD_DIR, "videos")
+    os.makedirs(videos_dir, exist_ok=True)
+    filename = f"bench_range_{int(time.time())}.mp4"
+    path = os.path.join(videos_dir, filename)
+    size = size_mb * 1024 * 1024
+    window = window_mb * 1024 * 1024
+
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+
+    client = TestClient(main.app)
+    url = f"/api/videos/view/{filename}"
+    rng = random.Random(seed)
+    positions = [rng.randrange(0, size) for _ in range(seeks)]
+
+    try:
+        # 1. 无Range：每次拖动下载完整文件
+        start = time.perf_counter()
+        full_bytes = 0
+        for _ in positions:
+            full_bytes += len(client.get(url).content)
+        full_time = time.perf_counter() - start
+
+        # 2. Range：每次拖动只请求一个窗口
+        start = time.perf_counter()
+        range_bytes = 0
+        etag = None
+        for position in positions:
+            end = min(position + window, size) - 1
+            response = client.get(url, headers={"Range": f"bytes={position}-{end}"})
+            assert response.status_code == 206, response.status_code
+            range_bytes += len(response.content)
+            etag = response.headers["etag"]
+        range_time = time.perf_counter() - start
+
+        # 3. 刷新后条件请求
+        start = time.perf_counter()
+        revalidate_bytes = 0
+        for _ in range(seeks):
+            response = client.get(url, headers={"If-None-Match": etag})
+            assert response.status_code == 304, response.status_code
+            revalidate_bytes += len(response.content)
+        revalidate_time = time.perf_counter() - start
+    finally:
+        os.remove(path)
+
+    print(f"视频大小: {size_mb}MB, 拖动次数: {seeks}, 每次请求窗口: {window_mb}MB")
+    print(f"{'模式':<16}{'传输字节':>16}{'耗时(秒)':>12}")
+    print(f"{'完整下载(200)':<16}{full_bytes:>16}{full_time:>12.3f}")
+    print(f"{'Range(206)':<16}{range_bytes:>16}{range_time:>12.3f}")
+    print(f"{'条件请求(304)':<16}{revalidate_bytes:>16}{revalidate_time:>12.3f}")
+    if range_bytes:
+        print(f"Range传输量降低: {full_bytes / range_bytes:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="视频Range/条件请求传输量基准测试")
+    parser.add_argument("--size-mb", type=int, default=50, help="测试视频大小（MB）")
+    parser.add_argument("--seeks", type=int, default=30, help="拖动次数")
+    parser.add_argument("--window-mb", type=int, default=2, help="每次拖动请求的字节窗口（MB）")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    args = parser.parse_args()
+    run(args.size_mb, args.seeks, args.window_mb, args.seed)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+整本笔记生成耗时基准测试
+对比同一文档的两种生成方式：
+  1. 串行分段：前端循环调用 generate-segmented-note → continue-segmented-note，每段等待上一段完成
+  2. map-reduce：服务端并发生成各段笔记，再逐层合并
+
+默认用模拟LLM（固定延迟 + 按提示词token数增加的延迟）测量调度本身的耗时差异；
+指定 --live 时使用真实API（需要配置API密钥，会产生调用费用），--filename 指定已导入的文档
+
+用法:
+    python bench_note_mapreduce.py [--pages 200] [--segment-pages 20] [--parallelism 4]
+                                   [--base-latency 0.5] [--latency-per-1k 0.05] [--rtt 0.05]
+    python bench_note_mapreduce.py --live --filename 课件.pdf
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+
+from llm_client import llm_client
+from page_store import page_store
+from prompt_builder import estimate_messages_tokens
+from simple_expert import SimpleExpert
+
+
+def _synthetic_pages(pages: int, seed: int):
+    rng = random.Random(seed)
+    words = ["梯度", "下降", "损失函数", "正则化", "卷积", "注意力", "样本", "特征", "模型", "优化",
+             "gradient", "tensor", "batch", "layer", "kernel", "entropy"]
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(80, 400))) for _ in range(pages)]
+
+
+async def _run(filename: str, total_pages: int, segment_pages: int, parallelism: int, rtt: float):
+    expert = SimpleExpert("bench_note_mapreduce")
+    expert.has_llm_client = True
+
+    # 1. 串行分段：每段一次HTTP往返 + 一次LLM调用，下一段要等上一段返回
+    start = time.perf_counter()
+    note = ""
+    start_page = 1
+    serial_calls = 0
+    while start_page <= total_pages:
+        await asyncio.sleep(rtt)
+        result = json.loads(await expert._generate_segmented_note_task({
+            "filename": filename,
+            "start_page": start_page,
+            "page_count": segment_pages,
+            "existing_note": note
+        }))
+        serial_calls += 1
+        note += "\n\n" + result["note"]
+        if not result["has_more"]:
+            break
+        start_page = result["next_start_page"]
+    serial_time = time.perf_counter() - start
+
+    # 2. map-reduce：一次提交，服务端并发
+    start = time.perf_counter()
+    await asyncio.sleep(rtt)
+    await expert._generate_mapreduce_note_task("bench_task", {
+        "filename": filename,
+        "segment_pages": segment_pages,
+        "parallelism": parallelism,
+        "regenerate": True
+    })
+    mapreduce_time = time.perf_counter() - start
+
+    print(f"文档页数: {total_pages}, 每段页数: {segment_pages}, 并发: {parallelism}")
+    print(f"{'模式':<16}{'耗时(秒)':>12}")
+    print(f"{'串行分段':<16}{serial_time:>12.3f}")
+    print(f"{'map-reduce':<16}{mapreduce_time:>12.3f}")
+    if mapreduce_time:
+        print(f"耗时降低: {serial_time / mapreduce_time:.1f}x（串行分段调用 {serial_calls} 次）")
+
+
+def run(args):
+    if args.live:
+        if not args.filename:
+            raise SystemExit("--live 需要同时指定 --filename")
+        total_pages = page_store.page_count(args.filename)
+        if not total_pages:
+            raise SystemExit(f"未找到已导入的文档: {args.filename}")
+        asyncio.run(_run(args.filename, total_pages, args.segment_pages, args.parallelism, args.rtt))
+        return
+
+    filename = f"bench_mapreduce_{int(time.time())}.pdf"
+    page_store.write_document(filename, _synthetic_pages(args.pages, args.seed))
+
+    async def simulated_chat(messages, model, **kwargs):
+        tokens = estimate_messages_tokens(messages)
+        await asyncio.sleep(args.base_latency + tokens / 1000 * args.latency_per_1k)
+        return f"模拟笔记（输入约{tokens} tokens）(第1页)"
+
+    llm_client.chat = simulated_chat
+    try:
+        asyncio.run(_run(filename, args.pages, args.segment_pages, args.parallelism, args.rtt))
+    finally:
+        page_store.delete_document(filename)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="整本笔记串行分段与map-reduce耗时对比")
+    parser.add_argument("--pages", type=int, default=200, help="模拟文档页数")
+    parser.add_argument("--segment-pages", type=int, default=20, help="每段页数")
+    parser.add_argument("--parallelism", type=int, default=4, help="map-reduce并发数")
+    parser.add_argument("--base-latency", type=float, default=0.5, help="模拟LLM每次调用的固定延迟（秒）")
+    parser.add_argument("--latency-per-1k", type=float, default=0.05, help="模拟LLM每1000个输入token增加的延迟（秒）")
+    parser.add_argument("--rtt", type=float, default=0.05, help="模拟前端到服务端的往返延迟（秒）")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--live", action="store_true", help="使用真实API")
+    parser.add_argument("--filename", help="--live时使用的已导入文档")
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+内容寻址的上传文件存储
+上传内容在流式写入时计算sha256，按哈希分片保存到 uploads/.blobs/objects/ab/cd/<sha256>，
+原有的 uploads/{filename} 路径以硬链接（不支持时复制）指向对象文件，
+并通过 文件名 -> 哈希 的别名表记录对应关系。相同内容只保存一份
+
+迁移已有上传文件:
+    python blob_store.py migrate
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+import time
+from typing import BinaryIO, Dict, List, Optional
+
+from config import UPLOAD_DIR, BLOB_DIR, BLOB_CHUNK_SIZE
+from file_index import notify_path
+
+logger = logging.getLogger(__name__)
+
+ALIAS_FILE = "aliases.json"
+
+
+class BlobStore:
+    """按sha256分片存储上传文件，维护 文件名 -> 哈希 别名表"""
+
+    def __init__(self, blob_dir: str = BLOB_DIR, upload_dir: str = UPLOAD_DIR):
+        self.blob_dir = blob_dir
+        self.upload_dir = upload_dir
+        self.objects_dir = os.path.join(blob_dir, "objects")
+        self.tmp_dir = os.path.join(blob_dir, "tmp")
+        self.alias_path = os.path.join(blob_dir, ALIAS_FILE)
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._aliases: Dict[str, Dict] = self._load_aliases()
+
+    def _load_aliases(self) -> Dict[str, Dict]:
+        if not os.path.exists(self.alias_path):
+            return {}
+        try:
+            with open(self.alias_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"❌ [BLOB] 加载别名表失败: {e}")
+            return {}
+
+    def _save_aliases(self):
+        """原子写入别名表，调用方需持有锁"""
+        tmp_path = f"{self.alias_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._aliases, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.alias_path)
+
+    def blob_path(self, sha256: str) -> str:
+        """对象文件路径，按哈希前两级分片"""
+        return os.path.join(self.objects_dir, sha256[:2], sha256[2:4], sha256)
+
+    def alias_name(self, path: str) -> str:
+        """将上传目录下的路径转换为别名（相对路径，统一使用/分隔）"""
+        if not os.path.isabs(path):
+            path = os.path.join(self.upload_dir, path)
+        return os.path.relpath(path, self.upload_dir).replace(os.sep, "/")
+
+    def store(self, source: BinaryIO, destination: str, max_size: Optional[int] = None) -> Dict:
+        """
+        流式保存上传内容并链接到目标路径
+
+        Args:
+            source: 可读的二进制文件对象
+            destination: 目标路径（位于上传目录下）
+            max_size: 允许的最大字节数，超出时抛出ValueError
+
+        Returns:
+            别名记录，包含 sha256、size、duplicate（内容此前已存在）、
+            replaced（同名文件此前指向不同内容）
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.tmp_dir, f"upload_{os.getpid()}_{threading.get_ident()}_{time.time_ns()}")
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = source.read(BLOB_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise ValueError(f"文件大小超过限制: {max_size} 字节")
+                    hasher.update(chunk)
+                    f.write(chunk)
+            return self._commit(tmp_path, hasher.hexdigest(), size, destination)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def store_file(self, path: str, destination: Optional[str] = None) -> Dict:
+        """将磁盘上已有的文件纳入存储（用于迁移），目标默认为文件自身路径"""
+        hasher = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(BLOB_CHUNK_SIZE), b""):
+                size += len(chunk)
+                hasher.update(chunk)
+
+        tmp_path = os.path.join(self.tmp_dir, f"adopt_{os.getpid()}_{threading.get_ident()}_{time.time_ns()}")
+        try:
+            try:
+                os.link(path, tmp_path)
+            except OSError:
+                shutil.copyfile(path, tmp_path)
+            return self._commit(tmp_path, hasher.hexdigest(), size, destination or path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _commit(self, tmp_path: str, sha256: str, size: int, destination: str) -> Dict:
+        """把临时文件放入对象目录（已存在则丢弃），并把目标路径链接到对象文件"""
+        blob = self.blob_path(sha256)
+        with self._lock:
+            duplicate = os.path.exists(blob)
+            if not duplicate:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.replace(tmp_path, blob)
+
+            self._link(blob, destination)
+            notify_path(destination)
+
+            name = self.alias_name(destination)
+            previous = self._aliases.get(name)
+            record = {
+                "sha256": sha256,
+                "size": size,
+                "created_at": previous["created_at"] if previous and previous["sha256"] == sha256 else time.time()
+            }
+            self._aliases[name] = record
+            self._save_aliases()
+
+            # 同名文件被不同内容覆盖时，回收不再被引用的旧对象
+            if previous and previous["sha256"] != sha256:
+                self._collect(previous["sha256"])
+
+        if duplicate:
+            logger.info(f"♻️ [BLOB] 重复内容，复用已有对象: {name} -> {sha256[:12]}")
+        replaced = bool(previous and previous["sha256"] != sha256)
+        return dict(record, name=name, duplicate=duplicate, replaced=replaced)
+
+    def _link(self, blob: str, destination: str):
+        """以硬链接方式把目标路径指向对象文件，先链接到临时名再原子替换"""
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        link_tmp = f"{destination}.link.{threading.get_ident()}"
+        try:
+            os.link(blob, link_tmp)
+        except OSError:
+            # 文件系统不支持硬链接时退化为复制
+            shutil.copyfile(blob, link_tmp)
+        os.replace(link_tmp, destination)
+
+    def lookup(self, name: str) -> Optional[Dict]:
+        """按别名查询记录"""
+        with self._lock:
+            record = self._aliases.get(self.alias_name(name))
+            return dict(record) if record else None
+
+    def aliases(self) -> List[str]:
+        """列出全部别名"""
+        with self._lock:
+            return list(self._aliases)
+
+    def aliases_of(self, sha256: str) -> List[str]:
+        """列出指向同一内容的全部别名"""
+        with self._lock:
+            return [name for name, record in self._aliases.items() if record["sha256"] == sha256]
+
+    def remove(self, name: str) -> bool:
+        """
+        删除别名，内容不再被任何别名引用时回收对象文件
+        不删除上传目录中的文件本身，由调用方负责
+
+        Returns:
+            别名是否存在
+        """
+        with self._lock:
+            record = self._aliases.pop(self.alias_name(name), None)
+            if record is None:
+                return False
+            self._save_aliases()
+            self._collect(record["sha256"])
+            return True
+
+    def _collect(self, sha256: str):
+        """对象不再被别名表引用时删除，调用方需持有锁"""
+        if any(record["sha256"] == sha256 for record in self._aliases.values()):
+            return
+        blob = self.blob_path(sha256)
+        try:
+            os.remove(blob)
+            logger.info(f"🗑️ [BLOB] 已回收对象: {sha256[:12]}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"⚠️ [BLOB] 回收对象失败: {sha256[:12]}, 错误: {e}")
+
+    def migrate_all(self) -> List[Dict]:
+        """把上传目录（含 images、videos 子目录）中尚未登记的文件纳入存储"""
+        migrated = []
+        for root, dirs, files in os.walk(self.upload_dir):
+            # 跳过存储自身、上传会话等隐藏目录及临时目录
+            dirs[:] = [d for d in dirs if not d.startswith(".") and d != "temp"]
+            for entry in files:
+                path = os.path.join(root, entry)
+                if self.lookup(path):
+                    continue
+                try:
+                    migrated.append(self.store_file(path))
+                except Exception as e:
+                    logger.error(f"❌ [BLOB] 迁移失败: {path}, 错误: {e}")
+        return migrated
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取存储统计信息"""
+        with self._lock:
+            unique = {}
+            logical_bytes = 0
+            for record in self._aliases.values():
+                unique[record["sha256"]] = record["size"]
+                logical_bytes += record["size"]
+            stored_bytes = sum(unique.values())
+            return {
+                "aliases": len(self._aliases),
+                "blobs": len(unique),
+                "logical_bytes": logical_bytes,
+                "stored_bytes": stored_bytes,
+                "saved_bytes": logical_bytes - stored_bytes
+            }
+
+
+# 全局内容寻址存储实例
+blob_store = BlobStore()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="WhatNote上传文件内容寻址存储工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="将上传目录中已有的文件纳入内容寻址存储")
+    subparsers.add_parser("stats", help="显示存储统计")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        results = blob_store.migrate_all()
+        duplicates = sum(1 for record in results if record["duplicate"])
+        print(f"迁移完成：{len(results)} 个文件，其中 {duplicates} 个为重复内容")
+    elif args.command == "stats":
+        print(json.dumps(blob_store.get_stats(), ensure_ascii=False, indent=2))
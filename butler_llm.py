@@ -1,7 +1,6 @@
 import os
 import json
 import logging
-import requests
 import uuid
 import time
 import datetime
@@ -12,6 +11,7 @@ from conversation_manager import conversation_manager
 import llm_agents  # 导入LLM交互模块
 from typing import Dict, List, Any, Optional, Union
 from llm_logger import LLMLogger  # 导入LLM日志记录器
+from llm_client import llm_client
 
 logger = logging.getLogger(__name__)
 
@@ -1852,14 +1852,6 @@ class ButlerLLM:
             raise ValueError("未配置QWEN_API_KEY")
         
         try:
-            # 使用OpenAI兼容的API调用
-            from openai import OpenAI
-            
-            client = OpenAI(
-                api_key=QWEN_API_KEY,
-                base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-            )
-            
             # 获取历史对话
             conversation_history = conversation_manager.get_conversation(self.session_id, "global")
             
@@ -1880,26 +1872,17 @@ class ButlerLLM:
             # 添加当前用户消息
             messages.append({"role": "user", "content": prompt})
             
-            # 流式调用
-            completion = client.chat.completions.create(
-                model="qwen-plus",
-                messages=messages,
-                stream=True,
-                stream_options={"include_usage": True}
-            )
-            
             # 收集完整响应
             full_response = ""
             
-            # 处理流式响应
-            for chunk in completion:
-                if chunk.choices and len(chunk.choices) > 0 and chunk.choices[0].delta.content:
-                    content_chunk = chunk.choices[0].delta.content
-                    full_response += content_chunk
-                    
-                    # 如果有回调函数，调用它
-                    if callback and callable(callback):
-                        callback(content_chunk)
+            # 流式调用（共享连接池），处理流式响应
+            for content_chunk in llm_client.stream_sync(messages, "qwen-plus", api_key=QWEN_API_KEY,
+                                                        stream_options={"include_usage": True}):
+                full_response += content_chunk
+                
+                # 如果有回调函数，调用它
+                if callback and callable(callback):
+                    callback(content_chunk)
             
             # 将用户消息和助手回复添加到历史记录
             conversation_manager.add_message(self.session_id, "global", "user", prompt)
@@ -1955,15 +1938,6 @@ class ButlerLLM:
         conversation_manager.add_message(self.session_id, "global", "user", prompt)
         
         try:
-            # 准备API请求 - 使用OpenAI兼容模式
-            import requests
-            
-            url = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {QWEN_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            
             # 构建消息列表，最多取最近10条
             messages = []
             
@@ -1982,22 +1956,13 @@ class ButlerLLM:
             if not (len(messages) >= 2 and messages[-1]["role"] == "user" and messages[-1]["content"] == prompt):
                 messages.append({"role": "user", "content": prompt})
             
-            data = {
-                "model": "qwen-max",  # 使用更高级的模型
-                "messages": messages,
-                "temperature": 0.7
-            }
-            
             # 记录调试信息
             logger.info(f"发送API请求，消息数: {len(messages)}")
             
-            # 发送请求 - 配置代理设置以避免连接问题
+            # 发送请求（使用共享连接池），使用更高级的模型
             start_time = time.time()
-            proxies = {'http': None, 'https': None}
-            response = requests.post(url, headers=headers, json=data, timeout=API_TIMEOUT, proxies=proxies)
-            response.raise_for_status()
-            
-            result = response.json()
+            result = llm_client.chat_completion_sync(messages, "qwen-max", api_key=QWEN_API_KEY,
+                                                     timeout=API_TIMEOUT, temperature=0.7)
             response_content = result["choices"][0]["message"]["content"]
             
             # 计算API调用耗时
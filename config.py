@@ -12,6 +12,52 @@ PAGE_DIR = os.path.join(BASE_DIR, "pages")
 # 文件上传配置
 UPLOAD_MAX_SIZE = 10 * 1024 * 1024  # 10MB
 ALLOWED_EXTENSIONS = {'pdf', 'pptx'}
+BLOB_DIR = os.path.join(UPLOAD_DIR, ".blobs")  # 内容寻址存储目录（需与上传目录位于同一文件系统以便硬链接）
+BLOB_CHUNK_SIZE = 1024 * 1024  # 流式写入/计算哈希的块大小（1MB）
+VIDEO_UPLOAD_MAX_SIZE = 100 * 1024 * 1024  # 视频上传上限（100MB）
+IMAGE_ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
+VIDEO_ALLOWED_EXTENSIONS = {'.mp4', '.webm', '.ogg', '.avi', '.mov', '.wmv', '.flv', '.mkv', '.m4v'}
+
+# 分块上传配置
+UPLOAD_SESSION_DIR = os.path.join(UPLOAD_DIR, ".sessions")  # 未完成的上传会话
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024  # 建议客户端使用的分块大小（4MB）
+UPLOAD_SESSION_TTL = 24 * 3600  # 未更新超过该时长（秒）的上传会话会被清理
+
+# PDF拆分配置
+PDF_SPLIT_PARALLEL_THRESHOLD = 40  # 超过该页数时使用多进程并行拆分
+PDF_SPLIT_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))  # 拆分进程数
+PDF_SPLIT_CHUNK_PAGES = 8  # 每个进程任务处理的页数
+PDF_SPLIT_FIRST_PAGES = 10  # 前N页就绪后即返回，其余页面在后台继续提取
+
+# 导入清单配置
+MANIFEST_TEXT_MIN_CHARS = 50  # 页面提取文字（去除空白）不超过该字符数时视为扫描页，注释走视觉识别
+
+# 页面文本缓存配置
+PAGE_TEXT_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 进程内页面文本缓存上限（64MB）
+PAGE_STORE_MAX_OPEN = 64  # 同时保持打开和映射的页面容器数上限，超过时关闭最久未使用的（避免文件句柄耗尽）
+
+# 页面图像渲染配置
+PAGE_RENDER_DIR = os.path.join(PAGE_DIR, "renders")
+PAGE_RENDER_TIERS = {
+    "thumbnail": 48,   # 缩略图
+    "viewer": 110,     # 查看器显示
+    "vision": 200      # 视觉模型输入
+}
+PAGE_RENDER_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 渲染缓存总字节预算（512MB）
+PAGE_RENDER_PREFETCH_RADIUS = 2  # 预渲染当前页前后各N页
+PAGE_RENDER_WORKERS = 2  # 后台预渲染线程数
+
+# HTTP缓存配置（按媒体类型或主类型匹配）
+HTTP_CACHE_CONTROL = {
+    "video": "public, max-age=86400",        # 视频文件名带时间戳，内容不会变化
+    "image": "public, max-age=86400",
+    "application/pdf": "no-cache",           # 课件可能以同名重新上传，每次用ETag校验
+    "default": "no-cache"
+}
+HTTP_RANGE_CHUNK_SIZE = 256 * 1024  # 分段响应的读取块大小
+
+# 文件名索引配置
+FILE_INDEX_WATCH_INTERVAL = 5  # 目录监视轮询间隔（秒），0表示只依赖上传/删除钩子
 
 # API配置
 API_TIMEOUT = 180  # 增加超时时间至3分钟，应对复杂的笔记改进任务
@@ -21,6 +67,135 @@ DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
 # 优先使用DASHSCOPE_API_KEY环境变量，不存在时再使用QWEN_VL_API_KEY
 QWEN_VL_API_KEY = DASHSCOPE_API_KEY or os.getenv("QWEN_VL_API_KEY")
 
+# LLM客户端配置（所有模块共用一个连接池）
+LLM_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+LLM_MAX_CONNECTIONS = 32  # 连接池最大连接数
+LLM_MAX_KEEPALIVE_CONNECTIONS = 16  # 保持空闲的长连接数
+LLM_KEEPALIVE_EXPIRY = 60  # 空闲连接保持时长（秒）
+LLM_CONNECT_TIMEOUT = 10  # 建立连接超时（秒），读取超时由各调用指定
+LLM_STREAM_BUFFER_CHUNKS = 64  # 流式调用缓冲的数据块数，消费方跟不上时暂停读取上游
+
+# LLM限流、重试与熔断配置（进程内所有调用共享）
+LLM_RATE_LIMITS = {  # 每个模型每分钟请求数（rpm）和token数（tpm）
+    "qwen-max": {"rpm": 600, "tpm": 1000000},
+    "qwen-plus": {"rpm": 1200, "tpm": 1000000},
+    "qwen-turbo": {"rpm": 1200, "tpm": 1000000},
+    "qwen-vl-plus": {"rpm": 600, "tpm": 1000000},
+    "qwen-vl-max": {"rpm": 600, "tpm": 1000000},
+    "default": {"rpm": 600, "tpm": 1000000}
+}
+LLM_MAX_RETRIES = 4  # 429/5xx/连接失败时的最大重试次数
+LLM_RETRY_BASE_DELAY = 1.0  # 指数退避的基础等待（秒）
+LLM_RETRY_MAX_DELAY = 30.0  # 单次重试的最长等待（秒）
+LLM_BREAKER_FAILURE_THRESHOLD = 5  # 连续失败（5xx/连接失败/超时）次数达到该值时熔断
+LLM_BREAKER_RESET_TIMEOUT = 30  # 熔断后经过该时长（秒）放行一个试探请求
+
+# LLM自适应并发配置（AIMD：成功时加性增大上限，拥塞时乘性减小）
+LLM_CONCURRENCY_INITIAL = 8  # 初始并发上限
+LLM_CONCURRENCY_MIN = 1  # 并发上限的下限
+LLM_CONCURRENCY_MAX = LLM_MAX_CONNECTIONS  # 并发上限的上限，不超过连接池大小
+LLM_CONCURRENCY_DECREASE = 0.7  # 拥塞时上限乘以该系数
+LLM_CONCURRENCY_LATENCY_TOLERANCE = 2.0  # 延迟超过基线（近期第10百分位）的该倍数时视为拥塞
+LLM_CONCURRENCY_WINDOW = 200  # 用于计算基线和百分位的最近调用数
+
+# 模型路由配置：按顺序匹配第一条规则，规则中未写的条件匹配任意值
+#   task: 任务类型（annotation/vision_annotation/note/qa/improve_note/board_note/query）
+#   style: 注释风格；max_prompt_tokens: 提示词内容不超过该token数时才匹配
+#   model/max_tokens/timeout: 使用的模型、输出token上限和读取超时（秒）
+#   fallback: 主模型降级（熔断或近期第90百分位耗时超过max_latency秒）时改用的模型
+# 存在MODEL_ROUTES_FILE（JSON列表，格式同下）时以文件为准，修改文件后下次调用即生效
+MODEL_ROUTES_FILE = os.getenv("MODEL_ROUTES_FILE", os.path.join(BASE_DIR, "model_routes.json"))
+MODEL_ROUTES = [
+    {"task": "annotation", "style": "keywords", "model": "qwen-turbo", "max_tokens": 1000, "timeout": 60},
+    {"task": "annotation", "style": "detailed", "model": "qwen-max", "max_tokens": 2000, "timeout": 120,
+     "fallback": "qwen-plus", "max_latency": 60},
+    {"task": "annotation", "model": "qwen-plus", "max_tokens": 2000, "timeout": 90,
+     "fallback": "qwen-turbo", "max_latency": 45},
+    {"task": "vision_annotation", "model": "qwen-vl-plus", "max_tokens": 3000, "timeout": API_TIMEOUT * 2},
+    {"task": "note", "model": "qwen-plus", "max_tokens": 4000, "timeout": API_TIMEOUT * 2,
+     "fallback": "qwen-turbo", "max_latency": 150},
+    {"task": "qa", "max_prompt_tokens": 20000, "model": "qwen-max", "max_tokens": 2000, "timeout": 120,
+     "fallback": "qwen-plus", "max_latency": 90},
+    {"task": "qa", "model": "qwen-plus", "max_tokens": 2000, "timeout": 120,
+     "fallback": "qwen-turbo", "max_latency": 90},
+    {"task": "improve_note", "model": "qwen-max", "max_tokens": 4000, "timeout": API_TIMEOUT,
+     "fallback": "qwen-plus", "max_latency": 150},
+    {"task": "board_note", "model": "qwen-plus", "max_tokens": 4000, "timeout": API_TIMEOUT,
+     "fallback": "qwen-turbo", "max_latency": 150},
+    {"task": "query", "model": "qwen-plus", "max_tokens": 4000, "timeout": 120,
+     "fallback": "qwen-turbo", "max_latency": 60},
+    {"model": "qwen-plus", "max_tokens": 2000, "timeout": API_TIMEOUT}  # 兜底规则
+]
+MODEL_ROUTE_LATENCY_WINDOW = 300  # 判断主模型延迟时只看最近该时长（秒）内的调用，降级后到期自动恢复
+MODEL_ROUTE_HISTORY = 200  # 保留最近的路由决策数
+
+# LLM响应缓存配置（内存 + SQLite两级）
+LLM_CACHE_DB = os.path.join(BASE_DIR, "llm_cache", "responses.sqlite3")
+LLM_CACHE_TTL = 7 * 24 * 3600  # 缓存有效期（秒）
+LLM_CACHE_MEMORY_MAX_BYTES = 16 * 1024 * 1024  # 内存层上限（16MB）
+LLM_CACHE_DISK_MAX_BYTES = 256 * 1024 * 1024  # 磁盘层上限（256MB），超出时淘汰最久未使用的条目
+
+# 提示词token预算配置（页面内容可使用的token数，已为提示词模板和模型输出留出余量）
+PROMPT_CONTENT_TOKEN_BUDGETS = {
+    "qwen-max": 20000,     # 上下文32K
+    "qwen-plus": 48000,    # 上下文128K
+    "qwen-turbo": 48000,
+    "qwen-vl-plus": 4000,  # 视觉模型的文字部分
+    "qwen-vl-max": 4000,
+    "default": 20000
+}
+PROMPT_MIN_PAGE_TOKENS = 60  # 每页至少分配的token数，预算不足以覆盖所有页面时只保留信息密度最高的页面
+
+# 任务调度配置（数字越小越优先，同一优先级先进先出）
+TASK_PRIORITIES = {
+    "answer_question": 0,      # 交互式问答
+    "general_query": 0,
+    "annotation": 0,           # 单页注释
+    "generate_annotation": 0,
+    "improve_annotation": 0,
+    "vision_annotation": 0,
+    "generate_segmented_note": 1,
+    "generate_board_note": 1,
+    "improve_board_note": 1,
+    "generate_batch_annotation": 2,  # 批量注释
+    "generate_note": 2,              # 整本笔记
+    "generate_mapreduce_note": 2
+}
+TASK_DEFAULT_PRIORITY = 1
+TASK_PRIORITY_AGING_INTERVAL = 15  # 任务每排队该时长（秒）有效优先级提升一级，避免低优先级任务饿死
+
+# 全局任务池与公平排队配置（所有展板共享执行名额，课程之间、展板之间按权重轮流出队）
+TASK_POOL_MAX_WORKERS = 16  # 全进程同时执行的任务数硬上限（同时不超过LLM自适应并发上限）
+FAIR_QUEUE_COURSE_WEIGHTS = {}  # 课程ID → 权重，未列出的课程权重为1
+FAIR_QUEUE_BOARD_WEIGHTS = {}   # 展板ID → 权重，未列出的展板权重为1
+FAIR_QUEUE_SHARE_WINDOW = 200  # 统计各课程、展板出队份额的最近出队次数
+
+# 任务记录配置（全局任务索引；已结束的任务按空闲时长、数量和内存占用淘汰）
+TASK_RESULT_DIR = os.path.join(BASE_DIR, "task_results")  # 大结果的落盘目录
+TASK_RESULT_TTL = 24 * 3600  # 已结束的任务超过该时长（秒）未被查询即淘汰
+TASK_RESULT_MAX_ENTRIES = 5000  # 最多保留的已结束任务数，超出时淘汰最久未查询的
+TASK_RESULT_MEMORY_MAX_BYTES = 64 * 1024 * 1024  # 内存中任务结果的总字节上限（64MB）
+TASK_RESULT_SPILL_BYTES = 32 * 1024  # 超过该字节数的结果写入磁盘，内存中只保留文件路径
+
+# 任务日志配置（提交/开始/完成/失败事件追加写入SQLite，重启后恢复未完成的任务）
+TASK_JOURNAL_DB = os.path.join(BASE_DIR, "task_journal", "tasks.sqlite3")
+TASK_JOURNAL_RETENTION = 7 * 24 * 3600  # 已结束任务的事件保留时长（秒），期间结果仍可按任务ID查询
+TASK_JOURNAL_RECOVER_MAX_AGE = 24 * 3600  # 提交超过该时长（秒）仍未完成的任务启动时不再恢复，记为失败
+TASK_JOURNAL_MAX_RECOVERIES = 3  # 同一任务最多恢复的次数，超过时记为失败（避免反复导致崩溃的任务）
+TASK_JOURNAL_RESULT_MAX_CHARS = 8000  # 完成事件中保存的结果字符数上限，更长的结果只保存开头（完整结果由任务记录保存）
+TASK_SHUTDOWN_DRAIN_TIMEOUT = 20  # 关闭时等待执行中任务结束的最长时间（秒），未结束的任务下次启动时恢复
+
+# 批量注释打包配置（连续的短页面合并为一次请求，按页输出JSON）
+ANNOTATION_BATCH_MAX_PAGES = 6  # 每次请求最多打包的页数
+ANNOTATION_BATCH_SHORT_PAGE_TOKENS = 400  # 页面文字不超过该token数时才参与打包
+ANNOTATION_BATCH_MAX_PROMPT_TOKENS = 2400  # 每次请求打包的页面内容token上限
+ANNOTATION_BATCH_MAX_OUTPUT_TOKENS = 8000  # 打包请求的输出token上限（按页数放大单页上限后不超过该值）
+
+# 整本笔记map-reduce生成配置
+NOTE_MAPREDUCE_SEGMENT_PAGES = 20  # 每段最多页数（有目录时按章节切分，过长的章节再均分）
+NOTE_MAPREDUCE_PARALLELISM = 4  # 同时生成的分段/合并数
+NOTE_MAPREDUCE_MERGE_FANIN = 4  # 每次合并的分段笔记数，超过时逐层合并
+
 # 日志配置
 LOG_LEVEL = "INFO"
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -28,3 +203,5 @@ LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 # 确保目录存在
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(PAGE_DIR, exist_ok=True)
+os.makedirs(PAGE_RENDER_DIR, exist_ok=True)
+os.makedirs(TASK_RESULT_DIR, exist_ok=True)
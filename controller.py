@@ -1,7 +1,20 @@
 import os
 import uuid
+import time
+import secrets
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 from llm_agents import main_llm_annotate, vision_llm_recognize, generate_pdf_note, ask_pdf_question, improve_user_note
-from config import PAGE_DIR, UPLOAD_DIR
+from config import (
+    PAGE_DIR, UPLOAD_DIR, PDF_SPLIT_PARALLEL_THRESHOLD, PDF_SPLIT_WORKERS,
+    PDF_SPLIT_CHUNK_PAGES, PDF_SPLIT_FIRST_PAGES
+)
+from page_store import page_store
+from page_cache import page_text_cache
+from page_renderer import page_renderer
+from blob_store import blob_store
+from file_index import upload_index, page_index
+from ingest_manifest import ingest_manifest
 import fitz
 import json
 from typing import Optional
@@ -13,8 +26,23 @@ logger = logging.getLogger(__name__)
 
 def get_page_text(filename: str, page_number: int) -> str:
     """
-    获取PDF页面文本，增强对特殊文件名的处理
+    获取PDF页面文本，经过进程内页面文本缓存（按文件mtime/大小校验）
     """
+    signature = page_store.page_signature(filename, page_number)
+    return page_text_cache.get(
+        filename, page_number, signature,
+        lambda: _read_page_text(filename, page_number)
+    )
+
+def _read_page_text(filename: str, page_number: int) -> str:
+    """
+    从磁盘读取PDF页面文本，增强对特殊文件名的处理
+    优先从打包的页面容器读取，未打包的文档回退到旧格式单页文本文件
+    """
+    packed_text = page_store.read_page(filename, page_number)
+    if packed_text is not None:
+        return packed_text
+    
     # 标准路径尝试
     page_file = os.path.join(PAGE_DIR, f"{filename}_page_{page_number}.txt")
     
@@ -22,22 +50,15 @@ def get_page_text(filename: str, page_number: int) -> str:
     if not os.path.exists(page_file):
         print(f"警告: 未找到页面文本文件: {page_file}")
         
-        # 尝试列出pages目录中所有可能匹配的文件
+        # 通过页面目录索引查找包含原文件名（不含扩展名）的同页码文件
         try:
-            all_page_files = os.listdir(PAGE_DIR)
-            possible_matches = [f for f in all_page_files if f.endswith(f"_page_{page_number}.txt")]
-            
-            # 尝试找到与当前文件名匹配度最高的文件
-            if possible_matches:
-                # 提取原始文件名部分（不含扩展名）
-                name_without_ext = os.path.splitext(filename)[0]
-                
-                # 寻找包含原文件名的页面文件
-                for match in possible_matches:
-                    if name_without_ext in match:
-                        page_file = os.path.join(PAGE_DIR, match)
-                        print(f"找到匹配的页面文件: {page_file}")
-                        break
+            name_without_ext = os.path.splitext(filename)[0]
+            suffix = f"_page_{page_number}.txt"
+            for match in page_index.containing(name_without_ext):
+                if match.endswith(suffix) and name_without_ext in match:
+                    page_file = os.path.join(PAGE_DIR, match)
+                    print(f"找到匹配的页面文件: {page_file}")
+                    break
         except Exception as e:
             print(f"搜索匹配页面文件时出错: {str(e)}")
     
@@ -54,9 +75,8 @@ def get_page_text(filename: str, page_number: int) -> str:
                     text = page.get_text()
                     
                     # 保存提取的文本到文件
-                    with open(page_file, 'w', encoding='utf-8') as f:
-                        f.write(text)
-                    print(f"成功提取并保存页面文本: {page_file}")
+                    saved_path = page_store.save_page_text(filename, page_number, text)
+                    print(f"成功提取并保存页面文本: {saved_path}")
                     return text
                 else:
                     print(f"页码超出范围: {page_number}，PDF总页数: {len(doc)}")
@@ -75,15 +95,52 @@ def get_page_text(filename: str, page_number: int) -> str:
         print(f"读取页面文本文件失败: {str(e)}")
         return ""
 
-def get_page_image(filename: str, page_number: int) -> str:
-    pdf_path = os.path.join(UPLOAD_DIR, filename)
-    img_path = os.path.join(PAGE_DIR, f"{filename}_page_{page_number}.png")
-    if not os.path.exists(img_path):
-        doc = fitz.open(pdf_path)
-        page = doc[page_number - 1]
-        pix = page.get_pixmap(dpi=200)
-        pix.save(img_path)
-    return img_path
+def get_page_texts(filename: str) -> list:
+    """
+    获取文档全部页面文本
+    优先读取打包容器，否则按旧格式逐页读取直到缺页
+    
+    Returns:
+        页面文本列表，没有页面时返回空列表
+    """
+    page_count = page_store.page_count(filename)
+    if page_count:
+        # 打包文档所有页面共享容器文件签名
+        signature = page_store.page_signature(filename)
+        return [
+            page_text_cache.get(
+                filename, i, signature,
+                lambda i=i: page_store.read_page(filename, i) or ""
+            )
+            for i in range(1, page_count + 1)
+        ]
+    
+    pages = []
+    i = 1
+    while True:
+        signature = page_store.page_signature(filename, i)
+        if signature is None:
+            break
+        page_file = page_store.legacy_page_path(filename, i)
+        pages.append(page_text_cache.get(filename, i, signature, lambda page_file=page_file: _read_text_file(page_file)))
+        i += 1
+    return pages
+
+def _read_text_file(path: str) -> str:
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def get_page_image(filename: str, page_number: int, size: str = "vision", fmt: str = "png") -> str:
+    """
+    获取页面图像路径，由渲染服务按分辨率档位缓存
+    
+    Args:
+        filename: PDF文件名
+        page_number: 页码
+        size: 分辨率档位 thumbnail / viewer / vision（默认200dpi，供视觉模型使用）
+        fmt: 图像格式 png / jpeg / webp
+    """
+    return page_renderer.get_page_image(filename, page_number, size, fmt)
 
 def check_file_exists(filename: str) -> dict:
     """
@@ -97,25 +154,11 @@ def check_file_exists(filename: str) -> dict:
     if os.path.exists(direct_path):
         return {"exists": True, "path": filename}
     
-    # 尝试在上传目录中查找匹配的文件
+    # 通过上传目录索引查找：精确匹配 -> 忽略大小写 -> 包含原文件名（服务器可能添加了前缀或后缀）
     try:
-        all_files = os.listdir(UPLOAD_DIR)
-        
-        # 1. 检查精确匹配
-        if filename in all_files:
-            return {"exists": True, "path": filename}
-        
-        # 2. 忽略大小写查找
-        lower_filename = filename.lower()
-        for file in all_files:
-            if file.lower() == lower_filename:
-                return {"exists": True, "path": file}
-        
-        # 3. 查找包含原文件名的文件(针对服务器可能添加前缀或后缀的情况)
-        name_without_ext = os.path.splitext(filename)[0]
-        for file in all_files:
-            if name_without_ext in file:
-                return {"exists": True, "path": file}
+        resolved = upload_index.resolve(filename)
+        if resolved and os.path.exists(os.path.join(UPLOAD_DIR, resolved)):
+            return {"exists": True, "path": resolved}
     except Exception as e:
         print(f"查找文件出错: {e}")
     
@@ -123,7 +166,8 @@ def check_file_exists(filename: str) -> dict:
 
 def annotate_page(filename: str, page_number: int, force_vision: bool = False, 
                 session_id: str = None, current_annotation: str = None, 
-                improve_request: str = None, board_id: str = None) -> dict:
+                improve_request: str = None, board_id: str = None,
+                regenerate: bool = False) -> dict:
     """
     为PDF页面生成注释
     
@@ -135,6 +179,7 @@ def annotate_page(filename: str, page_number: int, force_vision: bool = False,
         current_annotation: 当前的注释内容（用于重新生成时参考）
         improve_request: 用户的改进请求
         board_id: 展板ID，如果有，则使用对应的专家LLM
+        regenerate: 跳过LLM响应缓存重新生成
         
     Returns:
         包含注释内容和来源的字典
@@ -224,10 +269,8 @@ def annotate_page(filename: str, page_number: int, force_vision: bool = False,
         
         # 🔥 新增功能：将视觉识别结果保存到txt文件中，替换原始PDF提取的内容
         try:
-            page_file = os.path.join(PAGE_DIR, f"{filename}_page_{page_number}.txt")
-            with open(page_file, 'w', encoding='utf-8') as f:
-                f.write(vision_result)
-            print(f"✅ 视觉识别结果已保存到: {page_file}")
+            saved_path = page_store.save_page_text(filename, page_number, vision_result)
+            print(f"✅ 视觉识别结果已保存到: {saved_path}")
         except Exception as e:
             print(f"⚠️ 保存视觉识别结果失败: {str(e)}")
             # 即使保存失败，也继续返回结果
@@ -240,6 +283,15 @@ def annotate_page(filename: str, page_number: int, force_vision: bool = False,
         if improve_request and not current_annotation:
             print(f"首次生成注释，但包含改进建议: {improve_request}")
         
+        # 导入清单标记为扫描页（几乎没有可提取文字）时直接使用视觉识别
+        page_info = ingest_manifest.page_info(filename, page_number)
+        if page_info and page_info["type"] == "scanned":
+            print(f"导入清单显示第{page_number}页为扫描页（{page_info['chars']}字符），使用视觉识别")
+            img_path = get_page_image(filename, page_number)
+            vision_result = vision_llm_recognize(img_path, session_id=session_id, file_id=filename, 
+                                               context=context_dict, board_id=board_id)
+            return {"source": "vision", "annotation": vision_result, "session_id": session_id}
+        
         try:
             # 获取页面文本
             text = get_page_text(filename, page_number)
@@ -251,13 +303,13 @@ def annotate_page(filename: str, page_number: int, force_vision: bool = False,
                     # 获取或创建展板专家LLM
                     expert_llm = ExpertLLMRegistry.get_or_create(board_id)
                     if expert_llm:
-                        note = expert_llm.generate_note(filename, [text], page_number)
+                        note = expert_llm.generate_note(filename, [text], page_number, refresh=regenerate)
                         return {"source": "expert_llm", "annotation": note, "session_id": session_id}
                 except Exception as e:
                     print(f"使用展板专家LLM生成注释失败: {str(e)}，将使用通用LLM")
             
             # 如果没有展板ID或专家LLM处理失败，使用通用LLM
-            response = main_llm_annotate(text, session_id, filename)
+            response = main_llm_annotate(text, session_id, filename, refresh=regenerate)
             return {"source": "text", "annotation": response["note"], "session_id": session_id}
         except Exception as e:
             print(f"文本注释过程中出错: {str(e)}")
@@ -274,7 +326,8 @@ def annotate_page(filename: str, page_number: int, force_vision: bool = False,
     
     raise ValueError("未知的注释生成模式")
 
-def create_pdf_note(filename: str, pages_text: list, session_id: str = None) -> dict:
+def create_pdf_note(filename: str, pages_text: list, session_id: str = None,
+                    regenerate: bool = False) -> dict:
     """
     创建整本PDF的笔记
     
@@ -282,6 +335,7 @@ def create_pdf_note(filename: str, pages_text: list, session_id: str = None) ->
         filename: PDF文件名
         pages_text: 所有页面的文本内容列表
         session_id: 会话ID
+        regenerate: 跳过LLM响应缓存重新生成
         
     Returns:
         包含笔记内容和会话ID的字典
@@ -289,7 +343,7 @@ def create_pdf_note(filename: str, pages_text: list, session_id: str = None) ->
     if not session_id:
         session_id = str(uuid.uuid4())
         
-    note = generate_pdf_note(pages_text, session_id=session_id, file_id=filename)
+    note = generate_pdf_note(pages_text, session_id=session_id, file_id=filename, refresh=regenerate)
     return {"note": note, "session_id": session_id}
 
 def ask_question(filename: str, question: str, pages_text: list, session_id: str = None) -> dict:
@@ -378,14 +432,14 @@ def improve_note(filename: str, note_content: str, pages_text: list, improve_pro
 
 def split_pdf(pdf_path, base_name):
     """
-    将PDF按页拆分成文本文件，增强错误处理和日志记录
+    将PDF按页提取文本并写入打包的页面容器，增强错误处理和日志记录
     
     Args:
         pdf_path: PDF文件路径
         base_name: 保存的基本文件名
         
     Returns:
-        创建的页面文件列表
+        页面文本列表
     """
     try:
         print(f"开始拆分PDF文件: {pdf_path}")
@@ -393,41 +447,294 @@ def split_pdf(pdf_path, base_name):
         total_pages = len(doc)
         print(f"PDF总页数: {total_pages}")
         
-        page_files = []
+        pages_text = []
         for i, page in enumerate(doc):
             try:
-                # 获取页面文本
-                text = page.get_text()
-                
-                # 生成页面文件路径
-                page_file = os.path.join(PAGE_DIR, f"{base_name}_page_{i+1}.txt")
-                
-                # 保存页面文本
-                with open(page_file, 'w', encoding='utf-8') as f:
-                    f.write(text)
-                
-                # 验证文件已正确创建
-                if os.path.exists(page_file):
-                    page_size = os.path.getsize(page_file)
-                    print(f"✅ 成功创建第{i+1}页文本文件，大小: {page_size} 字节")
-                    page_files.append(page_file)
-                else:
-                    print(f"⚠️ 第{i+1}页文本文件未正确创建")
+                pages_text.append(page.get_text())
             except Exception as e:
                 print(f"❌ 处理第{i+1}页时出错: {str(e)}")
-                # 创建一个包含错误信息的页面文件，避免中断拆分过程
-                error_page_file = os.path.join(PAGE_DIR, f"{base_name}_page_{i+1}.txt")
-                with open(error_page_file, 'w', encoding='utf-8') as f:
-                    f.write(f"无法提取此页内容。错误信息: {str(e)}")
-                page_files.append(error_page_file)
+                # 写入包含错误信息的页面，避免中断拆分过程
+                pages_text.append(f"无法提取此页内容。错误信息: {str(e)}")
+        doc.close()
         
-        # 验证提取的页面数量
-        if len(page_files) != total_pages:
-            print(f"⚠️ 警告: 实际提取的页面数({len(page_files)})与PDF总页数({total_pages})不符")
-        else:
-            print(f"✅ 成功提取PDF全部{total_pages}页内容")
+        container_path = page_store.write_document(base_name, pages_text)
+        print(f"✅ 成功提取PDF全部{total_pages}页内容，已写入: {container_path}")
+        ingest_manifest.save(base_name, pages_text, pdf_path)
         
-        return page_files
+        return pages_text
     except Exception as e:
         print(f"❌ 拆分PDF文件失败: {str(e)}")
-        raise e 
\ No newline at end of file
+        raise e
+
+# PDF拆分进程池（延迟创建，避免在子进程导入本模块时重复创建）
+_split_executor = None
+
+def _get_split_executor() -> ProcessPoolExecutor:
+    global _split_executor
+    if _split_executor is None:
+        _split_executor = ProcessPoolExecutor(max_workers=PDF_SPLIT_WORKERS)
+    return _split_executor
+
+def _extract_page_range(pdf_path, start, end):
+    """
+    在子进程中提取[start, end)范围内的页面文本，每个进程独立打开文档
+    
+    Returns:
+        (start, 页面文本列表)
+    """
+    doc = fitz.open(pdf_path)
+    pages_text = []
+    try:
+        for i in range(start, end):
+            try:
+                pages_text.append(doc[i].get_text())
+            except Exception as e:
+                # 与串行拆分保持一致：写入错误信息，避免中断整个范围
+                pages_text.append(f"无法提取此页内容。错误信息: {str(e)}")
+    finally:
+        doc.close()
+    return start, pages_text
+
+def count_pdf_pages(pdf_path) -> int:
+    """读取PDF页数（只解析交叉引用表，不提取内容）"""
+    doc = fitz.open(pdf_path)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+def _store_split_result(base_name, pages_text, source_path, outline=None):
+    """在主进程中写入页面容器和导入清单（保证本进程的缓存与文件索引同步更新）"""
+    page_store.write_document(base_name, pages_text)
+    ingest_manifest.save(base_name, pages_text, source_path, outline=outline)
+
+# 正在后台跟踪剩余分片的拆分任务
+_split_trackers = set()
+
+def _on_tracker_done(tracker):
+    _split_trackers.discard(tracker)
+    if not tracker.cancelled() and tracker.exception() is not None:
+        print(f"❌ 并行拆分后台跟踪异常: {tracker.exception()!r}")
+
+async def split_pdf_parallel(pdf_path, base_name, board_id: str = None,
+                             first_pages: int = PDF_SPLIT_FIRST_PAGES,
+                             task_id: str = None, on_done=None):
+    """
+    多进程并行拆分PDF，前first_pages页就绪后立即返回，其余页面在后台继续提取
+    
+    页面范围被分片提交到进程池，每完成一个分片就通过task_event_manager推送进度
+    (已完成页数/总页数)。未指定board_id时进度事件发送到"global"频道。
+    页面容器只写入两次（均在线程池中）：前置页面就绪时写入已就绪的前缀，全部完成时写入整个文档。
+    页数较少的文档整体交给进程池提取，完成后返回。
+    
+    Args:
+        pdf_path: PDF文件路径
+        base_name: 保存的基本文件名
+        board_id: 接收进度事件的展板ID
+        first_pages: 需要在返回前完成的前置页数
+        task_id: 沿用调用方（如导入任务）的任务ID推送进度，此时不再单独发送开始事件
+        on_done: 全部页面提取完成（或失败）后的回调，参数为错误信息，成功时为None；
+            失败时已写入的前缀页面容器被删除
+        
+    Returns:
+        文档总页数
+    """
+    from task_event_manager import task_event_manager
+    
+    loop = asyncio.get_running_loop()
+    executor = _get_split_executor()
+    
+    total_pages = await loop.run_in_executor(None, count_pdf_pages, pdf_path)
+    
+    channel = board_id or "global"
+    
+    if total_pages < PDF_SPLIT_PARALLEL_THRESHOLD:
+        # 调用方提供了任务ID时，由这里负责推送结束事件
+        try:
+            _, pages_text = await loop.run_in_executor(executor, _extract_page_range, pdf_path, 0, total_pages)
+            await loop.run_in_executor(None, _store_split_result, base_name, pages_text, pdf_path)
+        except Exception as e:
+            if task_id is not None:
+                await task_event_manager.notify_task_failed(channel, task_id, str(e))
+            if on_done:
+                await on_done(str(e))
+            raise
+        if task_id is not None:
+            await task_event_manager.notify_task_completed(channel, task_id, {"pages": total_pages})
+        if on_done:
+            await on_done(None)
+        return total_pages
+    
+    print(f"开始并行拆分PDF文件: {pdf_path}，总页数: {total_pages}，进程数: {PDF_SPLIT_WORKERS}")
+    
+    # 第一个分片覆盖前first_pages页，其余按固定大小分片
+    first_end = max(1, min(first_pages, total_pages))
+    ranges = [(0, first_end)]
+    for start in range(first_end, total_pages, PDF_SPLIT_CHUNK_PAGES):
+        ranges.append((start, min(start + PDF_SPLIT_CHUNK_PAGES, total_pages)))
+    
+    futures = [
+        loop.run_in_executor(executor, _extract_page_range, pdf_path, start, end)
+        for start, end in ranges
+    ]
+    
+    # 已提取的页面文本，从第1页起连续提取完成的页数，以及容器中已可读取的页数
+    pages_text = [None] * total_pages
+    ready_prefix = 0
+    written_pages = 0
+    
+    def _store_range(start, range_text):
+        nonlocal ready_prefix
+        pages_text[start:start + len(range_text)] = range_text
+        while ready_prefix < total_pages and pages_text[ready_prefix] is not None:
+            ready_prefix += 1
+    
+    async def _write_prefix():
+        nonlocal written_pages
+        start, range_text = await futures[0]
+        _store_range(start, range_text)
+        prefix = ready_prefix
+        await loop.run_in_executor(None, page_store.write_document, base_name, pages_text[:prefix])
+        written_pages = prefix
+    
+    start_time = time.time()
+    if task_id is None:
+        task_id = f"pdf_split_task_{int(time.time() * 1000)}_{secrets.token_hex(2)}"
+        await task_event_manager.notify_task_started(channel, task_id, {
+            "task_type": "pdf_split",
+            "description": f"拆分 {base_name}（共{total_pages}页）"
+        })
+    
+    async def _track_progress():
+        completed_pages = 0
+        try:
+            for next_done in asyncio.as_completed(futures):
+                start, range_text = await next_done
+                if start != 0:
+                    # 第一个分片由_write_prefix记录
+                    _store_range(start, range_text)
+                completed_pages += len(range_text)
+                await task_event_manager.notify_task_progress(channel, task_id, {
+                    "completed_pages": completed_pages,
+                    "ready_pages": written_pages,
+                    "total_pages": total_pages,
+                    "range": [start + 1, start + len(range_text)],
+                    "elapsed": time.time() - start_time
+                })
+            # 前缀写入完成后再写入整个文档，避免较早的前缀覆盖完整容器
+            await prefix_written
+            await loop.run_in_executor(None, _store_split_result, base_name, pages_text, pdf_path)
+            print(f"✅ 并行拆分完成: {base_name}，共{total_pages}页，耗时: {time.time() - start_time:.2f}秒")
+            await task_event_manager.notify_task_completed(channel, task_id)
+            if on_done:
+                await on_done(None)
+        except Exception as e:
+            print(f"❌ 并行拆分PDF失败: {str(e)}")
+            # 取消尚未开始的分片，并删除只含前缀页面的容器，避免分页接口把不完整的文档当作完整文档返回
+            for future in futures:
+                future.cancel()
+            await asyncio.gather(prefix_written, return_exceptions=True)
+            await loop.run_in_executor(None, page_store.delete_document, base_name)
+            await task_event_manager.notify_task_failed(channel, task_id, str(e))
+            if on_done:
+                await on_done(str(e))
+    
+    prefix_written = asyncio.ensure_future(_write_prefix())
+    # 保留后台跟踪任务的引用，避免执行中被回收
+    tracker = asyncio.create_task(_track_progress())
+    _split_trackers.add(tracker)
+    tracker.add_done_callback(_on_tracker_done)
+    
+    # 等待前置页面完成并写入容器后返回，其余分片由后台跟踪（失败时由跟踪任务推送失败事件）
+    await prefix_written
+    print(f"✅ 前{first_end}页已就绪: {base_name}，耗时: {time.time() - start_time:.2f}秒")
+    
+    return total_pages
+
+def _extract_pptx(pptx_path):
+    """
+    在拆分进程中解析PPTX（python-pptx为纯Python实现，放在进程池中避免占用主进程GIL）
+    
+    Returns:
+        (页面文本列表, 以幻灯片标题构成的目录)
+    """
+    from pptx import Presentation
+    prs = Presentation(pptx_path)
+    pages_text = []
+    outline = []
+    for i, slide in enumerate(prs.slides, 1):
+        texts = []
+        for shape in slide.shapes:
+            if hasattr(shape, "text"):
+                texts.append(shape.text)
+        pages_text.append('\n'.join(texts))
+        # 以幻灯片标题作为导入清单中的目录
+        title_shape = slide.shapes.title
+        if title_shape is not None and title_shape.text.strip():
+            outline.append({"level": 1, "title": title_shape.text.strip(), "page": i})
+    return pages_text, outline
+
+def split_pptx(pptx_path, base_name):
+    """
+    将PPTX按幻灯片提取文本并写入打包的页面容器
+    
+    Returns:
+        页面文本列表
+    """
+    pages_text, outline = _extract_pptx(pptx_path)
+    _store_split_result(base_name, pages_text, pptx_path, outline)
+    return pages_text
+
+async def split_pptx_async(pptx_path, base_name) -> int:
+    """在拆分进程池中解析PPTX，主进程只负责写入结果，返回幻灯片数"""
+    loop = asyncio.get_running_loop()
+    pages_text, outline = await loop.run_in_executor(_get_split_executor(), _extract_pptx, pptx_path)
+    await loop.run_in_executor(None, _store_split_result, base_name, pages_text, pptx_path, outline)
+    return len(pages_text)
+
+def count_pptx_slides(pptx_path) -> int:
+    """直接统计压缩包中的幻灯片条目数，无需解析整个演示文稿"""
+    import re
+    import zipfile
+    with zipfile.ZipFile(pptx_path) as archive:
+        return sum(1 for name in archive.namelist() if re.match(r"ppt/slides/slide\d+\.xml$", name))
+
+def reuse_split_pages(filename: str, record: dict) -> int:
+    """
+    相同内容此前已上传并拆分时，直接复用其页面容器，重复上传只需更新元数据
+    
+    Args:
+        filename: 本次上传的文件名
+        record: blob_store 返回的别名记录
+        
+    Returns:
+        复用的页数，无可复用的完整容器时返回0
+    """
+    if not record.get("duplicate"):
+        return 0
+    
+    expected_pages = None
+    if filename.lower().endswith('.pdf'):
+        doc = fitz.open(os.path.join(UPLOAD_DIR, filename))
+        expected_pages = len(doc)
+        doc.close()
+    
+    # 同名文件内容已变化时，自身的旧容器不可复用；只考虑上传目录根下的课件
+    candidates = [name for name in blob_store.aliases_of(record["sha256"]) if '/' not in name]
+    if record.get("replaced") and filename in candidates:
+        candidates.remove(filename)
+    if filename in candidates:
+        candidates.remove(filename)
+        candidates.insert(0, filename)
+    
+    for source in candidates:
+        page_count = page_store.page_count(source)
+        # 页数不一致说明该容器仍在后台拆分中，暂不复用
+        if page_count == 0 or (expected_pages is not None and page_count != expected_pages):
+            continue
+        if page_store.link_document(source, filename):
+            print(f"♻️ 复用已拆分的页面: {filename} <- {source}，共{page_count}页")
+            if source != filename:
+                ingest_manifest.copy(source, filename)
+            return page_count
+    return 0
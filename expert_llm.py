@@ -2,10 +2,8 @@ import os
 import json
 import uuid
 import logging
-import requests
 import time
 import asyncio
-import httpx
 from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
 from collections import deque
@@ -14,6 +12,9 @@ from config import QWEN_API_KEY, API_TIMEOUT
 from board_logger import board_logger
 from conversation_manager import conversation_manager
 from llm_logger import LLMLogger  # 导入LLM日志记录器
+from llm_client import llm_client
+from llm_limits import llm_concurrency
+from prompt_builder import pack_pages, content_budget, estimate_messages_tokens, truncate_to_tokens, fit_text, log_prompt
 from board_manager import board_manager  # 导入展板管理器
 
 # 使用更长的超时时间用于PDF笔记生成，避免60秒超时
@@ -35,15 +36,20 @@ class ExpertLLM:
         
         # 动态并发任务管理
         self.active_tasks = {}  # 正在进行的任务 {task_id: task_info}
+        self.task_handles = {}  # 正在进行的任务的执行协程 {task_id: asyncio.Task}，取消时使用
         self.completed_tasks = deque(maxlen=100)  # 已完成任务的结果队列
         self.task_counter = 0  # 任务计数器
         self.context_lock = threading.Lock()  # 上下文更新锁
-        self.max_concurrent_tasks = 3  # 最大并发任务数
         self.result_processor_started = False  # 结果处理器启动标志
         
         # 初始化展板和专家对话
         self._init_expert_conversation()
         
+    @property
+    def max_concurrent_tasks(self):
+        """最大并发任务数，跟随LLM自适应并发上限"""
+        return llm_concurrency.current_limit
+
     def _ensure_result_processor_started(self):
         """确保结果处理器已启动"""
         if not self.result_processor_started:
@@ -131,7 +137,7 @@ class ExpertLLM:
         logger.info(f"启动动态任务 {task_id}: {task_info.get('type')}")
         
         # 异步执行任务
-        asyncio.create_task(self._execute_dynamic_task(task_id, task_info))
+        self.task_handles[task_id] = asyncio.create_task(self._execute_dynamic_task(task_id, task_info))
         
         # 启动超时监控
         asyncio.create_task(self._monitor_task_timeout(task_id))
@@ -185,6 +191,10 @@ class ExpertLLM:
             
             logger.info(f"动态任务 {task_id} 执行成功")
             
+        except asyncio.CancelledError:
+            # 已由cancel_task或超时监控记录结果
+            logger.info(f"动态任务 {task_id} 已停止执行")
+            
         except Exception as e:
             logger.error(f"动态任务 {task_id} 执行失败: {str(e)}")
             
@@ -205,6 +215,7 @@ class ExpertLLM:
                 logger.info(f"已从活跃任务列表中移除失败任务: {task_id}")
         
         finally:
+            self.task_handles.pop(task_id, None)
             # 确保任务一定会从活跃列表中移除（双重保险）
             if task_id in self.active_tasks:
                 del self.active_tasks[task_id]
@@ -511,8 +522,8 @@ class ExpertLLM:
         # 构建提示词
         prompt = f"【PDF分析任务】请分析这个文件：{filename}\n\n"
         
-        # 添加页面内容（限制长度）
-        content = "\n\n".join([f"第{i+1}页:\n{text[:500]}..." for i, text in enumerate(pages_text[:5])])
+        # 添加页面内容（前5页，按token预算截取）
+        content = pack_pages(pages_text[:5], 2500)["content"]
         prompt += f"文件内容示例:\n{content}\n\n"
         prompt += "请提供这个PDF的内容摘要，包括主题、关键概念和结构概述。"
         
@@ -524,7 +535,7 @@ class ExpertLLM:
         
         return summary
     
-    def generate_note(self, filename, pages_text, page_number=None):
+    def generate_note(self, filename, pages_text, page_number=None, refresh=False):
         """
         生成笔记
         
@@ -532,6 +543,7 @@ class ExpertLLM:
             filename: PDF文件名
             pages_text: 页面文本内容列表
             page_number: 特定页码，如果为None则生成整本笔记
+            refresh: 跳过LLM响应缓存重新生成
             
         Returns:
             生成的笔记内容
@@ -620,7 +632,7 @@ class ExpertLLM:
 1. 不要试图总结整本PDF，而只关注这一页的内容
 2. 由于这是第 {page_number} 页的内容，在提到重要概念时可以标注"(本页)"或"(第{page_number}页)"
 """
-                            return self._call_llm(prompt)
+                            return self._call_llm(prompt, refresh=refresh)
                 except Exception as e:
                     logger.error(f"尝试直接提取页面内容失败: {str(e)}")
                 
@@ -647,7 +659,7 @@ class ExpertLLM:
                 logger.info(f"正在为 {filename} 第 {page_number} 页生成笔记，内容长度: {len(content)} 字符")
                 
                 prompt = f"【单页笔记生成任务】为PDF文件 {filename} 的第 {page_number} 页生成笔记。\n\n"
-                prompt += f"页面内容:\n{content}\n\n"
+                prompt += f"页面内容:\n{fit_text(content, 'qwen-max')}\n\n"
                 prompt += f"""请仅基于这一页的内容，生成一份结构清晰的笔记，突出重点内容，使用Markdown格式。注意：1. 不要试图总结整本PDF，而只关注这一页的内容2. 由于这是第 {page_number} 页的内容，在提到重要概念时可以标注"(本页)"或"(第{page_number}页)"
 
 
@@ -677,24 +689,12 @@ class ExpertLLM:
                 if len(pages_text) == 0:
                     return "**错误：未找到任何页面内容。** 请重新上传PDF文件或确保文件内容可提取。"
                     
-                # 将限制从5页改为40页
                 total_pages = len(pages_text)
-                sample_pages = min(40, total_pages)
                 
-                # 判断使用的页面范围
-                if total_pages <= 40:
-                    # 如果总页数不超过40页，使用全部页面
-                    pages_used = pages_text
-                    page_range_info = f"<参考第1页-第{total_pages}页内容>"
-                else:
-                    # 如果超过40页，取前20页和后20页
-                    front_pages = 20
-                    back_pages = 20
-                    pages_used = pages_text[:front_pages] + pages_text[-back_pages:]
-                    page_range_info = f"<参考第1页-第{front_pages}页及第{total_pages-back_pages+1}页-第{total_pages}页内容>"
-                
-                # 构建内容样本
-                content = "\n\n".join([f"第{i+1}页:\n{text[:300]}..." for i, text in enumerate(pages_used)])
+                # 页面内容按模型token预算打包，预算不足时按信息密度分配，保留页码标签
+                packed = pack_pages(pages_text, content_budget("qwen-max"))
+                page_range_info = packed["page_range_info"]
+                content = packed["content"]
                 logger.info(f"正在为 {filename} 生成整本笔记，共 {total_pages} 页")
                 
                 prompt = f"【整本笔记生成任务】为PDF文件 {filename} 生成整本笔记。\n\n"
@@ -721,7 +721,7 @@ class ExpertLLM:
         
         try:
             # 调用LLM
-            note = self._call_llm(prompt)
+            note = self._call_llm(prompt, refresh=refresh)
             
             # 检查返回的内容是否为错误信息
             if note.startswith("API调用错误:"):
@@ -776,8 +776,8 @@ class ExpertLLM:
         prompt += f"当前笔记内容:\n{note_content}\n\n"
         
         if reference_pages:
-            # 添加部分参考内容
-            sample_text = "\n\n".join([text[:300] + "..." for text in reference_pages[:2]])
+            # 添加部分参考内容（前两页，按token预算截取）
+            sample_text = pack_pages(reference_pages[:2], 600)["content"]
             prompt += f"参考内容:\n{sample_text}"
         
         # 调用LLM
@@ -957,23 +957,10 @@ class ExpertLLM:
         
         return response
     
-    def _call_llm(self, prompt):
-        """内部方法：调用LLM API - 🔧 优化：使用异步包装避免阻塞"""
-        # 🔧 关键修复：将同步LLM调用包装为异步，避免阻塞其他操作
-        import asyncio
-        
-        # 如果在异步上下文中，直接运行异步版本
+    def _call_llm(self, prompt, refresh=False):
+        """内部方法：同步调用LLM API（请求在共享LLM客户端的事件循环中执行，相同请求命中响应缓存）"""
         try:
-            loop = asyncio.get_running_loop()
-            # 在当前事件循环中运行
-            task = asyncio.create_task(self._async_call_llm(prompt, self.session_id))
-            # 使用run_until_complete可能会导致嵌套循环问题，所以使用gather
-            future = asyncio.gather(task, return_exceptions=True)
-            result = loop.run_until_complete(future)
-            return result[0] if isinstance(result, list) and len(result) > 0 else "API调用错误"
-        except RuntimeError:
-            # 如果没有运行中的事件循环，创建新的
-            return asyncio.run(self._async_call_llm(prompt, self.session_id))
+            return llm_client.run_sync(self._async_call_llm(prompt, self.session_id, cache=True, refresh=refresh))
         except Exception as e:
             logger.error(f"LLM异步包装调用失败: {str(e)}")
             return f"API调用错误: {str(e)}"
@@ -1049,6 +1036,7 @@ class ExpertLLM:
         try:
             messages = self._prepare_messages(prompt)
             logger.info(f"📝 准备了 {len(messages)} 条消息")
+            log_prompt(messages, "qwen-plus", "专家流式问答")
         except Exception as e:
             logger.error(f"❌ _prepare_messages 调用失败: {str(e)}")
             raise
@@ -1056,65 +1044,27 @@ class ExpertLLM:
         try:
             start_time = time.time()
             
-            # 使用requests直接调用流式API
-            url = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {QWEN_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": "qwen-plus",
-                "messages": messages,
-                "stream": True,
-                "temperature": 0.7
-            }
-            
             full_response = ""
             chunk_count = 0
             
             logger.info("🌐 开始流式API请求...")
-            # 使用流式请求 - 配置代理设置以避免连接问题
-            proxies = {'http': None, 'https': None}
-            with requests.post(url, headers=headers, json=data, stream=True, timeout=60, proxies=proxies) as response:
-                response.raise_for_status()
-                logger.info(f"📡 HTTP响应状态: {response.status_code}")
+            # 通过共享连接池流式调用，60秒内没有新数据块视为超时
+            for content in llm_client.stream_sync(messages, "qwen-plus", api_key=QWEN_API_KEY,
+                                                  timeout=60, temperature=0.7):
+                chunk_count += 1
+                full_response += content
+                logger.info(f"📦 收到数据块 {chunk_count}: '{content}' (长度: {len(content)})")
                 
-                for line in response.iter_lines():
-                    if line:
-                        line = line.decode('utf-8')
-                        if line.startswith('data: '):
-                            data_str = line[6:]  # 去掉 'data: ' 前缀
-                            
-                            if data_str.strip() == '[DONE]':
-                                logger.info("🏁 收到[DONE]信号，流式结束")
-                                break
-                                
-                            try:
-                                chunk_data = json.loads(data_str)
-                                if 'choices' in chunk_data and chunk_data['choices']:
-                                    delta = chunk_data['choices'][0].get('delta', {})
-                                    content = delta.get('content', '')
-                                    
-                                    if content:
-                                        chunk_count += 1
-                                        full_response += content
-                                        logger.info(f"📦 收到数据块 {chunk_count}: '{content}' (长度: {len(content)})")
-                                        
-                                        # 如果有回调函数，则调用
-                                        if callback and callable(callback):
-                                            try:
-                                                logger.info(f"🔄 调用回调函数，内容: '{content}'")
-                                                callback(content)
-                                                logger.info("✅ 回调函数调用成功")
-                                            except Exception as callback_error:
-                                                logger.warning(f"❌ 回调函数执行失败: {callback_error}")
-                                        else:
-                                            logger.warning("⚠️ 没有可用的回调函数")
-                                                
-                            except json.JSONDecodeError as json_error:
-                                logger.warning(f"⚠️ JSON解析失败: {json_error}, 数据: {data_str[:100]}...")
-                                continue
+                # 如果有回调函数，则调用
+                if callback and callable(callback):
+                    try:
+                        logger.info(f"🔄 调用回调函数，内容: '{content}'")
+                        callback(content)
+                        logger.info("✅ 回调函数调用成功")
+                    except Exception as callback_error:
+                        logger.warning(f"❌ 回调函数执行失败: {callback_error}")
+                else:
+                    logger.warning("⚠️ 没有可用的回调函数")
             
             logger.info(f"📊 流式处理统计 - 总块数: {chunk_count}, 总长度: {len(full_response)}")
             
@@ -1200,14 +1150,6 @@ class ExpertLLM:
                 image_data = f.read()
                 base64_image = base64.b64encode(image_data).decode("utf-8")
             
-            # 使用OpenAI客户端
-            from openai import OpenAI
-            
-            client = OpenAI(
-                api_key=api_key,
-                base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-            )
-            
             # 构建消息体
             messages = [
                 {
@@ -1221,14 +1163,12 @@ class ExpertLLM:
             
             # 调用模型
             print(f"使用展板专家LLM({self.board_id})处理图像...")
-            completion = client.chat.completions.create(
-                model="qwen-vl-plus",  # 视觉语言模型
-                messages=messages
+            response_content = llm_client.chat_sync(
+                messages,
+                "qwen-vl-plus",  # 视觉语言模型
+                api_key=api_key
             )
             
-            # 提取回复内容
-            response_content = completion.choices[0].message.content
-            
             print(f"图像识别成功，响应长度: {len(response_content)}")
             
             # 保存到会话历史 - 使用正确的方法
@@ -1379,7 +1319,8 @@ class ExpertLLM:
         else:
             raise ValueError(f"不支持的任务类型: {task_type}")
 
-    async def _async_call_llm(self, prompt: str, task_session_id: str) -> str:
+    async def _async_call_llm(self, prompt: str, task_session_id: str,
+                              cache: bool = False, refresh: bool = False) -> str:
         """异步调用LLM API"""
         if not QWEN_API_KEY:
             logger.error("未配置QWEN_API_KEY")
@@ -1403,94 +1344,85 @@ class ExpertLLM:
             
             logger.info(f"异步LLM API调用开始 - 会话:{task_session_id}, 任务类型: {'PDF笔记生成' if is_pdf_note_task else '常规任务'}, 超时时间: {timeout}秒")
             
-            # 使用httpx进行异步请求
-            async with httpx.AsyncClient(timeout=timeout) as client:
-                url = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
-                headers = {
-                    "Authorization": f"Bearer {QWEN_API_KEY}",
-                    "Content-Type": "application/json"
-                }
-                
-                # 构建消息列表
-                messages = []
-                
-                # 添加系统消息
-                system_msg = next((msg for msg in conversation_history if msg.get("role") == "system"), None)
-                if system_msg:
-                    messages.append({"role": "system", "content": system_msg.get("content", "")})
-                
-                # 添加最近的对话历史
-                for msg in conversation_history[-8:]:
-                    role = msg.get("role")
-                    content = msg.get("content")
-                    
-                    if role and content and role in ["user", "assistant"]:
-                        messages.append({"role": role, "content": content})
-                
-                # 确保最后一条是当前用户消息
-                if not (len(messages) >= 2 and messages[-1]["role"] == "user" and messages[-1]["content"] == prompt):
-                    messages.append({"role": "user", "content": prompt})
-                
-                data = {
-                    "model": "qwen-max",
-                    "messages": messages,
-                    "temperature": 0.7
-                }
-                
-                # 记录API调用开始时间
-                start_time = time.time()
-                
-                # 发送异步请求
-                response = await client.post(url, headers=headers, json=data)
-                response.raise_for_status()
-                
-                result = response.json()
-                response_content = result["choices"][0]["message"]["content"]
-                
-                # 计算API调用耗时
-                end_time = time.time()
-                duration = end_time - start_time
-                
-                logger.info(f"异步LLM API调用成功 - 会话:{task_session_id}, 耗时: {duration:.1f}秒, 响应长度: {len(response_content)}字符")
-                
-                # 记录LLM交互日志 - 根据任务类型判断
-                llm_type = "expert_concurrent"
-                metadata = {
-                    "session_id": task_session_id,
-                    "board_id": self.board_id,
-                    "duration": duration,
-                    "token_count": result.get("usage", {}).get("total_tokens", 0),
-                    "concurrent": True,
-                    "timeout_used": timeout,
-                    "is_pdf_note_task": is_pdf_note_task
-                }
-                
-                # 特殊处理视觉识别任务
-                if "vision_annotation" in task_session_id or "vision" in prompt.lower():
-                    llm_type = "vision_recognize"
-                    metadata.update({
-                        "requestType": "image",  # 前端调试面板期望的字段名
-                        "operation_type": "vision_annotation",
-                        "input_type": "image"
-                    })
-                
-                LLMLogger.log_interaction(
-                    llm_type=llm_type,
-                    query=prompt,
-                    response=response_content,
-                    metadata=metadata
-                )
-                
-                # 添加助手回复
-                conversation_manager.add_message(
-                    task_session_id, 
-                    self.board_id, 
-                    "assistant", 
-                    response_content
-                )
-                
-                return response_content
+            # 构建消息列表
+            messages = []
+            
+            # 添加系统消息
+            system_msg = next((msg for msg in conversation_history if msg.get("role") == "system"), None)
+            if system_msg:
+                messages.append({"role": "system", "content": system_msg.get("content", "")})
+            
+            # 添加最近的对话历史
+            for msg in conversation_history[-8:]:
+                role = msg.get("role")
+                content = msg.get("content")
                 
+                if role and content and role in ["user", "assistant"]:
+                    messages.append({"role": role, "content": content})
+            
+            # 确保最后一条是当前用户消息
+            if not (len(messages) >= 2 and messages[-1]["role"] == "user" and messages[-1]["content"] == prompt):
+                messages.append({"role": "user", "content": prompt})
+            
+            # 超出模型预算时从最早的历史消息开始丢弃（保留系统消息和当前消息）
+            first_history = 1 if messages[0]["role"] == "system" else 0
+            while len(messages) - first_history > 1 and estimate_messages_tokens(messages) > content_budget("qwen-max"):
+                messages.pop(first_history)
+            log_prompt(messages, "qwen-max", "专家LLM")
+            
+            # 记录API调用开始时间
+            start_time = time.time()
+            
+            # 发送异步请求
+            result = await llm_client.chat_completion(messages, "qwen-max", api_key=QWEN_API_KEY,
+                                                      timeout=timeout, cache=cache, refresh=refresh,
+                                                      temperature=0.7)
+            response_content = result["choices"][0]["message"]["content"]
+            
+            # 计算API调用耗时
+            end_time = time.time()
+            duration = end_time - start_time
+            
+            logger.info(f"异步LLM API调用成功 - 会话:{task_session_id}, 耗时: {duration:.1f}秒, 响应长度: {len(response_content)}字符")
+            
+            # 记录LLM交互日志 - 根据任务类型判断
+            llm_type = "expert_concurrent"
+            metadata = {
+                "session_id": task_session_id,
+                "board_id": self.board_id,
+                "duration": duration,
+                "token_count": result.get("usage", {}).get("total_tokens", 0),
+                "concurrent": True,
+                "timeout_used": timeout,
+                "is_pdf_note_task": is_pdf_note_task
+            }
+            
+            # 特殊处理视觉识别任务
+            if "vision_annotation" in task_session_id or "vision" in prompt.lower():
+                llm_type = "vision_recognize"
+                metadata.update({
+                    "requestType": "image",  # 前端调试面板期望的字段名
+                    "operation_type": "vision_annotation",
+                    "input_type": "image"
+                })
+            
+            LLMLogger.log_interaction(
+                llm_type=llm_type,
+                query=prompt,
+                response=response_content,
+                metadata=metadata
+            )
+            
+            # 添加助手回复
+            conversation_manager.add_message(
+                task_session_id, 
+                self.board_id, 
+                "assistant", 
+                response_content
+            )
+            
+            return response_content
+            
         except Exception as e:
             logger.error(f"并发LLM API调用失败: {str(e)}")
             error_msg = f"API调用错误: {str(e)}"
@@ -1527,24 +1459,12 @@ class ExpertLLM:
             if not pages_text:
                 return f"错误：{filename} 未找到任何页面内容"
                 
-            # 限制页面数量避免超出上下文长度
             total_pages = len(pages_text)
-            sample_pages = min(40, total_pages)
-            
-            # 判断使用的页面范围
-            if total_pages <= 40:
-                # 如果总页数不超过40页，使用全部页面
-                pages_used = pages_text
-                page_range_info = f"<参考第1页-第{total_pages}页内容>"
-            else:
-                # 如果超过40页，取前20页和后20页
-                front_pages = 20
-                back_pages = 20
-                pages_used = pages_text[:front_pages] + pages_text[-back_pages:]
-                page_range_info = f"<参考第1页-第{front_pages}页及第{total_pages-back_pages+1}页-第{total_pages}页内容>"
             
-            # 构建内容样本
-            content = "\n\n".join([f"第{i+1}页:\n{text[:300]}..." for i, text in enumerate(pages_used)])
+            # 页面内容按模型token预算打包，预算不足时按信息密度分配，保留页码标签
+            packed = pack_pages(pages_text, content_budget("qwen-max"))
+            page_range_info = packed["page_range_info"]
+            content = packed["content"]
             
             prompt = f"【整本笔记生成任务】为PDF文件 {filename} 生成整本笔记。\n\n"
             prompt += f"文件有 {total_pages} 页，以下是部分内容示例:\n{content}\n\n"
@@ -1804,7 +1724,7 @@ class ExpertLLM:
                 improve_prompt += f"改进要求:\n{auto_improve_prompt}\n\n"
                 
                 if page_text and len(page_text.strip()) > 0:
-                    improve_prompt += f"页面文本内容参考:\n{page_text[:1000]}...\n\n"
+                    improve_prompt += f"页面文本内容参考:\n{truncate_to_tokens(page_text, 1000)}...\n\n"
                 
                 improve_prompt += "请根据改进要求，对初始图像识别注释进行优化和改进，使其更加准确、清晰、有用。保持注释的准确性，同时增强其可读性和实用性。"
                 
@@ -1849,7 +1769,7 @@ class ExpertLLM:
             prompt += f"文件: {filename} 第{page_number}页\n\n"
             prompt += f"当前注释:\n{current_annotation}\n\n"
             prompt += f"改进要求:\n{improve_request}\n\n"
-            prompt += f"页面内容参考:\n{page_text[:1000]}...\n\n"
+            prompt += f"页面内容参考:\n{truncate_to_tokens(page_text, 1000)}...\n\n"
             prompt += "请根据改进要求，对当前注释进行优化和改进，使其更加准确、清晰、有用。"
             
             # 使用异步LLM调用
@@ -1916,7 +1836,7 @@ class ExpertLLM:
 
     def cancel_task(self, task_id: str) -> bool:
         """
-        取消指定的任务
+        取消指定的任务，并取消其执行协程（进行中的LLM调用随之中止）
         
         Args:
             task_id: 任务ID
@@ -1941,6 +1861,10 @@ class ExpertLLM:
                     "cancelled": True
                 })
                 
+                handle = self.task_handles.pop(task_id, None)
+                if handle is not None:
+                    handle.cancel()
+                
                 logger.info(f"任务 {task_id} 已被取消")
                 return True
             
@@ -1968,8 +1892,11 @@ class ExpertLLM:
                 "timeout": True
             })
             
-            # 从活跃任务中移除
+            # 从活跃任务中移除，并停止仍在执行的协程
             del self.active_tasks[task_id]
+            handle = self.task_handles.pop(task_id, None)
+            if handle is not None:
+                handle.cancel()
             logger.info(f"超时任务 {task_id} 已从活跃列表中移除")
 
     # 在generate_note方法后添加新的分段生成方法
@@ -2016,8 +1943,12 @@ class ExpertLLM:
             # 提取指定范围的页面内容
             pages_to_process = pages_text[start_page-1:end_page]
             
-            # 构建内容样本
-            content = "\n\n".join([f"第{i+start_page}页:\n{text[:500]}..." for i, text in enumerate(pages_to_process)])
+            # 已有笔记只保留末尾部分作为衔接上下文
+            note_context = truncate_to_tokens(existing_note, 1000, keep_tail=True) if existing_note else ""
+            
+            # 页面内容按token预算打包（扣除已有笔记占用的部分），保留页码标签
+            packed = pack_pages(pages_to_process, content_budget("qwen-max", 1000), start_page=start_page)
+            content = packed["content"]
             
             # 计算是否还有更多内容
             has_more = end_page < total_pages
@@ -2032,7 +1963,7 @@ class ExpertLLM:
             if existing_note:
                 # 如果有已存在的笔记，提示AI进行续写
                 prompt = f"【分段笔记续写任务】为PDF文件 {filename} 的{current_range}生成笔记，并续写到已有笔记后面。\n\n"
-                prompt += f"已有笔记内容（前面部分）:\n{existing_note[-1000:]}...\n\n"  # 只显示最后1000字符作为上下文
+                prompt += f"已有笔记内容（前面部分）:\n...{note_context}\n\n"
                 prompt += f"当前需要处理的内容（{current_range}）:\n{content}\n\n"
                 prompt += f"""请为{current_range}的内容生成笔记，要求：
 
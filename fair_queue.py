@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+按课程、展板两级加权公平排队
+课程之间、同一课程的展板之间按权重轮流出队（起始时间公平排队，每次出队计1份服务），
+积压再多的展板也只能拿到自己的份额；同一展板内按优先级出队，同一优先级先进先出，
+排队越久有效优先级越高（老化）。
+
+当前调用所属的展板/课程/优先级记录在上下文变量中，任务执行时设置，
+其中发起的LLM调用（包括gather出的子协程）据此在全局并发名额上公平排队
+"""
+
+import time
+import contextvars
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from config import (FAIR_QUEUE_COURSE_WEIGHTS, FAIR_QUEUE_BOARD_WEIGHTS, FAIR_QUEUE_SHARE_WINDOW,
+                    TASK_DEFAULT_PRIORITY, TASK_PRIORITY_AGING_INTERVAL)
+
+# 不属于任何课程/展板的调用
+NO_FLOW = "-"
+
+# 每个展板、每个优先级保留的排队等待时间样本数
+_WAIT_SAMPLES = 200
+
+# 当前调用所属的 (课程ID, 展板ID, 优先级)
+_current_flow: contextvars.ContextVar[Optional[Tuple[str, str, int]]] = contextvars.ContextVar(
+    "current_flow", default=None
+)
+
+
+def set_flow(board_id: Optional[str], course_id: Optional[str] = None,
+             priority: int = TASK_DEFAULT_PRIORITY) -> contextvars.Token:
+    """设置当前上下文（通常是一个任务的执行协程）所属的展板、课程和优先级"""
+    return _current_flow.set((course_id or NO_FLOW, board_id or NO_FLOW, priority))
+
+
+def current_flow() -> Tuple[str, str, int]:
+    """当前上下文所属的 (课程ID, 展板ID, 优先级)，未设置时归入公共流"""
+    return _current_flow.get() or (NO_FLOW, NO_FLOW, TASK_DEFAULT_PRIORITY)
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+class _Flow:
+    """
+    公平排队中的一个节点（课程或展板）
+
+    tag在节点积压时是下一次出队的虚拟开始时间，空闲时是上一次出队的虚拟结束时间；
+    重新积压时取 max(tag, 父节点虚拟时间)，空闲期间不会攒下额度
+    """
+
+    def __init__(self, weight: float):
+        self.weight = max(float(weight), 0.01)
+        self.tag = 0.0
+        self.vtime = 0.0  # 子节点的虚拟时间（课程节点）
+        self.since = 0  # 开始积压时的序号，tag相同时先积压的先出队
+        self.queued = 0
+        self.dispatched = 0
+
+    def backlog(self, parent_vtime: float, seq: int):
+        if self.queued == 0:
+            self.tag = max(self.tag, parent_vtime)
+            self.since = seq
+        self.queued += 1
+
+    def serve(self) -> float:
+        start = self.tag
+        self.tag += 1 / self.weight
+        self.queued -= 1
+        self.dispatched += 1
+        return start
+
+
+class _BoardFlow(_Flow):
+    """展板节点，按优先级分队"""
+
+    def __init__(self, weight: float):
+        super().__init__(weight)
+        self.queues: Dict[int, Deque[Tuple[int, float, Any]]] = {}
+        self.waits: Dict[int, Deque[float]] = {}
+        self.priority_dispatched: Dict[int, int] = {}
+        self.aged: Dict[int, int] = {}
+
+
+class _CourseFlow(_Flow):
+    def __init__(self, weight: float):
+        super().__init__(weight)
+        self.boards: Dict[str, _BoardFlow] = {}
+
+
+def _pick(flows: Dict[str, _Flow]) -> Tuple[str, Any]:
+    return min(((key, flow) for key, flow in flows.items() if flow.queued),
+               key=lambda entry: (entry[1].tag, entry[1].since))
+
+
+class FairQueue:
+    """
+    两级加权公平队列（非线程安全，只在一个事件循环中使用）
+
+    Args:
+        course_weights: 课程ID → 权重，未列出的为1
+        board_weights: 展板ID → 权重，未列出的为1
+        aging_interval: 同一展板内，任务每排队该时长有效优先级提升一级
+    """
+
+    def __init__(self, course_weights: Optional[Dict[str, float]] = None,
+                 board_weights: Optional[Dict[str, float]] = None,
+                 aging_interval: float = TASK_PRIORITY_AGING_INTERVAL,
+                 share_window: int = FAIR_QUEUE_SHARE_WINDOW):
+        self.course_weights = FAIR_QUEUE_COURSE_WEIGHTS if course_weights is None else course_weights
+        self.board_weights = FAIR_QUEUE_BOARD_WEIGHTS if board_weights is None else board_weights
+        self.aging_interval = aging_interval
+        self._courses: Dict[str, _CourseFlow] = {}
+        self._vtime = 0.0
+        self._seq = 0
+        self._queued = 0
+        self._recent: Deque[Tuple[str, str]] = deque(maxlen=share_window)
+
+    def __len__(self) -> int:
+        return self._queued
+
+    def _board(self, course_id: str, board_id: str) -> Tuple[_CourseFlow, _BoardFlow]:
+        course = self._courses.get(course_id)
+        if course is None:
+            course = self._courses[course_id] = _CourseFlow(self.course_weights.get(course_id, 1))
+        board = course.boards.get(board_id)
+        if board is None:
+            board = course.boards[board_id] = _BoardFlow(self.board_weights.get(board_id, 1))
+        return course, board
+
+    def push(self, item: Any, course_id: str, board_id: str, priority: int):
+        """加入所属展板的队列"""
+        self._seq += 1
+        course, board = self._board(course_id, board_id)
+        course.backlog(self._vtime, self._seq)
+        board.backlog(course.vtime, self._seq)
+        board.queues.setdefault(priority, deque()).append((self._seq, time.monotonic(), item))
+        self._queued += 1
+
+    def discard(self, item: Any, course_id: str, board_id: str, priority: int) -> bool:
+        """把仍在排队的项移出队列（如等待方被取消），已出队时返回False"""
+        course = self._courses.get(course_id)
+        board = course.boards.get(board_id) if course else None
+        queue = board.queues.get(priority) if board else None
+        if not queue:
+            return False
+        for entry in queue:
+            if entry[2] is item:
+                queue.remove(entry)
+                board.queued -= 1
+                course.queued -= 1
+                self._queued -= 1
+                return True
+        return False
+
+    def _pick_priority(self, board: _BoardFlow, now: float) -> int:
+        # 各优先级队首中有效优先级最高（数值最小）的，相同时取先入队的
+        best = None
+        for priority, queue in board.queues.items():
+            if not queue:
+                continue
+            seq, enqueued_at, _ = queue[0]
+            effective = priority - int((now - enqueued_at) // self.aging_interval)
+            if best is None or (effective, seq) < best[0]:
+                best = ((effective, seq), priority)
+        return best[1]
+
+    def pop(self) -> Optional[Tuple[Any, Tuple[str, str, int]]]:
+        """按公平顺序出队，返回 (项, (课程ID, 展板ID, 优先级))；队列为空时返回None"""
+        if not self._queued:
+            return None
+        now = time.monotonic()
+        course_id, course = _pick(self._courses)
+        board_id, board = _pick(course.boards)
+        priority = self._pick_priority(board, now)
+        _, enqueued_at, item = board.queues[priority].popleft()
+
+        self._vtime = course.serve()
+        course.vtime = board.serve()
+        self._queued -= 1
+        self._recent.append((course_id, board_id))
+
+        waited = now - enqueued_at
+        board.waits.setdefault(priority, deque(maxlen=_WAIT_SAMPLES)).append(waited)
+        board.priority_dispatched[priority] = board.priority_dispatched.get(priority, 0) + 1
+        if waited >= self.aging_interval:
+            board.aged[priority] = board.aged.get(priority, 0) + 1
+        return item, (course_id, board_id, priority)
+
+    def get_stats(self, running: Optional[Dict[Tuple[str, str], int]] = None) -> Dict[str, Any]:
+        """
+        各课程、展板的权重、排队数、出队数、最近出队份额和排队等待时间
+
+        Args:
+            running: (课程ID, 展板ID) → 正在执行数，由使用方提供
+        """
+        running = running or {}
+        recent = list(self._recent)
+        course_share: Dict[str, int] = {}
+        board_share: Dict[Tuple[str, str], int] = {}
+        for course_id, board_id in recent:
+            course_share[course_id] = course_share.get(course_id, 0) + 1
+            board_share[(course_id, board_id)] = board_share.get((course_id, board_id), 0) + 1
+
+        def _share(count: int) -> Optional[float]:
+            return round(count / len(recent), 3) if recent else None
+
+        courses = {}
+        for course_id, course in self._courses.items():
+            boards = {}
+            for board_id, board in course.boards.items():
+                all_waits = [wait for waits in board.waits.values() for wait in waits]
+                boards[board_id] = {
+                    "weight": board.weight,
+                    "queued": board.queued,
+                    "running": running.get((course_id, board_id), 0),
+                    "dispatched": board.dispatched,
+                    "recent_share": _share(board_share.get((course_id, board_id), 0)),
+                    "wait_p50": _round(_percentile(all_waits, 50)),
+                    "wait_p90": _round(_percentile(all_waits, 90)),
+                    "priorities": {
+                        str(priority): {
+                            "queued": len(board.queues.get(priority, ())),
+                            "dispatched": board.priority_dispatched.get(priority, 0),
+                            "aged": board.aged.get(priority, 0),
+                            "wait_p50": _round(_percentile(list(board.waits.get(priority, ())), 50)),
+                            "wait_p90": _round(_percentile(list(board.waits.get(priority, ())), 90)),
+                            "wait_max": _round(max(board.waits[priority]) if board.waits.get(priority) else None)
+                        }
+                        for priority in sorted(set(board.queues) | set(board.priority_dispatched))
+                    }
+                }
+            courses[course_id] = {
+                "weight": course.weight,
+                "queued": course.queued,
+                "dispatched": course.dispatched,
+                "recent_share": _share(course_share.get(course_id, 0)),
+                "boards": boards
+            }
+        return {"queued": self._queued, "recent_window": len(recent), "courses": courses}
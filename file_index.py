@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+文件名索引
+为上传目录和页面目录维护内存中的文件名索引，替代每次未命中时的 os.listdir 线性扫描:
+- 精确匹配: 文件名集合
+- 忽略大小写匹配: casefold后的文件名 -> 文件名
+- 前缀查找: 有序文件名列表 + 二分查找
+- 子串查找: 三元组(trigram)倒排索引，候选集求交后再校验
+
+索引在启动时构建，上传/删除/重命名时通过 notify_path 等钩子更新，
+并可选地由后台监视线程（优先使用watchdog，未安装时轮询目录mtime）兜底同步外部修改
+"""
+
+import os
+import bisect
+import logging
+import threading
+from typing import Dict, List, Optional, Set
+
+from config import UPLOAD_DIR, PAGE_DIR, FILE_INDEX_WATCH_INTERVAL
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    HAS_WATCHDOG = True
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+    HAS_WATCHDOG = False
+
+logger = logging.getLogger(__name__)
+
+
+def _indexable(name: str) -> bool:
+    """跳过隐藏文件以及写入过程中的临时文件"""
+    return not name.startswith(".") and ".tmp" not in name and ".link." not in name
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class FileIndex:
+    """单个目录（不递归）的文件名索引"""
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+        self._lock = threading.RLock()
+        self._names: Set[str] = set()
+        self._folded: Dict[str, Set[str]] = {}
+        self._sorted: List[str] = []
+        self._trigrams: Dict[str, Set[str]] = {}
+        self._dir_mtime_ns = 0
+        self._watcher = None
+        self.rebuild()
+
+    def rebuild(self):
+        """重新扫描目录，构建全部索引"""
+        try:
+            stat = os.stat(self.directory)
+            with os.scandir(self.directory) as it:
+                names = [entry.name for entry in it if entry.is_file() and _indexable(entry.name)]
+        except FileNotFoundError:
+            stat, names = None, []
+
+        with self._lock:
+            self._names = set()
+            self._folded = {}
+            self._sorted = []
+            self._trigrams = {}
+            for name in names:
+                self._add(name)
+            self._sorted.sort()
+            self._dir_mtime_ns = stat.st_mtime_ns if stat else 0
+        logger.info(f"🗂️ [FILE-INDEX] 已索引 {self.directory}: {len(names)} 个文件")
+
+    def _add(self, name: str, keep_sorted: bool = False):
+        """加入索引，调用方需持有锁"""
+        if name in self._names:
+            return
+        self._names.add(name)
+        self._folded.setdefault(name.casefold(), set()).add(name)
+        if keep_sorted:
+            bisect.insort(self._sorted, name)
+        else:
+            self._sorted.append(name)
+        for gram in _trigrams(name.casefold()):
+            self._trigrams.setdefault(gram, set()).add(name)
+
+    def _remove(self, name: str):
+        """移出索引，调用方需持有锁"""
+        if name not in self._names:
+            return
+        self._names.discard(name)
+        folded = name.casefold()
+        variants = self._folded.get(folded)
+        if variants:
+            variants.discard(name)
+            if not variants:
+                del self._folded[folded]
+        index = bisect.bisect_left(self._sorted, name)
+        if index < len(self._sorted) and self._sorted[index] == name:
+            del self._sorted[index]
+        for gram in _trigrams(folded):
+            bucket = self._trigrams.get(gram)
+            if bucket:
+                bucket.discard(name)
+                if not bucket:
+                    del self._trigrams[gram]
+
+    def add(self, name: str):
+        """文件创建后调用"""
+        with self._lock:
+            self._add(name, keep_sorted=True)
+
+    def remove(self, name: str):
+        """文件删除后调用"""
+        with self._lock:
+            self._remove(name)
+
+    def rename(self, old_name: str, new_name: str):
+        """文件重命名后调用"""
+        with self._lock:
+            self._remove(old_name)
+            self._add(new_name, keep_sorted=True)
+
+    def contains(self, name: str) -> bool:
+        with self._lock:
+            return name in self._names
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def with_prefix(self, prefix: str) -> List[str]:
+        """按前缀查找（区分大小写），结果有序"""
+        with self._lock:
+            start = bisect.bisect_left(self._sorted, prefix)
+            result = []
+            for name in self._sorted[start:]:
+                if not name.startswith(prefix):
+                    break
+                result.append(name)
+            return result
+
+    def containing(self, fragment: str) -> List[str]:
+        """查找文件名中包含fragment（忽略大小写）的文件，按文件名长度排序"""
+        folded = fragment.casefold()
+        with self._lock:
+            if len(folded) < 3:
+                candidates = self._names
+            else:
+                buckets = [self._trigrams.get(gram) for gram in _trigrams(folded)]
+                if not all(buckets):
+                    return []
+                buckets.sort(key=len)
+                candidates = set(buckets[0]).intersection(*buckets[1:])
+            return sorted((name for name in candidates if folded in name.casefold()),
+                          key=lambda name: (len(name), name))
+
+    def resolve(self, name: str) -> Optional[str]:
+        """
+        将请求的文件名解析为目录中实际存在的文件名
+        依次尝试: 精确匹配 -> 忽略大小写 -> 文件名包含去掉扩展名的请求名（服务器可能添加了前后缀）
+        """
+        if not name:
+            return None
+        with self._lock:
+            if name in self._names:
+                return name
+            variants = self._folded.get(name.casefold())
+            if variants:
+                return min(variants)
+        stem = os.path.splitext(name)[0]
+        if not stem:
+            return None
+        matches = self.containing(stem)
+        return matches[0] if matches else None
+
+    def check_changed(self) -> bool:
+        """目录mtime变化（有文件被外部增删）时重建索引"""
+        try:
+            mtime_ns = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime_ns != self._dir_mtime_ns:
+            self.rebuild()
+            return True
+        return False
+
+    def start_watcher(self, interval: float = FILE_INDEX_WATCH_INTERVAL):
+        """启动目录监视，同步不经过本服务的文件变化；interval<=0时不启动"""
+        if interval <= 0 or self._watcher:
+            return
+        if HAS_WATCHDOG:
+            self._watcher = Observer()
+            self._watcher.schedule(_WatchdogHandler(self), self.directory, recursive=False)
+            self._watcher.daemon = True
+            self._watcher.start()
+            logger.info(f"👀 [FILE-INDEX] 使用watchdog监视: {self.directory}")
+            return
+
+        stop_event = threading.Event()
+
+        def _poll():
+            while not stop_event.wait(interval):
+                try:
+                    self.check_changed()
+                except Exception as e:
+                    logger.warning(f"⚠️ [FILE-INDEX] 轮询目录失败: {self.directory}, 错误: {e}")
+
+        thread = threading.Thread(target=_poll, name="file_index_watcher", daemon=True)
+        thread.stop_event = stop_event
+        thread.start()
+        self._watcher = thread
+        logger.info(f"👀 [FILE-INDEX] 每{interval}秒轮询监视: {self.directory}")
+
+    def stop_watcher(self):
+        if not self._watcher:
+            return
+        if HAS_WATCHDOG:
+            self._watcher.stop()
+        else:
+            self._watcher.stop_event.set()
+        self._watcher = None
+
+
+class _WatchdogHandler(FileSystemEventHandler):
+    """把watchdog事件转发到索引"""
+
+    def __init__(self, index: FileIndex):
+        self.index = index
+
+    def on_created(self, event):
+        if not event.is_directory:
+            notify_path(event.src_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            notify_path(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            notify_path(event.src_path)
+            notify_path(event.dest_path)
+
+
+# 全局索引实例
+upload_index = FileIndex(UPLOAD_DIR)
+page_index = FileIndex(PAGE_DIR)
+
+_indexes = {index.directory: index for index in (upload_index, page_index)}
+
+
+def notify_path(path: str):
+    """文件创建/删除/重命名后调用，按文件当前是否存在更新所在目录的索引"""
+    path = os.path.abspath(path)
+    index = _indexes.get(os.path.dirname(path))
+    if index is None:
+        return
+    name = os.path.basename(path)
+    if not _indexable(name):
+        return
+    if os.path.isfile(path):
+        index.add(name)
+    else:
+        index.remove(name)
+
+
+def start_watchers(interval: float = FILE_INDEX_WATCH_INTERVAL):
+    """为所有索引启动目录监视"""
+    for index in _indexes.values():
+        index.start_watcher(interval)
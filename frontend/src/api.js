@@ -441,7 +441,9 @@ const api = {
         sessionId: sessionId,
         currentAnnotation: currentAnnotation,
         improveRequest: improveRequest,
-        systemPrompt: systemPrompt
+        systemPrompt: systemPrompt,
+        // 已有注释时再次生成视为"重新生成"，后端跳过LLM响应缓存
+        regenerate: !!currentAnnotation
       }
     };
 
@@ -59,6 +59,7 @@ const TaskList = ({ boardId, apiClient }) => {
               case 'task_started':
               case 'task_completed':
               case 'task_failed':
+              case 'task_cancelled':
               case 'task_progress':
                 if (eventData.tasks) {
                   // 处理任务数据，添加显示信息
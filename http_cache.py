@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+文件响应的HTTP缓存与分段传输支持
+为视频、图片、课件等静态内容提供:
+- 强ETag（内容寻址存储中有记录时使用sha256，否则由mtime和大小生成）
+- If-None-Match / If-Modified-Since 条件请求，命中时返回304
+- Range 单段请求，返回206，视频拖动进度条时只传输需要的片段
+- 按媒体类型配置的 Cache-Control 策略
+"""
+
+import os
+import stat
+import logging
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.types import Scope
+
+from config import HTTP_CACHE_CONTROL, HTTP_RANGE_CHUNK_SIZE
+from blob_store import blob_store
+
+logger = logging.getLogger(__name__)
+
+
+def file_etag(path: str, stat_result: Optional[os.stat_result] = None) -> str:
+    """生成文件的强ETag，优先使用内容哈希"""
+    record = blob_store.lookup(os.path.abspath(path))
+    if record:
+        return f'"{record["sha256"]}"'
+    stat_result = stat_result or os.stat(path)
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def cache_control_for(media_type: Optional[str]) -> str:
+    """按媒体类型选择Cache-Control策略"""
+    major = (media_type or "").split("/")[0]
+    return HTTP_CACHE_CONTROL.get(media_type, HTTP_CACHE_CONTROL.get(major, HTTP_CACHE_CONTROL["default"]))
+
+
+def parse_range(range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单段Range请求头
+
+    Returns:
+        (start, end) 闭区间；多段或格式无法识别时返回None（按完整响应处理）
+
+    Raises:
+        ValueError: 范围无法满足（应返回416）
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, sep, end_text = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        start = int(start_text) if start_text else None
+        end = int(end_text) if end_text else None
+    except ValueError:
+        return None
+
+    if start is None:
+        # 后缀范围: bytes=-N 表示最后N个字节
+        if not end:
+            raise ValueError("无效的后缀范围")
+        return max(0, file_size - end), file_size - 1
+    if start >= file_size or (end is not None and start > end):
+        raise ValueError("请求范围超出文件大小")
+    return start, file_size - 1 if end is None else min(end, file_size - 1)
+
+
+def _is_not_modified(request_headers: Headers, etag: str, last_modified: float) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = [tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip()
+                      for tag in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def _iter_file(path: str, start: int, length: int):
+    async with await anyio.open_file(path, "rb") as f:
+        await f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = await f.read(min(HTTP_RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def build_file_response(request_headers: Headers, path: str, media_type: Optional[str] = None,
+                        filename: Optional[str] = None, method: str = "GET",
+                        stat_result: Optional[os.stat_result] = None) -> Response:
+    """
+    构造支持条件请求和Range的文件响应
+
+    Args:
+        request_headers: 请求头
+        path: 文件路径
+        media_type: 媒体类型，为空时按扩展名推断
+        filename: 设置后添加 Content-Disposition 头
+        method: 请求方法，HEAD请求不返回响应体
+    """
+    stat_result = stat_result or os.stat(path)
+    file_size = stat_result.st_size
+    if media_type is None:
+        import mimetypes
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    etag = file_etag(path, stat_result)
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "cache-control": cache_control_for(media_type),
+        "accept-ranges": "bytes"
+    }
+    if filename:
+        headers["content-disposition"] = f"attachment; filename*=utf-8''{quote(filename)}"
+
+    if _is_not_modified(request_headers, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    start, end = 0, file_size - 1
+    status_code = 200
+    range_header = request_headers.get("range")
+    if_range = request_headers.get("if-range")
+    # If-Range与当前版本不一致时忽略Range，返回完整内容
+    if range_header and (if_range is None or if_range.strip() == etag or if_range.strip() == headers["last-modified"]):
+        try:
+            byte_range = parse_range(range_header, file_size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{file_size}"})
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["content-range"] = f"bytes {start}-{end}/{file_size}"
+
+    length = max(0, end - start + 1)
+    headers["content-length"] = str(length)
+    if method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(_iter_file(path, start, length), status_code=status_code,
+                             headers=headers, media_type=media_type)
+
+
+def cached_file_response(request: Request, path: str, media_type: Optional[str] = None,
+                         filename: Optional[str] = None) -> Response:
+    """在路由函数中替代 FileResponse 使用"""
+    return build_file_response(request.headers, path, media_type, filename, request.method)
+
+
+class CachedStaticFiles(StaticFiles):
+    """支持Range、强ETag和Cache-Control的静态文件挂载"""
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope,
+                      status_code: int = 200) -> Response:
+        if status_code != 200 or not stat.S_ISREG(stat_result.st_mode):
+            return super().file_response(full_path, stat_result, scope, status_code)
+        return build_file_response(Headers(scope=scope), str(full_path),
+                                   method=scope.get("method", "GET"), stat_result=stat_result)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+课件导入任务
+上传接口保存文件后立即返回导入任务ID，PDF/PPTX的文本提取在拆分进程池中执行，
+不阻塞事件循环；进度通过task_event_manager推送，导入完成前分页接口返回202
+"""
+
+import time
+import asyncio
+import secrets
+import logging
+from typing import Any, Dict, Optional
+
+from task_event_manager import task_event_manager
+
+logger = logging.getLogger(__name__)
+
+# 已结束的任务保留一段时间，供客户端查询结果
+FINISHED_JOB_TTL = 3600
+
+
+class IngestJobManager:
+    """管理课件导入任务"""
+
+    def __init__(self):
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        # 文件名 -> 正在进行的任务ID
+        self._active: Dict[str, str] = {}
+
+    async def start(self, filename: str, save_path: str, record: dict,
+                    board_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        创建并启动导入任务
+
+        Args:
+            filename: 课件文件名
+            save_path: 课件保存路径
+            record: blob_store 返回的别名记录（用于复用相同内容的拆分结果）
+            board_id: 接收进度事件的展板ID，未指定时发送到"global"频道
+
+        Returns:
+            任务信息，包含 job_id 和预估的总页数
+        """
+        from controller import count_pdf_pages, count_pptx_slides
+        from page_renderer import page_renderer
+
+        self._cleanup()
+
+        loop = asyncio.get_running_loop()
+        if record.get("replaced"):
+            # 同名文件换成了新内容，旧内容渲染的页面图像（渲染缓存只按文件名和页码区分）不能再使用
+            await loop.run_in_executor(None, page_renderer.invalidate_document, filename)
+            logger.info(f"🖼️ [INGEST] 同名文件内容已变化，已清除旧的页面渲染缓存: {filename}")
+        is_pdf = filename.lower().endswith('.pdf')
+        # 只读取页数，完整提取交给后台
+        count = count_pdf_pages if is_pdf else count_pptx_slides
+        total_pages = await loop.run_in_executor(None, count, save_path)
+
+        job_id = f"ingest_task_{int(time.time() * 1000)}_{secrets.token_hex(2)}"
+        job = {
+            "job_id": job_id,
+            "filename": filename,
+            "board_id": board_id,
+            "status": "running",
+            "total_pages": total_pages,
+            "sha256": record.get("sha256"),
+            "deduplicated": False,
+            "error": None,
+            "created_at": time.time(),
+            "finished_at": None
+        }
+        self.jobs[job_id] = job
+        self._active[filename] = job_id
+
+        await task_event_manager.notify_task_started(board_id or "global", job_id, {
+            "task_type": "ingest",
+            "description": f"导入 {filename}（共{total_pages}页）"
+        })
+        asyncio.create_task(self._run(job, save_path, record, is_pdf))
+        logger.info(f"📥 [INGEST] 导入任务已创建: {job_id} {filename}，共{total_pages}页")
+        return dict(job)
+
+    async def _run(self, job: Dict[str, Any], save_path: str, record: dict, is_pdf: bool):
+        from controller import reuse_split_pages, split_pdf_parallel, split_pptx_async
+
+        filename = job["filename"]
+        channel = job["board_id"] or "global"
+        loop = asyncio.get_running_loop()
+
+        try:
+            # 相同内容已拆分过时直接复用页面容器
+            page_count = await loop.run_in_executor(None, reuse_split_pages, filename, record)
+            if page_count:
+                job["deduplicated"] = True
+                job["total_pages"] = page_count
+                await self._finish(job, None)
+                await task_event_manager.notify_task_completed(channel, job["job_id"], {"pages": page_count})
+                return
+
+            if is_pdf:
+                # 并行拆分自行推送进度、完成和失败事件，完成时回调更新任务状态
+                await split_pdf_parallel(save_path, filename, job["board_id"],
+                                         task_id=job["job_id"],
+                                         on_done=lambda error: self._finish(job, error))
+                return
+
+            await task_event_manager.notify_task_progress(channel, job["job_id"], {
+                "stage": "extracting",
+                "total_pages": job["total_pages"]
+            })
+            page_count = await split_pptx_async(save_path, filename)
+            job["total_pages"] = page_count
+            await self._finish(job, None)
+            await task_event_manager.notify_task_completed(channel, job["job_id"], {"pages": page_count})
+        except Exception as e:
+            logger.error(f"❌ [INGEST] 导入失败: {filename}, 错误: {e}")
+            if job["status"] == "running":
+                await self._finish(job, str(e))
+                await task_event_manager.notify_task_failed(channel, job["job_id"], str(e))
+
+    async def _finish(self, job: Dict[str, Any], error: Optional[str]):
+        if job["status"] != "running":
+            return
+        job["status"] = "failed" if error else "completed"
+        job["error"] = error
+        job["finished_at"] = time.time()
+        if self._active.get(job["filename"]) == job["job_id"]:
+            del self._active[job["filename"]]
+        logger.info(f"📥 [INGEST] 导入任务结束: {job['job_id']} 状态: {job['status']}，"
+                    f"耗时: {job['finished_at'] - job['created_at']:.2f}秒")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """查询任务状态，运行中的任务附带最新进度"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        result = dict(job)
+        if job["status"] == "running":
+            task = task_event_manager.task_states.get(job["board_id"] or "global", {}).get(job_id)
+            if task and task.get("progress"):
+                result["progress"] = task["progress"]
+        return result
+
+    def active_job(self, filename: str) -> Optional[Dict[str, Any]]:
+        """获取文件正在进行的导入任务"""
+        job_id = self._active.get(filename)
+        return self.get(job_id) if job_id else None
+
+    def failed_job(self, filename: str) -> Optional[Dict[str, Any]]:
+        """文件最近一次导入任务失败时返回该任务，否则返回None"""
+        jobs = [job for job in self.jobs.values() if job["filename"] == filename]
+        if not jobs:
+            return None
+        job = max(jobs, key=lambda job: job["created_at"])
+        return dict(job) if job["status"] == "failed" else None
+
+    def _cleanup(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job["finished_at"] and now - job["finished_at"] > FINISHED_JOB_TTL]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+
+# 全局导入任务管理器实例
+ingest_job_manager = IngestJobManager()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+文档导入清单
+在拆分课件时一次性记录文档的基本信息，保存为 pages/{filename}.manifest.json：
+页数、每页字符数、文字页/扫描页分类、每页内容哈希、PDF目录（或PPT幻灯片标题）和文件哈希。
+注释路由、笔记生成和前端据此做决策，无需再读取页面文件
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import fitz
+
+from config import PAGE_DIR, UPLOAD_DIR, BLOB_CHUNK_SIZE, MANIFEST_TEXT_MIN_CHARS
+from blob_store import blob_store
+from page_store import page_store
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+def _file_sha256(path: str) -> Optional[str]:
+    """优先使用内容寻址存储中记录的哈希，否则流式计算"""
+    record = blob_store.lookup(os.path.abspath(path))
+    if record:
+        return record["sha256"]
+    if not os.path.exists(path):
+        return None
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(BLOB_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _pdf_outline(path: str) -> List[Dict[str, Any]]:
+    """读取PDF书签目录"""
+    try:
+        doc = fitz.open(path)
+        try:
+            return [{"level": level, "title": title, "page": page} for level, title, page in doc.get_toc()]
+        finally:
+            doc.close()
+    except Exception as e:
+        logger.warning(f"⚠️ [MANIFEST] 读取PDF目录失败: {path}, 错误: {e}")
+        return []
+
+
+class ManifestStore:
+    """文档导入清单的读写与缓存"""
+
+    def __init__(self, page_dir: str = PAGE_DIR):
+        self.page_dir = page_dir
+        # filename -> (mtime_ns, manifest)
+        self._cache: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def manifest_path(self, filename: str) -> str:
+        return os.path.join(self.page_dir, f"{filename}{MANIFEST_SUFFIX}")
+
+    def build(self, filename: str, pages_text: List[str], source_path: Optional[str] = None,
+              outline: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        根据页面文本构建清单
+
+        Args:
+            filename: 文档文件名
+            pages_text: 全部页面文本
+            source_path: 原始文件路径，默认 UPLOAD_DIR/filename
+            outline: 目录，未提供时从PDF书签读取
+        """
+        source_path = source_path or os.path.join(UPLOAD_DIR, filename)
+        pages = []
+        for i, text in enumerate(pages_text, 1):
+            text = text or ""
+            chars = len(text.strip())
+            pages.append({
+                "page": i,
+                "chars": chars,
+                # 提取文字过少的页面视为扫描页/图片页，注释时走视觉识别
+                "type": "text" if chars > MANIFEST_TEXT_MIN_CHARS else "scanned",
+                "sha256": hashlib.sha256(text.encode('utf-8')).hexdigest()
+            })
+
+        text_pages = sum(1 for page in pages if page["type"] == "text")
+        scanned_pages = len(pages) - text_pages
+        if not pages or text_pages == len(pages):
+            document_type = "text"
+        elif text_pages == 0:
+            document_type = "scanned"
+        else:
+            document_type = "mixed"
+
+        if outline is None:
+            outline = _pdf_outline(source_path) if filename.lower().endswith('.pdf') else []
+
+        return {
+            "version": MANIFEST_VERSION,
+            "filename": filename,
+            "file_sha256": _file_sha256(source_path),
+            "file_size": os.path.getsize(source_path) if os.path.exists(source_path) else None,
+            "page_count": len(pages),
+            "total_chars": sum(page["chars"] for page in pages),
+            "text_pages": text_pages,
+            "scanned_pages": scanned_pages,
+            "document_type": document_type,
+            "outline": outline,
+            "pages": pages,
+            "created_at": time.time()
+        }
+
+    def save(self, filename: str, pages_text: List[str], source_path: Optional[str] = None,
+             outline: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """构建并保存清单"""
+        manifest = self.build(filename, pages_text, source_path, outline)
+        self._write(filename, manifest)
+        logger.info(f"📋 [MANIFEST] 已生成导入清单: {filename}，{manifest['page_count']}页，"
+                    f"文字页{manifest['text_pages']}，扫描页{manifest['scanned_pages']}")
+        return manifest
+
+    def _write(self, filename: str, manifest: Dict[str, Any]):
+        path = self.manifest_path(filename)
+        tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._cache[filename] = (os.stat(path).st_mtime_ns, manifest)
+
+    def get(self, filename: str, build_missing: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        读取清单；不存在时（旧文档）按已有页面文本补建
+
+        Returns:
+            清单字典，文档没有任何页面文本时返回None
+        """
+        path = self.manifest_path(filename)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+
+        if mtime_ns is not None:
+            with self._lock:
+                cached = self._cache.get(filename)
+                if cached and cached[0] == mtime_ns:
+                    return cached[1]
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                with self._lock:
+                    self._cache[filename] = (mtime_ns, manifest)
+                return manifest
+            except Exception as e:
+                logger.warning(f"⚠️ [MANIFEST] 读取导入清单失败，将重新生成: {filename}, 错误: {e}")
+
+        if not build_missing:
+            return None
+        pages_text = page_store.read_pages(filename)
+        if pages_text is None:
+            pages_text = page_store.read_legacy_pages(filename)
+        if not pages_text:
+            return None
+        return self.save(filename, pages_text)
+
+    def page_info(self, filename: str, page_number: int) -> Optional[Dict[str, Any]]:
+        """获取单页信息，无清单或页码越界时返回None"""
+        manifest = self.get(filename)
+        if not manifest or not 1 <= page_number <= manifest["page_count"]:
+            return None
+        return manifest["pages"][page_number - 1]
+
+    def copy(self, source: str, target: str) -> Optional[Dict[str, Any]]:
+        """为复用页面容器的重复上传复制清单"""
+        manifest = self.get(source)
+        if manifest is None:
+            return None
+        manifest = dict(manifest, filename=target, created_at=time.time())
+        self._write(target, manifest)
+        return manifest
+
+    def delete(self, filename: str) -> bool:
+        """删除清单"""
+        with self._lock:
+            self._cache.pop(filename, None)
+        try:
+            os.remove(self.manifest_path(filename))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+# 全局导入清单实例
+ingest_manifest = ManifestStore()
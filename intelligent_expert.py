@@ -8,9 +8,9 @@ import uuid
 import logging
 import re
 from typing import Dict, List, Any, Optional, Callable
-from openai import OpenAI
 from expert_llm import ExpertLLM
 from config import QWEN_API_KEY
+from llm_client import llm_client
 import controller
 import requests
 
@@ -22,10 +22,6 @@ class IntelligentExpert:
     def __init__(self, board_id: str):
         self.board_id = board_id
         self.session_id = f"intelligent_{board_id}_{uuid.uuid4().hex[:8]}"
-        self.client = OpenAI(
-            api_key=QWEN_API_KEY,
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        )
         self.conversation_history = []
         self.available_tools = self._setup_tools()
         
@@ -254,16 +250,15 @@ class IntelligentExpert:
             
             # 调用LLM分析
             try:
-                response = self.client.chat.completions.create(
-                    model="qwen-plus",
-                    messages=messages,
+                ai_response = await llm_client.chat(
+                    messages,
+                    "qwen-plus",
+                    api_key=QWEN_API_KEY,
                     temperature=0.1,
                     max_tokens=1000,
                     timeout=45  # 增加LLM调用超时
                 )
                 
-                ai_response = response.choices[0].message.content
-                
                 # 检查是否需要调用工具
                 tool_call = self._extract_tool_call(ai_response)
                 
@@ -1,15 +1,19 @@
 import os
 import json
+import asyncio
+import base64
 import logging
-import requests
 import uuid
 import time
-from config import QWEN_API_KEY, QWEN_VL_API_KEY, API_TIMEOUT
+from config import QWEN_API_KEY, QWEN_VL_API_KEY
+from llm_client import llm_client, LLMTimeoutError, LLMConnectionError
 from llm_logger import LLMLogger
+from model_router import model_router
+from prompt_builder import pack_pages, content_budget, estimate_tokens, fit_text, log_prompt
 
 logger = logging.getLogger(__name__)
 #dddddddddddddddddddddddddaaaaaaaaaaaaaaaaaaaaaaa
-def main_llm_annotate(text, session_id=None, file_id=None):
+def main_llm_annotate(text, session_id=None, file_id=None, refresh=False):
     """
     基于文本内容生成注释
     
@@ -17,6 +21,7 @@ def main_llm_annotate(text, session_id=None, file_id=None):
         text: 页面文本内容
         session_id: 会话ID，用于保持上下文连续性
         file_id: 文件ID，用于日志记录
+        refresh: 跳过LLM响应缓存重新生成
         
     Returns:
         包含注释内容的字典
@@ -29,18 +34,12 @@ def main_llm_annotate(text, session_id=None, file_id=None):
         return {"note": "API调用错误：未配置API密钥", "error": True}
     
     try:
-        # 准备API请求
-        url = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {QWEN_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        # 构建提示词
+        # 按页面大小选择模型，构建提示词
+        route = model_router.route("annotation", prompt_tokens=estimate_tokens(text))
         prompt = f"""请为以下PDF页面内容生成一份结构化的笔记。
         
 页面内容:
-{text}
+{fit_text(text, route["model"])}
 
 请生成一份清晰、结构化的笔记，使用Markdown格式，突出重点内容和关键概念。
 注意：只基于提供的内容生成笔记，不要添加未在原文中提及的信息。"""
@@ -51,18 +50,12 @@ def main_llm_annotate(text, session_id=None, file_id=None):
             {"role": "user", "content": prompt}
         ]
         
-        data = {
-            "model": "qwen-max",
-            "messages": messages,
-            "temperature": 0.3
-        }
-        
-        # 发送请求 - 配置代理设置以避免连接问题
+        # 发送请求（使用共享连接池），相同内容命中响应缓存
+        log_prompt(prompt, route["model"], "页面注释")
         start_time = time.time()
-        proxies = {'http': None, 'https': None}
-        response = requests.post(url, headers=headers, json=data, timeout=API_TIMEOUT, proxies=proxies)
-        response.raise_for_status()
-        result = response.json()
+        result = llm_client.chat_completion_sync(messages, route["model"], api_key=QWEN_API_KEY,
+                                                 timeout=route["timeout"], cache=True, refresh=refresh,
+                                                 max_tokens=route["max_tokens"], temperature=0.3)
         
         # 提取回复
         note_content = result["choices"][0]["message"]["content"]
@@ -78,6 +71,8 @@ def main_llm_annotate(text, session_id=None, file_id=None):
             metadata={
                 "session_id": session_id,
                 "file_id": file_id,
+                "model": route["model"],
+                "route_fallback": route["fallback_reason"],
                 "duration": duration,
                 "token_count": result.get("usage", {}).get("total_tokens", 0)
             }
@@ -103,6 +98,43 @@ def main_llm_annotate(text, session_id=None, file_id=None):
         
         return {"note": f"生成注释时出错: {str(e)}", "error": True}
 
+def _read_image_base64(image_path):
+    """读取图像文件并进行base64编码"""
+    with open(image_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8')
+
+def _vision_messages(image_data, context=None):
+    """构建页面图像识别的消息并选择视觉模型，context可含当前注释和改进要求，返回 (消息列表, 模型路由)"""
+    prompt = "请分析这个PDF页面图像，提取其中的所有文本内容，并生成一份结构化的笔记。"
+    
+    # 如果有上下文信息，添加到提示词中
+    if context:
+        if 'current_annotation' in context:
+            prompt += f"\n\n当前注释内容:\n{context['current_annotation']}"
+        if 'improve_request' in context:
+            prompt += f"\n\n改进要求:\n{context['improve_request']}"
+    
+    messages = [
+        {
+            "role": "system", 
+            "content": "你是一个专业的视觉内容分析助手，擅长从PDF页面图像中提取信息并生成结构化笔记。"
+        },
+        {
+            "role": "user", 
+            "content": [
+                {"type": "text", "text": prompt},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/png;base64,{image_data}"
+                    }
+                }
+            ]
+        }
+    ]
+    route = model_router.route("vision_annotation", prompt_tokens=estimate_tokens(prompt))
+    return messages, route
+
 def vision_llm_recognize(image_path, session_id=None, file_id=None, context=None, board_id=None):
     """
     使用视觉LLM识别图像内容并生成注释，同时将结果保存替换原文本文件
@@ -148,63 +180,15 @@ def vision_llm_recognize(image_path, session_id=None, file_id=None, context=None
                 page_number = int(match.group(2))  # 页码
                 logger.info(f"从图像路径提取信息: 文件={filename}, 页码={page_number}")
             
-        # 读取图像文件并进行base64编码
-        import base64
-        with open(image_path, "rb") as image_file:
-            image_data = base64.b64encode(image_file.read()).decode('utf-8')
-        
-        # 准备API请求
-        url = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {QWEN_VL_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        # 构建提示词
-        prompt = "请分析这个PDF页面图像，提取其中的所有文本内容，并生成一份结构化的笔记。"
-        
-        # 如果有上下文信息，添加到提示词中
-        if context:
-            if 'current_annotation' in context:
-                prompt += f"\n\n当前注释内容:\n{context['current_annotation']}"
-            if 'improve_request' in context:
-                prompt += f"\n\n改进要求:\n{context['improve_request']}"
+        # 读取图像并构建消息
+        messages, route = _vision_messages(_read_image_base64(image_path), context)
+        prompt = messages[1]["content"][0]["text"]
         
-        # 构建消息
-        messages = [
-            {
-                "role": "system", 
-                "content": "你是一个专业的视觉内容分析助手，擅长从PDF页面图像中提取信息并生成结构化笔记。"
-            },
-            {
-                "role": "user", 
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{image_data}"
-                        }
-                    }
-                ]
-            }
-        ]
-        
-        data = {
-            "model": "qwen-vl-max",
-            "messages": messages,
-            "temperature": 0.3
-        }
-        
-        # 发送请求 - 配置代理设置以避免连接问题
+        # 发送请求（使用共享连接池），视觉模型可能需要更长时间
         start_time = time.time()
-        proxies = {
-            'http': None,
-            'https': None
-        }
-        response = requests.post(url, headers=headers, json=data, timeout=API_TIMEOUT*2, proxies=proxies)  # 视觉模型可能需要更长时间
-        response.raise_for_status()
-        result = response.json()
+        result = llm_client.chat_completion_sync(messages, route["model"], api_key=QWEN_VL_API_KEY,
+                                                 timeout=route["timeout"], max_tokens=route["max_tokens"],
+                                                 temperature=0.3)
         
         # 提取回复
         note_content = result["choices"][0]["message"]["content"]
@@ -221,6 +205,8 @@ def vision_llm_recognize(image_path, session_id=None, file_id=None, context=None
                 "session_id": session_id,
                 "file_id": file_id,
                 "board_id": board_id,
+                "model": route["model"],
+                "route_fallback": route["fallback_reason"],
                 "duration": duration,
                 "token_count": result.get("usage", {}).get("total_tokens", 0),
                 "requestType": "image",  # 前端调试面板期望的字段名
@@ -232,15 +218,10 @@ def vision_llm_recognize(image_path, session_id=None, file_id=None, context=None
         # 新增：将图像识别结果保存到对应的页面文本文件，替换原有的文本提取内容
         if filename and page_number:
             try:
-                page_text_file = os.path.join("pages", f"{filename}_page_{page_number}.txt")
-                logger.info(f"保存图像识别结果到: {page_text_file}")
+                from page_store import page_store
                 
-                # 确保pages目录存在
-                os.makedirs("pages", exist_ok=True)
-                
-                # 将图像识别的结果写入到对应的页面文本文件中，替换原有内容
-                with open(page_text_file, 'w', encoding='utf-8') as f:
-                    f.write(note_content)
+                # 将图像识别的结果写入到对应的页面文本（打包容器或旧格式文件），替换原有内容
+                page_text_file = page_store.save_page_text(filename, page_number, note_content)
                 
                 logger.info(f"成功将图像识别结果保存到 {page_text_file}，内容长度: {len(note_content)}")
                 
@@ -260,7 +241,8 @@ def vision_llm_recognize(image_path, session_id=None, file_id=None, context=None
             "Access denied" in error_str or 
             "account is in good standing" in error_str):
             error_msg = f"视觉识别失败: API账户余额不足，请充值后重试"
-        elif ("HTTPSConnectionPool" in error_str or 
+        elif (isinstance(e, LLMConnectionError) or
+              "HTTPSConnectionPool" in error_str or 
               "Unable to connect" in error_str or
               "Connection refused" in error_str):
             error_msg = f"视觉识别失败: 网络连接问题，请检查网络后重试"
@@ -286,7 +268,7 @@ def vision_llm_recognize(image_path, session_id=None, file_id=None, context=None
         
         return f"视觉识别过程中出错: {error_msg}"
 
-def generate_pdf_note(pages_text, session_id=None, file_id=None):
+def generate_pdf_note(pages_text, session_id=None, file_id=None, refresh=False):
     """
     生成整本PDF的笔记
     
@@ -294,6 +276,7 @@ def generate_pdf_note(pages_text, session_id=None, file_id=None):
         pages_text: 所有页面的文本内容列表
         session_id: 会话ID，用于保持上下文连续性
         file_id: 文件ID，用于日志记录
+        refresh: 跳过LLM响应缓存重新生成
         
     Returns:
         生成的笔记内容
@@ -306,32 +289,12 @@ def generate_pdf_note(pages_text, session_id=None, file_id=None):
         return "API调用错误：未配置API密钥"
     
     try:
-        # 准备API请求
-        url = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {QWEN_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        # 构建提示词 - 为避免超出上下文长度，只使用部分页面作为示例
-        # 将限制从5页改为40页
+        # 构建提示词 - 页面内容按模型token预算打包，预算不足时按信息密度分配
         total_pages = len(pages_text)
-        sample_pages = min(40, total_pages)
-        
-        # 判断使用的页面范围
-        if total_pages <= 40:
-            # 如果总页数不超过40页，使用全部页面
-            pages_used = pages_text
-            page_range_info = f"<参考第1页-第{total_pages}页内容>"
-        else:
-            # 如果超过40页，取前20页和后20页
-            front_pages = 20
-            back_pages = 20
-            pages_used = pages_text[:front_pages] + pages_text[-back_pages:]
-            page_range_info = f"<参考第1页-第{front_pages}页及第{total_pages-back_pages+1}页-第{total_pages}页内容>"
-        
-        # 构建内容样本
-        content_samples = "\n\n".join([f"第{i+1}页:\n{text[:300]}..." for i, text in enumerate(pages_used)])
+        route = model_router.route("note", prompt_tokens=sum(map(estimate_tokens, pages_text)))
+        packed = pack_pages(pages_text, content_budget(route["model"]))
+        page_range_info = packed["page_range_info"]
+        content_samples = packed["content"]
         
         prompt = f"""请为以下PDF文档生成一份完整的笔记。
 
@@ -352,18 +315,12 @@ def generate_pdf_note(pages_text, session_id=None, file_id=None):
             {"role": "user", "content": prompt}
         ]
         
-        data = {
-            "model": "qwen-max",
-            "messages": messages,
-            "temperature": 0.3
-        }
-        
-        # 发送请求 - 配置代理设置以避免连接问题
+        # 发送请求（使用共享连接池），整本笔记可能需要更长时间，相同内容命中响应缓存
+        log_prompt(prompt, route["model"], "整本笔记")
         start_time = time.time()
-        proxies = {'http': None, 'https': None}
-        response = requests.post(url, headers=headers, json=data, timeout=API_TIMEOUT*2, proxies=proxies)  # 整本笔记可能需要更长时间
-        response.raise_for_status()
-        result = response.json()
+        result = llm_client.chat_completion_sync(messages, route["model"], api_key=QWEN_API_KEY,
+                                                 timeout=route["timeout"], cache=True, refresh=refresh,
+                                                 max_tokens=route["max_tokens"], temperature=0.3)
         
         # 提取回复
         note_content = result["choices"][0]["message"]["content"]
@@ -382,10 +339,12 @@ def generate_pdf_note(pages_text, session_id=None, file_id=None):
             metadata={
                 "session_id": session_id,
                 "file_id": file_id,
+                "model": route["model"],
+                "route_fallback": route["fallback_reason"],
                 "duration": duration,
                 "token_count": result.get("usage", {}).get("total_tokens", 0),
                 "pages_count": total_pages,
-                "pages_used": len(pages_used)
+                "pages_used": packed["pages_used"]
             }
         )
         
@@ -409,6 +368,89 @@ def generate_pdf_note(pages_text, session_id=None, file_id=None):
         
         return f"生成整本笔记时出错: {str(e)}"
 
+async def vision_llm_recognize_async(image_path, filename, page_number, session_id=None, context=None, board_id=None):
+    """
+    异步识别页面图像并生成注释，识别结果同样保存替换该页的文本
+    
+    LLM调用在调用方的上下文中发起：随所在任务取消而中止，受任务截止时间限制。
+    与vision_llm_recognize不同，失败时抛出异常而不是返回错误文本
+    
+    Args:
+        image_path: 页面图像路径
+        filename: PDF文件名
+        page_number: 页码
+        session_id: 会话ID，用于日志记录
+        context: 上下文信息，如当前注释和改进请求
+        board_id: 展板ID，用于日志记录
+        
+    Returns:
+        生成的注释内容
+    """
+    if not QWEN_VL_API_KEY:
+        raise ValueError("未配置视觉模型API密钥")
+    
+    loop = asyncio.get_running_loop()
+    image_data = await loop.run_in_executor(None, _read_image_base64, image_path)
+    messages, route = _vision_messages(image_data, context)
+    start_time = time.time()
+    result = await llm_client.chat_completion(messages, route["model"], api_key=QWEN_VL_API_KEY,
+                                              timeout=route["timeout"], max_tokens=route["max_tokens"],
+                                              temperature=0.3)
+    note_content = result["choices"][0]["message"]["content"]
+    
+    LLMLogger.log_interaction(
+        llm_type="vision_recognize",
+        query=messages[1]["content"][0]["text"],
+        response=note_content,
+        metadata={
+            "session_id": session_id,
+            "file_id": filename,
+            "board_id": board_id,
+            "model": route["model"],
+            "route_fallback": route["fallback_reason"],
+            "duration": time.time() - start_time,
+            "token_count": result.get("usage", {}).get("total_tokens", 0),
+            "requestType": "image",
+            "operation_type": "vision_annotation",
+            "input_type": "image"
+        }
+    )
+    
+    # 将图像识别的结果写入到对应的页面文本，替换原有的文本提取内容
+    try:
+        from page_store import page_store
+        page_text_file = await loop.run_in_executor(None, page_store.save_page_text, filename, page_number, note_content)
+        logger.info(f"成功将图像识别结果保存到 {page_text_file}，内容长度: {len(note_content)}")
+    except Exception as save_error:
+        logger.error(f"保存图像识别结果到文件失败: {str(save_error)}")
+    
+    return note_content
+
+def _pdf_question_messages(pages_text, question):
+    """按文档大小选择模型并构建PDF问答的消息，返回 (消息列表, 模型路由)"""
+    # 页面内容按模型token预算打包，扣除问题占用的部分
+    question_tokens = estimate_tokens(question)
+    route = model_router.route("qa", prompt_tokens=sum(map(estimate_tokens, pages_text)) + question_tokens)
+    packed = pack_pages(pages_text, content_budget(route["model"], question_tokens))
+    content_context = packed["content"]
+    
+    prompt = f"""请基于以下PDF文档内容回答问题。
+
+文档内容:
+{content_context}
+
+用户问题: {question}
+
+请提供准确、详细的回答，只基于文档中包含的信息。如果文档中没有相关信息，请明确说明。"""
+    
+    # 构建消息
+    messages = [
+        {"role": "system", "content": "你是一个专业的PDF内容问答助手，擅长基于文档内容回答问题。"},
+        {"role": "user", "content": prompt}
+    ]
+    log_prompt(prompt, route["model"], "PDF问答")
+    return messages, route
+
 def ask_pdf_question(pages_text, question, session_id=None, file_id=None):
     """
     回答关于PDF内容的问题
@@ -430,45 +472,13 @@ def ask_pdf_question(pages_text, question, session_id=None, file_id=None):
         return "API调用错误：未配置API密钥"
     
     try:
-        # 准备API请求
-        url = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {QWEN_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        # 构建提示词 - 为避免超出上下文长度，只使用部分页面作为上下文
-        # 根据问题长度动态调整包含的页面数量
-        max_pages = max(1, min(10, 8000 // (len(question) + 100)))
-        content_context = "\n\n".join([f"第{i+1}页:\n{text}" for i, text in enumerate(pages_text[:max_pages])])
-        
-        prompt = f"""请基于以下PDF文档内容回答问题。
-
-文档内容:
-{content_context}
-
-用户问题: {question}
-
-请提供准确、详细的回答，只基于文档中包含的信息。如果文档中没有相关信息，请明确说明。"""
-        
-        # 构建消息
-        messages = [
-            {"role": "system", "content": "你是一个专业的PDF内容问答助手，擅长基于文档内容回答问题。"},
-            {"role": "user", "content": prompt}
-        ]
+        messages, route = _pdf_question_messages(pages_text, question)
         
-        data = {
-            "model": "qwen-max",
-            "messages": messages,
-            "temperature": 0.3
-        }
-        
-        # 发送请求 - 配置代理设置以避免连接问题
+        # 发送请求（使用共享连接池）
         start_time = time.time()
-        proxies = {'http': None, 'https': None}
-        response = requests.post(url, headers=headers, json=data, timeout=API_TIMEOUT, proxies=proxies)
-        response.raise_for_status()
-        result = response.json()
+        result = llm_client.chat_completion_sync(messages, route["model"], api_key=QWEN_API_KEY,
+                                                 timeout=route["timeout"], max_tokens=route["max_tokens"],
+                                                 temperature=0.3)
         
         # 提取回复
         answer_content = result["choices"][0]["message"]["content"]
@@ -484,6 +494,8 @@ def ask_pdf_question(pages_text, question, session_id=None, file_id=None):
             metadata={
                 "session_id": session_id,
                 "file_id": file_id,
+                "model": route["model"],
+                "route_fallback": route["fallback_reason"],
                 "duration": duration,
                 "token_count": result.get("usage", {}).get("total_tokens", 0)
             }
@@ -509,6 +521,123 @@ def ask_pdf_question(pages_text, question, session_id=None, file_id=None):
         
         return f"回答问题时出错: {str(e)}"
 
+async def ask_pdf_question_async(pages_text, question, session_id=None, file_id=None):
+    """
+    异步回答关于PDF内容的问题
+    
+    LLM调用在调用方的上下文中发起：随所在任务取消而中止，受任务截止时间限制。
+    与ask_pdf_question不同，失败时抛出异常而不是返回错误文本
+    
+    Args:
+        pages_text: 所有页面的文本内容列表
+        question: 用户问题
+        session_id: 会话ID，用于日志记录
+        file_id: 文件ID，用于日志记录
+        
+    Returns:
+        问题的回答
+    """
+    if not QWEN_API_KEY:
+        raise ValueError("未配置API密钥")
+    
+    messages, route = _pdf_question_messages(pages_text, question)
+    start_time = time.time()
+    result = await llm_client.chat_completion(messages, route["model"], api_key=QWEN_API_KEY,
+                                              timeout=route["timeout"], max_tokens=route["max_tokens"],
+                                              temperature=0.3)
+    answer_content = result["choices"][0]["message"]["content"]
+    LLMLogger.log_interaction(
+        llm_type="pdf_question",
+        query=question,
+        response=answer_content,
+        metadata={
+            "session_id": session_id,
+            "file_id": file_id,
+            "model": route["model"],
+            "route_fallback": route["fallback_reason"],
+            "duration": time.time() - start_time,
+            "token_count": result.get("usage", {}).get("total_tokens", 0)
+        }
+    )
+    return answer_content
+
+async def ask_pdf_question_stream(pages_text, question, on_chunk, session_id=None, file_id=None):
+    """
+    流式回答关于PDF内容的问题，上游返回的文本片段到达即交给on_chunk
+    
+    所在任务被取消（如WebSocket客户端断开）时停止读取并关闭上游连接，不再继续生成
+    
+    Args:
+        pages_text: 所有页面的文本内容列表
+        question: 用户问题
+        on_chunk: 异步回调，参数为文本片段
+        session_id: 会话ID，用于日志记录
+        file_id: 文件ID，用于日志记录
+        
+    Returns:
+        完整的回答
+    """
+    if not QWEN_API_KEY:
+        raise ValueError("未配置API密钥")
+    
+    messages, route = _pdf_question_messages(pages_text, question)
+    start_time = time.time()
+    parts = []
+    async for delta in llm_client.stream(messages, route["model"], api_key=QWEN_API_KEY,
+                                         timeout=route["timeout"], max_tokens=route["max_tokens"],
+                                         temperature=0.3):
+        parts.append(delta)
+        await on_chunk(delta)
+    
+    answer_content = "".join(parts)
+    LLMLogger.log_interaction(
+        llm_type="pdf_question",
+        query=question,
+        response=answer_content,
+        metadata={
+            "session_id": session_id,
+            "file_id": file_id,
+            "model": route["model"],
+            "route_fallback": route["fallback_reason"],
+            "duration": time.time() - start_time,
+            "stream": True
+        }
+    )
+    return answer_content
+
+# 改进笔记时笔记内容的最大长度，超过时截断以避免超时
+_IMPROVE_NOTE_MAX_CHARS = 4000
+
+def _improve_note_messages(note_content, pages_text, improve_prompt):
+    """构建改进笔记的消息并选择模型，返回 (消息列表, 模型路由, 超时秒数)，长内容使用更长超时"""
+    # 对超长内容进行截断处理，避免超时
+    truncated_note = note_content
+    if len(note_content) > _IMPROVE_NOTE_MAX_CHARS:
+        truncated_note = note_content[:_IMPROVE_NOTE_MAX_CHARS] + "\n\n[内容过长，已截断...]"
+        logger.info(f"笔记内容过长({len(note_content)}字符)，已截断至{_IMPROVE_NOTE_MAX_CHARS}字符")
+    
+    prompt = f"""请根据以下要求改进笔记内容:
+
+改进要求: {improve_prompt}
+
+当前笔记内容:
+{truncated_note}
+"""
+    
+    # 如果有页面文本，添加部分作为参考（前两页，按token预算截取）
+    if pages_text and len(pages_text) > 0:
+        sample_text = pack_pages(pages_text[:2], 600)["content"]
+        prompt += f"\n\n参考内容:\n{sample_text}"
+    
+    messages = [
+        {"role": "system", "content": "你是一个专业的笔记改进助手，擅长根据用户要求优化笔记内容。"},
+        {"role": "user", "content": prompt}
+    ]
+    route = model_router.route("improve_note", prompt_tokens=estimate_tokens(prompt))
+    timeout = route["timeout"] * 2 if len(note_content) > 2000 else route["timeout"]
+    log_prompt(prompt, route["model"], "笔记改进")
+    return messages, route, timeout
+
 def improve_user_note(note_content, pages_text, improve_prompt, session_id=None, file_id=None):
     """
     改进用户笔记内容
@@ -535,56 +664,14 @@ def improve_user_note(note_content, pages_text, improve_prompt, session_id=None,
     
     for attempt in range(max_retries):
         try:
-            # 准备API请求
-            url = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {QWEN_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            
-            # 对超长内容进行截断处理，避免超时
-            MAX_CONTENT_LENGTH = 4000  # 设置最大内容长度
-            truncated_note = note_content
-            if len(note_content) > MAX_CONTENT_LENGTH:
-                truncated_note = note_content[:MAX_CONTENT_LENGTH] + "\n\n[内容过长，已截断...]"
-                logger.info(f"笔记内容过长({len(note_content)}字符)，已截断至{MAX_CONTENT_LENGTH}字符")
-            
-            # 构建提示词
-            prompt = f"""请根据以下要求改进笔记内容:
-
-改进要求: {improve_prompt}
-
-当前笔记内容:
-{truncated_note}
-"""
-            
-            # 如果有页面文本，添加部分作为参考
-            if pages_text and len(pages_text) > 0:
-                # 添加部分参考内容
-                sample_text = "\n\n".join([f"第{i+1}页:\n{text[:300]}..." for i, text in enumerate(pages_text[:2])])
-                prompt += f"\n\n参考内容:\n{sample_text}"
-            
-            # 构建消息
-            messages = [
-                {"role": "system", "content": "你是一个专业的笔记改进助手，擅长根据用户要求优化笔记内容。"},
-                {"role": "user", "content": prompt}
-            ]
-            
-            data = {
-                "model": "qwen-max",
-                "messages": messages,
-                "temperature": 0.3
-            }
-            
-            # 发送请求，对于改进任务使用更长的超时时间
+            messages, route, timeout = _improve_note_messages(note_content, pages_text, improve_prompt)
+            prompt = messages[1]["content"]
             start_time = time.time()
-            timeout = API_TIMEOUT * 2 if len(note_content) > 2000 else API_TIMEOUT  # 对长内容使用更长超时
-            proxies = {'http': None, 'https': None}
             
             logger.info(f"开始笔记改进请求（尝试 {attempt + 1}/{max_retries}），超时时间：{timeout}秒")
-            response = requests.post(url, headers=headers, json=data, timeout=timeout, proxies=proxies)
-            response.raise_for_status()
-            result = response.json()
+            result = llm_client.chat_completion_sync(messages, route["model"], api_key=QWEN_API_KEY,
+                                                     timeout=timeout, max_tokens=route["max_tokens"],
+                                                     temperature=0.3)
             
             # 提取回复
             improved_note = result["choices"][0]["message"]["content"]
@@ -601,24 +688,26 @@ def improve_user_note(note_content, pages_text, improve_prompt, session_id=None,
                 metadata={
                     "session_id": session_id,
                     "file_id": file_id,
+                    "model": route["model"],
+                    "route_fallback": route["fallback_reason"],
                     "duration": duration,
                     "token_count": result.get("usage", {}).get("total_tokens", 0),
                     "original_length": len(note_content),
-                    "truncated": len(note_content) > MAX_CONTENT_LENGTH,
+                    "truncated": len(note_content) > _IMPROVE_NOTE_MAX_CHARS,
                     "attempt": attempt + 1
                 }
             )
             
             return improved_note
             
-        except requests.exceptions.ReadTimeout:
+        except LLMTimeoutError:
             error_msg = f"API调用超时（尝试 {attempt + 1}/{max_retries}）"
             logger.warning(error_msg)
             if attempt == max_retries - 1:  # 最后一次尝试
                 return f"笔记改进请求超时，请稍后重试。如果问题持续，请考虑缩短笔记内容后再次尝试。"
             time.sleep(2)  # 重试前等待2秒
             
-        except requests.exceptions.ConnectionError:
+        except LLMConnectionError:
             error_msg = f"网络连接错误（尝试 {attempt + 1}/{max_retries}）"
             logger.warning(error_msg)
             if attempt == max_retries - 1:  # 最后一次尝试
@@ -647,3 +736,46 @@ def improve_user_note(note_content, pages_text, improve_prompt, session_id=None,
     
     # 如果所有重试都失败了，返回默认错误信息
     return "笔记改进失败，已尝试多次请求。请稍后重试。"
+
+async def improve_user_note_async(note_content, pages_text, improve_prompt, session_id=None, file_id=None):
+    """
+    异步改进用户笔记内容
+    
+    LLM调用在调用方的上下文中发起：随所在任务取消而中止，受任务截止时间限制。
+    与improve_user_note不同，不重试，失败时抛出异常而不是返回错误文本
+    
+    Args:
+        note_content: 当前笔记内容
+        pages_text: 相关页面的文本内容列表
+        improve_prompt: 用户的改进要求
+        session_id: 会话ID，用于日志记录
+        file_id: 文件ID，用于日志记录
+        
+    Returns:
+        改进后的笔记内容
+    """
+    if not QWEN_API_KEY:
+        raise ValueError("未配置API密钥")
+    
+    messages, route, timeout = _improve_note_messages(note_content, pages_text, improve_prompt)
+    start_time = time.time()
+    result = await llm_client.chat_completion(messages, route["model"], api_key=QWEN_API_KEY,
+                                              timeout=timeout, max_tokens=route["max_tokens"],
+                                              temperature=0.3)
+    improved_note = result["choices"][0]["message"]["content"]
+    LLMLogger.log_interaction(
+        llm_type="improve_note",
+        query=messages[1]["content"],
+        response=improved_note,
+        metadata={
+            "session_id": session_id,
+            "file_id": file_id,
+            "model": route["model"],
+            "route_fallback": route["fallback_reason"],
+            "duration": time.time() - start_time,
+            "token_count": result.get("usage", {}).get("total_tokens", 0),
+            "original_length": len(note_content),
+            "truncated": len(note_content) > _IMPROVE_NOTE_MAX_CHARS
+        }
+    )
+    return improved_note
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+LLM响应缓存
+两级缓存：进程内按字节数限制的LRU + SQLite磁盘层。键由模型、规范化后的消息、
+temperature、max_tokens和注释风格计算，条目超过有效期后失效，磁盘层超过字节预算时
+淘汰最久未使用的条目。统计命中率以及因命中而节省的响应字节数和token数
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import LLM_CACHE_DB, LLM_CACHE_TTL, LLM_CACHE_MEMORY_MAX_BYTES, LLM_CACHE_DISK_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_content(content: Any) -> Any:
+    # 去除文本首尾空白并统一换行，图像等非文本内容原样保留
+    if isinstance(content, str):
+        return content.replace("\r\n", "\n").strip()
+    if isinstance(content, list):
+        return [_normalize_content(part) for part in content]
+    if isinstance(content, dict):
+        return {key: _normalize_content(value) for key, value in content.items()}
+    return content
+
+
+class LLMResponseCache:
+    """内存 + SQLite两级LLM响应缓存"""
+
+    def __init__(self, db_path: str = LLM_CACHE_DB, ttl: int = LLM_CACHE_TTL,
+                 memory_max_bytes: int = LLM_CACHE_MEMORY_MAX_BYTES,
+                 disk_max_bytes: int = LLM_CACHE_DISK_MAX_BYTES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+
+        # 键 -> (写入时间, 响应JSON文本, 字节数)，顺序即LRU顺序（末尾为最近使用）
+        self._memory: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self.tokens_saved = 0
+
+    def _db(self) -> sqlite3.Connection:
+        # 调用方需持有self._lock
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, "
+                "created_at REAL, accessed_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, Any]], temperature: Optional[float] = None,
+                 max_tokens: Optional[int] = None, style: Optional[str] = None) -> str:
+        """计算缓存键：(模型, 规范化消息的哈希, temperature, max_tokens, 注释风格)"""
+        normalized = [
+            {"role": message.get("role"), "content": _normalize_content(message.get("content"))}
+            for message in messages
+        ]
+        messages_hash = hashlib.sha256(
+            json.dumps(normalized, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        raw = json.dumps([model, messages_hash, temperature, max_tokens, style], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存的响应，先查内存层再查磁盘层，过期条目视为未命中"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._record_hit(entry[1])
+
+            row = self._db().execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self._db().execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db().commit()
+            self.disk_hits += 1
+            self._remember(key, row[1], row[0])
+            return self._record_hit(row[0])
+
+    def _record_hit(self, text: str) -> Dict[str, Any]:
+        response = json.loads(text)
+        self.bytes_saved += len(text.encode("utf-8"))
+        self.tokens_saved += (response.get("usage") or {}).get("total_tokens", 0)
+        return response
+
+    def _remember(self, key: str, created_at: float, text: str):
+        # 调用方需持有self._lock
+        size = len(text.encode("utf-8"))
+        if size > self.memory_max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= old[2]
+        self._memory[key] = (created_at, text, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_max_bytes:
+            _, (_, _, evicted_size) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+
+    def put(self, key: str, model: str, response: Dict[str, Any]):
+        """写入响应，磁盘层超过字节预算时淘汰最久未使用的条目"""
+        text = json.dumps(response, ensure_ascii=False)
+        size = len(text.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, text)
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, text, size, now, now)
+            )
+            self._evict_disk(db, now)
+            db.commit()
+
+    def _evict_disk(self, db: sqlite3.Connection, now: float):
+        # 先删除过期条目，再按访问时间淘汰到预算的90%以下
+        expired = db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,)).rowcount
+        self.evictions += max(expired, 0)
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.disk_max_bytes:
+            return
+        target = self.disk_max_bytes * 0.9
+        for key, size in db.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            if total <= target:
+                break
+            db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+        logger.info(f"🗑️ [LLM-CACHE] 磁盘缓存淘汰完成，当前 {total} 字节")
+
+    def record_bypass(self):
+        """记录一次显式跳过缓存（重新生成）"""
+        with self._lock:
+            self.bypasses += 1
+
+    def clear(self):
+        """清空两级缓存（保留计数器）"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._db().execute("DELETE FROM responses")
+            self._db().commit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            entries, disk_bytes = self._db().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "bypasses": self.bypasses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "tokens_saved": self.tokens_saved,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": entries,
+                "disk_bytes": disk_bytes,
+                "ttl": self.ttl
+            }
+
+
+# 全局LLM响应缓存实例
+llm_response_cache = LLMResponseCache()
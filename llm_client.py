@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+统一的LLM客户端
+所有模块共用一个保持长连接的HTTP连接池（安装了h2时使用HTTP/2），支持流式与非流式调用，
+每次调用可单独指定读取超时。连接池运行在独立的事件循环线程中：
+异步代码直接await，不会阻塞调用方的事件循环；同步代码通过 *_sync 方法调用，共用同一个连接池。
+任务设置的截止时间记录在上下文变量中，其中发起的每次调用（包括重试和流式读取）都不会超过该时间
+"""
+
+import json
+import time
+import queue
+import asyncio
+import logging
+import threading
+import contextvars
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+
+import httpx
+
+from llm_cache import llm_response_cache
+from llm_limits import llm_rate_limiter, llm_concurrency, backoff_delay, CircuitBreaker
+from prompt_builder import estimate_messages_tokens
+from config import (
+    API_TIMEOUT, DASHSCOPE_API_KEY, QWEN_API_KEY, LLM_BASE_URL,
+    LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE_CONNECTIONS, LLM_KEEPALIVE_EXPIRY, LLM_CONNECT_TIMEOUT,
+    LLM_STREAM_BUFFER_CHUNKS, LLM_MAX_RETRIES
+)
+
+try:
+    import h2  # noqa: F401  httpx的HTTP/2支持依赖h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 流式队列中的结束标记
+_STREAM_END = object()
+
+# 可重试的上游状态码
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# 请求未指定max_tokens时，限流预扣的输出token数
+_DEFAULT_COMPLETION_TOKENS = 1000
+
+# 当前上下文（通常是一个任务的执行协程）的截止时间，time.time()时间戳
+_call_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("llm_call_deadline", default=None)
+
+
+class LLMError(Exception):
+    """LLM调用失败"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMTimeoutError(LLMError):
+    """LLM调用超时"""
+
+
+class LLMDeadlineExceeded(LLMTimeoutError):
+    """超过当前上下文（所属任务）的截止时间，调用已中止"""
+
+
+class LLMConnectionError(LLMError):
+    """无法连接到LLM服务"""
+
+
+class LLMUpstreamDegradedError(LLMError):
+    """上游服务降级（熔断中），请求未发出即失败"""
+
+
+def set_deadline(deadline_at: Optional[float]) -> contextvars.Token:
+    """设置当前上下文的截止时间（time.time()时间戳，None表示不限），其中发起的LLM调用到期即中止"""
+    return _call_deadline.set(deadline_at)
+
+
+def deadline_remaining() -> Optional[float]:
+    """距当前上下文截止时间的秒数（可能为负），未设置截止时间时返回None"""
+    deadline_at = _call_deadline.get()
+    return deadline_at - time.time() if deadline_at is not None else None
+
+
+def _deadline_exceeded() -> LLMDeadlineExceeded:
+    return LLMDeadlineExceeded("LLM调用超过任务截止时间")
+
+
+class LLMClient:
+    """OpenAI兼容接口的共享客户端"""
+
+    def __init__(self, base_url: str = LLM_BASE_URL, api_key: Optional[str] = None):
+        self.base_url = base_url
+        self.api_key = api_key or DASHSCOPE_API_KEY or QWEN_API_KEY
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """启动连接池所在的事件循环线程（首次调用时）"""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=loop.run_forever, name="llm_client", daemon=True)
+                self._thread.start()
+                self._loop = loop
+                logger.info(f"🌐 [LLM] 客户端事件循环已启动，HTTP/2: {HTTP2_AVAILABLE}")
+            return self._loop
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # 只在客户端事件循环中调用
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(API_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                trust_env=False  # 不走系统代理，避免连接问题
+            )
+        return self._client
+
+    def _build_request(self, messages: List[Dict[str, Any]], model: str, api_key: Optional[str],
+                       timeout: Optional[float], stream: bool, params: Dict[str, Any]):
+        key = api_key or self.api_key
+        if not key:
+            raise LLMError("未配置API密钥")
+        payload = {"model": model, "messages": messages,
+                   **{name: value for name, value in params.items() if value is not None}}
+        if stream:
+            payload["stream"] = True
+        headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
+        request_timeout = httpx.Timeout(timeout or API_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+        return payload, headers, request_timeout
+
+    @staticmethod
+    def _translate_error(e: Exception) -> LLMError:
+        if isinstance(e, LLMError):
+            return e
+        if isinstance(e, httpx.TimeoutException):
+            return LLMTimeoutError(f"LLM调用超时: {type(e).__name__}")
+        if isinstance(e, httpx.TransportError):
+            return LLMConnectionError(f"无法连接到LLM服务: {str(e) or type(e).__name__}")
+        return LLMError(str(e))
+
+    async def _admit(self, payload: Dict[str, Any], breaker: CircuitBreaker) -> int:
+        """熔断检查，等待限流额度和并发名额，返回预扣的token数（调用方负责释放并发名额）"""
+        model = payload["model"]
+        if not breaker.allow():
+            llm_rate_limiter.rejected += 1
+            raise LLMUpstreamDegradedError(
+                f"上游服务降级：{model} 连续调用失败，已暂停调用，约{breaker.retry_after():.0f}秒后重试", 503
+            )
+        tokens = estimate_messages_tokens(payload["messages"]) + (payload.get("max_tokens") or _DEFAULT_COMPLETION_TOKENS)
+        await llm_rate_limiter.acquire(model, tokens)
+        try:
+            await llm_concurrency.acquire()
+        except asyncio.CancelledError:
+            breaker.release_probe()
+            raise
+        return tokens
+
+    @staticmethod
+    def _congested(status_code: Optional[int] = None, error: Optional[Exception] = None) -> bool:
+        """是否为上游拥塞信号：429、5xx、超时或连接失败（本地连接池耗尽除外）"""
+        if error is not None:
+            return isinstance(error, httpx.TransportError) and not isinstance(error, httpx.PoolTimeout)
+        return status_code == 429 or (status_code or 0) >= 500
+
+    @staticmethod
+    def _per_token_latency(started: float, completion_tokens: Optional[int]) -> Optional[float]:
+        """每个输出token的耗时，输出过短时返回None"""
+        if not completion_tokens or completion_tokens < llm_concurrency.MIN_SAMPLE_TOKENS:
+            return None
+        return (time.monotonic() - started) / completion_tokens
+
+    @staticmethod
+    def _retry_delay(breaker: CircuitBreaker, attempt: int, status_code: Optional[int] = None,
+                     error: Optional[Exception] = None, retry_after: Optional[str] = None) -> Optional[float]:
+        """
+        记录一次失败的尝试并返回重试前的等待秒数，不应重试时返回None
+
+        429说明上游可用只是限流，不计入熔断；5xx、连接失败和超时计入熔断
+        """
+        if isinstance(error, httpx.PoolTimeout):
+            return None  # 本地连接池耗尽，与上游状态无关
+        if status_code == 429:
+            llm_rate_limiter.upstream_429 += 1
+            breaker.record_success()
+        elif error is not None or (status_code or 0) >= 500:
+            if status_code:
+                llm_rate_limiter.upstream_5xx += 1
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+            return None
+
+        retryable = status_code in _RETRYABLE_STATUS or isinstance(
+            error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+        )
+        if not retryable or attempt >= LLM_MAX_RETRIES:
+            return None
+        llm_rate_limiter.retries += 1
+        delay = backoff_delay(attempt, retry_after)
+        reason = f"HTTP {status_code}" if status_code else type(error).__name__
+        logger.warning(f"🔁 [LLM] {breaker.name} 调用失败（{reason}），{delay:.1f}秒后第{attempt + 1}次重试")
+        return delay
+
+    async def _post(self, payload: Dict[str, Any], headers: Dict[str, str],
+                    timeout: httpx.Timeout) -> Dict[str, Any]:
+        breaker = llm_rate_limiter.breaker(payload["model"])
+        attempt = 0
+        while True:
+            estimated = await self._admit(payload, breaker)
+            started = time.monotonic()
+            outcome: Dict[str, Any] = {}
+            try:
+                response = await self._get_client().post("/chat/completions", json=payload,
+                                                          headers=headers, timeout=timeout)
+            except asyncio.CancelledError:
+                breaker.release_probe()
+                raise
+            except Exception as e:
+                outcome["congested"] = self._congested(error=e)
+                delay = self._retry_delay(breaker, attempt, error=e)
+                if delay is None:
+                    raise self._translate_error(e) from e
+            else:
+                if response.status_code < 400:
+                    breaker.record_success()
+                    result = response.json()
+                    usage = result.get("usage") or {}
+                    outcome.update(kind="per_token",
+                                   latency=self._per_token_latency(started, usage.get("completion_tokens")))
+                    llm_rate_limiter.settle(payload["model"], estimated, usage.get("total_tokens", 0))
+                    llm_rate_limiter.record_latency(payload["model"], time.monotonic() - started)
+                    return result
+                outcome["congested"] = self._congested(status_code=response.status_code)
+                delay = self._retry_delay(breaker, attempt, status_code=response.status_code,
+                                          retry_after=response.headers.get("retry-after"))
+                if delay is None:
+                    raise LLMError(f"HTTP {response.status_code}: {response.text[:500]}", response.status_code)
+            finally:
+                llm_concurrency.release(started, **outcome)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _stream_into(self, payload: Dict[str, Any], headers: Dict[str, str],
+                           timeout: httpx.Timeout, put: Callable[[Any], Awaitable[None]]):
+        """
+        在客户端事件循环中读取SSE流，把每个数据块（或异常、结束标记）交给put
+        put在消费方缓冲区满时等待，此时暂停读取上游连接。
+        只有在收到第一个数据块之前的失败（429/5xx/连接失败）才会重试。
+        并发名额占用到流结束，首个数据块的等待时间作为自适应并发的延迟样本
+        """
+        breaker = llm_rate_limiter.breaker(payload["model"])
+        first_chunk_at = None
+
+        async def forward(item):
+            nonlocal first_chunk_at
+            if first_chunk_at is None:
+                first_chunk_at = time.monotonic()
+            await put(item)
+
+        try:
+            attempt = 0
+            while True:
+                await self._admit(payload, breaker)
+                started = time.monotonic()
+                outcome: Dict[str, Any] = {}
+                try:
+                    async with self._get_client().stream("POST", "/chat/completions", json=payload,
+                                                         headers=headers, timeout=timeout) as response:
+                        if response.status_code >= 400:
+                            body = (await response.aread()).decode("utf-8", errors="replace")
+                            outcome["congested"] = self._congested(status_code=response.status_code)
+                            delay = self._retry_delay(breaker, attempt, status_code=response.status_code,
+                                                      retry_after=response.headers.get("retry-after"))
+                            if delay is None:
+                                raise LLMError(f"HTTP {response.status_code}: {body[:500]}", response.status_code)
+                        else:
+                            breaker.record_success()
+                            await self._forward_lines(response, forward)
+                            outcome.update(kind="first_token",
+                                           latency=first_chunk_at - started if first_chunk_at else None)
+                            break
+                except httpx.TransportError as e:
+                    outcome["congested"] = self._congested(error=e)
+                    if first_chunk_at is not None:
+                        breaker.record_failure()
+                        raise  # 已经投递过数据块，重试会产生重复内容
+                    delay = self._retry_delay(breaker, attempt, error=e)
+                    if delay is None:
+                        raise
+                finally:
+                    llm_concurrency.release(started, **outcome)
+                await asyncio.sleep(delay)
+                attempt += 1
+        except asyncio.CancelledError:
+            # 消费方已停止迭代，不再投递
+            breaker.release_probe()
+            raise
+        except Exception as e:
+            await put(self._translate_error(e))
+        await put(_STREAM_END)
+
+    @staticmethod
+    async def _forward_lines(response: httpx.Response, put: Callable[[Any], Awaitable[None]]):
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data_str = line[5:].strip()
+            if data_str == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data_str)
+            except json.JSONDecodeError:
+                logger.warning(f"⚠️ [LLM] 无法解析流式数据: {data_str[:100]}")
+                continue
+            await put(chunk)
+
+    async def _run(self, coro):
+        """在客户端事件循环中执行协程并等待结果，超过当前上下文的截止时间时取消调用"""
+        loop = self._ensure_loop()
+        remaining = deadline_remaining()
+        if remaining is not None and remaining <= 0:
+            coro.close()
+            raise _deadline_exceeded()
+        if asyncio.get_running_loop() is not loop:
+            coro = asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+        if remaining is None:
+            return await coro
+        try:
+            return await asyncio.wait_for(coro, remaining)
+        except asyncio.TimeoutError:
+            raise _deadline_exceeded() from None
+
+    def run_sync(self, coro):
+        """在同步代码中执行协程（协程运行在客户端事件循环中，当前线程阻塞等待）"""
+        loop = self._ensure_loop()
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("不能在LLM客户端事件循环中同步等待")
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    async def chat_completion(self, messages: List[Dict[str, Any]], model: str, *,
+                              api_key: Optional[str] = None, timeout: Optional[float] = None,
+                              cache: bool = False, cache_style: Optional[str] = None,
+                              refresh: bool = False, **params) -> Dict[str, Any]:
+        """
+        非流式调用，返回完整的响应JSON（含usage、tool_calls等）
+
+        Args:
+            messages: 消息列表
+            model: 模型名称
+            api_key: 使用的API密钥，默认DASHSCOPE_API_KEY或QWEN_API_KEY
+            timeout: 读取超时（秒），默认API_TIMEOUT
+            cache: 是否使用LLM响应缓存
+            cache_style: 计入缓存键的注释风格
+            refresh: 跳过缓存读取并用新结果覆盖（重新生成）
+            **params: 透传的请求参数，如temperature、max_tokens、tools
+        """
+        payload, headers, request_timeout = self._build_request(messages, model, api_key, timeout, False, params)
+        if not cache:
+            return await self._run(self._post(payload, headers, request_timeout))
+
+        loop = asyncio.get_running_loop()
+        key = llm_response_cache.make_key(model, messages, params.get("temperature"),
+                                          params.get("max_tokens"), cache_style)
+        if refresh:
+            llm_response_cache.record_bypass()
+        else:
+            cached = await loop.run_in_executor(None, llm_response_cache.get, key)
+            if cached is not None:
+                logger.info(f"💾 [LLM] 缓存命中: {model}")
+                return cached
+        result = await self._run(self._post(payload, headers, request_timeout))
+        await loop.run_in_executor(None, llm_response_cache.put, key, model, result)
+        return result
+
+    async def chat(self, messages: List[Dict[str, Any]], model: str, **kwargs) -> str:
+        """非流式调用，只返回回复文本"""
+        result = await self.chat_completion(messages, model, **kwargs)
+        return result["choices"][0]["message"]["content"]
+
+    async def stream_chunks(self, messages: List[Dict[str, Any]], model: str, *,
+                            api_key: Optional[str] = None, timeout: Optional[float] = None,
+                            **params) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式调用，逐个产出解析后的数据块；timeout为相邻数据块之间的读取超时。
+        调用方停止迭代（包括所在任务被取消）或超过截止时间时关闭上游连接
+        """
+        payload, headers, request_timeout = self._build_request(messages, model, api_key, timeout, True, params)
+        consumer_loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue(maxsize=LLM_STREAM_BUFFER_CHUNKS)
+
+        async def put(item):
+            # 缓冲区满时等待消费方取走数据块（背压）
+            try:
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(chunks.put(item), consumer_loop))
+            except RuntimeError:
+                pass  # 调用方的事件循环已关闭
+
+        future = asyncio.run_coroutine_threadsafe(
+            self._stream_into(payload, headers, request_timeout, put), self._ensure_loop()
+        )
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(chunks.get(), deadline_remaining())
+                except asyncio.TimeoutError:
+                    raise _deadline_exceeded() from None
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, LLMError):
+                    raise item
+                yield item
+        finally:
+            # 调用方提前结束迭代时关闭上游连接
+            future.cancel()
+
+    async def stream(self, messages: List[Dict[str, Any]], model: str, **kwargs) -> AsyncIterator[str]:
+        """流式调用，逐个产出回复文本片段"""
+        async for chunk in self.stream_chunks(messages, model, **kwargs):
+            content = _delta_content(chunk)
+            if content:
+                yield content
+
+    def chat_completion_sync(self, messages: List[Dict[str, Any]], model: str, **kwargs) -> Dict[str, Any]:
+        """chat_completion的同步版本"""
+        return self.run_sync(self.chat_completion(messages, model, **kwargs))
+
+    def chat_sync(self, messages: List[Dict[str, Any]], model: str, **kwargs) -> str:
+        """chat的同步版本"""
+        return self.run_sync(self.chat(messages, model, **kwargs))
+
+    def stream_sync(self, messages: List[Dict[str, Any]], model: str, *,
+                    api_key: Optional[str] = None, timeout: Optional[float] = None,
+                    **params) -> Iterator[str]:
+        """stream的同步版本，逐个产出回复文本片段"""
+        payload, headers, request_timeout = self._build_request(messages, model, api_key, timeout, True, params)
+        chunks: "queue.Queue[Any]" = queue.Queue()
+
+        async def put(item):
+            chunks.put(item)
+
+        future = asyncio.run_coroutine_threadsafe(
+            self._stream_into(payload, headers, request_timeout, put), self._ensure_loop()
+        )
+        try:
+            while True:
+                remaining = deadline_remaining()
+                try:
+                    item = chunks.get(timeout=max(remaining, 0) if remaining is not None else None)
+                except queue.Empty:
+                    raise _deadline_exceeded() from None
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, LLMError):
+                    raise item
+                content = _delta_content(item)
+                if content:
+                    yield content
+        finally:
+            future.cancel()
+
+    async def aclose(self):
+        """关闭连接池并停止事件循环"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+
+        async def _close():
+            if self._client is not None:
+                await self._client.aclose()
+                self._client = None
+
+        try:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(_close(), loop))
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            logger.info("🌐 [LLM] 客户端已关闭")
+
+
+def _delta_content(chunk: Dict[str, Any]) -> str:
+    choices = chunk.get("choices") or []
+    if not choices:
+        return ""
+    return (choices[0].get("delta") or {}).get("content") or ""
+
+
+# 全局LLM客户端实例
+llm_client = LLMClient()
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+LLM调用的进程级限流与熔断
+按模型分别维护每分钟请求数和每分钟token数两个令牌桶，调用前等待令牌；
+上游连续出现5xx、连接失败或超时时熔断，熔断期间直接失败，冷却后放行一个试探请求；
+同时在途的上游调用数由AIMD自适应并发上限控制，随上游延迟和错误率自动调整，
+等待名额的调用在课程、展板之间加权公平排队。
+限流器在LLM客户端的事件循环中使用，所有模块的调用共享同一份额度
+"""
+
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from config import (
+    LLM_RATE_LIMITS, LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY,
+    LLM_BREAKER_FAILURE_THRESHOLD, LLM_BREAKER_RESET_TIMEOUT,
+    LLM_CONCURRENCY_INITIAL, LLM_CONCURRENCY_MIN, LLM_CONCURRENCY_MAX,
+    LLM_CONCURRENCY_DECREASE, LLM_CONCURRENCY_LATENCY_TOLERANCE, LLM_CONCURRENCY_WINDOW
+)
+from fair_queue import FairQueue, current_flow
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """令牌桶：容量为每分钟额度，按速率连续补充"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """获取amount个令牌需要等待的秒数（超过容量的请求按容量计算）"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        """扣除令牌，允许为负（实际用量超出预估时）"""
+        self._refill()
+        self.tokens -= amount
+
+
+class CircuitBreaker:
+    """熔断器：closed → open（快速失败）→ half_open（放行一个试探请求）→ closed"""
+
+    def __init__(self, name: str, failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = LLM_BREAKER_RESET_TIMEOUT,
+                 on_state_change: Optional[Callable[[str, str], None]] = None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = on_state_change
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.trips = 0
+
+    def _set_state(self, state: str):
+        if state == self.state:
+            return
+        logger.warning(f"⚡ [LLM-BREAKER] {self.name}: {self.state} → {state}")
+        self.state = state
+        if self.on_state_change:
+            self.on_state_change(self.name, state)
+
+    def allow(self) -> bool:
+        """是否放行请求"""
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._set_state("half_open")
+        if self.state == "half_open":
+            if self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.probe_in_flight = False
+        self._set_state("closed")
+
+    def release_probe(self):
+        """请求被取消、没有结果时释放试探名额"""
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            if self.state != "open":
+                self.trips += 1
+            self._set_state("open")
+
+    def retry_after(self) -> float:
+        """熔断剩余时间（秒）"""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def get_state(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "trips": self.trips,
+            "retry_after": round(self.retry_after(), 1)
+        }
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    计算第attempt次重试前的等待时间
+
+    优先使用上游的Retry-After（秒数或HTTP日期），否则为带完全抖动的指数退避
+    """
+    if retry_after:
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            try:
+                seconds = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                seconds = None
+        if seconds is not None:
+            return min(max(seconds, 0.0), LLM_RETRY_MAX_DELAY) + random.uniform(0, LLM_RETRY_BASE_DELAY)
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class LLMRateLimiter:
+    """按模型的请求数/token数限流，以及按模型的熔断器"""
+
+    def __init__(self, limits: Dict[str, Dict[str, int]] = LLM_RATE_LIMITS):
+        self.limits = limits
+        self._buckets: Dict[str, Dict[str, TokenBucket]] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._latency: Dict[str, Deque[Tuple[float, float]]] = {}
+        self._listeners: List[Callable[[str, str], None]] = []
+        self._state_lock = threading.Lock()
+
+        self.requests = 0
+        self.throttled_waits = 0
+        self.wait_seconds = 0.0
+        self.upstream_429 = 0
+        self.upstream_5xx = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def add_listener(self, listener: Callable[[str, str], None]):
+        """注册熔断状态变化回调 listener(model, state)，在LLM客户端事件循环线程中调用"""
+        self._listeners.append(listener)
+
+    def _notify(self, model: str, state: str):
+        for listener in self._listeners:
+            try:
+                listener(model, state)
+            except Exception as e:
+                logger.error(f"❌ [LLM-BREAKER] 状态回调失败: {str(e)}")
+
+    def _model_state(self, model: str):
+        with self._state_lock:
+            if model not in self._buckets:
+                limit = self.limits.get(model, self.limits["default"])
+                self._buckets[model] = {"rpm": TokenBucket(limit["rpm"]), "tpm": TokenBucket(limit["tpm"])}
+                self._breakers[model] = CircuitBreaker(model, on_state_change=self._notify)
+            return self._buckets[model], self._breakers[model]
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        return self._model_state(model)[1]
+
+    async def acquire(self, model: str, tokens: int):
+        """等待直到模型的请求数和token数额度都足够，然后扣除（同一模型的等待者按先后顺序获取）"""
+        buckets, _ = self._model_state(model)
+        lock = self._locks.setdefault(model, asyncio.Lock())
+        async with lock:
+            waited = 0.0
+            while True:
+                wait = max(buckets["rpm"].wait_time(1), buckets["tpm"].wait_time(tokens))
+                if wait <= 0:
+                    break
+                waited += wait
+                await asyncio.sleep(wait)
+            buckets["rpm"].consume(1)
+            buckets["tpm"].consume(tokens)
+        self.requests += 1
+        if waited:
+            self.throttled_waits += 1
+            self.wait_seconds += waited
+            logger.info(f"⏳ [LLM-LIMIT] {model} 限流等待 {waited:.2f}秒")
+
+    def settle(self, model: str, estimated: int, actual: int):
+        """按实际token用量修正预扣的额度"""
+        if actual and actual != estimated:
+            self._model_state(model)[0]["tpm"].consume(actual - estimated)
+
+    def record_latency(self, model: str, seconds: float):
+        """记录一次成功的非流式调用耗时"""
+        with self._state_lock:
+            self._latency.setdefault(model, deque(maxlen=LLM_CONCURRENCY_WINDOW)).append((time.monotonic(), seconds))
+
+    def latency_percentile(self, model: str, pct: float, max_age: Optional[float] = None) -> Optional[float]:
+        """模型近期非流式调用耗时的百分位（秒），只统计max_age秒内的样本，没有样本时返回None"""
+        since = time.monotonic() - max_age if max_age else 0.0
+        with self._state_lock:
+            samples = [seconds for at, seconds in self._latency.get(model, ()) if at >= since]
+        return _percentile(samples, pct)
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取限流和熔断状态"""
+        with self._state_lock:
+            models = {
+                model: {
+                    "limits": self.limits.get(model, self.limits["default"]),
+                    "available_requests": round(buckets["rpm"].tokens, 1),
+                    "available_tokens": round(buckets["tpm"].tokens),
+                    "breaker": self._breakers[model].get_state(),
+                    "latency_p90": _percentile([seconds for _, seconds in self._latency.get(model, ())], 90)
+                }
+                for model, buckets in self._buckets.items()
+            }
+        degraded = [model for model, info in models.items() if info["breaker"]["state"] != "closed"]
+        return {
+            "status": "degraded" if degraded else "ok",
+            "degraded_models": degraded,
+            "requests": self.requests,
+            "throttled_waits": self.throttled_waits,
+            "wait_seconds": round(self.wait_seconds, 2),
+            "upstream_429": self.upstream_429,
+            "upstream_5xx": self.upstream_5xx,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "models": models
+        }
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD自适应并发上限
+
+    每次调用结束时根据结果调整上限：上游返回429/5xx、超时、连接失败，或延迟超过基线的tolerance倍时
+    视为拥塞，上限乘以decrease；其余成功调用在上限已被用满时使上限增加1/limit（约每轮增加1）。
+    在上一次减小之前发出的调用反映的是旧负载，它们的拥塞信号不再重复减小上限。
+
+    延迟按类型分别统计：非流式调用用每个输出token的耗时（消除输出长度的影响），
+    流式调用用首个数据块的等待时间；基线为该类型近期样本的第10百分位。
+
+    名额的获取和释放在LLM客户端的事件循环线程中进行，状态查询来自主事件循环，
+    二者都在_state_lock下访问等待队列和统计数据
+    """
+
+    # 输出token数少于该值的非流式调用不参与每token延迟统计（耗时主要是处理输入）
+    MIN_SAMPLE_TOKENS = 20
+
+    def __init__(self, initial: int = LLM_CONCURRENCY_INITIAL, min_limit: int = LLM_CONCURRENCY_MIN,
+                 max_limit: int = LLM_CONCURRENCY_MAX, decrease: float = LLM_CONCURRENCY_DECREASE,
+                 tolerance: float = LLM_CONCURRENCY_LATENCY_TOLERANCE, window: int = LLM_CONCURRENCY_WINDOW):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.in_flight = 0
+        self._waiters = FairQueue()
+        self._state_lock = threading.Lock()
+        self._last_decrease = 0.0
+        self._durations: Deque[float] = deque(maxlen=window)
+        self._samples: Dict[str, Deque[float]] = {
+            "per_token": deque(maxlen=window),
+            "first_token": deque(maxlen=window)
+        }
+
+        self.increases = 0
+        self.decreases = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    @property
+    def current_limit(self) -> int:
+        """当前允许的在途调用数"""
+        return int(self.limit)
+
+    async def acquire(self):
+        """
+        等待一个并发名额，返回时已占用名额
+
+        等待者按当前上下文所属的课程、展板在名额上公平排队（见fair_queue），
+        同一展板内按优先级，未设置所属展板的调用归入公共流
+        """
+        flow = current_flow()
+        future = asyncio.get_running_loop().create_future()
+        with self._state_lock:
+            self._waiters.push(future, *flow)
+            self._wake()
+            if future.done():
+                return
+            self.waits += 1
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._state_lock:
+                if future.done() and not future.cancelled():
+                    # 名额已经交给本调用，转交给下一个等待者
+                    self.in_flight -= 1
+                    self._wake()
+                else:
+                    self._waiters.discard(future, *flow)
+            raise
+        finally:
+            with self._state_lock:
+                self.wait_seconds += time.monotonic() - started
+
+    def _wake(self):
+        # 调用方持有self._state_lock
+        while self._waiters and self.in_flight < self.current_limit:
+            future, _ = self._waiters.pop()
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    def release(self, started: float, congested: bool = False,
+                kind: Optional[str] = None, latency: Optional[float] = None):
+        """
+        释放名额并调整上限
+
+        Args:
+            started: 调用开始时间（time.monotonic()）
+            congested: 上游返回429/5xx、超时或连接失败
+            kind: 延迟类型，"per_token"或"first_token"；为None时不参与延迟判断（如被取消的调用）
+            latency: 对应类型的延迟（秒）
+        """
+        with self._state_lock:
+            saturated = self.in_flight >= self.current_limit
+            self.in_flight -= 1
+            if kind is not None:
+                self._durations.append(time.monotonic() - started)
+                if latency is not None:
+                    samples = self._samples[kind]
+                    baseline = _percentile(list(samples), 10) if len(samples) >= 10 else None
+                    samples.append(latency)
+                    if baseline and latency > baseline * self.tolerance:
+                        congested = True
+
+            if congested:
+                if started >= self._last_decrease:
+                    self._set_limit(self.limit * self.decrease)
+                    self._last_decrease = time.monotonic()
+                    self.decreases += 1
+            elif kind is not None and saturated:
+                self._set_limit(self.limit + 1 / self.limit)
+                self.increases += 1
+            self._wake()
+
+    def _set_limit(self, limit: float):
+        previous = self.current_limit
+        self.limit = min(max(limit, self.min_limit), self.max_limit)
+        if self.current_limit != previous:
+            logger.info(f"🎚️ [LLM-CONCURRENCY] 并发上限 {previous} → {self.current_limit}（在途 {self.in_flight}）")
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取并发上限、在途调用数和延迟百分位（可在任意线程中调用，返回一致的快照）"""
+        def _round(value):
+            return round(value, 3) if value is not None else None
+
+        def _percentiles(values):
+            return {f"p{pct}": _round(_percentile(values, pct)) for pct in (50, 90, 99)}
+
+        with self._state_lock:
+            status = {
+                "limit": self.current_limit,
+                "limit_exact": round(self.limit, 2),
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "in_flight": self.in_flight,
+                "waiting": len(self._waiters),
+                "fairness": self._waiters.get_stats(),
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 2),
+                "increases": self.increases,
+                "decreases": self.decreases
+            }
+            durations = list(self._durations)
+            per_token = list(self._samples["per_token"])
+            first_token = list(self._samples["first_token"])
+        status.update(latency=_percentiles(durations), latency_per_token=_percentiles(per_token),
+                      first_token_latency=_percentiles(first_token))
+        return status
+
+
+# 全局LLM限流器
+llm_rate_limiter = LLMRateLimiter()
+
+# 全局LLM自适应并发上限
+llm_concurrency = AdaptiveConcurrencyLimiter()
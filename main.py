@@ -8,10 +8,25 @@ from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Optional, Dict, Any
 import fitz  # PyMuPDF
 from pptx import Presentation
-from controller import annotate_page, create_pdf_note, ask_question, improve_note
+from controller import annotate_page, create_pdf_note, ask_question, improve_note, get_page_texts
+from page_store import page_store
+from page_cache import page_text_cache
+from page_renderer import page_renderer
+from blob_store import blob_store
+from http_cache import CachedStaticFiles, cached_file_response
+from file_index import page_index, notify_path, start_watchers
+from ingest_manifest import ingest_manifest
+from upload_sessions import upload_session_manager
+from llm_client import llm_client
+from llm_cache import llm_response_cache
+from llm_limits import llm_rate_limiter, llm_concurrency
+from model_router import model_router
+from ingest_jobs import ingest_job_manager
 from config import (
-    PAGE_DIR, UPLOAD_DIR, UPLOAD_MAX_SIZE, 
-    ALLOWED_EXTENSIONS, LOG_LEVEL, LOG_FORMAT, QWEN_API_KEY, QWEN_VL_API_KEY
+    PAGE_DIR, UPLOAD_DIR, UPLOAD_MAX_SIZE, VIDEO_UPLOAD_MAX_SIZE,
+    IMAGE_ALLOWED_EXTENSIONS, VIDEO_ALLOWED_EXTENSIONS,
+    ALLOWED_EXTENSIONS, LOG_LEVEL, LOG_FORMAT, QWEN_API_KEY, QWEN_VL_API_KEY,
+    TASK_SHUTDOWN_DRAIN_TIMEOUT
 )
 # 导入新模块
 from board_logger import board_logger
@@ -21,6 +36,9 @@ from board_manager import board_manager  # 导入展板管理器
 from intelligent_expert import IntelligentExpert
 # 导入简化的专家系统
 from simple_expert import simple_expert_manager
+from task_scheduler import task_worker_pool
+from task_registry import task_registry
+from task_journal import task_journal
 # 导入任务事件管理器
 from task_event_manager import task_event_manager
 from fastapi.staticfiles import StaticFiles
@@ -34,7 +52,6 @@ import time
 import datetime
 import httpx
 from fastapi import WebSocketDisconnect
-from openai import OpenAI
 import requests
 import random
 from datetime import datetime, timezone
@@ -70,8 +87,46 @@ app.add_middleware(
 # 集成LLM日志API路由
 app.include_router(llm_logger_router)
 
+@app.on_event("startup")
+async def start_file_index_watchers():
+    """启动上传目录和页面目录的文件名索引监视"""
+    start_watchers()
+
+@app.on_event("startup")
+async def watch_llm_upstream():
+    """LLM熔断状态变化时通过任务事件通知所有展板"""
+    loop = asyncio.get_running_loop()
+    
+    def on_breaker_change(model: str, state: str):
+        # 回调在LLM客户端线程中执行，事件推送需回到主事件循环
+        if state != "half_open":
+            asyncio.run_coroutine_threadsafe(task_event_manager.notify_upstream_status(model, state), loop)
+    
+    llm_rate_limiter.add_listener(on_breaker_change)
+
+@app.on_event("startup")
+async def recover_unfinished_tasks():
+    """重新排队上次运行（重启或崩溃前）未完成的任务"""
+    simple_expert_manager.recover_tasks()
+
+@app.on_event("shutdown")
+async def drain_tasks():
+    """停止启动新任务，在期限内等待执行中的任务结束；未结束的任务已记录在任务日志中，下次启动时恢复"""
+    remaining = await task_worker_pool.drain(TASK_SHUTDOWN_DRAIN_TIMEOUT)
+    if remaining:
+        logger.warning(f"⏹️ 关闭时仍有 {remaining} 个任务未结束，将在下次启动时恢复")
+    pending = task_worker_pool.pending()
+    if pending:
+        logger.info(f"⏹️ 关闭时有 {pending} 个排队任务，将在下次启动时恢复")
+    task_journal.close()
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    """关闭共享的LLM连接池"""
+    await llm_client.aclose()
+
 # 挂载静态文件目录
-app.mount("/materials", StaticFiles(directory="uploads"), name="materials")
+app.mount("/materials", CachedStaticFiles(directory="uploads"), name="materials")
 
 # 确保目录存在
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -81,7 +136,8 @@ os.makedirs(PAGE_DIR, exist_ok=True)
 lightweight_executor = ThreadPoolExecutor(max_workers=5, thread_name_prefix="lightweight_ops")
 
 # 🔧 添加LLM专用线程池，隔离LLM操作避免阻塞其他功能
-llm_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="llm_ops")
+# 线程只是等待共享LLM客户端返回，实际的上游并发由自适应并发上限控制，线程数按其最大值配置
+llm_executor = ThreadPoolExecutor(max_workers=llm_concurrency.max_limit, thread_name_prefix="llm_ops")
 
 async def run_llm_in_background(llm_func, *args, **kwargs):
     """在后台线程池中运行LLM操作，避免阻塞轻量级操作"""
@@ -121,12 +177,18 @@ def validate_file(file: UploadFile) -> None:
             detail=f"不支持的文件类型，仅支持: {', '.join(ALLOWED_EXTENSIONS)}"
         )
 
-def save_upload_file(upload_file: UploadFile, destination: str):
-    """保存上传文件"""
+async def save_upload_file(upload_file: UploadFile, destination: str, max_size: Optional[int] = None) -> dict:
+    """保存上传文件到内容寻址存储并在目标路径建立链接，边写入边校验大小，返回别名记录"""
     try:
-        with open(destination, 'wb') as buffer:
-            shutil.copyfileobj(upload_file.file, buffer)
-        logger.info(f"文件已保存: {destination}")
+        # 复制并计算SHA-256的磁盘I/O放到线程池中执行，大文件不阻塞事件循环
+        record = await asyncio.get_running_loop().run_in_executor(
+            None, blob_store.store, upload_file.file, destination, max_size
+        )
+        logger.info(f"文件已保存: {destination} (sha256: {record['sha256'][:12]}, 重复内容: {record['duplicate']})")
+        return record
+    except ValueError as e:
+        logger.warning(f"上传文件过大: {destination}, {str(e)}")
+        raise HTTPException(status_code=413, detail=f"文件大小超过限制: {max_size // (1024 * 1024)}MB")
     except Exception as e:
         logger.error(f"保存文件失败: {str(e)}")
         raise HTTPException(status_code=500, detail="文件保存失败")
@@ -141,74 +203,103 @@ async def global_exception_handler(request: Request, exc: Exception):
     )
 
 @app.post('/materials/upload')
-async def upload_material(file: UploadFile = File(...)):
+async def upload_material(file: UploadFile = File(...), board_id: Optional[str] = Form(None)):
     """上传课件文件"""
     logger.info(f"收到文件上传请求: {file.filename}")
     validate_file(file)
     
     save_path = os.path.join(UPLOAD_DIR, file.filename)
-    save_upload_file(file, save_path)
+    record = await save_upload_file(file, save_path, UPLOAD_MAX_SIZE)
     
     try:
-        ext = file.filename.split('.')[-1].lower()
-        if ext == 'pdf':
-            pages = split_pdf(save_path, file.filename)
-        else:
-            pages = split_pptx(save_path, file.filename)
-        logger.info(f"文件处理完成: {file.filename}, 共{len(pages)}页")
+        result = await process_uploaded_material(file.filename, save_path, record, board_id)
         
         # 同步到管家LLM
         sync_app_state_to_butler()
         
-        return {"filename": file.filename, "pages": len(pages)}
+        return result
     except Exception as e:
         logger.error(f"文件处理失败: {str(e)}")
         raise HTTPException(status_code=500, detail="文件处理失败")
 
+async def process_uploaded_material(filename: str, save_path: str, record: dict, board_id: Optional[str] = None) -> dict:
+    """
+    为已保存的课件创建导入任务并立即返回，拆分在后台进行
+    
+    相同内容已拆分过时由导入任务直接复用页面容器。返回的pages为预估页数，
+    导入完成前 /materials/{filename}/pages 返回202
+    """
+    job = await ingest_job_manager.start(filename, save_path, record, board_id)
+    logger.info(f"文件已提交导入: {filename}, 任务: {job['job_id']}, 共{job['total_pages']}页")
+    return {
+        "filename": filename,
+        "pages": job["total_pages"],
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "sha256": record["sha256"],
+        "deduplicated": record["duplicate"]
+    }
+
+@app.get('/api/ingest/{job_id}')
+async def get_ingest_job(job_id: str):
+    """查询课件导入任务的状态和进度"""
+    job = ingest_job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="导入任务不存在")
+    return job
+
 # PDF按页拆分
 def split_pdf(pdf_path, base_name):
     # 使用controller.py中的split_pdf函数
     from controller import split_pdf as controller_split_pdf
     return controller_split_pdf(pdf_path, base_name)
 
+async def split_pdf_parallel(pdf_path, base_name, board_id=None):
+    # 使用controller.py中的并行拆分，前几页就绪即返回
+    from controller import split_pdf_parallel as controller_split_pdf_parallel
+    return await controller_split_pdf_parallel(pdf_path, base_name, board_id=board_id)
+
 # PPTX按页拆分
 
 def split_pptx(pptx_path, base_name):
-    prs = Presentation(pptx_path)
-    page_files = []
-    for i, slide in enumerate(prs.slides):
-        texts = []
-        for shape in slide.shapes:
-            if hasattr(shape, "text"):
-                texts.append(shape.text)
-        text = '\n'.join(texts)
-        page_file = os.path.join(PAGE_DIR, f"{base_name}_page_{i+1}.txt")
-        with open(page_file, 'w', encoding='utf-8') as f:
-            f.write(text)
-        page_files.append(page_file)
-    return page_files
+    # 使用controller.py中的split_pptx函数
+    from controller import split_pptx as controller_split_pptx
+    return controller_split_pptx(pptx_path, base_name)
+
+@app.get('/api/materials/{filename}/manifest')
+async def get_material_manifest(filename: str):
+    """获取文档导入清单：页数、每页字符数、文字页/扫描页分类、内容哈希、目录和文件哈希"""
+    try:
+        manifest = await asyncio.get_event_loop().run_in_executor(
+            lightweight_executor, ingest_manifest.get, filename
+        )
+    except Exception as e:
+        logger.error(f"读取导入清单失败: {str(e)}")
+        raise HTTPException(status_code=500, detail="读取导入清单失败")
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="未找到分页内容")
+    return manifest
 
 # 获取课件分页内容列表
 @app.get('/materials/{filename}/pages')
 async def get_material_pages(filename: str) -> List[str]:
     """获取课件分页内容"""
     logger.info(f"获取文件页面: {filename}")
-    prefix = os.path.join(PAGE_DIR, f"{filename}_page_")
-    pages = []
-    i = 1
-    while True:
-        page_file = f"{prefix}{i}.txt"
-        if not os.path.exists(page_file):
-            break
-        try:
-            with open(page_file, 'r', encoding='utf-8') as f:
-                pages.append(f.read())
-            i += 1
-        except Exception as e:
-            logger.error(f"读取页面失败: {str(e)}")
-            raise HTTPException(status_code=500, detail="读取页面失败")
+    job = ingest_job_manager.active_job(filename)
+    if job is not None:
+        # 导入尚未完成，客户端可根据job_id查询进度或订阅任务事件
+        return JSONResponse(status_code=202, content=job)
+    try:
+        pages = get_page_texts(filename)
+    except Exception as e:
+        logger.error(f"读取页面失败: {str(e)}")
+        raise HTTPException(status_code=500, detail="读取页面失败")
     
     if not pages:
+        failed = ingest_job_manager.failed_job(filename)
+        if failed is not None:
+            # 导入失败时不保留不完整的分页内容，返回失败原因
+            raise HTTPException(status_code=500, detail=f"课件导入失败: {failed['error']}")
         raise HTTPException(status_code=404, detail='未找到分页内容')
     return pages
 
@@ -220,13 +311,15 @@ async def annotate_material_page(
     session_id: Optional[str] = Query(None),
     current_annotation: Optional[str] = None,
     improve_request: Optional[str] = None,
-    board_id: Optional[str] = Query(None)
+    board_id: Optional[str] = Query(None),
+    regenerate: bool = False
 ):
-    """生成页面注释"""
+    """生成页面注释（regenerate=true时跳过LLM响应缓存）"""
     logger.info(f"生成注释: {filename} 第{page_number}页, 会话ID: {session_id}, 展板ID: {board_id}")
     logger.info(f"注释生成参数: 强制视觉={force_vision}, 当前注释长度={len(current_annotation) if current_annotation else 0}, 改进请求={improve_request}")
     try:
-        result = annotate_page(filename, page_number, force_vision, session_id, current_annotation, improve_request, board_id)
+        result = annotate_page(filename, page_number, force_vision, session_id, current_annotation, improve_request, board_id,
+                               regenerate=regenerate)
         return result
     except Exception as e:
         logger.error(f"生成注释失败: {str(e)}")
@@ -238,7 +331,8 @@ async def post_annotate_material_page(
     page_number: int, 
     force_vision: bool = False,
     session_id: Optional[str] = Query(None),
-    request_data: Optional[dict] = Body(None)
+    request_data: Optional[dict] = Body(None),
+    regenerate: bool = False
 ):
     """POST方式生成页面注释（直接路径）"""
     logger.info(f"直接路径POST生成注释: {filename} 第{page_number}页, 会话ID: {session_id}")
@@ -254,7 +348,8 @@ async def post_annotate_material_page(
             session_id, 
             request_data.get('current_annotation') if request_data else None,
             request_data.get('improve_request') if request_data else None,
-            board_id
+            board_id,
+            regenerate=regenerate
         )
         return result
     except Exception as e:
@@ -358,13 +453,25 @@ async def post_force_vision_annotation(
         raise HTTPException(status_code=500, detail=f"生成注释失败: {str(e)}")
 
 @app.get('/materials/{filename}/pages/{page_number}/image')
-async def get_material_page_image(filename: str, page_number: int):
-    """获取页面图片"""
-    logger.info(f"获取页面图片: {filename} 第{page_number}页")
+async def get_material_page_image(
+    filename: str,
+    page_number: int,
+    size: str = Query("vision"),
+    format: str = Query("png")
+):
+    """获取页面图片，size为分辨率档位(thumbnail/viewer/vision)，format为png/jpeg/webp"""
+    logger.info(f"获取页面图片: {filename} 第{page_number}页, 尺寸: {size}, 格式: {format}")
+    if size not in config.PAGE_RENDER_TIERS:
+        raise HTTPException(status_code=400, detail=f"不支持的图像尺寸: {size}")
     try:
         from controller import get_page_image
-        img_path = get_page_image(filename, page_number)
-        return FileResponse(img_path, media_type="image/png")
+        # 渲染为CPU密集操作，放到轻量级线程池中执行
+        img_path = await asyncio.get_event_loop().run_in_executor(
+            lightweight_executor, get_page_image, filename, page_number, size, format
+        )
+        # 预渲染相邻页面
+        page_renderer.prefetch(filename, page_number, size, format)
+        return FileResponse(img_path, media_type=page_renderer.media_type(img_path))
     except Exception as e:
         logger.error(f"获取页面图片失败: {str(e)}")
         raise HTTPException(status_code=500, detail="获取页面图片失败")
@@ -372,26 +479,18 @@ async def get_material_page_image(filename: str, page_number: int):
 @app.post('/materials/{filename}/note')
 async def generate_material_note(
     filename: str,
-    session_id: Optional[str] = Query(None)
+    session_id: Optional[str] = Query(None),
+    regenerate: bool = False
 ):
-    """生成整本PDF的AI笔记"""
+    """生成整本PDF的AI笔记（regenerate=true时跳过LLM响应缓存）"""
     try:
         # 读取所有页面内容
-        prefix = os.path.join(PAGE_DIR, f"{filename}_page_")
-        pages = []
-        i = 1
-        while True:
-            page_file = f"{prefix}{i}.txt"
-            if not os.path.exists(page_file):
-                break
-            with open(page_file, 'r', encoding='utf-8') as f:
-                pages.append(f.read())
-            i += 1
+        pages = get_page_texts(filename)
         if not pages:
             raise HTTPException(status_code=404, detail='未找到分页内容')
             
         # 使用修改后的controller函数
-        result = create_pdf_note(filename, pages, session_id)
+        result = create_pdf_note(filename, pages, session_id, regenerate=regenerate)
         return result
     except Exception as e:
         logger.error(f"生成整本笔记失败: {str(e)}")
@@ -406,16 +505,7 @@ async def ask_material_question(
     """针对整本PDF的AI问答"""
     try:
         # 读取所有页面内容
-        prefix = os.path.join(PAGE_DIR, f"{filename}_page_")
-        pages = []
-        i = 1
-        while True:
-            page_file = f"{prefix}{i}.txt"
-            if not os.path.exists(page_file):
-                break
-            with open(page_file, 'r', encoding='utf-8') as f:
-                pages.append(f.read())
-            i += 1
+        pages = get_page_texts(filename)
         if not pages:
             raise HTTPException(status_code=404, detail='未找到分页内容')
         
@@ -441,16 +531,7 @@ async def ask_pdf_question_stream(websocket: WebSocket, filename: str):
             return
         
         # 读取所有页面内容
-        prefix = os.path.join(PAGE_DIR, f"{filename}_page_")
-        pages = []
-        i = 1
-        while True:
-            page_file = f"{prefix}{i}.txt"
-            if not os.path.exists(page_file):
-                break
-            with open(page_file, 'r', encoding='utf-8') as f:
-                pages.append(f.read())
-            i += 1
+        pages = get_page_texts(filename)
             
         if not pages:
             await websocket.send_json({"error": "未找到PDF内容"})
@@ -463,15 +544,23 @@ async def ask_pdf_question_stream(websocket: WebSocket, filename: str):
         async def send_chunk(chunk):
             await websocket.send_json({"chunk": chunk})
         
-        # 创建一个同步回调
-        def callback(chunk):
-            asyncio.run_coroutine_threadsafe(send_chunk(chunk), asyncio.get_event_loop())
+        async def wait_for_disconnect():
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
         
         # 导入流式问答
         from llm_agents import ask_pdf_question_stream
         
-        # 启动流式生成，传递会话ID和回调函数
-        full_answer = ask_pdf_question_stream(pages, question, callback, session_id, filename)
+        # 流式生成与连接监听并行：客户端断开时取消生成，上游请求随之中止并释放LLM并发名额
+        generation = asyncio.create_task(ask_pdf_question_stream(pages, question, send_chunk, session_id, filename))
+        disconnect = asyncio.create_task(wait_for_disconnect())
+        await asyncio.wait({generation, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        if not generation.done():
+            generation.cancel()
+            logger.info(f"流式问答客户端已断开，停止生成: {filename}")
+            return
+        disconnect.cancel()
+        full_answer = generation.result()
         
         # 发送完成信号
         await websocket.send_json({"done": True, "full_answer": full_answer})
@@ -513,16 +602,7 @@ async def improve_material_note(
             raise HTTPException(status_code=400, detail="内容不能为空")
         
         # 读取所有页面内容作为参考资料
-        prefix = os.path.join(PAGE_DIR, f"{filename}_page_")
-        pages = []
-        i = 1
-        while True:
-            page_file = f"{prefix}{i}.txt"
-            if not os.path.exists(page_file):
-                break
-            with open(page_file, 'r', encoding='utf-8') as f:
-                pages.append(f.read())
-            i += 1
+        pages = get_page_texts(filename)
             
         if not pages:
             raise HTTPException(status_code=404, detail='未找到PDF内容')
@@ -544,6 +624,37 @@ async def check_api_config():
         "qwen_vl_api_configured": bool(QWEN_VL_API_KEY)
     }
 
+@app.get('/api/cache/page-text/stats')
+async def get_page_text_cache_stats():
+    """获取页面文本缓存的命中/未命中统计"""
+    return {"status": "success", "stats": page_text_cache.get_stats()}
+
+@app.get('/api/cache/llm/stats')
+async def get_llm_cache_stats():
+    """获取LLM响应缓存的命中率、节省字节数和token数"""
+    stats = await asyncio.get_event_loop().run_in_executor(lightweight_executor, llm_response_cache.get_stats)
+    return {"status": "success", "stats": stats}
+
+@app.get('/api/llm/status')
+async def get_llm_status():
+    """获取LLM限流、重试、熔断和自适应并发状态"""
+    return {"status": "success", "llm": llm_rate_limiter.get_status(), "concurrency": llm_concurrency.get_status()}
+
+@app.get('/api/llm/routes')
+async def get_llm_routes(recent: int = 20):
+    """获取当前生效的模型路由表、各任务使用的模型计数和最近的路由决策"""
+    return {"status": "success", "router": model_router.get_status(recent)}
+
+@app.get('/api/cache/page-images/stats')
+async def get_page_image_cache_stats():
+    """获取页面图像渲染缓存统计"""
+    return {"status": "success", "stats": page_renderer.get_stats()}
+
+@app.get('/api/storage/blobs/stats')
+async def get_blob_store_stats():
+    """获取内容寻址存储统计（别名数、对象数、去重节省的字节数）"""
+    return {"status": "success", "stats": blob_store.get_stats()}
+
 @app.get('/materials/check/{filename}')
 async def check_material_file(filename: str):
     """检查指定文件是否存在，返回真实文件路径"""
@@ -557,7 +668,7 @@ async def check_material_file(filename: str):
         raise HTTPException(status_code=500, detail="检查文件失败")
 
 @app.get('/materials/view/{filename}')
-async def view_material_file(filename: str):
+async def view_material_file(filename: str, request: Request):
     """获取文件内容"""
     logger.info(f"请求查看文件: {filename}")
     try:
@@ -568,7 +679,7 @@ async def view_material_file(filename: str):
             raise HTTPException(status_code=404, detail="文件不存在")
         
         file_path = os.path.join(UPLOAD_DIR, file_check["path"])
-        return FileResponse(file_path, filename=file_check["path"])
+        return cached_file_response(request, file_path, filename=file_check["path"])
     except Exception as e:
         pass
     except HTTPException:
@@ -673,10 +784,20 @@ class AppState:
     def get_course_folders(self) -> List[Dict[str, Any]]:
         # 获取所有课程文件夹
         return self.course_folders
+    
+    def get_board_course(self, board_id: str) -> Optional[str]:
+        # 获取展板所属的课程ID，查不到时返回None
+        for board in self.boards:
+            if board.get('id') == board_id:
+                return board.get('course_folder')
+        return None
 
 # 初始化应用状态
 app_state = AppState()
 
+# 全局任务池按课程、展板两级公平排队
+task_worker_pool.set_course_resolver(app_state.get_board_course)
+
 # 新增API端点: 获取应用状态
 @app.get('/api/app-state')
 async def get_app_state():
@@ -1037,31 +1158,25 @@ async def cleanup_duplicate_pdf_files():
 
 # 添加新的API路由处理PDF上传
 @app.post('/api/materials/upload')
-async def api_upload_material(file: UploadFile = File(...)):
+async def api_upload_material(file: UploadFile = File(...), board_id: Optional[str] = Form(None)):
     """API路由: 上传课件文件"""
     logger.info(f"收到API文件上传请求: {file.filename}")
     validate_file(file)
     
     save_path = os.path.join(UPLOAD_DIR, file.filename)
-    save_upload_file(file, save_path)
+    record = await save_upload_file(file, save_path, UPLOAD_MAX_SIZE)
     
     try:
-        ext = file.filename.split('.')[-1].lower()
-        if ext == 'pdf':
-            pages = split_pdf(save_path, file.filename)
-        else:
-            pages = split_pptx(save_path, file.filename)
-        logger.info(f"文件处理完成: {file.filename}, 共{len(pages)}页")
-        return {"filename": file.filename, "pages": len(pages)}
+        return await process_uploaded_material(file.filename, save_path, record, board_id)
     except Exception as e:
         logger.error(f"文件处理失败: {str(e)}")
         raise HTTPException(status_code=500, detail="文件处理失败")
 
 # 添加API转发路由 - 用于统一前端路径
 @app.get('/api/materials/view/{filename}')
-async def api_view_material_file(filename: str):
+async def api_view_material_file(filename: str, request: Request):
     """API路由: 获取文件内容"""
-    return await view_material_file(filename)
+    return await view_material_file(filename, request)
 
 @app.get('/api/materials/{filename}/pages')
 async def api_get_material_pages(filename: str) -> List[str]:
@@ -1074,12 +1189,14 @@ async def api_annotate_material_page(
     page_number: int, 
     force_vision: bool = False,
     session_id: Optional[str] = Query(None),
-    board_id: Optional[str] = Query(None)
+    board_id: Optional[str] = Query(None),
+    regenerate: bool = False
 ):
     """API方式获取页面注释"""
     logger.info(f"API方式生成注释: {filename} 第{page_number}页, 会话ID: {session_id}, 展板ID: {board_id}")
     try:
-        result = annotate_page(filename, page_number, force_vision, session_id, None, None, board_id)
+        result = annotate_page(filename, page_number, force_vision, session_id, None, None, board_id,
+                               regenerate=regenerate)
         return result
     except Exception as e:
         logger.error(f"生成注释失败: {str(e)}")
@@ -1091,7 +1208,8 @@ async def api_post_annotate_material_page(
     page_number: int, 
     force_vision: bool = False,
     session_id: Optional[str] = Query(None),
-    request_data: Optional[dict] = Body(None)
+    request_data: Optional[dict] = Body(None),
+    regenerate: bool = False
 ):
     """API POST方式生成页面注释"""
     logger.info(f"API POST生成注释: {filename} 第{page_number}页")
@@ -1106,7 +1224,8 @@ async def api_post_annotate_material_page(
             session_id, 
             request_data.get('current_annotation') if request_data else None,
             request_data.get('improve_request') if request_data else None,
-            board_id
+            board_id,
+            regenerate=regenerate
         )
         return result
     except Exception as e:
@@ -1128,9 +1247,14 @@ async def api_force_vision_annotation_post(
     return await post_force_vision_annotation(filename, page_number, session_id, request_data)
 
 @app.get('/api/materials/{filename}/pages/{page_number}/image')
-async def api_get_material_page_image(filename: str, page_number: int):
+async def api_get_material_page_image(
+    filename: str,
+    page_number: int,
+    size: str = Query("vision"),
+    format: str = Query("png")
+):
     """API路由: 获取页面图像"""
-    return await get_material_page_image(filename, page_number)
+    return await get_material_page_image(filename, page_number, size, format)
 
 @app.post('/api/materials/{filename}/note')
 async def api_generate_material_note(
@@ -1164,6 +1288,151 @@ async def api_check_material_file(filename: str):
     """API路由: 检查指定文件是否存在"""
     return await check_material_file(filename)
 
+# 分块可续传上传API
+UPLOAD_KIND_LIMITS = {
+    "material": UPLOAD_MAX_SIZE,
+    "image": UPLOAD_MAX_SIZE,
+    "video": VIDEO_UPLOAD_MAX_SIZE
+}
+
+def is_plain_filename(filename: str) -> bool:
+    """文件名不含目录、盘符或上级目录（课件按原文件名保存在UPLOAD_DIR中，不能写到目录之外）"""
+    return bool(filename) and not any(c in filename for c in '/\\:') and filename not in ('.', '..')
+
+@app.post('/api/uploads')
+async def create_upload_session(request_data: dict = Body(...)):
+    """
+    创建分块上传会话
+    
+    请求体: {"filename": str, "size": int, "kind": "material"|"image"|"video",
+             "board_id": 可选, "window_id": 可选}
+    """
+    filename = request_data.get("filename") or ""
+    kind = request_data.get("kind", "material")
+    if not filename:
+        raise HTTPException(status_code=400, detail="文件名不能为空")
+    if not is_plain_filename(filename):
+        raise HTTPException(status_code=400, detail="文件名不能包含路径")
+    if kind not in UPLOAD_KIND_LIMITS:
+        raise HTTPException(status_code=400, detail=f"不支持的上传类型: {kind}")
+    
+    file_ext = os.path.splitext(filename.lower())[1]
+    allowed = {
+        "material": {f".{ext}" for ext in ALLOWED_EXTENSIONS},
+        "image": IMAGE_ALLOWED_EXTENSIONS,
+        "video": VIDEO_ALLOWED_EXTENSIONS
+    }[kind]
+    if file_ext not in allowed:
+        raise HTTPException(status_code=400, detail=f"不支持的文件类型，仅支持: {', '.join(sorted(allowed))}")
+    
+    try:
+        size = int(request_data.get("size", 0))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="文件大小无效")
+    
+    session = upload_session_manager.create(
+        filename, size, kind, UPLOAD_KIND_LIMITS[kind],
+        metadata={
+            "board_id": request_data.get("board_id"),
+            "window_id": request_data.get("window_id")
+        }
+    )
+    return {
+        "upload_id": session["upload_id"],
+        "offset": session["offset"],
+        "size": session["size"],
+        "chunk_size": session["chunk_size"]
+    }
+
+@app.get('/api/uploads/{upload_id}')
+async def get_upload_session(upload_id: str):
+    """查询上传会话已接收的字节数，断线后客户端从该偏移继续上传"""
+    session = upload_session_manager.get(upload_id)
+    return {
+        "upload_id": upload_id,
+        "filename": session["filename"],
+        "offset": session["offset"],
+        "size": session["size"]
+    }
+
+@app.put('/api/uploads/{upload_id}')
+async def put_upload_chunk(upload_id: str, request: Request, offset: int = Query(...)):
+    """在offset处写入一个数据块（请求体为原始字节），返回新的偏移量"""
+    session = await upload_session_manager.write_chunk(upload_id, offset, request.stream())
+    return {
+        "upload_id": upload_id,
+        "offset": session["offset"],
+        "size": session["size"],
+        "complete": session["offset"] == session["size"]
+    }
+
+@app.post('/api/uploads/{upload_id}/complete')
+async def complete_upload_session(upload_id: str):
+    """提交上传会话：将已接收的文件存入内容寻址存储，课件同时进行拆分"""
+    session = upload_session_manager.complete(upload_id)
+    filename = session["filename"]
+    kind = session["kind"]
+    metadata = session.get("metadata", {})
+    
+    if kind == "material":
+        if not is_plain_filename(filename):
+            raise HTTPException(status_code=400, detail="文件名不能包含路径")
+        save_name = filename
+        save_path = os.path.join(UPLOAD_DIR, save_name)
+    else:
+        save_name = make_media_filename(filename, metadata.get("window_id"))
+        save_path = os.path.join(UPLOAD_DIR, f"{kind}s", save_name)
+    
+    # 分块文件以硬链接方式纳入存储，不再复制一遍数据；计算SHA-256需读取整个文件，放到线程池中执行
+    try:
+        record = await asyncio.get_running_loop().run_in_executor(
+            None, blob_store.store_file, upload_session_manager.part_path(upload_id), save_path
+        )
+    except Exception as e:
+        logger.error(f"保存文件失败: {str(e)}")
+        raise HTTPException(status_code=500, detail="文件保存失败")
+    upload_session_manager.discard(upload_id)
+    logger.info(f"📤 [UPLOAD] 分块上传完成: {upload_id} -> {save_path}")
+    
+    if kind != "material":
+        return {
+            "success": True,
+            "filename": save_name,
+            "original_filename": filename,
+            "url": f"/api/{kind}s/view/{save_name}",
+            "path": save_path,
+            "size": record["size"],
+            "window_id": metadata.get("window_id")
+        }
+    
+    try:
+        return await process_uploaded_material(save_name, save_path, record, metadata.get("board_id"))
+    except Exception as e:
+        logger.error(f"文件处理失败: {str(e)}")
+        raise HTTPException(status_code=500, detail="文件处理失败")
+
+@app.delete('/api/uploads/{upload_id}')
+async def abort_upload_session(upload_id: str):
+    """放弃上传会话并删除已接收的数据"""
+    upload_session_manager.get(upload_id)
+    upload_session_manager.discard(upload_id)
+    return {"status": "success", "upload_id": upload_id}
+
+def make_media_filename(filename: str, window_id: Optional[str] = None) -> str:
+    """生成图片/视频的唯一保存文件名（添加时间戳避免冲突）"""
+    timestamp = int(time.time())
+    name, ext = os.path.splitext(filename)
+    
+    # 🔧 修复：正确处理文件名中的非ASCII字符
+    # 将非ASCII字符替换为安全字符
+    import re
+    safe_name = re.sub(r'[^\w\-_\.]', '_', name)
+    
+    # 如果提供了窗口ID，将其包含在文件名中
+    if window_id:
+        return f"{safe_name}_{window_id}_{timestamp}{ext}"
+    return f"{safe_name}_{timestamp}{ext}"
+
 @app.post('/api/images/upload')
 async def upload_image(
     file: UploadFile = File(...),
@@ -1173,10 +1442,9 @@ async def upload_image(
     logger.info(f"收到图片上传请求: {file.filename}, 窗口ID: {window_id}")
     
     # 验证是否为图片文件
-    allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
     file_ext = os.path.splitext(file.filename.lower())[1]
     
-    if file_ext not in allowed_extensions:
+    if file_ext not in IMAGE_ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=400, detail="只支持图片文件（jpg, jpeg, png, gif, bmp, webp）")
     
     # 创建images目录（如果不存在）
@@ -1184,26 +1452,12 @@ async def upload_image(
     if not os.path.exists(images_dir):
         os.makedirs(images_dir, exist_ok=True)
     
-    # 生成唯一文件名（添加时间戳避免冲突）
-    timestamp = int(time.time())
-    name, ext = os.path.splitext(file.filename)
-    
-    # 🔧 修复：正确处理文件名中的非ASCII字符
-    # 将非ASCII字符替换为安全字符
-    import re
-    safe_name = re.sub(r'[^\w\-_\.]', '_', name)
-    
-    # 如果提供了窗口ID，将其包含在文件名中（类似视频的命名方式）
-    if window_id:
-        unique_filename = f"{safe_name}_{window_id}_{timestamp}{ext}"
-    else:
-        unique_filename = f"{safe_name}_{timestamp}{ext}"
-    
+    unique_filename = make_media_filename(file.filename, window_id)
     save_path = os.path.join(images_dir, unique_filename)
     
     try:
         # 保存图片文件
-        save_upload_file(file, save_path)
+        await save_upload_file(file, save_path, UPLOAD_MAX_SIZE)
         
         # 构建访问URL
         image_url = f"/api/images/view/{unique_filename}"
@@ -1217,12 +1471,14 @@ async def upload_image(
             "path": save_path,
             "window_id": window_id
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"图片保存失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"图片保存失败: {str(e)}")
 
 @app.get('/api/images/view/{filename}')
-async def view_image(filename: str):
+async def view_image(filename: str, request: Request):
     """查看图片文件"""
     import urllib.parse
     
@@ -1266,11 +1522,7 @@ async def view_image(filename: str):
     
     media_type = media_type_map.get(ext, 'image/jpeg')
     
-    return FileResponse(
-        file_path,
-        media_type=media_type,
-        filename=os.path.basename(file_path)
-    )
+    return cached_file_response(request, file_path, media_type, os.path.basename(file_path))
 
 # 视频相关API
 @app.post('/api/videos/upload')
@@ -1282,49 +1534,23 @@ async def upload_video(
     logger.info(f"收到视频上传请求: {file.filename}, window_id: {window_id}")
     
     # 验证是否为视频文件
-    allowed_extensions = {'.mp4', '.webm', '.ogg', '.avi', '.mov', '.wmv', '.flv', '.mkv', '.m4v'}
     file_ext = os.path.splitext(file.filename.lower())[1]
     
-    if file_ext not in allowed_extensions:
+    if file_ext not in VIDEO_ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=400, detail="只支持视频文件（mp4, webm, ogg, avi, mov, wmv, flv, mkv, m4v）")
     
-    # 验证文件大小（100MB）
-    file_size = 0
-    # 读取文件内容获取大小
-    content = await file.read()
-    file_size = len(content)
-    # 重置文件指针到开头
-    await file.seek(0)
-    
-    max_size = 100 * 1024 * 1024  # 100MB
-    if file_size > max_size:
-        raise HTTPException(status_code=400, detail="视频文件大小不能超过100MB")
-    
     # 创建videos目录（如果不存在）
     videos_dir = os.path.join(UPLOAD_DIR, 'videos')
     if not os.path.exists(videos_dir):
         os.makedirs(videos_dir, exist_ok=True)
     
-    # 生成唯一文件名（添加时间戳避免冲突）
-    timestamp = int(time.time())
-    name, ext = os.path.splitext(file.filename)
-    
-    # 🔧 修复：正确处理文件名中的非ASCII字符
-    # 将非ASCII字符替换为安全字符
-    import re
-    safe_name = re.sub(r'[^\w\-_\.]', '_', name)
-    
-    # 如果提供了窗口ID，将其包含在文件名中
-    if window_id:
-        unique_filename = f"{safe_name}_{window_id}_{timestamp}{ext}"
-    else:
-        unique_filename = f"{safe_name}_{timestamp}{ext}"
-    
+    unique_filename = make_media_filename(file.filename, window_id)
     save_path = os.path.join(videos_dir, unique_filename)
     
     try:
-        # 保存视频文件
-        save_upload_file(file, save_path)
+        # 保存视频文件，边写入边校验大小（100MB），不再整体读入内存
+        record = await save_upload_file(file, save_path, VIDEO_UPLOAD_MAX_SIZE)
+        file_size = record["size"]
         
         # 构建访问URL
         video_url = f"/api/videos/view/{unique_filename}"
@@ -1338,12 +1564,14 @@ async def upload_video(
             "path": save_path,
             "size": file_size
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"视频保存失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"视频保存失败: {str(e)}")
 
 @app.get('/api/videos/view/{filename}')
-async def view_video(filename: str):
+async def view_video(filename: str, request: Request):
     """查看视频文件"""
     videos_dir = os.path.join(UPLOAD_DIR, 'videos')
     file_path = os.path.join(videos_dir, filename)
@@ -1367,11 +1595,8 @@ async def view_video(filename: str):
     
     media_type = media_type_map.get(ext, 'video/mp4')
     
-    return FileResponse(
-        file_path,
-        media_type=media_type,
-        filename=filename
-    )
+    # 支持Range请求，拖动进度条时只传输需要的片段
+    return cached_file_response(request, file_path, media_type, filename)
 
 @app.delete('/api/videos/{filename}')
 async def delete_video(filename: str):
@@ -1393,6 +1618,7 @@ async def delete_video(filename: str):
         
         # 删除物理文件
         os.remove(file_path)
+        blob_store.remove(file_path)
         logger.info(f"✅ 视频文件已删除: {file_path}")
         
         success_message = f"视频文件 '{filename}' 已删除"
@@ -1433,6 +1659,7 @@ async def delete_image(filename: str):
         
         # 删除物理文件
         os.remove(file_path)
+        blob_store.remove(file_path)
         logger.info(f"✅ 图片文件已删除: {file_path}")
         
         success_message = f"图片文件 '{filename}' 已删除"
@@ -2049,6 +2276,9 @@ async def update_board_context(board_id: str, context_data: dict = Body(...)):
                     "currentPage": window.get("currentPage"),
                     "contentPreview": window.get("contentPreview", "")[:500]  # 限制长度
                 })
+                # 后台预渲染用户正在查看页面附近的视觉档位图像，降低注释路径的渲染延迟
+                if window.get("filename") and window.get("currentPage"):
+                    page_renderer.prefetch(window["filename"], int(window["currentPage"]), "vision")
         
         # 构建详细的上下文信息给专家LLM
         pdf_files = board_manager.get_pdf_files(board_id)
@@ -2210,22 +2440,31 @@ async def expert_stream(websocket: WebSocket):
         # 获取简化专家实例
         expert = simple_expert_manager.get_expert(board_id)
         
-        # 处理查询
+        # 处理查询：上游的文本片段到达即转发，发送等待客户端接收，慢客户端会反压到上游读取
         try:
-            response = await expert.process_query(query)
+            metrics = {}
+            parts = []
+            stream = expert.process_query_stream(query, metrics=metrics)
+            try:
+                async for delta in stream:
+                    parts.append(delta)
+                    await websocket.send_json({"chunk": delta})
+            finally:
+                await stream.aclose()
             
             # 发送最终响应
             if websocket_active:
-                    await websocket.send_json({
+                await websocket.send_json({
                     "done": True,
-                    "full_response": response,
-                        "timestamp": time.time()
-                    })
+                    "full_response": "".join(parts),
+                    "metrics": metrics,
+                    "timestamp": time.time()
+                })
                 
             logger.info(f"专家LLM查询完成: 展板 {board_id}")
             
-        except Exception as e:
-            pass
+        except WebSocketDisconnect:
+            raise
         except Exception as process_error:
             error_msg = f"分析失败: {str(process_error)}"
             logger.error(f"专家LLM处理失败: {str(process_error)}", exc_info=True)
@@ -2435,23 +2674,19 @@ async def test_api_connection():
         qwen_test = {"status": "未测试", "error": None}
         if QWEN_API_KEY:
             try:
-                client = OpenAI(
-                    api_key=QWEN_API_KEY,
-                    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-                )
-                
                 # 使用最简单的API调用
-                completion = client.chat.completions.create(
-                    model="qwen-turbo",
-                    messages=[
+                response_content = await llm_client.chat(
+                    [
                         {"role": "system", "content": "你是一个测试助手"},
                         {"role": "user", "content": "测试连接"}
                     ],
+                    "qwen-turbo",
+                    api_key=QWEN_API_KEY,
                     max_tokens=10
                 )
                 
                 qwen_test["status"] = "成功"
-                qwen_test["response"] = completion.choices[0].message.content
+                qwen_test["response"] = response_content
             except Exception as e:
                 qwen_test["status"] = "失败"
                 qwen_test["error"] = str(e)
@@ -2507,12 +2742,14 @@ async def api_improve_annotation(
     
     try:
         # 读取原始页面内容
-        page_file = os.path.join(PAGE_DIR, f"{filename}_page_{page_number}.txt")
-        if not os.path.exists(page_file):
-            raise HTTPException(status_code=404, detail="找不到页面内容")
-        
-        with open(page_file, 'r', encoding='utf-8') as f:
-            page_text = f.read()
+        page_text = page_store.read_page(filename, page_number)
+        if page_text is None:
+            page_file = page_store.legacy_page_path(filename, page_number)
+            if not os.path.exists(page_file):
+                raise HTTPException(status_code=404, detail="找不到页面内容")
+            
+            with open(page_file, 'r', encoding='utf-8') as f:
+                page_text = f.read()
         
         # 根据是否有现有注释决定使用哪个函数
         if is_new_annotation:
@@ -2541,23 +2778,13 @@ async def get_dynamic_task_result(task_id: str):
     logger.info(f"🔍 [RESULT-QUERY] 开始查询任务结果: {task_id}")
     
     try:
-        # 从所有专家实例中查找任务结果
-        result_found = False
-        task_result = None
-        board_id_found = None
-        
+        # 从全局任务索引中按任务ID查找结果（不在内存中时查询任务日志，放到线程池中执行）
         search_start_time = time.time()
-        for board_id, expert in simple_expert_manager.experts.items():
-            if task_id in expert.task_results:
-                task_result = expert.task_results[task_id]
-                board_id_found = board_id
-                result_found = True
-                break
-        
+        task_result = await asyncio.get_running_loop().run_in_executor(None, task_registry.get_result, task_id)
         search_time = time.time() - search_start_time
-        logger.info(f"🔎 [RESULT-QUERY] 搜索完成，耗时: {search_time:.3f}s，搜索了 {len(simple_expert_manager.experts)} 个专家实例")
         
-        if result_found:
+        if task_result is not None:
+            board_id_found = task_result["board_id"]
             # 记录查询统计
             logger.info(f"✅ [RESULT-QUERY] 任务结果找到: {task_id} (展板: {board_id_found}), 状态: {task_result.get('status', 'unknown')}")
             
@@ -2569,7 +2796,7 @@ async def get_dynamic_task_result(task_id: str):
                 "query_timing": {
                     "total_query_time": time.time() - query_start_time,
                     "search_time": search_time,
-                    "expert_count": len(simple_expert_manager.experts)
+                    "indexed_tasks": len(task_registry)
                 }
             }
             
@@ -2590,6 +2817,39 @@ async def get_dynamic_task_result(task_id: str):
             }
         )
 
+@app.delete('/api/expert/dynamic/task/{task_id}')
+async def cancel_dynamic_task(task_id: str):
+    """
+    取消排队或执行中的动态任务
+    
+    停止任务执行并中止其进行中的LLM调用，空出并发名额，向展板发送task_cancelled事件
+    """
+    logger.info(f"🛑 [TASK-CANCEL] 收到取消任务请求: {task_id}")
+    
+    task = task_registry.get(task_id)
+    if task is None:
+        return JSONResponse(
+            status_code=404,
+            content={"detail": "任务不存在或已结束", "task_id": task_id}
+        )
+    
+    expert = simple_expert_manager.get_expert(task.board_id)
+    if not await expert.cancel_task(task_id):
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "任务已结束或不能单独取消（如批量注释中的单页任务）",
+                     "task_id": task_id, "task_status": task.status.value}
+        )
+    
+    return {
+        "status": "success",
+        "task_id": task_id,
+        "board_id": task.board_id,
+        "task_type": task.task_type,
+        "cancelled": True,
+        "timestamp": datetime.now().isoformat()
+    }
+
 @app.get('/api/expert/dynamic/concurrent-status/{board_id}')
 async def get_concurrent_status(board_id: str):
     """
@@ -2606,7 +2866,7 @@ async def get_concurrent_status(board_id: str):
         status = expert.get_concurrent_status()
         
         # 记录详细的状态信息
-        logger.info(f"📈 并发状态查询结果: 展板={board_id}, 活跃任务={status.get('active_tasks', 0)}, 最大并发={status.get('max_concurrent_tasks', 3)}")
+        logger.info(f"📈 并发状态查询结果: 展板={board_id}, 活跃任务={status.get('active_tasks', 0)}, 最大并发={status.get('max_concurrent_tasks')}")
         
         response_time = time.time() - timestamp_start
         return {
@@ -2711,6 +2971,7 @@ async def submit_dynamic_task(request_data: dict = Body(...)):
         
         # 根据任务类型处理不同的任务
         task_submit_start_time = time.time()
+        page_tasks = None
         
         if task_type == 'generate_board_note':
             # 展板笔记生成任务
@@ -2736,6 +2997,14 @@ async def submit_dynamic_task(request_data: dict = Body(...)):
         elif task_type == 'generate_segmented_note':
             # 分段笔记生成任务
             task_id = await expert.submit_task("generate_segmented_note", task_params)
+        elif task_type == 'generate_mapreduce_note':
+            # 整本笔记并行生成任务
+            task_id = await expert.submit_task("generate_mapreduce_note", task_params)
+        elif task_type == 'generate_batch_annotation':
+            # 批量注释任务（连续的短页面打包请求），同时返回每一页的任务ID
+            batch = await expert.submit_batch_annotation(task_params)
+            task_id = batch["task_id"] if batch else None
+            page_tasks = batch["page_tasks"] if batch else None
         else:
             logger.error(f"❌ [TASK-SUBMIT] 不支持的任务类型: {task_type}")
             return JSONResponse(
@@ -2748,7 +3017,7 @@ async def submit_dynamic_task(request_data: dict = Body(...)):
         if task_id:
             total_submit_time = time.time() - submit_start_time
             logger.info(f"✅ [TASK-SUBMIT] 任务提交成功: {task_id}, 总耗时: {total_submit_time:.3f}s (专家: {expert_time:.3f}s, 提交: {task_submit_time:.3f}s)")
-            return {
+            response = {
                 "status": "success",
                 "board_id": board_id,
                 "task_id": task_id,
@@ -2760,6 +3029,9 @@ async def submit_dynamic_task(request_data: dict = Body(...)):
                     "submit_time": task_submit_time
                 }
             }
+            if page_tasks:
+                response["page_tasks"] = page_tasks
+            return response
         else:
             logger.error(f"❌ [TASK-SUBMIT] 任务提交失败: 返回task_id为空")
             return JSONResponse(
@@ -2862,8 +3134,11 @@ async def delete_pdf_file(pdf_filename: str, board_id: str = Query(None)):
                 if os.path.exists(pdf_path):
                     try:
                         os.remove(pdf_path)
+                        notify_path(pdf_path)
                         files_deleted.append(pdf_path)
                         logger.info(f"已删除PDF文件: {pdf_path}")
+                        # 移除别名，内容不再被引用时回收存储对象
+                        blob_store.remove(os.path.abspath(pdf_path))
                     except Exception as e:
                         logger.error(f"删除PDF文件失败 {pdf_path}: {e}")
             
@@ -2874,7 +3149,7 @@ async def delete_pdf_file(pdf_filename: str, board_id: str = Query(None)):
                 base_name = pdf_filename.replace('.pdf', '')
                 page_files = []
                 
-                for f in os.listdir(pages_dir):
+                for f in page_index.with_prefix(f"{base_name}_page_"):
                     # 严格匹配：必须是 "filename_page_数字.txt" 格式
                     if (f.startswith(f"{base_name}_page_") and 
                         f.endswith('.txt') and 
@@ -2894,10 +3169,25 @@ async def delete_pdf_file(pdf_filename: str, board_id: str = Query(None)):
                     page_path = os.path.join(pages_dir, page_file)
                     try:
                         os.remove(page_path)
+                        notify_path(page_path)
                         files_deleted.append(page_path)
                         logger.info(f"已删除页面文件: {page_path}")
                     except Exception as e:
                         logger.error(f"删除页面文件失败 {page_path}: {e}")
+            
+            # 删除渲染的页面图像
+            page_renderer.invalidate_document(pdf_filename)
+            
+            # 删除导入清单
+            ingest_manifest.delete(pdf_filename)
+            
+            # 删除打包的页面容器
+            try:
+                if page_store.delete_document(pdf_filename):
+                    files_deleted.append(page_store.container_path(pdf_filename))
+                    logger.info(f"已删除页面容器: {pdf_filename}")
+            except Exception as e:
+                logger.error(f"删除页面容器失败 {pdf_filename}: {e}")
         
         # 4. 返回删除结果
         result = {
@@ -3066,6 +3356,93 @@ async def submit_continue_segmented_note_task(request_data: dict = Body(...)):
         logger.error(f"提交继续生成PDF笔记任务失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"提交任务失败: {str(e)}")
 
+@app.post('/api/expert/dynamic/generate-mapreduce-note')
+async def submit_generate_mapreduce_note_task(request_data: dict = Body(...)):
+    """
+    提交整本笔记并行生成任务（map-reduce）
+    各段笔记完成时通过任务事件流推送（task_progress事件，stage为map），全部合并后任务完成
+    """
+    try:
+        board_id = request_data.get("board_id")
+        filename = request_data.get("filename")
+        
+        if not board_id or not filename:
+            raise HTTPException(status_code=400, detail="缺少必要参数 board_id 或 filename")
+        
+        task_params = {
+            "filename": filename,
+            "segment_pages": request_data.get("segment_pages"),
+            "parallelism": request_data.get("parallelism"),
+            "regenerate": bool(request_data.get("regenerate", False))
+        }
+        
+        logger.info(f"提交整本笔记并行生成任务: {filename}")
+        
+        expert = simple_expert_manager.get_expert(board_id)
+        task_id = await expert.submit_task("generate_mapreduce_note", task_params)
+        
+        return {
+            "task_id": task_id,
+            "status": "submitted",
+            "filename": filename,
+            "message": f"整本笔记并行生成任务已提交，任务ID: {task_id}"
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"提交整本笔记并行生成任务失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"提交任务失败: {str(e)}")
+
+@app.post('/api/expert/dynamic/generate-batch-annotation')
+async def submit_generate_batch_annotation_task(request_data: dict = Body(...)):
+    """
+    提交批量注释任务
+    连续的短页面打包为一次请求，结果拆回每一页的任务：返回的page_tasks为 {页码: 任务ID}，
+    每一页完成时发送该任务ID的task_completed事件，也可以通过 /api/expert/dynamic/result/{task_id} 查询
+    """
+    try:
+        board_id = request_data.get("board_id")
+        filename = request_data.get("filename")
+        start_page = request_data.get("start_page")
+        end_page = request_data.get("end_page")
+        
+        if not board_id or not filename or not start_page or not end_page:
+            raise HTTPException(status_code=400, detail="缺少必要参数 board_id、filename、start_page 或 end_page")
+        if int(end_page) < int(start_page):
+            raise HTTPException(status_code=400, detail="end_page 不能小于 start_page")
+        
+        task_params = {
+            "filename": filename,
+            "start_page": int(start_page),
+            "end_page": int(end_page),
+            "annotationStyle": request_data.get("annotation_style"),
+            "customPrompt": request_data.get("custom_prompt"),
+            "systemPrompt": request_data.get("system_prompt"),
+            "regenerate": bool(request_data.get("regenerate", False))
+        }
+        
+        logger.info(f"提交批量注释任务: {filename} 第{start_page}-{end_page}页")
+        
+        expert = simple_expert_manager.get_expert(board_id)
+        batch = await expert.submit_batch_annotation(task_params)
+        if not batch:
+            raise HTTPException(status_code=500, detail="提交任务失败: 无法创建任务ID")
+        
+        return {
+            "task_id": batch["task_id"],
+            "page_tasks": batch["page_tasks"],
+            "status": "submitted",
+            "filename": filename,
+            "message": f"批量注释任务已提交，任务ID: {batch['task_id']}"
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"提交批量注释任务失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"提交任务失败: {str(e)}")
+
 # 新增SSE端点用于实时任务状态推送
 @app.get('/api/expert/dynamic/task-events/{board_id}')
 async def task_events_stream(board_id: str):
@@ -4756,6 +5133,9 @@ async def handle_cache_command(args):
                 except:
                     pass
         
+        # 清空页面文本缓存
+        page_text_cache.clear()
+        
         return {
             "response": f"✅ 缓存已清理，清理了 {cleared_count} 个缓存目录", 
             "type": "success",
@@ -4780,6 +5160,12 @@ async def handle_cache_command(args):
             else:
                 cache_info.append(f"  {cache_dir}: 不存在")
         
+        page_cache_stats = page_text_cache.get_stats()
+        cache_info.append(
+            f"  页面文本缓存: {page_cache_stats['entries']} 条, {page_cache_stats['bytes']} 字节, "
+            f"命中 {page_cache_stats['hits']} / 未命中 {page_cache_stats['misses']}"
+        )
+        
         response = "📋 缓存状态:\n" + "\n".join(cache_info)
         return {
             "response": response, 
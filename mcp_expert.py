@@ -7,8 +7,8 @@ import logging
 import time
 import uuid
 from typing import Dict, List, Any, Optional, Callable, AsyncGenerator
-from openai import OpenAI
 from config import QWEN_API_KEY
+from llm_client import llm_client
 from mcp_tools import MCPToolRegistry, MCPToolResult
 from datetime import datetime
 
@@ -21,12 +21,6 @@ class MCPExpert:
         self.board_id = board_id
         self.session_id = f"expert_{board_id}_{uuid.uuid4().hex[:8]}"
         
-        # 初始化OpenAI客户端
-        self.client = OpenAI(
-            api_key=QWEN_API_KEY,
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        )
-        
         # 工具注册中心
         self.tool_registry = MCPToolRegistry(board_id)
         
@@ -110,33 +104,25 @@ class MCPExpert:
             
             try:
                 # 调用LLM
-                if tools:
-                    response = self.client.chat.completions.create(
-                        model="qwen-plus",
-                        messages=messages,
-                        tools=tools,
-                        tool_choice="auto",
-                        temperature=0.1,
-                        max_tokens=3000,
-                        timeout=90
-                    )
-                else:
-                    response = self.client.chat.completions.create(
-                        model="qwen-plus",
-                        messages=messages,
-                        temperature=0.1,
-                        max_tokens=3000,
-                        timeout=90
-                    )
+                tool_params = {"tools": tools, "tool_choice": "auto"} if tools else {}
+                response = await llm_client.chat_completion(
+                    messages,
+                    "qwen-plus",
+                    api_key=QWEN_API_KEY,
+                    temperature=0.1,
+                    max_tokens=3000,
+                    timeout=90,
+                    **tool_params
+                )
                 
-                message = response.choices[0].message
+                message = response["choices"][0]["message"]
                 
                 # 检查是否有工具调用
-                if message.tool_calls:
+                if message.get("tool_calls"):
                     # 执行工具调用
-                    for tool_call in message.tool_calls:
-                        function_name = tool_call.function.name
-                        function_args = json.loads(tool_call.function.arguments)
+                    for tool_call in message["tool_calls"]:
+                        function_name = tool_call["function"]["name"]
+                        function_args = json.loads(tool_call["function"]["arguments"])
                         
                         if status_callback:
                             await status_callback(f"🔧 调用工具: {function_name}")
@@ -151,11 +137,11 @@ class MCPExpert:
                             "role": "assistant",
                             "content": None,
                             "tool_calls": [{
-                                "id": tool_call.id,
+                                "id": tool_call["id"],
                                 "type": "function",
                                 "function": {
                                     "name": function_name,
-                                    "arguments": tool_call.function.arguments
+                                    "arguments": tool_call["function"]["arguments"]
                                 }
                             }]
                         })
@@ -163,7 +149,7 @@ class MCPExpert:
                         # 添加工具结果到对话历史
                         self.conversation_history.append({
                             "role": "tool",
-                            "tool_call_id": tool_call.id,
+                            "tool_call_id": tool_call["id"],
                             "content": json.dumps(tool_result.to_dict(), ensure_ascii=False)
                         })
                     
@@ -172,7 +158,7 @@ class MCPExpert:
                 
                 else:
                     # 没有工具调用，返回最终答案
-                    final_answer = message.content
+                    final_answer = message.get("content")
                     
                     # 添加到对话历史
                     self.conversation_history.append({
@@ -229,47 +215,47 @@ class MCPExpert:
             
             try:
                 # 调用LLM
-                if tools:
-                    response = self.client.chat.completions.create(
-                        model="qwen-plus",
-                        messages=messages,
-                        tools=tools,
-                        tool_choice="auto",
-                        temperature=0.1,
-                        max_tokens=3000,
-                        timeout=90,
-                        stream=True
-                    )
-                else:
-                    response = self.client.chat.completions.create(
-                        model="qwen-plus",
-                        messages=messages,
-                        temperature=0.1,
-                        max_tokens=3000,
-                        timeout=90,
-                        stream=True
-                    )
+                tool_params = {"tools": tools, "tool_choice": "auto"} if tools else {}
                 
                 # 处理流式响应
                 accumulated_content = ""
-                tool_calls_buffer = []
+                # 工具调用以增量片段返回，按index拼接完整的名称和参数
+                tool_calls_buffer: Dict[int, Dict[str, Any]] = {}
                 
-                for chunk in response:
-                    if chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
+                async for chunk in llm_client.stream_chunks(
+                    messages,
+                    "qwen-plus",
+                    api_key=QWEN_API_KEY,
+                    temperature=0.1,
+                    max_tokens=3000,
+                    timeout=90,
+                    **tool_params
+                ):
+                    if not chunk.get("choices"):
+                        continue
+                    delta = chunk["choices"][0].get("delta") or {}
+                    if delta.get("content"):
+                        content = delta["content"]
                         accumulated_content += content
                         yield content
                     
-                    if chunk.choices[0].delta.tool_calls:
-                        tool_calls_buffer.extend(chunk.choices[0].delta.tool_calls)
+                    for fragment in delta.get("tool_calls") or []:
+                        buffered = tool_calls_buffer.setdefault(fragment.get("index", 0), {
+                            "id": None, "function": {"name": "", "arguments": ""}
+                        })
+                        if fragment.get("id"):
+                            buffered["id"] = fragment["id"]
+                        function = fragment.get("function") or {}
+                        buffered["function"]["name"] += function.get("name") or ""
+                        buffered["function"]["arguments"] += function.get("arguments") or ""
                 
                 # 处理工具调用
                 if tool_calls_buffer:
                     yield "\n\n"
-                    for tool_call in tool_calls_buffer:
-                        if tool_call.function:
-                            function_name = tool_call.function.name
-                            function_args = json.loads(tool_call.function.arguments)
+                    for _, tool_call in sorted(tool_calls_buffer.items()):
+                        if tool_call["function"]["name"]:
+                            function_name = tool_call["function"]["name"]
+                            function_args = json.loads(tool_call["function"]["arguments"] or "{}")
                             
                             yield f"🔧 调用工具: {function_name}\n"
                             
@@ -283,11 +269,11 @@ class MCPExpert:
                                 "role": "assistant",
                                 "content": None,
                                 "tool_calls": [{
-                                    "id": tool_call.id,
+                                    "id": tool_call["id"],
                                     "type": "function",
                                     "function": {
                                         "name": function_name,
-                                        "arguments": tool_call.function.arguments
+                                        "arguments": tool_call["function"]["arguments"]
                                     }
                                 }]
                             })
@@ -295,7 +281,7 @@ class MCPExpert:
                             # 添加工具结果到对话历史
                             self.conversation_history.append({
                                 "role": "tool",
-                                "tool_call_id": tool_call.id,
+                                "tool_call_id": tool_call["id"],
                                 "content": json.dumps(tool_result.to_dict(), ensure_ascii=False)
                             })
                     
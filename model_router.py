@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+按任务类型、注释风格和提示词大小选择模型
+路由表默认取自config.MODEL_ROUTES，存在路由文件时以文件为准，文件修改后下次路由即重新加载。
+主模型降级（熔断未闭合，或最近一段时间内第90百分位耗时超过规则的max_latency）时改用规则中的备用模型，
+降级期间主模型没有新样本，旧样本过期后自动切回。
+每次路由决策都会记录，可通过接口查看各任务实际使用的模型
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from config import MODEL_ROUTES, MODEL_ROUTES_FILE, MODEL_ROUTE_HISTORY, MODEL_ROUTE_LATENCY_WINDOW, API_TIMEOUT
+from llm_limits import llm_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# 没有任何规则匹配时使用的路由
+_DEFAULT_ROUTE = {"model": "qwen-plus", "max_tokens": 2000, "timeout": API_TIMEOUT}
+
+
+class ModelRouter:
+    """模型路由表"""
+
+    def __init__(self, routes: List[Dict[str, Any]] = MODEL_ROUTES, routes_file: Optional[str] = MODEL_ROUTES_FILE):
+        self.default_routes = routes
+        self.routes_file = routes_file
+        self._routes = list(routes)
+        self._source = "config"
+        self._file_mtime: Optional[float] = None
+        self._lock = threading.Lock()
+
+        self.decisions: Deque[Dict[str, Any]] = deque(maxlen=MODEL_ROUTE_HISTORY)
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self.fallbacks = 0
+
+    @staticmethod
+    def _validate(routes: Any) -> List[Dict[str, Any]]:
+        if not isinstance(routes, list) or not routes:
+            raise ValueError("路由表必须是非空列表")
+        for rule in routes:
+            if not isinstance(rule, dict) or not rule.get("model"):
+                raise ValueError(f"路由规则缺少model: {rule}")
+        return routes
+
+    def _reload(self):
+        """路由文件修改过时重新加载；文件格式错误时保留当前路由表，文件被删除时恢复默认路由表"""
+        if not self.routes_file:
+            return
+        try:
+            mtime = os.path.getmtime(self.routes_file)
+        except OSError:
+            if self._file_mtime is not None:
+                self._routes, self._source, self._file_mtime = list(self.default_routes), "config", None
+                logger.info("🧭 [ROUTER] 路由文件已删除，恢复默认路由表")
+            return
+        if mtime == self._file_mtime:
+            return
+        self._file_mtime = mtime
+        try:
+            with open(self.routes_file, "r", encoding="utf-8") as f:
+                routes = self._validate(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.error(f"❌ [ROUTER] 路由文件无效，继续使用当前路由表: {self.routes_file}: {str(e)}")
+            return
+        self._routes, self._source = routes, self.routes_file
+        logger.info(f"🧭 [ROUTER] 已加载路由文件 {self.routes_file}，共 {len(routes)} 条规则")
+
+    def get_routes(self) -> List[Dict[str, Any]]:
+        """当前生效的路由表"""
+        with self._lock:
+            self._reload()
+            return list(self._routes)
+
+    @staticmethod
+    def _matches(rule: Dict[str, Any], task: str, style: Optional[str], prompt_tokens: int) -> bool:
+        if rule.get("task") not in (None, task):
+            return False
+        if rule.get("style") not in (None, style):
+            return False
+        max_prompt_tokens = rule.get("max_prompt_tokens")
+        return max_prompt_tokens is None or prompt_tokens <= max_prompt_tokens
+
+    @staticmethod
+    def _degraded(model: str, max_latency: Optional[float]) -> Optional[str]:
+        """主模型降级的原因，未降级时返回None"""
+        state = llm_rate_limiter.breaker(model).state
+        if state != "closed":
+            return f"熔断({state})"
+        if max_latency:
+            p90 = llm_rate_limiter.latency_percentile(model, 90, MODEL_ROUTE_LATENCY_WINDOW)
+            if p90 is not None and p90 > max_latency:
+                return f"延迟过高(p90 {p90:.1f}秒 > {max_latency}秒)"
+        return None
+
+    def route(self, task: str, style: Optional[str] = None, prompt_tokens: int = 0) -> Dict[str, Any]:
+        """
+        为一次调用选择模型
+
+        Args:
+            task: 任务类型
+            style: 注释风格
+            prompt_tokens: 提示词内容的token数（截断前的估算值）
+
+        Returns:
+            {"model", "max_tokens", "timeout", "task", "style", "prompt_tokens", "primary", "fallback_reason", "rule"}
+        """
+        with self._lock:
+            self._reload()
+            routes = self._routes
+        index, rule = next(
+            ((i, rule) for i, rule in enumerate(routes) if self._matches(rule, task, style, prompt_tokens)),
+            (None, _DEFAULT_ROUTE)
+        )
+
+        primary = rule["model"]
+        model = primary
+        reason = self._degraded(primary, rule.get("max_latency")) if rule.get("fallback") else None
+        if reason:
+            model = rule["fallback"]
+
+        decision = {
+            "task": task,
+            "style": style,
+            "prompt_tokens": prompt_tokens,
+            "model": model,
+            "max_tokens": rule.get("max_tokens"),
+            "timeout": rule.get("timeout") or API_TIMEOUT,
+            "primary": primary,
+            "fallback_reason": reason,
+            "rule": index,
+            "time": time.time()
+        }
+        with self._lock:
+            self.decisions.append(decision)
+            task_counts = self.counts.setdefault(task, {})
+            task_counts[model] = task_counts.get(model, 0) + 1
+            if reason:
+                self.fallbacks += 1
+
+        if reason:
+            logger.warning(f"🧭 [ROUTER] {task}/{style or '-'}: {primary} {reason}，改用 {model}")
+        else:
+            logger.info(f"🧭 [ROUTER] {task}/{style or '-'} 约{prompt_tokens} tokens → {model}（规则 {index}）")
+        return decision
+
+    def get_status(self, recent: int = 20) -> Dict[str, Any]:
+        """获取路由表、各任务使用的模型计数和最近的路由决策"""
+        routes = self.get_routes()
+        with self._lock:
+            decisions = list(self.decisions)[-recent:] if recent > 0 else []
+            return {
+                "source": self._source,
+                "routes": routes,
+                "counts": {task: dict(models) for task, models in self.counts.items()},
+                "fallbacks": self.fallbacks,
+                "recent_decisions": decisions
+            }
+
+
+# 全局模型路由器
+model_router = ModelRouter()
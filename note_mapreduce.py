@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+整本笔记的map-reduce生成
+把文档切分为若干段（有目录时按章节边界切分），在并发上限内同时为各段生成笔记（map），
+再按组逐层合并为最终笔记（reduce）。每段完成时通过回调通知调用方，便于即时推送给前端
+"""
+
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import NOTE_MAPREDUCE_SEGMENT_PAGES, NOTE_MAPREDUCE_PARALLELISM, NOTE_MAPREDUCE_MERGE_FANIN
+from prompt_builder import pack_pages, content_budget, estimate_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def plan_segments(total_pages: int, outline: Optional[List[Dict[str, Any]]] = None,
+                  segment_pages: int = NOTE_MAPREDUCE_SEGMENT_PAGES) -> List[Dict[str, Any]]:
+    """
+    规划分段
+
+    有目录时以一级标题为章节边界：过长的章节均分为不超过segment_pages页的若干段，
+    相邻的短章节合并到一段中；没有目录时按segment_pages页等长切分
+
+    Returns:
+        [{"start_page", "end_page", "title"}]，页码从1开始且首尾相接
+    """
+    if total_pages <= 0:
+        return []
+    segment_pages = max(1, segment_pages)
+
+    # 章节起始页（去重、排序，并确保从第1页开始）
+    starts = sorted({
+        item["page"] for item in (outline or [])
+        if item.get("level") == 1 and 1 <= item.get("page", 0) <= total_pages
+    } | {1})
+    titles = {}
+    for item in outline or []:
+        if item.get("level") == 1:
+            titles.setdefault(item.get("page"), item.get("title"))
+
+    chapters = [
+        (start, (starts[i + 1] - 1) if i + 1 < len(starts) else total_pages)
+        for i, start in enumerate(starts)
+    ]
+
+    segments: List[Dict[str, Any]] = []
+    for start, end in chapters:
+        length = end - start + 1
+        title = titles.get(start)
+        if length > segment_pages:
+            # 均分过长的章节，避免最后一段只有零星几页
+            parts = -(-length // segment_pages)
+            size = -(-length // parts)
+            for part_start in range(start, end + 1, size):
+                segments.append({"start_page": part_start, "end_page": min(part_start + size - 1, end),
+                                 "title": title})
+            continue
+        previous = segments[-1] if segments else None
+        if previous and end - previous["start_page"] + 1 <= segment_pages:
+            # 合并相邻的短章节
+            previous["end_page"] = end
+            previous["title"] = "、".join(filter(None, [previous["title"], title])) or None
+        else:
+            segments.append({"start_page": start, "end_page": end, "title": title})
+    return segments
+
+
+def _range_text(start: int, end: int) -> str:
+    return f"第{start}页-第{end}页" if start != end else f"第{start}页"
+
+
+def _segment_prompt(filename: str, segment: Dict[str, Any], total_pages: int, content: str) -> str:
+    current_range = _range_text(segment["start_page"], segment["end_page"])
+    chapter = f"（章节：{segment['title']}）" if segment.get("title") else ""
+    return f"""【分段笔记任务】为PDF文件 {filename} 的{current_range}{chapter}生成笔记，文件共 {total_pages} 页。
+
+当前内容（{current_range}）:
+{content}
+
+请为{current_range}的内容生成笔记，要求：
+
+1. 使用Markdown格式，突出重点和关键概念
+2. 在引用重要内容时标注页码，格式为：(第X页) 或 (第X-Y页)
+3. 只基于提供的内容，不要添加原文未提及的信息
+4. 这是整本笔记的一部分，之后会与其他部分合并，无需写全书的引言和总结
+
+请开始生成{current_range}的笔记："""
+
+
+def _merge_prompt(filename: str, notes: List[Dict[str, Any]], final: bool) -> str:
+    parts = "\n\n".join(
+        f"--- {_range_text(note['start_page'], note['end_page'])} ---\n{note['note']}" for note in notes
+    )
+    goal = ("合并为一份完整的整本笔记，开头给出全书结构概览" if final
+            else "合并为一份连贯的阶段笔记，之后还会与其他部分继续合并")
+    return f"""【笔记合并任务】以下是PDF文件 {filename} 按页码顺序排列的分段笔记，请{goal}。
+
+{parts}
+
+要求：
+1. 保持原有顺序，统一标题层级，使用Markdown格式
+2. 去除重复内容，保留所有关键概念和结论
+3. 保留并核对页码标注，格式为：(第X页) 或 (第X-Y页)
+4. 不要添加分段笔记中没有的信息
+
+请输出合并后的笔记："""
+
+
+async def generate_mapreduce_note(filename: str, pages_text: List[str],
+                                  call_llm: Callable[[str], Awaitable[str]],
+                                  outline: Optional[List[Dict[str, Any]]] = None,
+                                  model: str = "qwen-plus",
+                                  segment_pages: int = NOTE_MAPREDUCE_SEGMENT_PAGES,
+                                  parallelism: int = NOTE_MAPREDUCE_PARALLELISM,
+                                  fanin: int = NOTE_MAPREDUCE_MERGE_FANIN,
+                                  on_progress: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
+                                  ) -> Dict[str, Any]:
+    """
+    以map-reduce方式生成整本笔记
+
+    Args:
+        filename: 文件名（用于提示词）
+        pages_text: 全部页面文本，空页面保留以保持页码一致
+        call_llm: 调用LLM的协程函数，参数为提示词，返回回复文本
+        outline: 导入清单中的目录，用于按章节切分
+        model: call_llm使用的模型，用于计算token预算
+        segment_pages: 每段最多页数
+        parallelism: 同时进行的LLM调用数上限（map和reduce阶段共用）
+        fanin: 每次合并的笔记数
+        on_progress: 进度回调，每段笔记完成、每层合并完成时调用
+
+    Returns:
+        {"note", "segments", "levels", "duration"}
+    """
+    start_time = time.time()
+    total_pages = len(pages_text)
+    segments = [
+        segment for segment in plan_segments(total_pages, outline, segment_pages)
+        if any(pages_text[segment["start_page"] - 1:segment["end_page"]])
+    ]
+    if not segments:
+        raise ValueError(f"{filename} 没有可用于生成笔记的页面内容")
+
+    semaphore = asyncio.Semaphore(max(1, parallelism))
+    budget = content_budget(model)
+    logger.info(f"🗺️ [MAP-REDUCE] {filename} 共 {total_pages} 页，切分为 {len(segments)} 段，并发 {parallelism}")
+
+    async def _call(prompt: str) -> str:
+        async with semaphore:
+            return await call_llm(prompt)
+
+    completed = 0
+
+    async def _map(index: int, segment: Dict[str, Any]) -> Dict[str, Any]:
+        nonlocal completed
+        packed = pack_pages(pages_text[segment["start_page"] - 1:segment["end_page"]], budget,
+                            start_page=segment["start_page"])
+        note = await _call(_segment_prompt(filename, segment, total_pages, packed["content"]))
+        result = {**segment, "index": index, "note": note}
+        completed += 1
+        if on_progress:
+            await on_progress({"stage": "map", "completed": completed, "total": len(segments), "segment": result})
+        return result
+
+    notes = list(await asyncio.gather(*(_map(i, segment) for i, segment in enumerate(segments))))
+
+    # 逐层合并：每fanin份笔记合并为一份，直到只剩一份
+    level = 0
+    fanin = max(2, fanin)
+    while len(notes) > 1:
+        level += 1
+        groups = [notes[i:i + fanin] for i in range(0, len(notes), fanin)]
+        final = len(groups) == 1
+
+        async def _reduce(group: List[Dict[str, Any]]) -> Dict[str, Any]:
+            if len(group) == 1:
+                return group[0]
+            # 每份笔记平分内容预算，超出的部分截断
+            share = budget // len(group)
+            group = [
+                {**note, "note": truncate_to_tokens(note["note"], share) + "..."}
+                if estimate_tokens(note["note"]) > share else note
+                for note in group
+            ]
+            prompt = _merge_prompt(filename, group, final)
+            return {"start_page": group[0]["start_page"], "end_page": group[-1]["end_page"],
+                    "note": await _call(prompt)}
+
+        notes = list(await asyncio.gather(*(_reduce(group) for group in groups)))
+        if on_progress:
+            await on_progress({"stage": "reduce", "level": level, "remaining": len(notes)})
+
+    duration = time.time() - start_time
+    logger.info(f"✅ [MAP-REDUCE] {filename} 笔记生成完成，{len(segments)} 段，{level} 层合并，耗时 {duration:.2f}秒")
+    return {
+        "note": notes[0]["note"],
+        "segments": len(segments),
+        "levels": level,
+        "duration": duration
+    }
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+页面文本缓存
+进程内共享、按字节数限制大小的LRU缓存，键为 (filename, page)，
+以底层文件的 (mtime, size) 作为有效性签名，文件变化后自动失效
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from config import PAGE_TEXT_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+Signature = Optional[Tuple[int, int]]
+
+
+class PageTextCache:
+    """页面文本LRU缓存，记录命中/未命中计数"""
+
+    def __init__(self, max_bytes: int = PAGE_TEXT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[Signature, str, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _text_size(text: str) -> int:
+        # 按UTF-8编码长度估算占用，避免对每次写入做真实编码
+        return len(text) * 3 if not text.isascii() else len(text)
+
+    def get(self, filename: str, page_number: int, signature: Signature,
+            loader: Callable[[], str]) -> str:
+        """
+        读取页面文本，签名不一致或未缓存时调用loader加载
+
+        Args:
+            filename: 文件名
+            page_number: 页码
+            signature: 底层文件的 (mtime_ns, size)，None表示文件不存在（不缓存）
+            loader: 实际读取页面文本的函数
+        """
+        key = (filename, page_number)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and signature is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        text = loader()
+
+        # loader可能刚刚创建了文件（如即时提取），此时签名尚未知，留待下次读取再缓存
+        if signature is not None and text is not None:
+            self.put(filename, page_number, signature, text)
+        return text
+
+    def put(self, filename: str, page_number: int, signature: Signature, text: str):
+        """写入缓存条目并按字节上限淘汰最久未使用的条目"""
+        size = self._text_size(text)
+        if size > self.max_bytes:
+            return
+
+        key = (filename, page_number)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[2]
+            self._entries[key] = (signature, text, size)
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes and self._entries:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, filename: str, page_number: Optional[int] = None):
+        """使某一页或整个文档的缓存立即失效"""
+        with self._lock:
+            if page_number is not None:
+                keys = [(filename, page_number)] if (filename, page_number) in self._entries else []
+            else:
+                keys = [key for key in self._entries if key[0] == filename]
+
+            for key in keys:
+                _, _, size = self._entries.pop(key)
+                self.current_bytes -= size
+                self.invalidations += 1
+
+        if keys:
+            logger.debug(f"🗑️ [PAGE-CACHE] 缓存失效: {filename} {page_number or '全部页面'}，条目数: {len(keys)}")
+
+    def clear(self):
+        """清空缓存（保留计数器）"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes
+            }
+
+
+# 全局页面文本缓存实例
+page_text_cache = PageTextCache()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+页面图像渲染服务
+按分辨率档位（缩略图/查看器/视觉模型输入）和格式（PNG/WebP/JPEG）渲染PDF页面，
+在后台预渲染用户正在查看页面的相邻页，并按总字节预算以LRU方式淘汰磁盘缓存
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Optional
+
+import fitz
+
+from config import (
+    UPLOAD_DIR, PAGE_RENDER_DIR, PAGE_RENDER_TIERS, PAGE_RENDER_CACHE_MAX_BYTES,
+    PAGE_RENDER_PREFETCH_RADIUS, PAGE_RENDER_WORKERS
+)
+
+try:
+    # WebP编码依赖Pillow，未安装时回退到PNG
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    Image = None
+    HAS_PIL = False
+
+logger = logging.getLogger(__name__)
+
+FORMAT_EXTENSIONS = {"png": "png", "jpeg": "jpg", "jpg": "jpg", "webp": "webp"}
+MEDIA_TYPES = {"png": "image/png", "jpg": "image/jpeg", "webp": "image/webp"}
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+
+class PageRenderer:
+    """带字节预算LRU磁盘缓存的页面渲染器"""
+
+    def __init__(self, render_dir: str = PAGE_RENDER_DIR,
+                 max_bytes: int = PAGE_RENDER_CACHE_MAX_BYTES):
+        self.render_dir = render_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.render_dir, exist_ok=True)
+
+        # 路径 -> 文件大小，顺序即LRU顺序（末尾为最近使用）
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=PAGE_RENDER_WORKERS, thread_name_prefix="page_render")
+
+        self.renders = 0
+        self.hits = 0
+        self.evictions = 0
+
+        self._load_index()
+
+    def _load_index(self):
+        """启动时扫描渲染目录，按访问时间重建LRU顺序"""
+        entries = []
+        for entry in os.scandir(self.render_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_atime, entry.path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._index[path] = size
+            self._total_bytes += size
+        logger.info(f"🖼️ [RENDER] 渲染缓存索引已加载: {len(self._index)} 个文件, {self._total_bytes} 字节")
+        self._evict_if_needed()
+
+    @staticmethod
+    def normalize_format(fmt: Optional[str]) -> str:
+        """规范化输出格式，WebP在缺少Pillow时回退为PNG"""
+        ext = FORMAT_EXTENSIONS.get((fmt or "png").lower())
+        if ext is None:
+            raise ValueError(f"不支持的图像格式: {fmt}")
+        if ext == "webp" and not HAS_PIL:
+            return "png"
+        return ext
+
+    @staticmethod
+    def media_type(path: str) -> str:
+        """根据渲染文件扩展名获取媒体类型"""
+        return MEDIA_TYPES.get(os.path.splitext(path)[1].lstrip("."), "image/png")
+
+    def render_path(self, filename: str, page_number: int, tier: str, ext: str) -> str:
+        return os.path.join(self.render_dir, f"{filename}_page_{page_number}@{tier}.{ext}")
+
+    def get_page_image(self, filename: str, page_number: int,
+                       tier: str = "vision", fmt: str = "png") -> str:
+        """
+        获取页面图像路径，未缓存时同步渲染
+
+        Args:
+            filename: PDF文件名
+            page_number: 页码（从1开始）
+            tier: 分辨率档位，见 PAGE_RENDER_TIERS
+            fmt: 输出格式 png / jpeg / webp
+
+        Returns:
+            渲染后的图像文件路径
+        """
+        if tier not in PAGE_RENDER_TIERS:
+            raise ValueError(f"不支持的图像尺寸: {tier}")
+        ext = self.normalize_format(fmt)
+        path = self.render_path(filename, page_number, tier, ext)
+
+        with self._lock:
+            if path in self._index and os.path.exists(path):
+                self._index.move_to_end(path)
+                self.hits += 1
+                return path
+            future = self._inflight.get(path)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[path] = future
+
+        if not owner:
+            # 同一页面正在被其他线程（如预渲染）渲染，等待其结果
+            return future.result()
+
+        try:
+            self._render(filename, page_number, tier, ext, path)
+            future.set_result(path)
+            return path
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(path, None)
+
+    def _render(self, filename: str, page_number: int, tier: str, ext: str, path: str):
+        pdf_path = os.path.join(UPLOAD_DIR, filename)
+        doc = fitz.open(pdf_path)
+        try:
+            if not 1 <= page_number <= len(doc):
+                raise ValueError(f"页码超出范围: {page_number}，PDF总页数: {len(doc)}")
+            pix = doc[page_number - 1].get_pixmap(dpi=PAGE_RENDER_TIERS[tier])
+            if ext == "png":
+                data = pix.tobytes("png")
+            elif ext == "jpg":
+                data = pix.tobytes("jpeg", jpg_quality=JPEG_QUALITY)
+            else:
+                import io
+                mode = "RGBA" if pix.alpha else "RGB"
+                image = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+                buffer = io.BytesIO()
+                image.save(buffer, format="WEBP", quality=WEBP_QUALITY)
+                data = buffer.getvalue()
+        finally:
+            doc.close()
+
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            old_size = self._index.pop(path, None)
+            if old_size is not None:
+                self._total_bytes -= old_size
+            self._index[path] = len(data)
+            self._total_bytes += len(data)
+            self.renders += 1
+            self._evict_if_needed()
+
+    def _evict_if_needed(self):
+        """超出字节预算时淘汰最久未使用的渲染文件，调用方需持有锁（初始化时除外）"""
+        while self._total_bytes > self.max_bytes and self._index:
+            path, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def prefetch(self, filename: str, page_number: int, tier: str = "viewer",
+                 fmt: str = "png", radius: int = PAGE_RENDER_PREFETCH_RADIUS):
+        """在后台预渲染指定页面及其相邻页面，不阻塞调用方"""
+        if tier not in PAGE_RENDER_TIERS or radius < 0:
+            return
+        try:
+            ext = self.normalize_format(fmt)
+        except ValueError:
+            return
+
+        # 当前页优先，然后由近及远
+        candidates = [page_number]
+        for offset in range(1, radius + 1):
+            candidates.extend([page_number + offset, page_number - offset])
+
+        for candidate in candidates:
+            if candidate < 1:
+                continue
+            path = self.render_path(filename, candidate, tier, ext)
+            with self._lock:
+                if path in self._index or path in self._inflight:
+                    continue
+            self._executor.submit(self._prefetch_one, filename, candidate, tier, ext)
+
+    def _prefetch_one(self, filename: str, page_number: int, tier: str, ext: str):
+        try:
+            self.get_page_image(filename, page_number, tier, ext)
+        except ValueError:
+            # 超出页码范围等情况直接忽略
+            pass
+        except Exception as e:
+            logger.debug(f"🖼️ [RENDER] 预渲染失败: {filename} 第{page_number}页 ({tier}), 错误: {e}")
+
+    def invalidate_document(self, filename: str):
+        """删除文档的全部渲染缓存"""
+        prefix = os.path.join(self.render_dir, f"{filename}_page_")
+        with self._lock:
+            for path in [p for p in self._index if p.startswith(prefix)]:
+                self._total_bytes -= self._index.pop(path)
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def get_stats(self) -> Dict[str, object]:
+        """获取渲染缓存统计信息"""
+        with self._lock:
+            return {
+                "files": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "renders": self.renders,
+                "hits": self.hits,
+                "evictions": self.evictions,
+                "inflight": len(self._inflight),
+                "tiers": dict(PAGE_RENDER_TIERS),
+                "webp_supported": HAS_PIL
+            }
+
+
+# 全局页面渲染器实例
+page_renderer = PageRenderer()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+页面文本打包存储
+每个文档的全部页面文本保存在一个容器文件中（文本块 + 偏移索引），
+通过mmap随机访问，替代pages目录下成千上万个 {filename}_page_{i}.txt 小文件
+
+容器格式（小端序）:
+    头部    4s magic | H version | H reserved | I page_count
+    索引    (page_count + 1) 个 uint64 偏移量，相对于文本块起始位置
+    文本块  所有页面的UTF-8文本依次拼接
+
+迁移已有pages目录:
+    python page_store.py migrate [--delete-legacy]
+"""
+
+import os
+import re
+import mmap
+import struct
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from config import PAGE_DIR, PAGE_STORE_MAX_OPEN
+from page_cache import page_text_cache
+from file_index import notify_path
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"WNPG"
+VERSION = 1
+HEADER = struct.Struct("<4sHHI")
+OFFSET = struct.Struct("<Q")
+CONTAINER_SUFFIX = ".pages"
+
+LEGACY_PAGE_PATTERN = re.compile(r"^(.+)_page_(\d+)\.txt$")
+
+
+class _MappedContainer:
+    """已映射的容器文件"""
+
+    def __init__(self, path: str):
+        self.file = open(path, 'rb')
+        try:
+            stat = os.fstat(self.file.fileno())
+            self.signature = (stat.st_mtime_ns, stat.st_size)
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.file.close()
+            raise
+
+        magic, version, _, page_count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"无效的页面容器文件: {path}")
+
+        self.page_count = page_count
+        self.index_start = HEADER.size
+        self.blob_start = HEADER.size + OFFSET.size * (page_count + 1)
+
+    def page_text(self, index: int) -> str:
+        """按0起始的索引读取页面文本，直接在映射内存上切片解码"""
+        start, end = struct.unpack_from("<2Q", self.mm, self.index_start + OFFSET.size * index)
+        view = memoryview(self.mm)[self.blob_start + start:self.blob_start + end]
+        try:
+            return str(view, 'utf-8')
+        finally:
+            view.release()
+
+    def close(self):
+        try:
+            self.mm.close()
+        finally:
+            self.file.close()
+
+
+class PageStore:
+    """按文档打包的页面文本存储，保持与 get_page_text(filename, page_number) 兼容"""
+
+    def __init__(self, page_dir: str = PAGE_DIR, max_open: int = PAGE_STORE_MAX_OPEN):
+        self.page_dir = page_dir
+        self.max_open = max_open
+        # 按最近使用排序的已映射容器，超过max_open时关闭最久未使用的
+        self._maps: "OrderedDict[str, _MappedContainer]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def container_path(self, filename: str) -> str:
+        """获取文档容器文件路径"""
+        return os.path.join(self.page_dir, f"{filename}{CONTAINER_SUFFIX}")
+
+    def page_signature(self, filename: str, page_number: Optional[int] = None) -> Optional[Tuple[int, int]]:
+        """
+        获取页面底层文件的 (mtime_ns, size) 签名，供缓存校验
+
+        已打包的文档返回容器文件签名；否则返回旧格式单页文件签名，文件不存在时返回None
+        """
+        paths = [self.container_path(filename)]
+        if page_number is not None:
+            paths.append(self.legacy_page_path(filename, page_number))
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                return (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                continue
+        return None
+
+    def has_document(self, filename: str) -> bool:
+        """检查文档是否已有打包容器"""
+        return os.path.exists(self.container_path(filename))
+
+    def _get_container(self, filename: str) -> Optional[_MappedContainer]:
+        """获取（必要时重新映射）文档容器，调用方需持有锁"""
+        path = self.container_path(filename)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._close_container(filename)
+            return None
+
+        container = self._maps.get(filename)
+        if container and container.signature == (stat.st_mtime_ns, stat.st_size):
+            self._maps.move_to_end(filename)
+            return container
+
+        # 尚未映射或文件已被其他写入方替换，重新映射
+        self._close_container(filename)
+        container = _MappedContainer(path)
+        self._maps[filename] = container
+        while len(self._maps) > self.max_open:
+            _, evicted = self._maps.popitem(last=False)
+            evicted.close()
+        return container
+
+    def _close_container(self, filename: str):
+        container = self._maps.pop(filename, None)
+        if container:
+            container.close()
+
+    def page_count(self, filename: str) -> int:
+        """获取文档页数，无容器时返回0"""
+        with self._lock:
+            container = self._get_container(filename)
+            return container.page_count if container else 0
+
+    def read_page(self, filename: str, page_number: int) -> Optional[str]:
+        """
+        读取单页文本
+
+        Returns:
+            页面文本；容器不存在或页码越界时返回None
+        """
+        with self._lock:
+            container = self._get_container(filename)
+            if not container or not 1 <= page_number <= container.page_count:
+                return None
+            return container.page_text(page_number - 1)
+
+    def read_pages(self, filename: str) -> Optional[List[str]]:
+        """读取文档全部页面文本，容器不存在时返回None"""
+        with self._lock:
+            container = self._get_container(filename)
+            if not container:
+                return None
+            return [container.page_text(i) for i in range(container.page_count)]
+
+    def write_document(self, filename: str, pages: List[str]) -> str:
+        """
+        写入（覆盖）文档容器，先写临时文件再原子替换
+
+        Returns:
+            容器文件路径
+        """
+        encoded = [(text or "").encode('utf-8') for text in pages]
+        offsets = [0]
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+
+        path = self.container_path(filename)
+        tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, len(encoded)))
+            f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+            for data in encoded:
+                f.write(data)
+
+        with self._lock:
+            # Windows下无法替换仍被映射的文件，先关闭本进程内的映射
+            self._close_container(filename)
+            os.replace(tmp_path, path)
+
+        page_text_cache.invalidate(filename)
+        notify_path(path)
+        return path
+
+    def update_page(self, filename: str, page_number: int, text: str) -> bool:
+        """
+        替换容器中的单页文本（如视觉识别结果），需要重写整个容器
+
+        Returns:
+            是否写入成功；容器不存在或页码越界时返回False
+        """
+        with self._lock:
+            pages = self.read_pages(filename)
+            if pages is None or not 1 <= page_number <= len(pages):
+                return False
+            pages[page_number - 1] = text
+            self.write_document(filename, pages)
+            return True
+
+    def link_document(self, source: str, target: str) -> bool:
+        """
+        让目标文档复用源文档的容器（硬链接，不支持时复制），用于相同内容的重复上传
+        之后任一方更新页面时会原子替换为新文件，不会影响另一方
+
+        Returns:
+            源容器不存在时返回False
+        """
+        source_path = self.container_path(source)
+        if not os.path.exists(source_path):
+            return False
+        if source == target:
+            return True
+
+        path = self.container_path(target)
+        tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        try:
+            os.link(source_path, tmp_path)
+        except OSError:
+            shutil.copyfile(source_path, tmp_path)
+
+        with self._lock:
+            self._close_container(target)
+            os.replace(tmp_path, path)
+
+        page_text_cache.invalidate(target)
+        notify_path(path)
+        return True
+
+    def delete_document(self, filename: str) -> bool:
+        """删除文档容器"""
+        with self._lock:
+            self._close_container(filename)
+            page_text_cache.invalidate(filename)
+            path = self.container_path(filename)
+            if os.path.exists(path):
+                os.remove(path)
+                notify_path(path)
+                return True
+            return False
+
+    def legacy_page_path(self, filename: str, page_number: int) -> str:
+        """旧格式单页文本文件路径"""
+        return os.path.join(self.page_dir, f"{filename}_page_{page_number}.txt")
+
+    def save_page_text(self, filename: str, page_number: int, text: str) -> str:
+        """
+        保存单页文本：已打包的文档更新容器，否则写入旧格式文本文件
+
+        Returns:
+            实际写入的文件路径
+        """
+        if self.update_page(filename, page_number, text):
+            return self.container_path(filename)
+
+        page_file = self.legacy_page_path(filename, page_number)
+        with open(page_file, 'w', encoding='utf-8') as f:
+            f.write(text)
+        page_text_cache.invalidate(filename, page_number)
+        notify_path(page_file)
+        return page_file
+
+    def read_legacy_pages(self, filename: str) -> List[str]:
+        """按旧格式逐页读取文本文件，直到缺页为止"""
+        pages = []
+        i = 1
+        while True:
+            page_file = self.legacy_page_path(filename, i)
+            if not os.path.exists(page_file):
+                break
+            with open(page_file, 'r', encoding='utf-8') as f:
+                pages.append(f.read())
+            i += 1
+        return pages
+
+    def migrate_legacy(self, filename: str, delete_legacy: bool = False) -> int:
+        """
+        将文档的旧格式页面文件打包为容器
+
+        Returns:
+            打包的页数，没有旧页面文件时返回0
+        """
+        pages = self.read_legacy_pages(filename)
+
+        if not pages:
+            return 0
+
+        self.write_document(filename, pages)
+
+        if delete_legacy:
+            for page_number in range(1, len(pages) + 1):
+                try:
+                    os.remove(self.legacy_page_path(filename, page_number))
+                except OSError as e:
+                    logger.warning(f"删除旧页面文件失败: {filename} 第{page_number}页, 错误: {e}")
+
+        return len(pages)
+
+    def list_legacy_documents(self) -> List[str]:
+        """列出pages目录中仍使用旧格式的文档名"""
+        documents = set()
+        for entry in os.listdir(self.page_dir):
+            match = LEGACY_PAGE_PATTERN.match(entry)
+            if match and match.group(2) == "1":
+                documents.add(match.group(1))
+        return sorted(documents)
+
+    def migrate_all(self, delete_legacy: bool = False) -> List[Tuple[str, int]]:
+        """迁移pages目录中所有旧格式文档"""
+        migrated = []
+        for filename in self.list_legacy_documents():
+            try:
+                count = self.migrate_legacy(filename, delete_legacy=delete_legacy)
+                migrated.append((filename, count))
+                logger.info(f"📦 [PAGE-STORE] 已打包: {filename}，共{count}页")
+            except Exception as e:
+                logger.error(f"❌ [PAGE-STORE] 打包失败: {filename}, 错误: {e}")
+        return migrated
+
+
+# 全局页面存储实例
+page_store = PageStore()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="WhatNote页面文本打包存储工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="将pages目录中的旧格式页面文件打包为容器")
+    migrate_parser.add_argument("--delete-legacy", action="store_true", help="打包成功后删除旧页面文件")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        results = page_store.migrate_all(delete_legacy=args.delete_legacy)
+        total_pages = sum(count for _, count in results)
+        print(f"迁移完成：{len(results)} 个文档，共 {total_pages} 页")
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+按token预算构建提示词
+估算器把文本切分为中日韩单字、拉丁单词、数字串和标点，分别按通义千问分词器的平均比例计数。
+多页内容按模型的token预算打包：预算足够时保留全文，不足时按页面信息密度（不同词元数）
+分配预算，每页保留页码标签
+"""
+
+import re
+import math
+import logging
+from typing import Any, Dict, List, Optional, Union
+
+from config import PROMPT_CONTENT_TOKEN_BUDGETS, PROMPT_MIN_PAGE_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# 中日韩字符 | 拉丁单词 | 数字串 | 其他非空白字符
+_TOKEN_RE = re.compile(
+    r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]|[A-Za-z]+|\d+|\S"
+)
+
+# 页码标签"第N页:\n"及截断标记占用的token数
+_PAGE_TAG_TOKENS = 6
+
+
+def _unit_tokens(unit: str) -> int:
+    # 中日韩字符约1个token，英文约4个字母1个token，数字约3位1个token
+    if unit[0].isascii() and unit[0].isalpha():
+        return math.ceil(len(unit) / 4)
+    if unit[0].isdigit():
+        return math.ceil(len(unit) / 3)
+    return 1
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """估算文本的token数"""
+    if not text:
+        return 0
+    return sum(_unit_tokens(match.group()) for match in _TOKEN_RE.finditer(text))
+
+
+def estimate_messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    """估算消息列表的token数（只计文本部分，每条消息另加4个token的格式开销）"""
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        total += estimate_tokens(content) + 4
+    return total
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep_tail: bool = False) -> str:
+    """
+    截断文本使其不超过max_tokens个token
+
+    Args:
+        text: 原文本
+        max_tokens: token上限
+        keep_tail: 保留末尾部分（用于已有笔记等只需要最近上下文的场景）
+    """
+    if not text or max_tokens <= 0:
+        return ""
+    matches = list(_TOKEN_RE.finditer(text))
+    if keep_tail:
+        matches.reverse()
+    used = 0
+    for match in matches:
+        used += _unit_tokens(match.group())
+        if used > max_tokens:
+            return text[match.end():] if keep_tail else text[:match.start()]
+    return text
+
+
+def content_budget(model: str, reserved: int = 0) -> int:
+    """模型可用于页面内容的token预算，reserved为提示词中其他部分（问题、已有笔记等）占用的token数"""
+    budget = PROMPT_CONTENT_TOKEN_BUDGETS.get(model, PROMPT_CONTENT_TOKEN_BUDGETS["default"])
+    return max(budget - reserved, PROMPT_MIN_PAGE_TOKENS)
+
+
+def fit_text(text: str, model: str, reserved: int = 0, keep_tail: bool = False) -> str:
+    """把单段文本（如单页内容）截断到模型的内容预算内"""
+    budget = content_budget(model, reserved)
+    if estimate_tokens(text) <= budget:
+        return text
+    logger.info(f"✂️ [PROMPT] 文本超出预算，截断至 {budget} tokens（{model}）")
+    return truncate_to_tokens(text, budget, keep_tail=keep_tail) + "..."
+
+
+def _allocate(sizes: List[int], weights: List[int], budget: int) -> List[int]:
+    # 按权重分配预算，页面所需少于份额时取全文，多出的预算再分给其余页面
+    alloc = [0] * len(sizes)
+    active = {i for i, size in enumerate(sizes) if size > 0}
+    remaining = budget
+    while active and remaining > 0:
+        total_weight = sum(weights[i] for i in active)
+        fits = {i for i in active if sizes[i] <= remaining * weights[i] / total_weight}
+        if not fits:
+            for i in active:
+                alloc[i] = int(remaining * weights[i] / total_weight)
+            break
+        for i in fits:
+            alloc[i] = sizes[i]
+            remaining -= sizes[i]
+        active -= fits
+    return alloc
+
+
+def _format_page_ranges(page_numbers: List[int]) -> str:
+    ranges = []
+    for page in page_numbers:
+        if ranges and page == ranges[-1][1] + 1:
+            ranges[-1][1] = page
+        else:
+            ranges.append([page, page])
+    if len(ranges) > 5:
+        return f"<参考第{page_numbers[0]}页-第{page_numbers[-1]}页中的{len(page_numbers)}页内容>"
+    parts = [f"第{start}页-第{end}页" if start != end else f"第{start}页" for start, end in ranges]
+    return f"<参考{'及'.join(parts)}内容>"
+
+
+def pack_pages(pages_text: List[str], budget: int, start_page: int = 1) -> Dict[str, Any]:
+    """
+    把多页文本打包进token预算
+
+    Args:
+        pages_text: 页面文本列表，空页面会被跳过但不影响页码
+        budget: 页面内容的token预算
+        start_page: pages_text[0]对应的页码
+
+    Returns:
+        {"content": 带页码标签的内容, "page_range_info": 参考页码范围说明,
+         "pages_used": 使用的页数, "truncated_pages": 被截断的页数, "tokens": 内容token数}
+    """
+    units = [[match.group() for match in _TOKEN_RE.finditer(text or "")] for text in pages_text]
+    sizes = [sum(_unit_tokens(unit) for unit in page_units) for page_units in units]
+    # 信息密度：页面中不同词元的数量，重复的页眉页脚、目录点线等权重较低
+    weights = [len({unit.lower() for unit in page_units}) for page_units in units]
+    candidates = [i for i, size in enumerate(sizes) if size > 0]
+
+    # 页数过多、每页连最低份额都分不到时，把文档等分为若干段，每段保留信息密度最高的一页，
+    # 使开头、中间和结尾都有覆盖
+    max_pages = max(1, budget // (PROMPT_MIN_PAGE_TOKENS + _PAGE_TAG_TOKENS))
+    if len(candidates) > max_pages:
+        step = len(candidates) / max_pages
+        candidates = [
+            max(candidates[int(k * step):int((k + 1) * step)], key=lambda i: weights[i])
+            for k in range(max_pages)
+        ]
+
+    content_budget_left = max(budget - len(candidates) * _PAGE_TAG_TOKENS, 0)
+    alloc = _allocate([sizes[i] for i in candidates], [weights[i] for i in candidates], content_budget_left)
+
+    samples = []
+    truncated = 0
+    tokens = 0
+    for i, page_alloc in zip(candidates, alloc):
+        text = pages_text[i]
+        if page_alloc < sizes[i]:
+            text = truncate_to_tokens(text, page_alloc) + "..."
+            truncated += 1
+        samples.append(f"第{start_page + i}页:\n{text}")
+        tokens += min(page_alloc, sizes[i]) + _PAGE_TAG_TOKENS
+
+    page_numbers = [start_page + i for i in candidates]
+    total_pages = len(pages_text)
+    logger.info(
+        f"📦 [PROMPT] 打包 {len(candidates)}/{total_pages} 页，截断 {truncated} 页，"
+        f"约 {tokens} tokens（预算 {budget}，全文约 {sum(sizes)}）"
+    )
+    return {
+        "content": "\n\n".join(samples),
+        "page_range_info": _format_page_ranges(page_numbers) if page_numbers else "",
+        "pages_used": len(candidates),
+        "truncated_pages": truncated,
+        "tokens": tokens
+    }
+
+
+def log_prompt(prompt: Union[str, List[Dict[str, Any]]], model: str, purpose: str) -> int:
+    """记录最终提示词（文本或消息列表）的token数并返回"""
+    tokens = estimate_messages_tokens(prompt) if isinstance(prompt, list) else estimate_tokens(prompt)
+    logger.info(f"🧮 [PROMPT] {purpose} 提示词约 {tokens} tokens（{model}，内容预算 {content_budget(model)}）")
+    return tokens
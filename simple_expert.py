@@ -11,14 +11,31 @@ import logging
 import time
 import httpx
 import os
+import json
+import hashlib
 import secrets
 from typing import Dict, List, Any, Optional, AsyncGenerator, Set
-from openai import OpenAI
+from llm_client import llm_client, set_deadline, LLMUpstreamDegradedError, LLMDeadlineExceeded
+from llm_limits import llm_concurrency
+from model_router import model_router
 from datetime import datetime
-from enum import Enum
 
 # 导入任务事件管理器
 from task_event_manager import task_event_manager
+from single_flight import task_single_flight
+from task_scheduler import task_worker_pool
+from task_registry import task_registry, Task, TaskStatus
+from task_journal import task_journal
+from fair_queue import set_flow
+from note_mapreduce import generate_mapreduce_note
+from annotation_batch import plan_batches, batch_prompt, parse_batch_output
+from config import (
+    NOTE_MAPREDUCE_SEGMENT_PAGES, NOTE_MAPREDUCE_PARALLELISM, ANNOTATION_BATCH_MAX_OUTPUT_TOKENS,
+    TASK_JOURNAL_RECOVER_MAX_AGE, TASK_JOURNAL_MAX_RECOVERIES
+)
+from prompt_builder import (
+    pack_pages, content_budget, estimate_tokens, estimate_messages_tokens, truncate_to_tokens, fit_text, log_prompt
+)
 
 # 导入配置
 try:
@@ -30,26 +47,8 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
-class TaskStatus(Enum):
-    """任务状态枚举"""
-    PENDING = "pending"
-    RUNNING = "running"
-    COMPLETED = "completed"
-    FAILED = "failed"
-
-class Task:
-    """任务类"""
-    def __init__(self, task_id: str, task_type: str, params: Dict[str, Any], board_id: str):
-        self.task_id = task_id
-        self.task_type = task_type
-        self.params = params
-        self.status = TaskStatus.PENDING
-        self.result = None
-        self.error = None
-        self.created_at = datetime.now()
-        self.completed_at = None
-        self.started_at = None
-        self.board_id = board_id
+# 不转为结果文本的LLM异常：任务直接失败并发送task_failed事件（如上游降级时快速失败、超过任务截止时间）
+_TASK_ABORT_ERRORS = (LLMUpstreamDegradedError, LLMDeadlineExceeded)
 
 class SimpleExpert:
     """简化的专家LLM，支持并发任务管理"""
@@ -64,18 +63,9 @@ class SimpleExpert:
         self.custom_annotation_prompt = ''
         
         # 任务管理
-        self.tasks: Dict[str, Task] = {}
-        self.task_queue = asyncio.Queue()
         self.active_tasks: Set[str] = set()
-        self.task_results: Dict[str, Dict[str, Any]] = {}
-        self.max_concurrent_tasks = 5  # 提高并发上限到5个任务
-        
-        # 处理器状态
-        self._processor_started = False
-        self._processor_lock = asyncio.Lock()
-        
-        # 在初始化时标记需要延迟启动（避免循环依赖）
-        self._needs_delayed_start = True
+        # 已开始执行的任务协程（包括合并到其他任务、等待结果的任务），取消任务时使用
+        self._running: Dict[str, asyncio.Task] = {}
         
         # 对话历史管理
         self.conversation_history = []
@@ -85,57 +75,21 @@ class SimpleExpert:
         # 预创建HTTP客户端
         self.http_client = httpx.AsyncClient(timeout=60.0)
         
-        # 初始化LLM客户端（更灵活的API密钥处理）
-        api_key = DASHSCOPE_API_KEY or QWEN_API_KEY
-        if api_key:
-            try:
-                self.client = OpenAI(
-                    api_key=api_key,
-                    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-                )
-                self.has_llm_client = True
-                logger.info(f"🧠 [INIT] LLM客户端初始化成功: {board_id}")
-            except Exception as e:
-                logger.warning(f"⚠️ [INIT] LLM客户端初始化失败: {board_id}, 错误: {str(e)}")
-                self.client = None
-                self.has_llm_client = False
+        # LLM调用统一走共享的异步客户端（更灵活的API密钥处理）
+        self.api_key = DASHSCOPE_API_KEY or QWEN_API_KEY
+        self.has_llm_client = bool(self.api_key)
+        if self.has_llm_client:
+            logger.info(f"🧠 [INIT] LLM客户端就绪: {board_id}")
         else:
             logger.warning(f"⚠️ [INIT] 未找到API密钥，LLM功能将不可用: {board_id}")
-            self.client = None
-            self.has_llm_client = False
         
-        # 预启动任务处理器
-        self._startup_task = None
         logger.info(f"📝 [INIT] SimpleExpert初始化完成: {board_id}")
-        
-        # 立即启动任务处理器（异步）
-        try:
-            # 尝试获取当前事件循环
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                # 如果循环正在运行，创建任务
-                self._startup_task = loop.create_task(self._ensure_processor_started())
-            else:
-                # 如果没有运行的循环，标记需要延迟启动
-                self._needs_delayed_start = True
-        except RuntimeError:
-            # 没有事件循环，标记需要延迟启动
-            self._needs_delayed_start = True
-            logger.info(f"🔄 [INIT] 将在首次任务提交时启动处理器: {board_id}")
+
+    @property
+    def max_concurrent_tasks(self) -> int:
+        """最大并发任务数：全局任务池的执行上限，所有展板共享"""
+        return task_worker_pool.current_limit
     
-    async def _ensure_processor_started(self):
-        """确保任务处理器已启动"""
-        if not self._processor_started:
-            logger.info(f"🚀 [PROCESSOR] 预启动任务处理器: {self.board_id}")
-            start_time = time.time()
-            
-            # 启动任务处理器
-            asyncio.create_task(self._task_processor())
-            self._processor_started = True
-            
-            startup_time = time.time() - start_time
-            logger.info(f"✅ [PROCESSOR] 任务处理器预启动完成: {self.board_id}，耗时: {startup_time:.3f}s")
-        
     async def submit_task(self, task_type: str, params: Dict[str, Any]) -> Optional[str]:
         """提交任务到并发处理系统"""
         submit_start_time = time.time()
@@ -151,84 +105,130 @@ class SimpleExpert:
             params=params,
             board_id=self.board_id
         )
+        task.deadline_at = self._task_deadline(params, submit_start_time)
         
-        # 存储任务
-        self.tasks[task_id] = task
+        # 登记到全局任务索引，并写入任务日志（重启后据此恢复未完成的任务）
+        task_registry.add(task)
+        task_journal.record_submit(task_id, self.board_id, task_type, params)
         task_create_time = time.time()
         logger.info(f"📝 [TASK-SUBMIT] 任务对象创建完成，耗时: {task_create_time - submit_start_time:.3f}s，任务ID: {task_id}")
         
+        # 相同的任务正在排队或执行时（包括其他展板提交的），直接等待其结果，不再重复调用LLM
+        fingerprint = self._task_fingerprint(task_type, params)
+        if fingerprint:
+            is_leader, leader_id, shared_result = task_single_flight.attach(fingerprint, task_id)
+            if not is_leader:
+                task.coalesced_with = leader_id
+                asyncio.create_task(self._follow_task(task, fingerprint, shared_result))
+                return task_id
+            task.fingerprint = fingerprint
+        
         try:
-            # 快速检查并启动任务处理器
-            processor_check_time = time.time()
-            
-            # 如果有延迟启动标记，现在启动
-            if getattr(self, '_needs_delayed_start', False):
-                await self._ensure_processor_started()
-                self._needs_delayed_start = False
-            elif not self._processor_started:
-                await self._ensure_processor_started()
-            
-            logger.info(f"✅ [TASK-SUBMIT] 处理器检查完成，耗时: {time.time() - processor_check_time:.3f}s")
-            
-            # 提交任务到队列
+            # 提交到全局任务池，与其他展板的任务公平排队
             queue_submit_time = time.time()
-            await self.task_queue.put(task)
-            logger.info(f"📤 [TASK-SUBMIT] 任务已加入队列，耗时: {time.time() - queue_submit_time:.3f}s")
+            task_worker_pool.submit(task, self.board_id, task.priority, self._start_task)
+            logger.info(f"📤 [TASK-SUBMIT] 任务已加入全局任务池（优先级 {task.priority}，"
+                        f"排队 {task_worker_pool.pending()}），耗时: {time.time() - queue_submit_time:.3f}s")
             
         except Exception as e:
             logger.error(f"❌ [TASK-SUBMIT] 提交任务失败: {str(e)}", exc_info=True)
+            if task.fingerprint:
+                task_single_flight.resolve(task.fingerprint, task_id, error=e)
+            task_registry.remove(task_id)
+            task_journal.record_fail(task_id, self.board_id, task_type, f"提交任务失败: {str(e)}", 0)
             return None
         
         total_submit_time = time.time() - submit_start_time
         logger.info(f"🎯 [TASK-SUBMIT] 任务提交完成，总耗时: {total_submit_time:.3f}s，任务ID: {task_id}")
         return task_id
     
-    async def _task_processor(self):
-        """后台任务处理器"""
-        processor_start_time = time.time()
-        logger.info(f"🔧 [PROCESSOR] 任务处理器启动，时间戳: {processor_start_time}")
+    async def submit_batch_annotation(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        提交批量注释任务
         
-        while True:
-            try:
-                # 等待任务
-                queue_wait_start = time.time()
-                task = await self.task_queue.get()
-                queue_wait_time = time.time() - queue_wait_start
-                
-                logger.info(f"📥 [PROCESSOR] 从队列获取任务: {task.task_id}，等待时间: {queue_wait_time:.3f}s")
-                
-                # 检查并发限制
-                concurrent_check_time = time.time()
-                if len(self.active_tasks) >= self.max_concurrent_tasks:
-                    # 如果超过并发限制，重新放回队列
-                    logger.warning(f"⏸️ [PROCESSOR] 并发已满({len(self.active_tasks)}/{self.max_concurrent_tasks})，任务 {task.task_id} 重新入队")
-                    await asyncio.sleep(0.1)
-                    await self.task_queue.put(task)
-                    continue
-                
-                logger.info(f"✅ [PROCESSOR] 并发检查通过，耗时: {time.time() - concurrent_check_time:.3f}s")
-                
-                # 将任务标记为活跃
-                active_mark_time = time.time()
-                self.active_tasks.add(task.task_id)
-                task.status = TaskStatus.RUNNING
-                task.started_at = datetime.now()
-                
-                logger.info(f"🏃 [PROCESSOR] 任务 {task.task_id} 标记为活跃，耗时: {time.time() - active_mark_time:.3f}s")
-                logger.info(f"📊 [PROCESSOR] 当前活跃任务数: {len(self.active_tasks)}/{self.max_concurrent_tasks}")
-                
-                # 异步执行任务
-                execution_start_time = time.time()
-                asyncio.create_task(self._execute_task(task))
-                logger.info(f"🚀 [PROCESSOR] 任务 {task.task_id} 已启动执行，启动耗时: {time.time() - execution_start_time:.3f}s")
-                
-            except Exception as e:
-                logger.error(f"❌ [PROCESSOR] 任务处理器错误: {str(e)}", exc_info=True)
-                await asyncio.sleep(1)  # 错误后稍微等待
+        为每一页预先创建注释任务ID，批量任务执行时按页完成这些任务并发送各自的任务事件，
+        前端可以像单页注释一样按任务ID获取每一页的结果
+        
+        Returns:
+            {"task_id": 批量任务ID, "page_tasks": {页码: 单页任务ID}}，提交失败时返回None
+        """
+        start_page = int(params.get('start_page') or 1)
+        end_page = int(params.get('end_page') or start_page)
+        page_tasks = {}
+        for page in range(start_page, end_page + 1):
+            page_task_id = f"annotation_task_{int(time.time() * 1000)}_{secrets.token_hex(2)}"
+            task_registry.add(Task(
+                task_id=page_task_id,
+                task_type="annotation",
+                params={**params, "pageNumber": page},
+                board_id=self.board_id
+            ))
+            page_tasks[page] = page_task_id
+        
+        task_id = await self.submit_task("generate_batch_annotation", {**params, "page_tasks": page_tasks})
+        if not task_id:
+            for page_task_id in page_tasks.values():
+                task_registry.remove(page_task_id)
+            return None
+        return {"task_id": task_id, "page_tasks": page_tasks}
+    
+    def recover_task(self, task_id: str, task_type: str, params: Dict[str, Any],
+                     submitted_at: Optional[float] = None):
+        """
+        按原任务ID重新排队上次运行中未完成的任务（不参与相同任务合并）
+        
+        批量注释任务只重新登记上次未完成的页面，已完成页面的结果仍可从任务日志中按原任务ID查询；
+        截止时间仍从最初提交时算起
+        """
+        task = Task(task_id=task_id, task_type=task_type, params=params, board_id=self.board_id)
+        task.deadline_at = self._task_deadline(params, submitted_at or time.time())
+        task_registry.add(task)
+        if task_type == "generate_batch_annotation":
+            page_tasks = params.get("page_tasks") or {}
+            completed = set(task_journal.completed(page_tasks.values()))
+            page_params = {key: value for key, value in params.items() if key != "page_tasks"}
+            for page, page_task_id in page_tasks.items():
+                if page_task_id not in completed and task_registry.get(page_task_id) is None:
+                    task_registry.add(Task(
+                        task_id=page_task_id,
+                        task_type="annotation",
+                        params={**page_params, "pageNumber": int(page)},
+                        board_id=self.board_id
+                    ))
+        
+        task_journal.record_recover(task_id, self.board_id, task_type)
+        task_worker_pool.submit(task, self.board_id, task.priority, self._start_task)
+        logger.info(f"♻️ [TASK-RECOVER] 已恢复任务: {task_id}（{task_type}），展板: {self.board_id}")
+    
+    def _start_task(self, task: Task):
+        """任务从全局任务池出队后启动执行（名额已由任务池占用，执行结束时释放）"""
+        logger.info(f"📥 [PROCESSOR] 调度任务: {task.task_id}（优先级 {task.priority}），"
+                    f"排队 {(datetime.now() - task.created_at).total_seconds():.3f}s")
+        
+        # 将任务标记为活跃（排队时已取消、只为合并到它的任务执行的不再记录开始）
+        self.active_tasks.add(task.task_id)
+        if not task.cancel_requested:
+            task.status = TaskStatus.RUNNING
+            task.started_at = datetime.now()
+            task_journal.record_start(task.task_id, self.board_id, task.task_type)
+        logger.info(f"📊 [PROCESSOR] 展板活跃任务数: {len(self.active_tasks)}，"
+                    f"全局执行中: {task_worker_pool.running}/{self.max_concurrent_tasks}")
+        
+        # 异步执行任务
+        asyncio.create_task(self._execute_task(task))
     
     async def _execute_task(self, task: Task):
         """执行任务"""
+        # 任务中发起的LLM调用按所属课程、展板和任务优先级公平排队，且不超过任务的截止时间
+        set_flow(self.board_id, task_worker_pool.course_of(self.board_id), task.priority)
+        set_deadline(task.deadline_at)
+        self._running[task.task_id] = asyncio.current_task()
+        work = None
         try:
+            if task.cancel_requested:
+                # 启动后、开始执行前已被取消
+                raise asyncio.CancelledError()
+            
             logger.info(f"开始执行任务: {task.task_id}, 类型: {task.task_type}")
             task.status = TaskStatus.RUNNING
             task.start_time = time.time()
@@ -245,101 +245,462 @@ class SimpleExpert:
                 }
             )
             
-            # 根据任务类型执行对应的处理
-            if task.task_type == "annotation" or task.task_type == "generate_annotation":
-                filename = task.params.get('filename')
-                page_number = task.params.get('pageNumber', task.params.get('page_number'))
-                
-                # 🔧 新增：支持显式传递的风格参数
-                annotation_style = task.params.get('annotationStyle')
-                custom_prompt = task.params.get('customPrompt')
-                
-                # 🔧 修复：处理systemPrompt参数（批量注释功能）
-                # 批量注释的systemPrompt优先级最高，直接覆盖其他设置
-                system_prompt = task.params.get('systemPrompt')
-                if system_prompt:
-                    annotation_style = 'custom'
-                    custom_prompt = system_prompt
-                result = await self._generate_annotation_task(filename, page_number, annotation_style, custom_prompt)
-            elif task.task_type == "vision_annotation":
-                result = await self._vision_annotation_task(task.params)
-            elif task.task_type == "improve_annotation":
-                result = await self._improve_annotation_task(task.params)
-            elif task.task_type == "generate_note":
-                result = await self._generate_note_task(task.params)
-            elif task.task_type == "generate_segmented_note":
-                result = await self._generate_segmented_note_task(task.params)
-            elif task.task_type == "generate_board_note":
-                result = await self._generate_board_note_task(task.params)
-            elif task.task_type == "improve_board_note":
-                result = await self._improve_board_note_task(task.params)
-            elif task.task_type == "answer_question":
-                result = await self._ask_question_task(task.params)
-            elif task.task_type == "general_query":
-                result = await self._general_query_task(task.params)
+            work = self._run_until_deadline(task, self._run_task(task))
+            if task.fingerprint:
+                # 上游调用单独执行：本任务被取消时，合并到它的任务仍能等到结果
+                work = asyncio.ensure_future(work)
+                result = await asyncio.shield(work)
             else:
-                raise ValueError(f"未知的任务类型: {task.task_type}")
+                result = await work
+            
+            # 把结果交给合并到此任务的相同任务
+            if task.fingerprint:
+                task_single_flight.resolve(task.fingerprint, task.task_id, result=result)
+            
+            await self._complete_task(task, result)
+            
+        except asyncio.CancelledError:
+            if not task.cancel_requested:
+                # 服务关闭等情况下的中止不记为结束，任务日志中保持未完成，下次启动时恢复
+                if isinstance(work, asyncio.Future):
+                    work.cancel()
+                raise
+            if task.status != TaskStatus.CANCELLED:
+                await self._cancelled_task(task, keep_params=bool(task.fingerprint))
+            if task.fingerprint:
+                await self._serve_followers(task, work)
+        
+        except Exception as e:
+            if task.fingerprint:
+                task_single_flight.resolve(task.fingerprint, task.task_id, error=e)
             
-            # 任务完成
-            task.status = TaskStatus.COMPLETED
-            task.result = result
-            task.end_time = time.time()
-            task.duration = task.end_time - task.start_time
+            await self._fail_task(task, e)
+        
+        finally:
+            # 从活动任务中移除，空出的名额立即交给下一个任务
+            self._running.pop(task.task_id, None)
+            self.active_tasks.discard(task.task_id)
+            task_worker_pool.release(self.board_id)
+            if task.fingerprint:
+                # 任务被取消等情况下也要释放等待者
+                task_single_flight.resolve(task.fingerprint, task.task_id, error=RuntimeError("合并的任务已中止"))
+    
+    async def _run_task(self, task: Task) -> Any:
+        """按任务类型执行对应的处理，返回任务结果"""
+        if task.task_type == "annotation" or task.task_type == "generate_annotation":
+            filename = task.params.get('filename')
+            page_number = task.params.get('pageNumber', task.params.get('page_number'))
+            
+            # 🔧 新增：支持显式传递的风格参数
+            annotation_style = task.params.get('annotationStyle')
+            custom_prompt = task.params.get('customPrompt')
+            
+            # 🔧 修复：处理systemPrompt参数（批量注释功能）
+            # 批量注释的systemPrompt优先级最高，直接覆盖其他设置
+            system_prompt = task.params.get('systemPrompt')
+            if system_prompt:
+                annotation_style = 'custom'
+                custom_prompt = system_prompt
+            # "重新生成"时跳过LLM响应缓存
+            regenerate = bool(task.params.get('regenerate'))
+            return await self._generate_annotation_task(filename, page_number, annotation_style, custom_prompt,
+                                                        regenerate=regenerate)
+        elif task.task_type == "generate_batch_annotation":
+            return await self._batch_annotation_task(task.task_id, task.params)
+        elif task.task_type == "vision_annotation":
+            return await self._vision_annotation_task(task.params)
+        elif task.task_type == "improve_annotation":
+            return await self._improve_annotation_task(task.params)
+        elif task.task_type == "generate_note":
+            return await self._generate_note_task(task.params)
+        elif task.task_type == "generate_segmented_note":
+            return await self._generate_segmented_note_task(task.params)
+        elif task.task_type == "generate_mapreduce_note":
+            return await self._generate_mapreduce_note_task(task.task_id, task.params)
+        elif task.task_type == "generate_board_note":
+            return await self._generate_board_note_task(task.params)
+        elif task.task_type == "improve_board_note":
+            return await self._improve_board_note_task(task.params)
+        elif task.task_type == "answer_question":
+            return await self._ask_question_task(task.params)
+        elif task.task_type == "general_query":
+            return await self._general_query_task(task.params)
+        else:
+            raise ValueError(f"未知的任务类型: {task.task_type}")
+    
+    @staticmethod
+    def _task_deadline(params: Dict[str, Any], submitted_at: float) -> Optional[float]:
+        """任务参数中的deadline（提交后的秒数）换算为截止时间戳，未设置或无效时返回None"""
+        try:
+            deadline = float(params.get('deadline'))
+        except (TypeError, ValueError):
+            return None
+        return submitted_at + deadline if deadline > 0 else None
+    
+    async def _run_until_deadline(self, task: Task, awaitable) -> Any:
+        """
+        等待任务执行结果，超过任务截止时间时中止执行（LLM调用随之取消）并抛出TimeoutError
+        
+        部分任务会把LLM调用的异常转为结果文本返回，截止时间之后才得到的结果同样按超时处理
+        """
+        if task.deadline_at is None:
+            return await awaitable
+        remaining = task.deadline_at - time.time()
+        try:
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            result = await asyncio.wait_for(awaitable, remaining)
+            if time.time() >= task.deadline_at:
+                raise asyncio.TimeoutError()
+            return result
+        except asyncio.TimeoutError:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise TimeoutError(f"任务超过截止时间（提交后{task.params.get('deadline')}秒）") from None
+    
+    async def _serve_followers(self, task: Task, work: Optional[asyncio.Future]):
+        """
+        已取消的任务仍有合并到它的任务在等待时，继续完成上游调用（尚未开始时开始执行）并把结果交给它们；
+        没有等待的任务或等待的任务都已离开时中止上游调用
+        """
+        try:
+            if not task_single_flight.has_followers(task.fingerprint, task.task_id):
+                if work is not None:
+                    # 等上游调用中止后再释放执行名额
+                    work.cancel()
+                    await asyncio.wait({work})
+                return
+            if work is None:
+                work = asyncio.ensure_future(self._run_until_deadline(task, self._run_task(task)))
+            task_single_flight.abandon(task.fingerprint, task.task_id, work)
+            logger.info(f"🔗 [SINGLE-FLIGHT] 任务 {task.task_id} 已取消，继续执行上游调用供合并的任务使用")
+            try:
+                await asyncio.wait({work})
+            except asyncio.CancelledError:
+                work.cancel()
+                raise
+        finally:
+            # 取消时保留的执行参数
+            task.params = None
+        if work.cancelled():
+            return
+        if work.exception() is not None:
+            task_single_flight.resolve(task.fingerprint, task.task_id, error=work.exception())
+        else:
+            task_single_flight.resolve(task.fingerprint, task.task_id, result=work.result())
+    
+    async def _complete_task(self, task: Task, result: Any):
+        """记录任务完成并发送完成事件"""
+        task.end_time = time.time()
+        task.duration = task.end_time - task.start_time
+        
+        # 保存结果以便按任务ID查询（较大的结果写入磁盘），并写入任务日志
+        task_journal.record_complete(task.task_id, self.board_id, task.task_type, result, task.duration)
+        task_registry.finish(task, TaskStatus.COMPLETED, result=result)
+        
+        # ✅ 发送任务完成事件
+        await task_event_manager.notify_task_completed(
+            board_id=self.board_id,
+            task_id=task.task_id,
+            result=result
+        )
+        
+        logger.info(f"任务完成: {task.task_id}, 耗时: {task.duration:.3f}秒, 结果长度: {len(str(result)) if result else 0}")
+    
+    async def _fail_task(self, task: Task, error: BaseException):
+        """记录任务失败并发送失败事件"""
+        task.end_time = time.time()
+        task.duration = task.end_time - task.start_time if task.start_time else 0
+        
+        # 保存失败信息以便按任务ID查询，并写入任务日志
+        task_journal.record_fail(task.task_id, self.board_id, task.task_type, str(error), task.duration)
+        task_registry.finish(task, TaskStatus.FAILED, error=str(error))
+        
+        # ❌ 发送任务失败事件
+        await task_event_manager.notify_task_failed(
+            board_id=self.board_id,
+            task_id=task.task_id,
+            error=str(error)
+        )
+        
+        logger.error(f"任务失败: {task.task_id}, 错误: {str(error)}, 耗时: {task.duration:.3f}秒")
+    
+    async def _cancelled_task(self, task: Task, keep_params: bool = False):
+        """记录任务已取消并发送取消事件，keep_params为True时保留执行参数（继续为合并的任务执行）"""
+        task.end_time = time.time()
+        task.duration = task.end_time - task.start_time if task.start_time else 0
+        
+        params = task.params
+        task_journal.record_cancel(task.task_id, self.board_id, task.task_type, "任务已取消", task.duration)
+        task_registry.finish(task, TaskStatus.CANCELLED, error="任务已取消")
+        if keep_params:
+            task.params = params
+        
+        # 🛑 发送任务取消事件
+        await task_event_manager.notify_task_cancelled(
+            board_id=self.board_id,
+            task_id=task.task_id,
+            task_type=task.task_type
+        )
+        
+        logger.info(f"🛑 任务已取消: {task.task_id}, 耗时: {task.duration:.3f}秒")
+    
+    async def cancel_task(self, task_id: str) -> bool:
+        """
+        取消本展板排队或执行中的任务
+        
+        排队中的任务直接移出全局任务池；执行中的任务取消其执行协程，进行中的LLM调用随之中止
+        （上游流式连接关闭、并发名额释放），执行名额空出后交给下一个任务。
+        取消合并了其他任务的任务时，本任务立即记为已取消，上游调用继续执行（排队中的留在任务池中），
+        结果交给合并到它的任务；批量注释中的单页任务不能单独取消
+        
+        Returns:
+            是否已取消，任务不存在、不属于本展板或已结束时返回False
+        """
+        task = task_registry.get(task_id)
+        if task is None or task.board_id != self.board_id or task.cancel_requested:
+            return False
+        if task.status not in (TaskStatus.PENDING, TaskStatus.RUNNING):
+            return False
+        
+        running = self._running.get(task_id)
+        if running is not None:
+            task.cancel_requested = True
+            running.cancel()
+        elif task.fingerprint and task_single_flight.has_followers(task.fingerprint, task_id):
+            # 留在任务池中，出队后只为合并到它的任务执行
+            task.cancel_requested = True
+            await self._cancelled_task(task, keep_params=True)
+        elif task_worker_pool.discard(task, self.board_id, task.priority):
+            task.cancel_requested = True
+            if task.fingerprint:
+                task_single_flight.resolve(task.fingerprint, task.task_id, error=RuntimeError("合并的任务已取消"))
+            await self._cancelled_task(task)
+        elif task_id in self.active_tasks or task.coalesced_with:
+            # 已出队或已合并但执行协程尚未开始，协程开始时检查取消标记
+            task.cancel_requested = True
+        else:
+            return False
+        
+        logger.info(f"🛑 [TASK-CANCEL] 已取消任务: {task_id}（{task.task_type}），展板: {self.board_id}")
+        return True
+    
+    async def _follow_task(self, task: Task, fingerprint: str, shared_result: asyncio.Future):
+        """合并到进行中的相同任务：不占用并发名额，以自己的任务ID接收同一结果和事件"""
+        self._running[task.task_id] = asyncio.current_task()
+        try:
+            if task.cancel_requested:
+                raise asyncio.CancelledError()
             
-            # 存储任务结果到task_results以便查询 - 确保所有值都可序列化
-            self.task_results[task.task_id] = {
-                "status": "completed",
-                "result": str(result) if result is not None else "",  # 确保结果是字符串
-                "task_type": str(task.task_type),
-                "task_id": str(task.task_id),
-                "board_id": str(self.board_id),
-                "success": True,
-                "duration": float(task.duration)
-            }
+            task.status = TaskStatus.RUNNING
+            task.started_at = datetime.now()
+            task.start_time = time.time()
             
-            # ✅ 发送任务完成事件
-            await task_event_manager.notify_task_completed(
+            await task_event_manager.notify_task_started(
                 board_id=self.board_id,
                 task_id=task.task_id,
-                result=result
+                task_info={
+                    "task_type": task.task_type,
+                    "description": self._get_task_description(task),
+                    "board_id": self.board_id,
+                    "params": task.params,
+                    "coalesced_with": task.coalesced_with
+                }
             )
             
-            logger.info(f"任务完成: {task.task_id}, 耗时: {task.duration:.3f}秒, 结果长度: {len(str(result)) if result else 0}")
-            
+            # 只停止等待，不影响被合并的任务
+            result = await self._run_until_deadline(task, asyncio.shield(shared_result))
+        except asyncio.CancelledError:
+            if not task.cancel_requested:
+                raise
+            await self._cancelled_task(task)
+            return
         except Exception as e:
-            # 任务失败
-            task.status = TaskStatus.FAILED
-            task.error = str(e)
-            task.end_time = time.time()
-            task.duration = task.end_time - task.start_time if task.start_time else 0
-            
-            # 存储失败结果 - 确保所有值都可序列化
-            self.task_results[task.task_id] = {
-                "status": "failed",
-                "error": str(e),
-                "task_type": str(task.task_type),
-                "task_id": str(task.task_id),
-                "board_id": str(self.board_id),
-                "success": False,
-                "duration": float(task.duration)
+            await self._fail_task(task, e)
+            return
+        finally:
+            self._running.pop(task.task_id, None)
+            task_single_flight.leave(fingerprint, task.task_id)
+        await self._complete_task(task, result)
+    
+    def _task_fingerprint(self, task_type: str, params: Dict[str, Any]) -> Optional[str]:
+        """
+        计算任务的规范指纹，结果只取决于指纹中字段的任务才参与合并
+        
+        注释任务按 (文件, 页码, 实际生效的风格和自定义提示, 是否重新生成) 计算，
+        并行整本笔记按 (文件, 每段页数, 是否重新生成) 计算，均与展板和会话无关；
+        普通笔记、分段笔记（经展板对话历史生成）、问答、改进等依赖展板对话历史或其他上下文的任务不合并
+        """
+        if task_type in ("annotation", "generate_annotation"):
+            style, custom_prompt = self._resolve_annotation_style(params)
+            canonical = {
+                "type": "annotation",
+                "filename": params.get('filename'),
+                "page": int(params.get('pageNumber', params.get('page_number')) or 0),
+                "style": style,
+                "custom_prompt": custom_prompt if style == 'custom' else None,
+                "regenerate": bool(params.get('regenerate'))
             }
-            
-            # ❌ 发送任务失败事件
-            await task_event_manager.notify_task_failed(
-                board_id=self.board_id,
-                task_id=task.task_id,
-                error=str(e)
-            )
-            
-            logger.error(f"任务失败: {task.task_id}, 错误: {str(e)}, 耗时: {task.duration:.3f}秒")
+        elif task_type == "generate_mapreduce_note":
+            canonical = {
+                "type": task_type,
+                "filename": params.get('filename'),
+                "segment_pages": params.get('segment_pages'),
+                "regenerate": bool(params.get('regenerate'))
+            }
+        else:
+            return None
+        raw = json.dumps(canonical, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def _resolve_annotation_style(self, params: Dict[str, Any]):
+        """注释任务实际生效的 (风格, 自定义提示)：批量注释的systemPrompt优先，其次是显式风格，最后是实例设置"""
+        if params.get('systemPrompt'):
+            return 'custom', params.get('systemPrompt')
+        if params.get('annotationStyle'):
+            return params.get('annotationStyle'), params.get('customPrompt')
+        return self.annotation_style, self.custom_annotation_prompt
+    
+    async def _batch_annotation_task(self, task_id: str, params: Dict[str, Any]) -> str:
+        """
+        批量注释：连续的短页面打包为一次请求按页输出，其余页面逐页生成
+        
+        每一页的结果记录到提交时预先创建的单页任务中，并发送各自的开始/完成事件；
+        打包超出预算、调用失败或输出无法解析的页面回退为逐页调用
+        """
+        filename = params.get('filename')
+        page_tasks = {int(page): page_task_id for page, page_task_id in (params.get('page_tasks') or {}).items()}
+        # 只生成待处理的页面：重启后恢复的批量任务中，上次已完成的页面不在任务索引中
+        pending_pages = []
+        for page in sorted(page_tasks):
+            page_task = task_registry.get(page_tasks[page])
+            if page_task is not None and page_task.status == TaskStatus.PENDING:
+                pending_pages.append(page)
+        style, custom_prompt = self._resolve_annotation_style(params)
+        regenerate = bool(params.get('regenerate'))
+        stats = {"calls": 0, "batched_pages": 0, "fallback_pages": 0}
+        pages: List[Dict[str, Any]] = []
+        
+        async def _annotate_page(page: int):
+            page_task = task_registry.get(page_tasks[page])
+            try:
+                result = await self._generate_annotation_task(filename, page, style, custom_prompt,
+                                                              regenerate=regenerate)
+                stats["calls"] += 1
+                await self._complete_task(page_task, result)
+            except Exception as e:
+                await self._fail_task(page_task, e)
+        
+        async def _run_batch(batch: List[Dict[str, Any]]):
+            for page in batch:
+                await self._start_page_task(task_registry.get(page_tasks[page["page"]]), task_id)
+            annotations = {}
+            if len(batch) > 1:
+                annotations = await self._annotate_batch(filename, batch, style, custom_prompt, regenerate)
+                stats["calls"] += 1
+                stats["batched_pages"] += len(annotations)
+                stats["fallback_pages"] += len(batch) - len(annotations)
+            for page, annotation in annotations.items():
+                await self._complete_task(task_registry.get(page_tasks[page]), annotation)
+            await asyncio.gather(*(_annotate_page(page["page"]) for page in batch if page["page"] not in annotations))
         
+        try:
+            # 读取页面文字，扫描页和文字不足的页面不参与打包
+            from controller import get_page_text
+            from ingest_manifest import ingest_manifest
+            for page in pending_pages:
+                text = None
+                page_info = ingest_manifest.page_info(filename, page)
+                if not (page_info and page_info["type"] == "scanned"):
+                    try:
+                        text = get_page_text(filename, page)
+                    except Exception as e:
+                        logger.warning(f"读取 {filename} 第{page}页文字失败: {str(e)}")
+                pages.append({"page": page, "text": text.strip() if text and len(text.strip()) > 50 else None})
+        
+            batches = plan_batches(pages)
+            logger.info(f"📚 [BATCH-ANNOTATION] {filename} 共 {len(pages)} 页，分为 {len(batches)} 组，"
+                        f"其中 {sum(1 for batch in batches if len(batch) > 1)} 组打包请求")
+        
+            await asyncio.gather(*(_run_batch(batch) for batch in batches))
         finally:
-            # 从活动任务中移除
-            self.active_tasks.discard(task.task_id)
+            # 批量任务异常中止时，未完成的单页任务一并标记失败（批量任务被取消时一并标记取消）
+            batch_task = task_registry.get(task_id)
+            cancelled = batch_task is not None and batch_task.cancel_requested
+            for page_task_id in page_tasks.values():
+                page_task = task_registry.get(page_task_id)
+                if page_task and page_task.status in (TaskStatus.PENDING, TaskStatus.RUNNING):
+                    if cancelled:
+                        await self._cancelled_task(page_task)
+                    else:
+                        await self._fail_task(page_task, RuntimeError("批量注释任务已中止"))
+        
+        logger.info(f"✅ [BATCH-ANNOTATION] {filename} 批量注释完成，{len(pages)} 页共调用 {stats['calls']} 次，"
+                    f"打包完成 {stats['batched_pages']} 页，回退逐页 {stats['fallback_pages']} 页")
+        return json.dumps({"page_tasks": page_tasks, "pages": len(pages), **stats}, ensure_ascii=False)
+    
+    async def _start_page_task(self, task: Task, batch_task_id: str):
+        """把批量注释中的单页任务标记为执行中并发送开始事件"""
+        task.status = TaskStatus.RUNNING
+        task.started_at = datetime.now()
+        task.start_time = time.time()
+        await task_event_manager.notify_task_started(
+            board_id=self.board_id,
+            task_id=task.task_id,
+            task_info={
+                "task_type": task.task_type,
+                "description": self._get_task_description(task),
+                "board_id": self.board_id,
+                "params": {key: value for key, value in task.params.items() if key != "page_tasks"},
+                "batch_task_id": batch_task_id
+            }
+        )
+    
+    async def _annotate_batch(self, filename: str, batch: List[Dict[str, Any]], style: str,
+                              custom_prompt: Optional[str], regenerate: bool) -> Dict[int, str]:
+        """打包的多页注释请求，返回解析成功的各页注释；超出预算、调用失败或无法解析时返回空字典"""
+        page_numbers = [page["page"] for page in batch]
+        tokens = sum(estimate_tokens(page["text"]) for page in batch)
+        route = model_router.route("annotation", style, tokens)
+        if tokens > content_budget(route["model"]):
+            logger.info(f"📚 [BATCH-ANNOTATION] 第{page_numbers[0]}-{page_numbers[-1]}页超出{route['model']}的内容预算，逐页生成")
+            return {}
+        
+        prompt = batch_prompt(filename, batch, style, custom_prompt)
+        log_prompt(prompt, route["model"], f"批量注释 {filename} 第{page_numbers[0]}-{page_numbers[-1]}页")
+        try:
+            output = await llm_client.chat(
+                model=route["model"],
+                api_key=self.api_key,
+                cache=True,
+                cache_style=style,
+                refresh=regenerate,
+                messages=[
+                    {"role": "system", "content": "你是一个专业的学术助手，擅长为PDF内容生成详细的学术注释。你严格按要求输出JSON。"},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=min((route["max_tokens"] or 2000) * len(batch), ANNOTATION_BATCH_MAX_OUTPUT_TOKENS),
+                timeout=route["timeout"] * 2,
+                temperature=0.7
+            )
+        except _TASK_ABORT_ERRORS:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ [BATCH-ANNOTATION] 第{page_numbers[0]}-{page_numbers[-1]}页打包请求失败，逐页生成: {str(e)}")
+            return {}
+        
+        annotations = parse_batch_output(output, page_numbers)
+        if len(annotations) < len(batch):
+            missing = [page for page in page_numbers if page not in annotations]
+            logger.warning(f"⚠️ [BATCH-ANNOTATION] 打包输出缺少第{missing}页，这些页面逐页生成")
+        return annotations
     
-    async def _generate_annotation_task(self, filename: str, page_number: int, annotation_style: str = None, custom_prompt: str = None) -> str:
+    async def _generate_annotation_task(self, filename: str, page_number: int, annotation_style: str = None,
+                                        custom_prompt: str = None, regenerate: bool = False) -> str:
         """
         生成页面注释任务 - 支持多种注释风格
+        
+        相同页面、相同风格的请求命中LLM响应缓存，regenerate为True时跳过缓存重新生成
         """
         start_time = time.time()
         
@@ -357,32 +718,43 @@ class SimpleExpert:
                 custom_prompt = self.custom_annotation_prompt
                 logger.info(f"使用实例设置的注释风格: {annotation_style}")
             
-            # 首先尝试获取PDF文字内容
+            # 首先尝试获取PDF文字内容，导入清单已标记为扫描页时直接使用图像识别
             try:
                 from controller import get_page_text
-                page_text = get_page_text(filename, page_number)
+                from ingest_manifest import ingest_manifest
+                page_info = ingest_manifest.page_info(filename, page_number)
+                if page_info and page_info["type"] == "scanned":
+                    page_text = ""
+                    logger.info(f"导入清单显示第{page_number}页为扫描页({page_info['chars']}字符)，跳过文字读取")
+                else:
+                    page_text = get_page_text(filename, page_number)
                 
                 if page_text and len(page_text.strip()) > 50:  # 文字内容充足
                     logger.info(f"使用PDF文字生成注释，文字长度: {len(page_text)} 字符")
                     
-                    # 根据风格选择提示词模板
+                    # 按风格和页面大小选择模型，根据风格选择提示词模板，页面文字截断到模型预算内
+                    route = model_router.route("annotation", annotation_style, estimate_tokens(page_text))
                     annotation_prompt = self._get_annotation_prompt(
-                        filename, page_number, page_text, annotation_style, custom_prompt
+                        filename, page_number, fit_text(page_text, route["model"]), annotation_style, custom_prompt
                     )
+                    log_prompt(annotation_prompt, route["model"], f"注释 {filename} 第{page_number}页")
                     
                     # 使用通用LLM生成注释
-                    if self.has_llm_client and self.client:
-                        response = self.client.chat.completions.create(
-                            model="qwen-plus",
+                    if self.has_llm_client:
+                        annotation_content = await llm_client.chat(
+                            model=route["model"],
+                            api_key=self.api_key,
+                            cache=True,
+                            cache_style=annotation_style,
+                            refresh=regenerate,
                             messages=[
                                 {"role": "system", "content": "你是一个专业的学术助手，擅长为PDF内容生成详细的学术注释。"},
                                 {"role": "user", "content": annotation_prompt}
                             ],
-                            max_tokens=2000,
+                            max_tokens=route["max_tokens"],
+                            timeout=route["timeout"],
                             temperature=0.7
                         )
-                        
-                        annotation_content = response.choices[0].message.content
                         execution_time = time.time() - start_time
                         
                         logger.info(f"基于文字的注释生成完成，风格: {annotation_style}，长度: {len(annotation_content)} 字符，耗时: {execution_time:.3f}秒")
@@ -394,6 +766,8 @@ class SimpleExpert:
                 else:
                     logger.info(f"PDF文字内容不足({len(page_text) if page_text else 0}字符)，将使用图像识别")
                     
+            except _TASK_ABORT_ERRORS:
+                raise
             except Exception as e:
                 logger.warning(f"PDF文字提取失败: {str(e)}，将使用图像识别")
             
@@ -420,12 +794,17 @@ class SimpleExpert:
                     filename, page_number, annotation_style, custom_prompt
                 )
                 
-                if self.has_llm_client and self.client:
+                if self.has_llm_client:
                     logger.info(f"正在调用视觉LLM API进行图像分析，风格: {annotation_style}...")
                     
                     # 使用支持视觉的模型和正确的API格式
-                    response = self.client.chat.completions.create(
-                        model="qwen-vl-plus",  # 使用支持视觉的模型
+                    route = model_router.route("vision_annotation", annotation_style)
+                    annotation_content = await llm_client.chat(
+                        model=route["model"],  # 使用支持视觉的模型
+                        api_key=self.api_key,
+                        cache=True,
+                        cache_style=annotation_style,
+                        refresh=regenerate,
                         messages=[
                             {
                                 "role": "user", 
@@ -443,11 +822,10 @@ class SimpleExpert:
                                 ]
                             }
                         ],
-                        max_tokens=3000,  # 增加token限制以获得更详细的分析
+                        max_tokens=route["max_tokens"],
+                        timeout=route["timeout"],
                         temperature=0.3   # 降低温度以获得更准确的分析
                     )
-                    
-                    annotation_content = response.choices[0].message.content
                     execution_time = time.time() - start_time
                     
                     logger.info(f"基于图像的注释生成完成，风格: {annotation_style}，长度: {len(annotation_content)} 字符，耗时: {execution_time:.3f}秒")
@@ -466,27 +844,34 @@ class SimpleExpert:
 
 请确保内容准确且具有学术价值。"""
                         
-                        fallback_response = self.client.chat.completions.create(
-                            model="qwen-plus",
+                        text_route = model_router.route("annotation", annotation_style, estimate_tokens(fallback_prompt))
+                        fallback_response = await llm_client.chat(
+                            model=text_route["model"],
+                            api_key=self.api_key,
                             messages=[
                                 {"role": "system", "content": "你是一个专业的生物学学术助手，擅长细胞结构与形态学内容。"},
                                 {"role": "user", "content": fallback_prompt}
                             ],
-                            max_tokens=2000,
+                            max_tokens=text_route["max_tokens"],
+                            timeout=text_route["timeout"],
                             temperature=0.7
                         )
                         
-                        annotation_content = f"**注：由于视觉识别限制，以下是基于课程内容的推测性注释**\n\n{fallback_response.choices[0].message.content}"
+                        annotation_content = f"**注：由于视觉识别限制，以下是基于课程内容的推测性注释**\n\n{fallback_response}"
                     
                     return annotation_content
                 else:
                     logger.warning("LLM客户端不可用，无法生成注释")
                     return "LLM服务不可用，无法生成注释"
                     
+            except _TASK_ABORT_ERRORS:
+                raise
             except Exception as e:
                 logger.error(f"图像识别注释生成失败: {str(e)}")
                 return f"注释生成失败: {str(e)}"
             
+        except _TASK_ABORT_ERRORS:
+            raise
         except Exception as e:
             execution_time = time.time() - start_time
             error_msg = f"注释生成任务失败: {str(e)}"
@@ -668,7 +1053,7 @@ PDF文件：{filename}
         }
     
     async def _improve_annotation_task(self, params: Dict[str, Any]) -> str:
-        """改进注释任务"""
+        """改进注释任务：没有当前注释时生成新注释，否则按改进要求改进（在任务上下文中直接调用LLM）"""
         filename = params.get('filename')
         page_number = params.get('pageNumber', params.get('page_number'))
         current_annotation = params.get('currentAnnotation', params.get('current_annotation', ''))
@@ -676,30 +1061,21 @@ PDF文件：{filename}
         
         logger.info(f"🔄 改进注释任务: {filename} 第{page_number}页, 当前注释长度: {len(current_annotation)}, 改进要求: {improve_request}")
         
-        # 调用改进注释API
-        response = await self.http_client.post(
-            f"http://127.0.0.1:8000/api/materials/{filename}/pages/{page_number}/improve-annotation",
-            json={
-                "current_annotation": current_annotation,
-                "improve_request": improve_request,
-                "board_id": self.board_id
-            },
-            timeout=60.0
-        )
+        if not current_annotation:
+            logger.info("没有提供现有注释内容，将执行初始注释生成")
+            return await self._generate_annotation_task(filename, page_number)
         
-        if response.status_code == 200:
-            data = response.json()
-            # 直接返回改进后的注释内容作为字符串结果
-            improved_content = data.get("improved_annotation", "")
-            logger.info(f"✅ 注释改进成功，返回内容长度: {len(improved_content)}")
-            return improved_content
-        else:
-            error_msg = f"改进注释失败: {response.status_code}"
-            logger.error(error_msg)
-            raise Exception(error_msg)
+        from controller import get_page_text
+        from llm_agents import improve_user_note_async
+        page_text = await asyncio.get_running_loop().run_in_executor(None, get_page_text, filename, page_number)
+        improved_content = await improve_user_note_async(
+            current_annotation, [page_text] if page_text else [], improve_request, file_id=filename
+        )
+        logger.info(f"✅ 注释改进成功，返回内容长度: {len(improved_content)}")
+        return improved_content
     
     async def _vision_annotation_task(self, params: Dict[str, Any]) -> str:
-        """视觉识别注释任务"""
+        """视觉识别注释任务（在任务上下文中直接调用视觉LLM，识别结果替换该页文本）"""
         filename = params.get('filename')
         page_number = params.get('pageNumber', params.get('page_number'))
         session_id = params.get('sessionId', params.get('session_id'))
@@ -708,101 +1084,67 @@ PDF文件：{filename}
         
         logger.info(f"👁️ 视觉识别注释任务: {filename} 第{page_number}页, 会话ID: {session_id}")
         
-        # 调用视觉识别API
-        response = await self.http_client.post(
-            f"http://127.0.0.1:8000/api/materials/{filename}/pages/{page_number}/vision-annotate",
-            json={
-                "current_annotation": current_annotation,
-                "improve_request": improve_request,
-                "board_id": self.board_id,
-                "session_id": session_id
-            },
-            timeout=90.0  # 视觉识别可能需要更长时间
-        )
+        context = {}
+        if current_annotation:
+            context['current_annotation'] = current_annotation
+        if improve_request:
+            context['improve_request'] = improve_request
         
-        if response.status_code == 200:
-            data = response.json()
-            # 提取注释内容
-            annotation_content = data.get("annotation", "")
-            logger.info(f"✅ 视觉识别注释成功，返回内容长度: {len(annotation_content)}")
-            return annotation_content
-        else:
-            error_msg = f"视觉识别注释失败: {response.status_code}"
-            logger.error(error_msg)
-            raise Exception(error_msg)
+        # 页面渲染为CPU密集操作，放到线程池中执行
+        from controller import get_page_image
+        from llm_agents import vision_llm_recognize_async
+        img_path = await asyncio.get_running_loop().run_in_executor(None, get_page_image, filename, page_number)
+        annotation_content = await vision_llm_recognize_async(
+            img_path, filename, page_number, session_id=session_id, context=context, board_id=self.board_id
+        )
+        logger.info(f"✅ 视觉识别注释成功，返回内容长度: {len(annotation_content)}")
+        return annotation_content
     
     async def _generate_note_task(self, params: Dict[str, Any]) -> str:
-        """生成笔记任务 - 恢复原来的40页限制和页码标注功能"""
+        """生成笔记任务 - 页面内容按token预算打包，保留页码标注"""
         filename = params.get('filename')
         content = params.get('content', '')
         
         try:
             if filename:
-                # 生成PDF笔记 - 读取实际PDF内容，恢复40页限制和页码标注
+                # 生成PDF笔记 - 读取实际PDF内容，按token预算打包并保留页码标注
                 logger.info(f"开始生成PDF笔记，文件名: {filename}")
                 
-                # 读取PDF所有页面内容
-                prefix = os.path.join(PAGE_DIR, f"{filename}_page_")
-                pages_text = []
-                i = 1
-                while True:
-                    page_file = f"{prefix}{i}.txt"
-                    if not os.path.exists(page_file):
-                        break
-                    try:
-                        with open(page_file, 'r', encoding='utf-8') as f:
-                            page_content = f.read().strip()
-                            if page_content:  # 只添加非空页面
-                                pages_text.append(page_content)
-                    except Exception as e:
-                        logger.warning(f"读取页面文件失败: {page_file}, 错误: {str(e)}")
-                    i += 1
+                # 读取PDF所有页面内容（保留空页面以保持页码一致，打包时跳过）
+                from controller import get_page_texts
+                pages_text = [page.strip() for page in get_page_texts(filename)]
                 
-                if not pages_text:
+                if not any(pages_text):
                     error_msg = f"未找到PDF页面内容文件: {filename}"
                     logger.error(error_msg)
                     return error_msg
                 
-                # 应用40页限制和页码标注逻辑
                 total_pages = len(pages_text)
-                sample_pages = min(40, total_pages)
                 
-                # 判断使用的页面范围
-                if total_pages <= 40:
-                    # 如果总页数不超过40页，使用全部页面
-                    pages_used = pages_text
-                    page_range_info = f"<参考第1页-第{total_pages}页内容>"
-                else:
-                    # 如果超过40页，取前20页和后20页
-                    front_pages = 20
-                    back_pages = 20
-                    pages_used = pages_text[:front_pages] + pages_text[-back_pages:]
-                    page_range_info = f"<参考第1页-第{front_pages}页及第{total_pages-back_pages+1}页-第{total_pages}页内容>"
+                # 导入清单中的目录帮助模型把握未采样页面的结构
+                from ingest_manifest import ingest_manifest
+                manifest = ingest_manifest.get(filename)
+                outline_info = ""
+                if manifest and manifest.get("outline"):
+                    outline_lines = [
+                        f"{'  ' * (item['level'] - 1)}- {item['title']} (第{item['page']}页)"
+                        for item in manifest["outline"][:60]
+                    ]
+                    outline_info = "文档目录:\n" + "\n".join(outline_lines) + "\n\n"
                 
-                # 构建带页码标注的内容样本
-                content_samples = []
-                for i, text in enumerate(pages_used):
-                    if total_pages <= 40:
-                        # 使用全部页面时，页码是连续的
-                        page_num = i + 1
-                    else:
-                        # 使用前后20页时，需要正确计算页码
-                        if i < front_pages:
-                            page_num = i + 1
-                        else:
-                            page_num = total_pages - back_pages + (i - front_pages) + 1
-                    
-                    # 限制每页内容长度，但保留足够信息
-                    page_preview = text[:500] if len(text) > 500 else text
-                    content_samples.append(f"第{page_num}页:\n{page_preview}...")
-                
-                content = "\n\n".join(content_samples)
-                logger.info(f"成功读取PDF内容，总页数: {total_pages}，使用页数: {len(pages_used)}，总长度: {len(content)}字符")
+                # 按全文大小选择模型，页面内容按模型token预算打包，扣除目录和对话历史占用的部分
+                reserved = estimate_tokens(outline_info) + self._history_tokens()
+                route = model_router.route("note", prompt_tokens=sum(map(estimate_tokens, pages_text)) + reserved)
+                packed = pack_pages(pages_text, content_budget(route["model"], reserved))
+                content = packed["content"]
+                page_range_info = packed["page_range_info"]
+                logger.info(f"成功读取PDF内容，总页数: {total_pages}，使用页数: {packed['pages_used']}，"
+                            f"截断页数: {packed['truncated_pages']}")
                 
                 # 生成笔记的提示词 - 恢复页码标注要求
                 query = f"""请为以下PDF文档生成一份完整的笔记。
 
-文档有 {total_pages} 页，以下是部分内容示例:
+{outline_info}文档有 {total_pages} 页，以下是部分内容示例:
 {content}
 
 请生成一份完整的笔记，包括主要内容的结构化总结，使用Markdown格式，突出重点和关键概念。
@@ -816,7 +1158,8 @@ PDF文件：{filename}
 
 请开始生成笔记："""
                 
-                note_content = await self.process_query(query)
+                log_prompt(query, route["model"], "PDF笔记")
+                note_content = await self.process_query(query, route=route)
                 
                 if note_content and len(note_content) > 50:
                     # 在笔记开头添加页数引用信息
@@ -835,7 +1178,8 @@ PDF文件：{filename}
                 
                 if content and len(content) > 5:
                     query = f"请为以下内容创建详细的学习笔记，使用Markdown格式：\n\n{content}"
-                    note_content = await self.process_query(query)
+                    route = model_router.route("note", prompt_tokens=estimate_tokens(query) + self._history_tokens())
+                    note_content = await self.process_query(query, route=route)
                     
                     if note_content and len(note_content) > 10:
                         logger.info(f"成功生成文本笔记，长度: {len(note_content)}")
@@ -849,29 +1193,24 @@ PDF文件：{filename}
                     logger.error(error_msg)
                     return error_msg
                     
+        except _TASK_ABORT_ERRORS:
+            raise
         except Exception as e:
             error_msg = f"笔记生成任务执行异常: {str(e)}, 参数: {params}"
             logger.error(error_msg, exc_info=True)
             return error_msg
     
     async def _ask_question_task(self, params: Dict[str, Any]) -> str:
-        """问答任务"""
+        """问答任务（在任务上下文中直接调用LLM）"""
         filename = params.get('filename')
         question = params.get('question')
         
-        response = await self.http_client.post(
-            f"http://127.0.0.1:8000/api/materials/{filename}/ask",
-            json={"question": question},
-            timeout=60.0
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            # 从answer字段提取答案内容
-            answer_content = data.get("answer", "")
-            return answer_content
-        else:
-            raise Exception(f"问答失败: {response.status_code}")
+        from controller import get_page_texts
+        from llm_agents import ask_pdf_question_async
+        pages = await asyncio.get_running_loop().run_in_executor(None, get_page_texts, filename)
+        if not pages:
+            raise ValueError(f"未找到分页内容: {filename}")
+        return await ask_pdf_question_async(pages, question, file_id=filename)
     
     async def _general_query_task(self, params: Dict[str, Any]) -> str:
         """通用查询任务"""
@@ -880,24 +1219,18 @@ PDF文件：{filename}
         return result
     
     def get_task_result(self, task_id: str) -> Optional[Dict[str, Any]]:
-        """获取任务结果"""
-        if task_id in self.task_results:
-            result = self.task_results[task_id].copy()  # 创建副本避免修改原数据
-            
-            # 确保所有字段都是可序列化的
-            for key, value in result.items():
-                if value is not None:
-                    result[key] = str(value) if not isinstance(value, (str, int, float, bool, list, dict)) else value
-            
-            return result
+        """获取本展板任务的结果"""
+        result = task_registry.get_result(task_id)
+        if result is not None:
+            return result if result["board_id"] == str(self.board_id) else None
         
-        # 检查活动任务
-        if task_id in self.active_tasks:
-            task_info = self.active_tasks[task_id]
+        # 检查执行中的任务（包括合并到其他任务、正在等待结果的任务）
+        task = task_registry.get(task_id)
+        if task is not None and task.board_id == self.board_id and task.status == TaskStatus.RUNNING:
             return {
                 "status": "running",
                 "task_id": str(task_id),
-                "task_type": str(task_info.get("task_type", "unknown")),
+                "task_type": str(task.task_type),
                 "board_id": str(self.board_id),
                 "success": None
             }
@@ -907,18 +1240,17 @@ PDF文件：{filename}
     def get_concurrent_status(self) -> Dict[str, Any]:
         """获取并发状态"""
         active_count = len(self.active_tasks)
-        completed_count = len([t for t in self.tasks.values() if t.status == TaskStatus.COMPLETED])
-        failed_count = len([t for t in self.tasks.values() if t.status == TaskStatus.FAILED])
-        pending_count = len([t for t in self.tasks.values() if t.status == TaskStatus.PENDING])
+        # 各状态的任务数由任务索引增量维护（已淘汰的任务不计入）
+        counts = task_registry.board_counts(self.board_id)
         
         # 获取活跃任务的详细信息
         active_task_details = []
         for task_id in self.active_tasks:
-            if task_id in self.tasks:
-                task = self.tasks[task_id]
+            task = task_registry.get(task_id)
+            if task is not None:
                 # 计算任务运行时间
                 duration = 0
-                if hasattr(task, 'start_time') and task.start_time:
+                if task.start_time:
                     duration = time.time() - task.start_time
                 
                 # 构建任务详情
@@ -927,7 +1259,7 @@ PDF文件：{filename}
                     "task_type": task.task_type,
                     "status": task.status.value if hasattr(task.status, 'value') else str(task.status),
                     "duration": duration,
-                    "started_at": task.started_at.isoformat() if hasattr(task, 'started_at') and task.started_at else None,
+                    "started_at": task.started_at.isoformat() if task.started_at else None,
                     "description": self._get_task_description(task)
                 }
                 active_task_details.append(task_detail)
@@ -935,12 +1267,17 @@ PDF文件：{filename}
         return {
             "active_tasks": active_count,
             "max_concurrent_tasks": self.max_concurrent_tasks,
-            "completed_tasks": completed_count,
-            "failed_tasks": failed_count,
-            "pending_tasks": pending_count,
-            "total_tasks": len(self.tasks),
+            "completed_tasks": counts["completed"],
+            "failed_tasks": counts["failed"],
+            "cancelled_tasks": counts["cancelled"],
+            "pending_tasks": counts["pending"],
+            "total_tasks": sum(counts.values()),
             "active_task_ids": list(self.active_tasks),
-            "active_task_details": active_task_details  # 添加详细任务信息
+            "active_task_details": active_task_details,  # 添加详细任务信息
+            "worker_pool": task_worker_pool.get_status(),
+            "task_registry": task_registry.get_stats(),
+            "single_flight": task_single_flight.get_stats(),
+            "llm_concurrency": llm_concurrency.get_status()
         }
     
     def _get_task_description(self, task: Task) -> str:
@@ -952,6 +1289,9 @@ PDF文件：{filename}
             filename = params.get('filename', '未知文件')
             page_number = params.get('pageNumber', params.get('page_number', '未知页'))
             return f"为 {filename} 第{page_number}页生成注释"
+        elif task_type == "generate_batch_annotation":
+            filename = params.get('filename', '未知文件')
+            return f"为 {filename} 第{params.get('start_page', 1)}-{params.get('end_page', params.get('start_page', 1))}页批量生成注释"
         elif task_type == "improve_annotation":
             filename = params.get('filename', '未知文件')
             page_number = params.get('pageNumber', params.get('page_number', '未知页'))
@@ -968,6 +1308,9 @@ PDF文件：{filename}
             start_page = params.get('start_page', 1)
             pages_per_segment = params.get('pages_per_segment', 40)
             return f"为 {filename} 分段生成笔记（从第{start_page}页开始，{pages_per_segment}页一段）"
+        elif task_type == "generate_mapreduce_note":
+            filename = params.get('filename', '未知文件')
+            return f"为 {filename} 并行生成整本笔记"
         elif task_type == "generate_board_note":
             return "生成展板笔记"
         elif task_type == "improve_board_note":
@@ -1105,62 +1448,175 @@ PDF文件：{filename}
             logger.error(f"工具执行失败 {tool_name}: {str(e)}")
             return {"success": False, "error": str(e)}
     
-    async def process_query(self, query: str) -> str:
-        """处理查询并返回结果"""
+    async def process_query(self, query: str, route: Optional[Dict[str, Any]] = None) -> str:
+        """
+        处理查询并返回结果
+        
+        Args:
+            query: 用户查询
+            route: 调用方已选好的模型路由（如笔记任务），默认按对话查询路由
+        """
         try:
             # 检查是否有可用的LLM客户端
-            if not self.has_llm_client or not self.client:
+            if not self.has_llm_client:
                 logger.warning(f"⚠️ [QUERY] 没有可用的LLM客户端，无法处理查询: {self.board_id}")
                 return "抱歉，当前没有配置可用的AI模型。请检查API密钥配置。"
             
-            # 添加用户消息到对话历史
-            self.conversation_history.append({
-                "role": "user",
-                "content": query
-            })
-            
             # 调用LLM
-            response = self.client.chat.completions.create(
-                model="qwen-plus",
-                messages=[
-                    {"role": "system", "content": "你是一个智能学习助手，专门帮助用户理解和学习各种知识。请用中文回答，提供准确、详细且有用的信息。"},
-                    *self.conversation_history
-                ],
-                max_tokens=4000,
+            messages, route = self._query_messages(query, route)
+            assistant_message = await llm_client.chat(
+                model=route["model"],
+                api_key=self.api_key,
+                messages=messages,
+                max_tokens=route["max_tokens"],
+                timeout=route["timeout"],
                 temperature=0.7
             )
             
-            assistant_message = response.choices[0].message.content
-            
-            # 添加助手回复到对话历史
-            self.conversation_history.append({
-                "role": "assistant", 
-                "content": assistant_message
-            })
-            
-            # 保持对话历史长度
-            if len(self.conversation_history) > 20:
-                self.conversation_history = self.conversation_history[-20:]
-            
+            self._remember_reply(assistant_message)
             return assistant_message
             
+        except _TASK_ABORT_ERRORS:
+            raise
         except Exception as e:
             logger.error(f"处理查询失败: {str(e)}", exc_info=True)
             return f"抱歉，处理您的请求时发生错误: {str(e)}"
     
-    async def process_query_stream(self, query: str) -> AsyncGenerator[str, None]:
-        """流式处理用户查询"""
+    async def _generate_mapreduce_note_task(self, task_id: str, params: Dict[str, Any]) -> str:
+        """
+        以map-reduce方式生成整本笔记：各段并发生成后逐层合并，每段完成时通过任务进度事件推送给前端
+        """
+        filename = params.get('filename')
+        segment_pages = int(params.get('segment_pages') or NOTE_MAPREDUCE_SEGMENT_PAGES)
+        parallelism = int(params.get('parallelism') or NOTE_MAPREDUCE_PARALLELISM)
+        regenerate = bool(params.get('regenerate'))
+        
+        if not self.has_llm_client:
+            return "LLM服务不可用，无法生成笔记"
+        
+        from controller import get_page_texts
+        from ingest_manifest import ingest_manifest
+        pages_text = [page.strip() for page in get_page_texts(filename)]
+        if not any(pages_text):
+            return f"错误：未找到PDF页面内容文件: {filename}"
+        manifest = ingest_manifest.get(filename)
+        outline = manifest.get("outline") if manifest else None
+        
+        # 按单段的平均内容大小选择模型，所有分段和合并使用同一路由
+        segment_tokens = sum(map(estimate_tokens, pages_text)) * min(segment_pages, len(pages_text)) // len(pages_text)
+        route = model_router.route("note", prompt_tokens=segment_tokens)
+        
+        async def call_llm(prompt: str) -> str:
+            # 各段互不依赖，不走对话历史，相同内容命中响应缓存
+            log_prompt(prompt, route["model"], "map-reduce笔记")
+            return await llm_client.chat(
+                model=route["model"],
+                api_key=self.api_key,
+                cache=True,
+                refresh=regenerate,
+                messages=[
+                    {"role": "system", "content": "你是一个专业的笔记生成助手，擅长将PDF内容转化为结构化笔记。"},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=route["max_tokens"],
+                timeout=route["timeout"],
+                temperature=0.3
+            )
+        
+        async def on_progress(progress: Dict[str, Any]):
+            await task_event_manager.notify_task_progress(self.board_id, task_id, progress)
+        
+        result = await generate_mapreduce_note(
+            filename, pages_text, call_llm,
+            outline=outline,
+            model=route["model"],
+            segment_pages=segment_pages,
+            parallelism=parallelism,
+            on_progress=on_progress
+        )
+        return f"<参考第1页-第{len(pages_text)}页内容>\n\n{result['note']}"
+    
+    def _history_tokens(self) -> int:
+        """对话历史占用的token数（process_query会把历史一并发送）"""
+        return sum(estimate_tokens(message.get("content")) for message in self.conversation_history)
+    
+    def _query_messages(self, query: str, route: Optional[Dict[str, Any]] = None):
+        """把用户消息加入对话历史，返回带系统提示的完整消息列表和模型路由（未指定时按对话查询路由）"""
+        self.conversation_history.append({
+            "role": "user",
+            "content": query
+        })
+        messages = [
+            {"role": "system", "content": "你是一个智能学习助手，专门帮助用户理解和学习各种知识。请用中文回答，提供准确、详细且有用的信息。"},
+            *self.conversation_history
+        ]
+        if route is None:
+            route = model_router.route("query", prompt_tokens=estimate_messages_tokens(messages))
+        log_prompt(messages, route["model"], "对话查询")
+        return messages, route
+    
+    def _remember_reply(self, assistant_message: str):
+        """添加助手回复到对话历史，并保持对话历史长度"""
+        self.conversation_history.append({
+            "role": "assistant",
+            "content": assistant_message
+        })
+        if len(self.conversation_history) > 20:
+            self.conversation_history = self.conversation_history[-20:]
+    
+    async def process_query_stream(self, query: str,
+                                   metrics: Optional[Dict[str, Any]] = None) -> AsyncGenerator[str, None]:
+        """
+        流式处理用户查询，上游返回的文本片段到达即产出
+        
+        Args:
+            query: 用户查询
+            metrics: 传入时在结束后填入首个token延迟（ttft）、总耗时、token数和每秒token数
+        """
+        if not self.has_llm_client:
+            logger.warning(f"⚠️ [QUERY] 没有可用的LLM客户端，无法处理查询: {self.board_id}")
+            yield "抱歉，当前没有配置可用的AI模型。请检查API密钥配置。"
+            return
+        
+        start_time = time.time()
+        first_token_time = None
+        parts = []
         try:
-            # 先处理工具调用（如果需要）
-            result = await self.process_query(query)
-            
-            # 逐字输出结果
-            for char in result:
-                yield char
-                await asyncio.sleep(0.01)  # 模拟流式效果
-                
+            messages, route = self._query_messages(query)
+            async for delta in llm_client.stream(
+                messages,
+                route["model"],
+                api_key=self.api_key,
+                max_tokens=route["max_tokens"],
+                timeout=route["timeout"],
+                temperature=0.7
+            ):
+                if first_token_time is None:
+                    first_token_time = time.time()
+                parts.append(delta)
+                yield delta
         except Exception as e:
+            logger.error(f"流式处理查询失败: {str(e)}", exc_info=True)
             yield f"流式处理出错: {str(e)}"
+            return
+        
+        response = "".join(parts)
+        self._remember_reply(response)
+        
+        # 记录首个token延迟和生成速度
+        duration = time.time() - start_time
+        tokens = estimate_tokens(response)
+        generation_time = time.time() - first_token_time if first_token_time else 0
+        stream_metrics = {
+            "ttft": round(first_token_time - start_time, 3) if first_token_time else None,
+            "duration": round(duration, 3),
+            "tokens": tokens,
+            "tokens_per_second": round(tokens / generation_time, 1) if generation_time > 0 else None
+        }
+        if metrics is not None:
+            metrics.update(stream_metrics)
+        logger.info(f"⚡ [STREAM] 展板 {self.board_id} 流式查询完成: 首token {stream_metrics['ttft']}秒，"
+                    f"{tokens} tokens，{stream_metrics['tokens_per_second']} tokens/秒，总耗时 {duration:.2f}秒")
 
     async def _generate_board_note_task(self, params: Dict[str, Any]) -> str:
         """
@@ -1208,20 +1664,21 @@ PDF文件：{filename}
 请开始生成展板总结笔记：
 """
             
-            if self.has_llm_client and self.client:
+            if self.has_llm_client:
                 logger.info(f"🤖 [BOARD-NOTE] 使用LLM生成展板笔记")
                 
-                response = self.client.chat.completions.create(
-                    model="qwen-plus",
+                route = model_router.route("board_note", prompt_tokens=estimate_tokens(board_note_prompt))
+                board_note_content = await llm_client.chat(
+                    model=route["model"],
+                    api_key=self.api_key,
                     messages=[
                         {"role": "system", "content": "你是一个专业的学术助手，擅长整合多个文档的内容并生成高质量的综合性笔记。"},
                         {"role": "user", "content": board_note_prompt}
                     ],
-                    max_tokens=4000,  # 展板笔记可能比较长
+                    max_tokens=route["max_tokens"],  # 展板笔记可能比较长
+                    timeout=route["timeout"],
                     temperature=0.7
                 )
-                
-                board_note_content = response.choices[0].message.content
                 execution_time = time.time() - start_time
                 
                 # 在开头添加展板信息和生成时间
@@ -1247,6 +1704,8 @@ PDF文件：{filename}
                 logger.warning(f"⚠️ [BOARD-NOTE] LLM客户端不可用")
                 return "LLM服务不可用，无法生成展板笔记。"
                 
+        except _TASK_ABORT_ERRORS:
+            raise
         except Exception as e:
             execution_time = time.time() - start_time
             error_msg = f"展板笔记生成失败: {str(e)}"
@@ -1291,20 +1750,21 @@ PDF文件：{filename}
 请提供改进后的展板笔记：
 """
             
-            if self.has_llm_client and self.client:
+            if self.has_llm_client:
                 logger.info(f"🤖 [BOARD-NOTE-IMPROVE] 使用LLM改进展板笔记")
                 
-                response = self.client.chat.completions.create(
-                    model="qwen-plus",
+                route = model_router.route("board_note", prompt_tokens=estimate_tokens(improve_board_note_prompt))
+                improved_content = await llm_client.chat(
+                    model=route["model"],
+                    api_key=self.api_key,
                     messages=[
                         {"role": "system", "content": "你是一个专业的学术助手，擅长根据用户要求改进和优化笔记内容。"},
                         {"role": "user", "content": improve_board_note_prompt}
                     ],
-                    max_tokens=4000,
+                    max_tokens=route["max_tokens"],
+                    timeout=route["timeout"],
                     temperature=0.7
                 )
-                
-                improved_content = response.choices[0].message.content
                 execution_time = time.time() - start_time
                 
                 logger.info(f"✅ [BOARD-NOTE-IMPROVE] 展板笔记改进完成，改进后长度: {len(improved_content)} 字符，耗时: {execution_time:.3f}秒")
@@ -1314,6 +1774,8 @@ PDF文件：{filename}
                 logger.warning(f"⚠️ [BOARD-NOTE-IMPROVE] LLM客户端不可用")
                 return content  # 返回原内容
                 
+        except _TASK_ABORT_ERRORS:
+            raise
         except Exception as e:
             execution_time = time.time() - start_time
             error_msg = f"展板笔记改进失败: {str(e)}"
@@ -1334,21 +1796,8 @@ PDF文件：{filename}
         
         try:
             # 读取PDF所有页面内容
-            prefix = os.path.join(PAGE_DIR, f"{filename}_page_")
-            pages_text = []
-            i = 1
-            while True:
-                page_file = f"{prefix}{i}.txt"
-                if not os.path.exists(page_file):
-                    break
-                try:
-                    with open(page_file, 'r', encoding='utf-8') as f:
-                        page_content = f.read().strip()
-                        pages_text.append(page_content)  # 保留空页面以保持页码一致
-                except Exception as e:
-                    logger.warning(f"读取页面文件失败: {page_file}, 错误: {str(e)}")
-                    pages_text.append("")  # 添加空字符串占位
-                i += 1
+            from controller import get_page_texts
+            pages_text = [page.strip() for page in get_page_texts(filename)]  # 保留空页面以保持页码一致
             
             if not pages_text:
                 return f"错误：未找到PDF页面内容文件: {filename}"
@@ -1365,23 +1814,17 @@ PDF文件：{filename}
             # 提取指定范围的页面内容
             pages_to_process = pages_text[start_page-1:end_page]
             
-            # 过滤掉空页面但保留页码信息
-            valid_pages = []
-            for i, page_content in enumerate(pages_to_process):
-                page_num = start_page + i
-                if page_content.strip():
-                    valid_pages.append((page_num, page_content))
-            
-            if not valid_pages:
+            if not any(pages_to_process):
                 return f"错误：指定范围({start_page}-{end_page}页)内没有有效内容"
             
-            # 构建内容样本
-            content_samples = []
-            for page_num, page_content in valid_pages:
-                page_preview = page_content[:500] if len(page_content) > 500 else page_content
-                content_samples.append(f"第{page_num}页:\n{page_preview}...")
+            # 已有笔记只保留末尾部分作为衔接上下文
+            note_context = truncate_to_tokens(existing_note, 1000, keep_tail=True) if existing_note else ""
             
-            content = "\n\n".join(content_samples)
+            # 按本段大小选择模型，页面内容按token预算打包（空页面跳过但保留页码）
+            reserved = estimate_tokens(note_context) + self._history_tokens()
+            route = model_router.route("note", prompt_tokens=sum(map(estimate_tokens, pages_to_process)) + reserved)
+            packed = pack_pages(pages_to_process, content_budget(route["model"], reserved), start_page=start_page)
+            content = packed["content"]
             
             # 计算是否还有更多内容
             has_more = end_page < total_pages
@@ -1390,7 +1833,7 @@ PDF文件：{filename}
             # 构建页面范围信息
             current_range = f"第{start_page}页-第{end_page}页" if start_page != end_page else f"第{start_page}页"
             
-            logger.info(f"处理{current_range}，有效页面数: {len(valid_pages)}")
+            logger.info(f"处理{current_range}，有效页面数: {packed['pages_used']}")
             
             # 构建提示词
             if existing_note:
@@ -1398,7 +1841,7 @@ PDF文件：{filename}
                 query = f"""【分段笔记续写任务】为PDF文件 {filename} 的{current_range}生成笔记，并续写到已有笔记后面。
 
 已有笔记内容（前面部分）:
-{existing_note[-1000:]}...
+...{note_context}
 
 当前需要处理的内容（{current_range}）:
 {content}
@@ -1433,7 +1876,8 @@ PDF文件：{filename}
 请开始生成{current_range}的笔记："""
             
             # 调用LLM生成笔记
-            note_segment = await self.process_query(query)
+            log_prompt(query, route["model"], f"分段笔记{current_range}")
+            note_segment = await self.process_query(query, route=route)
             
             # 检查返回内容
             if not note_segment or len(note_segment.strip()) < 50:
@@ -1446,7 +1890,7 @@ PDF文件：{filename}
                 "has_more": bool(has_more),
                 "total_pages": int(total_pages),
                 "current_range": str(current_range),
-                "pages_processed": int(len(valid_pages)),
+                "pages_processed": int(packed['pages_used']),
                 "start_page": int(start_page),
                 "end_page": int(end_page)
             }
@@ -1454,9 +1898,10 @@ PDF文件：{filename}
             logger.info(f"分段笔记生成完成: {current_range}, 笔记长度: {len(note_segment)}, 还有更多: {has_more}")
             
             # 返回JSON字符串，因为任务结果需要是字符串格式
-            import json
             return json.dumps(result, ensure_ascii=False)
             
+        except _TASK_ABORT_ERRORS:
+            raise
         except Exception as e:
             error_msg = f"分段生成笔记时出错: {str(e)}"
             logger.error(error_msg)
@@ -1486,6 +1931,45 @@ class SimpleExpertManager:
         """移除专家实例"""
         if board_id in self.experts:
             del self.experts[board_id]
+    
+    def recover_tasks(self) -> int:
+        """
+        恢复任务日志中上次运行未完成（排队或执行中）的任务，按原任务ID重新排队，返回恢复的任务数
+        
+        已在任务索引中的任务跳过，重复调用不会重复执行；
+        参数无法解析、提交过久、恢复次数过多或已过截止时间的任务记为失败
+        """
+        task_journal.compact()
+        recovered = 0
+        now = time.time()
+        for record in task_journal.unfinished():
+            task_id, board_id, task_type = record["task_id"], record["board_id"], record["task_type"]
+            if task_registry.get(task_id) is not None:
+                continue
+            
+            reason = None
+            if not isinstance(record["params"], dict):
+                reason = "任务参数无法解析"
+            elif now - record["submitted_at"] > TASK_JOURNAL_RECOVER_MAX_AGE:
+                reason = "任务提交时间过久"
+            elif record["recoveries"] >= TASK_JOURNAL_MAX_RECOVERIES:
+                reason = f"已恢复{record['recoveries']}次仍未完成"
+            elif (SimpleExpert._task_deadline(record["params"], record["submitted_at"]) or float("inf")) <= now:
+                reason = "已超过任务截止时间"
+            if reason:
+                task_journal.record_fail(task_id, board_id, task_type, f"重启后未恢复任务：{reason}", 0)
+                logger.warning(f"⚠️ [TASK-RECOVER] 不再恢复任务 {task_id}: {reason}")
+                continue
+            
+            try:
+                self.get_expert(board_id).recover_task(task_id, task_type, record["params"], record["submitted_at"])
+                recovered += 1
+            except Exception as e:
+                logger.error(f"❌ [TASK-RECOVER] 恢复任务失败: {task_id}: {str(e)}", exc_info=True)
+        
+        if recovered:
+            logger.info(f"♻️ [TASK-RECOVER] 已从任务日志恢复 {recovered} 个未完成的任务")
+        return recovered
 
 # 全局管理器实例
 simple_expert_manager = SimpleExpertManager() 
\ No newline at end of file
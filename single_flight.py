@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+进行中任务的合并（single-flight）
+以任务指纹为键登记正在排队或执行的任务，相同指纹的后续任务不再发起上游调用，
+而是等待首个任务的结果。所有展板的专家实例共用同一个登记表。
+
+首个任务被取消时，若仍有后续任务在等待，上游调用继续完成并把结果交给它们，
+等待的任务全部离开后才中止
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """按指纹合并相同的进行中任务"""
+
+    def __init__(self):
+        # 指纹 -> (首个任务ID, 结果Future)
+        self._calls: Dict[str, Tuple[str, asyncio.Future]] = {}
+        # 指纹 -> 等待中的后续任务ID
+        self._followers: Dict[str, Set[str]] = {}
+        # 指纹 -> 首个任务已取消、继续为后续任务执行的上游调用
+        self._abandoned: Dict[str, asyncio.Future] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def attach(self, key: str, task_id: str) -> Tuple[bool, str, asyncio.Future]:
+        """
+        登记任务
+
+        Returns:
+            (是否为首个任务, 首个任务ID, 结果Future)。非首个任务应等待Future而不是自行执行
+        """
+        call = self._calls.get(key)
+        if call is not None:
+            self.followers += 1
+            self._followers.setdefault(key, set()).add(task_id)
+            logger.info(f"🔗 [SINGLE-FLIGHT] 任务 {task_id} 合并到进行中的任务 {call[0]}")
+            return False, call[0], call[1]
+
+        future = asyncio.get_running_loop().create_future()
+        # 没有后续任务等待时，避免未读取的异常产生警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = (task_id, future)
+        self.leaders += 1
+        return True, task_id, future
+
+    def resolve(self, key: str, task_id: str, result: Any = None, error: Optional[BaseException] = None):
+        """
+        首个任务结束时调用，把结果或异常交给所有等待的任务
+
+        只处理task_id作为首个任务登记的合并：该任务已结束后，相同指纹的新任务可能已登记为新的首个任务，
+        重复调用不会影响新的合并
+        """
+        call = self._calls.get(key)
+        if call is None or call[0] != task_id:
+            return
+        del self._calls[key]
+        self._followers.pop(key, None)
+        self._abandoned.pop(key, None)
+        if call[1].done():
+            return
+        if error is not None:
+            call[1].set_exception(error)
+        else:
+            call[1].set_result(result)
+
+    def has_followers(self, key: str, task_id: str) -> bool:
+        """task_id作为首个任务登记的合并中是否还有后续任务在等待"""
+        call = self._calls.get(key)
+        return call is not None and call[0] == task_id and bool(self._followers.get(key))
+
+    def abandon(self, key: str, task_id: str, work: asyncio.Future):
+        """首个任务被取消、仍有后续任务等待时调用，登记继续为它们执行的上游调用work，最后一个后续任务离开时取消work"""
+        if self.has_followers(key, task_id):
+            self._abandoned[key] = work
+
+    def leave(self, key: str, task_id: str):
+        """后续任务结束（包括被取消、超过截止时间）时调用，不再等待结果"""
+        followers = self._followers.get(key)
+        if not followers or task_id not in followers:
+            return
+        followers.discard(task_id)
+        if followers:
+            return
+        del self._followers[key]
+        work = self._abandoned.pop(key, None)
+        if work is not None and not work.done():
+            logger.info(f"🔗 [SINGLE-FLIGHT] 首个任务已取消且没有等待的任务，中止上游调用: {self._calls[key][0]}")
+            work.cancel()
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取合并统计"""
+        return {
+            "in_flight": len(self._calls),
+            "abandoned": len(self._abandoned),
+            "leaders": self.leaders,
+            "coalesced": self.followers
+        }
+
+
+# 全局任务合并登记表
+task_single_flight = SingleFlight()
@@ -123,6 +123,25 @@ class TaskEventManager:
                 "timestamp": datetime.now().isoformat()
             })
     
+    async def notify_task_cancelled(self, board_id: str, task_id: str, task_type: str = None):
+        """通知任务已取消（包括尚未开始执行、不在活跃列表中的任务）"""
+        cancelled_task = None
+        if board_id in self.task_states:
+            cancelled_task = self.task_states[board_id].pop(task_id, None)
+
+        logger.info(f"🛑 [EVENT] 任务取消: {board_id}/{task_id} - {task_type}")
+
+        # 广播事件
+        await self._broadcast_to_board(board_id, {
+            "type": "task_cancelled",
+            "board_id": board_id,
+            "task_id": task_id,
+            "task_type": task_type,
+            "cancelled_task": cancelled_task,
+            "tasks": self.get_board_tasks(board_id),
+            "timestamp": datetime.now().isoformat()
+        })
+
     async def update_task_progress(self, board_id: str, task_id: str, duration: float):
         """更新任务进度"""
         if board_id in self.task_states and task_id in self.task_states[board_id]:
@@ -139,6 +158,33 @@ class TaskEventManager:
                     "timestamp": datetime.now().isoformat()
                 })
     
+    async def notify_task_progress(self, board_id: str, task_id: str, progress: Dict[str, Any]):
+        """通知任务的细粒度进度（如PDF拆分已完成的页数）"""
+        if board_id in self.task_states and task_id in self.task_states[board_id]:
+            self.task_states[board_id][task_id]["progress"] = progress
+            
+            await self._broadcast_to_board(board_id, {
+                "type": "task_progress",
+                "board_id": board_id,
+                "task_id": task_id,
+                "progress": progress,
+                "tasks": self.get_board_tasks(board_id),
+                "timestamp": datetime.now().isoformat()
+            })
+    
+    async def notify_upstream_status(self, model: str, state: str):
+        """向所有展板广播LLM上游状态变化（熔断时为upstream_degraded，恢复时为upstream_recovered）"""
+        event_type = "upstream_recovered" if state == "closed" else "upstream_degraded"
+        event_data = {
+            "type": event_type,
+            "model": model,
+            "state": state,
+            "message": f"{model} 上游服务已恢复" if state == "closed" else f"{model} 上游服务降级，相关任务将快速失败",
+            "timestamp": datetime.now().isoformat()
+        }
+        for board_id in list(self.board_subscribers.keys()):
+            await self._broadcast_to_board(board_id, {**event_data, "board_id": board_id})
+    
     def get_board_tasks(self, board_id: str) -> List[Dict[str, Any]]:
         """获取展板的活跃任务列表"""
         if board_id not in self.task_states:
@@ -188,14 +234,18 @@ class TaskEventManager:
         """获取任务的友好显示名称"""
         display_names = {
             'annotation': '生成注释',
+            'generate_batch_annotation': '批量生成注释',
             'improve_annotation': '改进注释',
             'generate_note': '生成笔记',
             'generate_segmented_note': '分段生成笔记',
+            'generate_mapreduce_note': '并行生成整本笔记',
             'generate_board_note': '生成展板笔记',
             'improve_board_note': '改进展板笔记',
             'answer_question': '回答问题',
             'vision_annotation': '视觉识别注释',
-            'general_query': '通用查询'
+            'general_query': '通用查询',
+            'pdf_split': '拆分PDF',
+            'ingest': '导入课件'
         }
         return display_names.get(task_type, task_type)
 
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+任务日志
+任务的提交、开始、恢复、完成、失败和取消事件追加写入SQLite（WAL），进程重启或崩溃后：
+最后一个事件不是完成/失败/取消的任务在启动时按原任务ID重新排队（见SimpleExpertManager.recover_tasks），
+已结束任务的结果在保留期内仍可按任务ID查询。已结束超过保留期的任务在启动时清理。
+
+事件由单独的写入线程按批提交，记录事件不阻塞事件循环；
+完成事件中超过TASK_JOURNAL_RESULT_MAX_CHARS的结果只保存开头部分（完整结果由任务记录保存）
+"""
+
+import os
+import json
+import time
+import logging
+import queue
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from config import TASK_JOURNAL_DB, TASK_JOURNAL_RETENTION, TASK_JOURNAL_RESULT_MAX_CHARS
+
+logger = logging.getLogger(__name__)
+
+# 表示任务已结束的事件
+_FINISH_EVENTS = "('complete', 'fail', 'cancel')"
+
+# 结束事件对应的任务状态
+_FINISH_STATUS = {"complete": "completed", "fail": "failed", "cancel": "cancelled"}
+
+# 写入线程每批最多提交的事件数
+_WRITE_BATCH = 500
+
+# 写入队列中的关闭标记
+_CLOSE = object()
+
+
+class TaskJournal:
+    """追加写入的任务事件日志"""
+
+    def __init__(self, db_path: str = TASK_JOURNAL_DB, retention: float = TASK_JOURNAL_RETENTION,
+                 result_max_chars: int = TASK_JOURNAL_RESULT_MAX_CHARS):
+        self.db_path = db_path
+        self.retention = retention
+        self.result_max_chars = result_max_chars
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        # 已放入写入队列和写入线程已处理的事件数，flush按此等待
+        self._written_cond = threading.Condition()
+        self._queued = 0
+        self._written = 0
+        self.appended = 0
+        self.batches = 0
+        self.errors = 0
+
+    def _db(self) -> sqlite3.Connection:
+        # 调用方需持有self._lock
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # WAL模式下NORMAL不在每次提交时同步磁盘，进程崩溃不丢数据，断电最多丢失最近的事件
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, task_id TEXT, board_id TEXT, task_type TEXT, "
+                "event TEXT, payload TEXT, duration REAL, created_at REAL, truncated INTEGER DEFAULT 0)"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(events)")]
+            if "truncated" not in columns:
+                self._conn.execute("ALTER TABLE events ADD COLUMN truncated INTEGER DEFAULT 0")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_events_task ON events(task_id, seq)")
+            self._conn.commit()
+        return self._conn
+
+    def _append(self, task_id: str, board_id: str, task_type: str, event: str,
+                payload: Optional[str] = None, duration: Optional[float] = None, truncated: bool = False):
+        # 只放入写入队列，由写入线程按批提交（不等待写入线程持有的self._lock）
+        with self._written_cond:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="task_journal", daemon=True)
+                self._writer.start()
+            self._queued += 1
+            self._queue.put((task_id, str(board_id), task_type, event, payload, duration, time.time(), int(truncated)))
+
+    def _write_loop(self):
+        while True:
+            rows = [self._queue.get()]
+            while len(rows) < _WRITE_BATCH:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = rows[-1] is _CLOSE
+            events = rows[:-1] if closing else rows
+            if events:
+                self._write_batch(events)
+                with self._written_cond:
+                    self._written += len(events)
+                    self._written_cond.notify_all()
+            if closing:
+                return
+
+    def _write_batch(self, rows: List[tuple]):
+        # 日志写入失败只记录错误，不影响任务本身
+        try:
+            with self._lock:
+                db = self._db()
+                db.executemany(
+                    "INSERT INTO events (task_id, board_id, task_type, event, payload, duration, created_at, truncated) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                db.commit()
+                self.appended += len(rows)
+                self.batches += 1
+        except sqlite3.Error as e:
+            self.errors += len(rows)
+            logger.error(f"❌ [TASK-JOURNAL] 写入任务日志失败（{len(rows)} 条事件）: {str(e)}")
+
+    def flush(self):
+        """
+        等待调用前已记录的事件写入（之后记录的事件不等待），在线程中调用，不在事件循环中调用
+        """
+        with self._written_cond:
+            if self._writer is None or not self._writer.is_alive():
+                return
+            target = self._queued
+            self._written_cond.wait_for(lambda: self._written >= target)
+
+    def record_submit(self, task_id: str, board_id: str, task_type: str, params: Dict[str, Any]):
+        """记录任务提交（含执行参数，恢复时据此重新执行）"""
+        self._append(task_id, board_id, task_type, "submit",
+                     json.dumps(params, ensure_ascii=False, default=str))
+
+    def record_start(self, task_id: str, board_id: str, task_type: str):
+        self._append(task_id, board_id, task_type, "start")
+
+    def record_recover(self, task_id: str, board_id: str, task_type: str):
+        self._append(task_id, board_id, task_type, "recover")
+
+    def record_complete(self, task_id: str, board_id: str, task_type: str, result: Any, duration: float):
+        """记录任务完成，过长的结果只保存开头部分"""
+        text = str(result) if result is not None else ""
+        truncated = len(text) > self.result_max_chars
+        self._append(task_id, board_id, task_type, "complete",
+                     text[:self.result_max_chars] if truncated else text, duration, truncated)
+
+    def record_fail(self, task_id: str, board_id: str, task_type: str, error: str, duration: float):
+        self._append(task_id, board_id, task_type, "fail", error, duration)
+
+    def record_cancel(self, task_id: str, board_id: str, task_type: str, reason: str, duration: float):
+        self._append(task_id, board_id, task_type, "cancel", reason, duration)
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        """
+        最后一个事件不是完成/失败/取消的已提交任务，按提交顺序排列
+
+        Returns:
+            [{"task_id", "board_id", "task_type", "params", "submitted_at", "recoveries"}]
+        """
+        self.flush()
+        with self._lock:
+            db = self._db()
+            rows = db.execute(
+                "SELECT s.task_id, s.board_id, s.task_type, s.payload, s.created_at, "
+                "(SELECT COUNT(*) FROM events r WHERE r.task_id = s.task_id AND r.event = 'recover') "
+                "FROM events s WHERE s.event = 'submit' AND NOT EXISTS ("
+                "SELECT 1 FROM events f WHERE f.task_id = s.task_id AND f.event IN " + _FINISH_EVENTS +
+                " AND f.seq > s.seq) ORDER BY s.seq"
+            ).fetchall()
+
+        tasks = []
+        for task_id, board_id, task_type, payload, submitted_at, recoveries in rows:
+            try:
+                params = json.loads(payload) if payload else {}
+            except json.JSONDecodeError:
+                params = None
+            tasks.append({
+                "task_id": task_id,
+                "board_id": board_id,
+                "task_type": task_type,
+                "params": params,
+                "submitted_at": submitted_at,
+                "recoveries": recoveries
+            })
+        return tasks
+
+    def _last_finish(self, task_id: str) -> Optional[tuple]:
+        # 调用方需持有self._lock
+        return self._db().execute(
+            "SELECT board_id, task_type, event, payload, duration, truncated FROM events "
+            "WHERE task_id = ? AND event IN " + _FINISH_EVENTS + " ORDER BY seq DESC LIMIT 1",
+            (task_id,)
+        ).fetchone()
+
+    def completed(self, task_ids: Iterable[str]) -> List[str]:
+        """给定任务中已成功完成的任务ID"""
+        self.flush()
+        with self._lock:
+            return [task_id for task_id in task_ids
+                    if (row := self._last_finish(task_id)) is not None and row[2] == "complete"]
+
+    def get_result(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """
+        已结束任务的结果（格式同TaskRegistry.get_result），没有记录时返回None
+
+        结果在记录时被截断的，result_truncated为True。会等待之前记录的事件写入并查询数据库，
+        应在线程池中调用
+        """
+        self.flush()
+        try:
+            with self._lock:
+                row = self._last_finish(task_id)
+        except sqlite3.Error as e:
+            logger.error(f"❌ [TASK-JOURNAL] 查询任务结果失败: {task_id}: {str(e)}")
+            return None
+        if row is None:
+            return None
+        board_id, task_type, event, payload, duration, truncated = row
+        completed = event == "complete"
+        result = {
+            "status": _FINISH_STATUS[event],
+            "task_type": task_type,
+            "task_id": task_id,
+            "board_id": board_id,
+            "success": completed,
+            "duration": float(duration or 0)
+        }
+        result["result" if completed else "error"] = payload or ""
+        if truncated:
+            result["result_truncated"] = True
+        return result
+
+    def compact(self) -> int:
+        """删除结束超过保留期的任务的全部事件，返回删除的事件数"""
+        cutoff = time.time() - self.retention
+        self.flush()
+        with self._lock:
+            db = self._db()
+            cursor = db.execute(
+                "DELETE FROM events WHERE task_id IN ("
+                "SELECT task_id FROM events WHERE event IN " + _FINISH_EVENTS +
+                " GROUP BY task_id HAVING MAX(created_at) < ?)",
+                (cutoff,)
+            )
+            db.commit()
+            removed = cursor.rowcount
+        if removed:
+            logger.info(f"🧹 [TASK-JOURNAL] 已清理 {removed} 条过期的任务事件")
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """本次运行写入的事件数、提交批数、待写入数和写入失败数"""
+        return {
+            "appended": self.appended,
+            "batches": self.batches,
+            "pending": self._queued - self._written,
+            "errors": self.errors,
+            "retention": self.retention
+        }
+
+    def close(self):
+        """写完已记录的事件后关闭数据库"""
+        with self._written_cond:
+            writer, self._writer = self._writer, None
+        if writer is not None and writer.is_alive():
+            self._queue.put(_CLOSE)
+            writer.join()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# 全局任务日志
+task_journal = TaskJournal()
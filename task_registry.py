@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+任务记录
+所有展板的任务登记在同一个 task_id → 任务 的索引中，按任务ID查询结果不再遍历各展板；
+各展板各状态的任务数在状态变化时增量维护。
+已结束的任务只保留结果和摘要字段，按最近查询时间排成LRU：空闲超过TASK_RESULT_TTL、
+数量超过TASK_RESULT_MAX_ENTRIES或内存中的结果超过字节上限时淘汰；
+较大的结果写入TASK_RESULT_DIR，内存中只保留路径，查询时再读取。
+不在索引中的任务（已淘汰或上次运行结束的）从任务日志中查询结果
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, Optional
+
+from config import (TASK_RESULT_DIR, TASK_RESULT_TTL, TASK_RESULT_MAX_ENTRIES,
+                    TASK_RESULT_MEMORY_MAX_BYTES, TASK_RESULT_SPILL_BYTES)
+from task_scheduler import task_priority
+from task_journal import task_journal
+
+logger = logging.getLogger(__name__)
+
+
+class TaskStatus(Enum):
+    """任务状态枚举"""
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class Task:
+    """任务类"""
+
+    __slots__ = (
+        "task_id", "task_type", "params", "_status", "result", "error", "created_at", "started_at",
+        "completed_at", "start_time", "end_time", "duration", "board_id", "fingerprint", "coalesced_with",
+        "priority", "result_path", "result_size", "deadline_at", "cancel_requested", "_registry"
+    )
+
+    def __init__(self, task_id: str, task_type: str, params: Dict[str, Any], board_id: str):
+        self.task_id = task_id
+        self.task_type = task_type
+        self.params = params
+        self._status = TaskStatus.PENDING
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.completed_at = None
+        self.start_time = None
+        self.end_time = None
+        self.duration = None
+        self.board_id = board_id
+        self.fingerprint = None  # 参与合并的任务指纹
+        self.coalesced_with = None  # 合并到的进行中任务ID
+        self.priority = task_priority(task_type)  # 调度优先级，数字越小越优先
+        self.result_path = None  # 结果已写入磁盘时的文件路径
+        self.result_size = 0  # 内存中结果的字节数
+        self.deadline_at = None  # 截止时间（time.time()时间戳），未设置截止时间时为None
+        self.cancel_requested = False  # 是否已被用户取消（区别于服务关闭时的中止）
+        self._registry = None
+
+    @property
+    def status(self) -> TaskStatus:
+        return self._status
+
+    @status.setter
+    def status(self, status: TaskStatus):
+        previous, self._status = self._status, status
+        if self._registry is not None and previous is not status:
+            self._registry._count(self.board_id, previous, -1)
+            self._registry._count(self.board_id, status, 1)
+
+
+def _text_size(text: str) -> int:
+    # 按UTF-8编码长度估算占用
+    return len(text) * 3 if not text.isascii() else len(text)
+
+
+class TaskRegistry:
+    """全局任务索引和已结束任务的结果存储"""
+
+    def __init__(self, result_dir: str = TASK_RESULT_DIR, ttl: float = TASK_RESULT_TTL,
+                 max_entries: int = TASK_RESULT_MAX_ENTRIES, max_bytes: int = TASK_RESULT_MEMORY_MAX_BYTES,
+                 spill_bytes: int = TASK_RESULT_SPILL_BYTES):
+        self.result_dir = result_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.spill_bytes = spill_bytes
+        self._tasks: Dict[str, Task] = {}
+        # 已结束的任务：task_id → 最近查询时间（time.monotonic()），按查询时间从旧到新排列
+        self._finished: "OrderedDict[str, float]" = OrderedDict()
+        self._counts: Dict[str, Dict[TaskStatus, int]] = {}
+        self._lock = threading.RLock()
+        self.memory_bytes = 0
+        self.spilled = 0
+        self.evictions = 0
+        self._remove_stale_files()
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def _count(self, board_id: str, status: TaskStatus, delta: int):
+        with self._lock:
+            counts = self._counts.setdefault(board_id, {})
+            counts[status] = counts.get(status, 0) + delta
+
+    def add(self, task: Task):
+        """登记新任务"""
+        with self._lock:
+            self._tasks[task.task_id] = task
+            task._registry = self
+            self._count(task.board_id, task.status, 1)
+
+    def get(self, task_id: str) -> Optional[Task]:
+        return self._tasks.get(task_id)
+
+    def remove(self, task_id: str):
+        """移除任务（如提交失败的任务）"""
+        with self._lock:
+            task = self._tasks.pop(task_id, None)
+            if task is None:
+                return
+            self._count(task.board_id, task.status, -1)
+            task._registry = None
+            if self._finished.pop(task_id, None) is not None:
+                self.memory_bytes -= task.result_size
+                if task.result_path:
+                    self._delete_file(task.result_path)
+
+    def finish(self, task: Task, status: TaskStatus, result: Any = None, error: Optional[str] = None):
+        """
+        记录任务结束：保存结果（较大的结果写入磁盘），丢弃执行参数，加入已结束任务的LRU并按需淘汰
+        """
+        task.completed_at = datetime.now()
+        task.error = error
+        task.params = None
+        text = str(result) if result is not None else ""
+        if status is TaskStatus.COMPLETED and _text_size(text) > self.spill_bytes and self._spill(task, text):
+            task.result = None
+        else:
+            task.result = text if status is TaskStatus.COMPLETED else None
+            task.result_size = _text_size(task.result) if task.result else 0
+        task.status = status
+
+        with self._lock:
+            if task.task_id in self._tasks and task.task_id not in self._finished:
+                self._finished[task.task_id] = time.monotonic()
+                self.memory_bytes += task.result_size
+            self._evict()
+
+    def _spill(self, task: Task, text: str) -> bool:
+        path = os.path.join(self.result_dir, f"{task.task_id}.txt")
+        try:
+            os.makedirs(self.result_dir, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        except OSError as e:
+            logger.warning(f"⚠️ [TASK-REGISTRY] 任务结果写入磁盘失败，保留在内存中: {task.task_id}: {str(e)}")
+            return False
+        task.result_path = path
+        self.spilled += 1
+        return True
+
+    @staticmethod
+    def _delete_file(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        # 调用方持有锁：从最久未查询的一端淘汰过期、超出数量或超出内存上限的任务
+        now = time.monotonic()
+        while self._finished:
+            task_id, touched = next(iter(self._finished.items()))
+            if (now - touched <= self.ttl and len(self._finished) <= self.max_entries
+                    and self.memory_bytes <= self.max_bytes):
+                break
+            self.remove(task_id)
+            self.evictions += 1
+
+    def _remove_stale_files(self):
+        # 上次运行留下的结果文件已没有对应的任务记录，超过TTL的删除
+        try:
+            names = os.listdir(self.result_dir)
+        except OSError:
+            return
+        cutoff = time.time() - self.ttl
+        for name in names:
+            path = os.path.join(self.result_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _read_result(self, task: Task) -> str:
+        if task.result_path is None:
+            return task.result or ""
+        try:
+            with open(task.result_path, "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError as e:
+            logger.error(f"❌ [TASK-REGISTRY] 读取任务结果失败: {task.task_id}: {str(e)}")
+            return ""
+
+    def get_result(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """
+        已结束任务的结果（可直接序列化），任务未结束或没有记录时返回None
+
+        不在内存中的任务查询任务日志（阻塞I/O），事件循环中应放到线程池中调用
+        """
+        with self._lock:
+            self._evict()
+            task = self._tasks.get(task_id)
+            if task is not None and task_id not in self._finished:
+                return None
+            if task is not None:
+                self._finished[task_id] = time.monotonic()
+                self._finished.move_to_end(task_id)
+        if task is None:
+            return task_journal.get_result(task_id)
+
+        completed = task.status is TaskStatus.COMPLETED
+        result = {
+            "status": task.status.value,
+            "task_type": str(task.task_type),
+            "task_id": str(task.task_id),
+            "board_id": str(task.board_id),
+            "success": completed,
+            "duration": float(task.duration or 0)
+        }
+        if completed:
+            result["result"] = self._read_result(task)
+        else:
+            result["error"] = task.error
+        if task.coalesced_with:
+            result["coalesced_with"] = task.coalesced_with
+        return result
+
+    def board_counts(self, board_id: str) -> Dict[str, int]:
+        """展板各状态的任务数（已淘汰的任务不计入）"""
+        with self._lock:
+            counts = dict(self._counts.get(board_id, {}))
+        return {status.value: counts.get(status, 0) for status in TaskStatus}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """任务索引大小、已结束任务数、内存占用和淘汰计数"""
+        with self._lock:
+            return {
+                "tasks": len(self._tasks),
+                "finished": len(self._finished),
+                "memory_bytes": self.memory_bytes,
+                "max_bytes": self.max_bytes,
+                "spilled": self.spilled,
+                "evictions": self.evictions,
+                "ttl": self.ttl
+            }
+
+
+# 全局任务记录
+task_registry = TaskRegistry()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+全局任务池
+所有展板的任务提交到同一个池中，同时执行的任务数不超过 TASK_POOL_MAX_WORKERS 和LLM自适应并发上限；
+排队的任务在课程之间、展板之间按权重公平出队，同一展板内按优先级出队并随排队时长老化。
+并发名额空出时立即唤醒调度方，不再轮询或把任务放回队尾
+"""
+
+import time
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from config import TASK_PRIORITIES, TASK_DEFAULT_PRIORITY, TASK_POOL_MAX_WORKERS
+from fair_queue import FairQueue, NO_FLOW
+from llm_limits import llm_concurrency
+
+logger = logging.getLogger(__name__)
+
+# 并发上限可能在没有任务结束时增大（自适应并发），等待名额时最长隔该时长重新检查一次
+_LIMIT_RECHECK_INTERVAL = 1.0
+
+
+def task_priority(task_type: str) -> int:
+    """任务类型对应的优先级"""
+    return TASK_PRIORITIES.get(task_type, TASK_DEFAULT_PRIORITY)
+
+
+class TaskWorkerPool:
+    """
+    进程内共享的任务池（只在主事件循环中使用）
+
+    提交时附带启动回调，出队后由调度协程调用回调启动任务；任务结束时必须调用release
+    """
+
+    def __init__(self, max_workers: int = TASK_POOL_MAX_WORKERS,
+                 limit: Optional[Callable[[], int]] = None):
+        self.max_workers = max_workers
+        self._limit = limit or (lambda: llm_concurrency.current_limit)
+        self._queue = FairQueue()
+        self._changed: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._course_resolver: Optional[Callable[[str], Optional[str]]] = None
+        self.running = 0
+        self._running_by_board: Dict[str, int] = {}
+        self._board_course: Dict[str, str] = {}  # 展板最近一次出队时所属的课程
+        self._entries: Dict[int, Tuple[Tuple[Any, Callable[[Any], None]], str]] = {}  # 排队中的任务 → (队列项, 课程ID)
+        self.dispatched = 0
+        self.closed = False  # 关闭后不再启动新任务，排队的任务留待下次启动时从任务日志恢复
+
+    @property
+    def current_limit(self) -> int:
+        """当前允许同时执行的任务数"""
+        return max(1, min(self.max_workers, self._limit()))
+
+    def set_course_resolver(self, resolver: Callable[[str], Optional[str]]):
+        """设置由展板ID查找所属课程ID的函数"""
+        self._course_resolver = resolver
+
+    def course_of(self, board_id: str) -> str:
+        """展板所属的课程ID，查不到时归入公共课程"""
+        if self._course_resolver:
+            try:
+                return self._course_resolver(board_id) or NO_FLOW
+            except Exception as e:
+                logger.warning(f"⚠️ [TASK-POOL] 查找展板 {board_id} 所属课程失败: {str(e)}")
+        return NO_FLOW
+
+    def _ensure_dispatcher(self):
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch_loop())
+            logger.info(f"🚀 [TASK-POOL] 任务池调度器启动，执行上限 {self.current_limit}（硬上限 {self.max_workers}）")
+
+    def submit(self, item: Any, board_id: str, priority: int, start: Callable[[Any], None]):
+        """
+        提交任务（需在事件循环中调用）
+
+        Args:
+            item: 任务对象
+            board_id: 所属展板ID
+            priority: 优先级，数字越小越优先
+            start: 出队后调用的启动回调（同步函数，应立即创建执行任务并返回）
+        """
+        self._ensure_dispatcher()
+        entry, course_id = (item, start), self.course_of(board_id)
+        self._entries[id(item)] = (entry, course_id)
+        self._queue.push(entry, course_id, board_id, priority)
+        self._changed.set()
+
+    def discard(self, item: Any, board_id: str, priority: int) -> bool:
+        """把仍在排队的任务移出队列（如任务被取消），已出队启动时返回False"""
+        queued = self._entries.pop(id(item), None)
+        if queued is None:
+            return False
+        entry, course_id = queued
+        return self._queue.discard(entry, course_id, board_id, priority)
+
+    def release(self, board_id: str):
+        """一个任务执行结束，空出执行名额"""
+        self.running = max(0, self.running - 1)
+        if self._running_by_board.get(board_id, 0) > 1:
+            self._running_by_board[board_id] -= 1
+        else:
+            self._running_by_board.pop(board_id, None)
+        if self._changed is not None:
+            self._changed.set()
+
+    def pending(self) -> int:
+        return len(self._queue)
+
+    async def _dispatch_loop(self):
+        while True:
+            if self.closed or not (self._queue and self.running < self.current_limit):
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=_LIMIT_RECHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            (item, start), (course_id, board_id, _) = self._queue.pop()
+            self._entries.pop(id(item), None)
+            self.running += 1
+            self.dispatched += 1
+            self._board_course[board_id] = course_id
+            self._running_by_board[board_id] = self._running_by_board.get(board_id, 0) + 1
+            try:
+                start(item)
+            except Exception as e:
+                logger.error(f"❌ [TASK-POOL] 启动任务失败: {str(e)}", exc_info=True)
+                self.release(board_id)
+
+    async def drain(self, timeout: float) -> int:
+        """停止启动新任务并等待执行中的任务结束，返回超时后仍在执行的任务数"""
+        self.closed = True
+        deadline = time.monotonic() + timeout
+        while self.running and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        return self.running
+
+    def get_status(self) -> Dict[str, Any]:
+        """执行名额利用率，以及各课程、展板的排队、执行、出队份额和等待时间"""
+        limit = self.current_limit
+        running = {(self._board_course[board_id], board_id): count
+                   for board_id, count in self._running_by_board.items()}
+        return {
+            "running": self.running,
+            "limit": limit,
+            "max_workers": self.max_workers,
+            "utilization": round(self.running / limit, 3),
+            "queued": self.pending(),
+            "dispatched": self.dispatched,
+            "closed": self.closed,
+            "fairness": self._queue.get_stats(running=running)
+        }
+
+
+# 全局任务池（所有展板共享）
+task_worker_pool = TaskWorkerPool()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+可续传的分块上传会话
+客户端先创建会话，再按偏移量逐块PUT上传，数据直接追加写入磁盘上的分块文件，
+连接中断后可查询已接收的字节数，从该偏移继续上传，最后提交会话完成上传
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, Optional
+
+from fastapi import HTTPException
+
+from config import UPLOAD_SESSION_DIR, UPLOAD_SESSION_TTL, UPLOAD_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# 接收的数据攒到该字节数后在线程池中写入一次磁盘
+_WRITE_BUFFER_BYTES = 1024 * 1024
+
+
+class UploadSessionManager:
+    """分块上传会话管理器，会话元数据与已接收数据均保存在磁盘上，服务重启后仍可续传"""
+
+    def __init__(self, session_dir: str = UPLOAD_SESSION_DIR):
+        self.session_dir = session_dir
+        os.makedirs(self.session_dir, exist_ok=True)
+        # 同一会话同时只允许一个写入请求
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _meta_path(self, upload_id: str) -> str:
+        return os.path.join(self.session_dir, f"{upload_id}.json")
+
+    def part_path(self, upload_id: str) -> str:
+        """已接收数据的分块文件路径"""
+        return os.path.join(self.session_dir, f"{upload_id}.part")
+
+    def _save(self, session: Dict):
+        tmp_path = f"{self._meta_path(session['upload_id'])}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(session, f, ensure_ascii=False)
+        os.replace(tmp_path, self._meta_path(session['upload_id']))
+
+    def create(self, filename: str, size: int, kind: str, max_size: int,
+               metadata: Optional[Dict] = None) -> Dict:
+        """
+        创建上传会话
+
+        Args:
+            filename: 原始文件名
+            size: 文件总字节数
+            kind: 上传类型 material / image / video
+            max_size: 该类型允许的最大字节数
+            metadata: 完成时需要的附加信息（如board_id、window_id）
+        """
+        if size <= 0:
+            raise HTTPException(status_code=400, detail="文件大小无效")
+        if size > max_size:
+            raise HTTPException(status_code=413, detail=f"文件大小超过限制: {max_size // (1024 * 1024)}MB")
+
+        self.cleanup_expired()
+
+        session = {
+            "upload_id": uuid.uuid4().hex,
+            "filename": filename,
+            "kind": kind,
+            "size": size,
+            "offset": 0,
+            "chunk_size": UPLOAD_CHUNK_SIZE,
+            "metadata": metadata or {},
+            "created_at": time.time(),
+            "updated_at": time.time()
+        }
+        open(self.part_path(session["upload_id"]), 'wb').close()
+        self._save(session)
+        logger.info(f"📤 [UPLOAD] 创建上传会话: {session['upload_id']} {filename} ({size} 字节)")
+        return session
+
+    def get(self, upload_id: str) -> Dict:
+        """获取会话，偏移量以磁盘上实际写入的字节数为准"""
+        meta_path = self._meta_path(upload_id)
+        if not upload_id.isalnum() or not os.path.exists(meta_path):
+            raise HTTPException(status_code=404, detail="上传会话不存在或已过期")
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            session = json.load(f)
+        try:
+            session["offset"] = os.path.getsize(self.part_path(upload_id))
+        except OSError:
+            raise HTTPException(status_code=404, detail="上传会话数据已丢失")
+        return session
+
+    async def write_chunk(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict:
+        """
+        在指定偏移处追加写入数据块
+
+        offset必须等于已接收的字节数，否则返回409及当前偏移，客户端据此续传。
+        数据边接收边写盘（每攒够_WRITE_BUFFER_BYTES写入一次，磁盘读写都在线程池中进行，不阻塞事件循环），
+        连接中断时已接收的部分会保留
+        """
+        lock = self._locks.setdefault(upload_id, asyncio.Lock())
+        if lock.locked():
+            raise HTTPException(status_code=409, detail="该上传会话正在写入中")
+
+        loop = asyncio.get_running_loop()
+        async with lock:
+            session = await loop.run_in_executor(None, self.get, upload_id)
+            if offset != session["offset"]:
+                raise HTTPException(
+                    status_code=409,
+                    detail={"message": "偏移量不匹配", "offset": session["offset"]}
+                )
+
+            received = session["offset"]
+            buffer = bytearray()
+            f = await loop.run_in_executor(None, open, self.part_path(upload_id), 'ab')
+            try:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    if received + len(chunk) > session["size"]:
+                        raise HTTPException(status_code=413, detail="上传数据超过声明的文件大小")
+                    buffer += chunk
+                    received += len(chunk)
+                    if len(buffer) >= _WRITE_BUFFER_BYTES:
+                        data, buffer = buffer, bytearray()
+                        await loop.run_in_executor(None, f.write, data)
+            finally:
+                try:
+                    # 连接中断前已接收的数据同样写入，下次从实际写入的位置续传
+                    if buffer:
+                        await loop.run_in_executor(None, f.write, buffer)
+                finally:
+                    await loop.run_in_executor(None, f.close)
+                    session["offset"] = received
+                    session["updated_at"] = time.time()
+                    await loop.run_in_executor(None, self._save, session)
+            return session
+
+    def complete(self, upload_id: str) -> Dict:
+        """校验数据已全部接收，返回会话（分块文件由调用方读取后调用 discard 删除）"""
+        session = self.get(upload_id)
+        if session["offset"] != session["size"]:
+            raise HTTPException(
+                status_code=409,
+                detail={"message": "文件尚未上传完整", "offset": session["offset"], "size": session["size"]}
+            )
+        return session
+
+    def discard(self, upload_id: str):
+        """删除会话及其分块文件"""
+        for path in (self.part_path(upload_id), self._meta_path(upload_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._locks.pop(upload_id, None)
+
+    def cleanup_expired(self, ttl: int = UPLOAD_SESSION_TTL) -> int:
+        """清理长时间未更新的会话"""
+        removed = 0
+        now = time.time()
+        for entry in os.listdir(self.session_dir):
+            if not entry.endswith(".json"):
+                continue
+            upload_id = entry[:-len(".json")]
+            try:
+                with open(os.path.join(self.session_dir, entry), 'r', encoding='utf-8') as f:
+                    updated_at = json.load(f).get("updated_at", 0)
+            except Exception:
+                updated_at = 0
+            if now - updated_at > ttl:
+                self.discard(upload_id)
+                removed += 1
+        if removed:
+            logger.info(f"🧹 [UPLOAD] 已清理过期上传会话: {removed} 个")
+        return removed
+
+
+# 全局上传会话管理器实例
+upload_session_manager = UploadSessionManager()